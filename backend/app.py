@@ -1,4 +1,4 @@
-from flask import Flask, jsonify, request, send_from_directory, send_file
+from flask import Flask, jsonify, request, send_from_directory, send_file, Response
 from datetime import datetime, timedelta
 import sqlite3
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -41,10 +41,13 @@ if _standalone_data:
 else:
     _DATA_DIR = os.path.join(_project_root, 'data')
 _env_path = os.path.join(_backend_dir, '.env')
-# 数据库路径与连接：统一 timeout 减少 "database is locked"
+# 数据库路径与连接：主库连接从连接池借出（已设置 busy_timeout 与 PRAGMA，close() 即归还），减少 "database is locked"
 _DB_PATH = os.path.join(_DATA_DIR, 'risk_platform.db')
+from backend.services import db_pool
 def _db_conn(path=None, timeout=30):
-    return sqlite3.connect(path or _DB_PATH, timeout=timeout)
+    if path is None or path == _DB_PATH:
+        return db_pool.connect(_DB_PATH)
+    return sqlite3.connect(path, timeout=timeout)
 try:
     from dotenv import load_dotenv
     load_dotenv(_env_path)
@@ -207,7 +210,7 @@ def _get_smtp_config():
     db_path = _DB_PATH
     out = {'host': '', 'port': 587, 'user': '', 'password': '', 'from_addr': ''}
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cursor = conn.cursor()
         for key in ('smtp_host', 'smtp_port', 'smtp_user', 'smtp_password', 'smtp_from'):
             cursor.execute("SELECT value FROM system_settings WHERE key=?", (key,))
@@ -244,7 +247,7 @@ def _smtp_configured():
     return bool(c.get('host') and c.get('user'))
 
 def _get_user_email(user_id):
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT email FROM users WHERE id=?", (user_id,))
     row = cursor.fetchone()
@@ -339,7 +342,7 @@ def health():
     try:
         db_path = _DB_PATH
         if os.path.isfile(db_path):
-            conn = sqlite3.connect(db_path)
+            conn = _db_conn(db_path)
             conn.cursor().execute('SELECT 1').fetchone()
             conn.close()
         return '', 200
@@ -348,6 +351,15 @@ def health():
         return jsonify({'status': 'unhealthy', 'message': str(e) if not _is_production else 'db_error'}), 503
 
 
+def _invalidate_feature_store():
+    """绕过 risk_timeseries_service 改动时间序列（开发环境重置、管理员改表、从备份恢复）后清空列式特征缓存。"""
+    try:
+        from backend.ml import feature_store
+    except ImportError:
+        return
+    feature_store.invalidate(_DB_PATH)
+
+
 # Database initialization
 # 生产环境请设置 SKIP_DROP_TABLES=1 或 FLASK_ENV=production，仅执行迁移（加表/加列），不 DROP 表
 def init_db():
@@ -358,7 +370,7 @@ def init_db():
 
     if not skip_drop:
         # 开发环境：先删依赖 companies 的表，再删 companies，避免重启后「最新企业资讯」仍显示已删企业
-        for t in ('risk_alerts', 'company_media_reviews', 'company_news', 'company_keywords', 'user_company_favorites', 'user_companies'):
+        for t in ('company_stats', 'risk_alerts', 'company_media_reviews', 'company_news', 'company_keywords', 'user_company_favorites', 'user_companies'):
             cursor.execute("DROP TABLE IF EXISTS " + t)
         cursor.execute("DROP TABLE IF EXISTS risk_insights")
         cursor.execute("DROP TABLE IF EXISTS news_items")
@@ -366,152 +378,22 @@ def init_db():
         cursor.execute("DROP TABLE IF EXISTS risk_alerts")
         cursor.execute("DROP TABLE IF EXISTS companies")
         cursor.execute("DROP TABLE IF EXISTS users")
-
-    # 生产环境（skip_drop）也需确保 users/companies 等核心表存在（新建数据目录时）
-    if skip_drop:
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS companies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            industry TEXT,
-            risk_level TEXT DEFAULT '未知',
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            legal_representative TEXT,
-            registered_capital TEXT,
-            business_status TEXT,
-            registered_address TEXT,
-            business_scope TEXT,
-            equity_structure TEXT,
-            social_evaluation TEXT,
-            crawl_status TEXT DEFAULT 'pending',
-            established_date TEXT,
-            legal_cases TEXT,
-            equity_changes TEXT,
-            capital_changes TEXT
-        )
-        ''')
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS risk_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER,
-            alert_type TEXT NOT NULL,
-            severity TEXT NOT NULL,
-            description TEXT,
-            source TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-        ''')
-        cursor.execute("SELECT COUNT(*) FROM users")
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("INSERT INTO users (username, email, password_hash, role) VALUES (?, ?, ?, ?)",
-                ("admin", "admin@example.com", generate_password_hash("admin123"), "admin"))
-        conn.commit()
-    # 开发环境：创建表并插入示例数据
-    if not skip_drop:
-        # Users table
-        cursor.execute('''
-        CREATE TABLE users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            email TEXT UNIQUE NOT NULL,
-            password_hash TEXT NOT NULL,
-            role TEXT NOT NULL DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-        # Companies table
-        cursor.execute('''
-        CREATE TABLE companies (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            industry TEXT,
-            risk_level TEXT DEFAULT '未知',
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            legal_representative TEXT,
-            registered_capital TEXT,
-            business_status TEXT,
-            registered_address TEXT,
-            business_scope TEXT,
-            equity_structure TEXT,
-            social_evaluation TEXT,
-            crawl_status TEXT DEFAULT 'pending',
-            established_date TEXT,
-            legal_cases TEXT,
-            equity_changes TEXT,
-            capital_changes TEXT
-        )
-        ''')
-        # Risk alerts table
-        cursor.execute('''
-        CREATE TABLE risk_alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER,
-            alert_type TEXT NOT NULL,
-            severity TEXT NOT NULL,
-            description TEXT,
-            source TEXT,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-        ''')
-        # Documents table
-        cursor.execute('''
-        CREATE TABLE documents (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            company_id INTEGER,
-            filename TEXT NOT NULL,
-            filepath TEXT NOT NULL,
-            upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            status TEXT DEFAULT 'uploaded',
-            analysis_result TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-        ''')
-        # News items table
-        cursor.execute('''
-        CREATE TABLE news_items (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            category TEXT NOT NULL,
-            source_url TEXT,
-            scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            user_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        # Risk insights table
-        cursor.execute('''
-        CREATE TABLE risk_insights (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT NOT NULL,
-            content TEXT NOT NULL,
-            risk_level TEXT NOT NULL,
-            source_data TEXT,
-            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            user_id INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-        ''')
-        # Insert sample data
+        # 删表后重跑版本化迁移（索引等随表一起被删除）
+        cursor.execute("PRAGMA user_version = 0")
+        # 企业 id 重新分配后旧的特征缓存文件、检索索引可能对应到其他企业
+        _invalidate_feature_store()
+        from backend.services import company_retrieval
+        company_retrieval.reset_index(_DB_PATH)
+
+    # 建表：生产与开发共用 db_schema（CREATE TABLE IF NOT EXISTS），之后新增的列、索引由下方版本化迁移补齐
+    from backend.services import db_schema
+    db_schema.create_tables(conn)
+    cursor.execute("SELECT COUNT(*) FROM users")
+    if cursor.fetchone()[0] == 0:
         cursor.execute("INSERT INTO users (username, email, password_hash, role) VALUES (?, ?, ?, ?)",
-                   ("admin", "admin@example.com", generate_password_hash("admin123"), "admin"))
+            ("admin", "admin@example.com", generate_password_hash("admin123"), "admin"))
+    # 开发环境：插入示例数据
+    if not skip_drop:
         cursor.execute("INSERT INTO companies (name, industry) VALUES (?, ?)", 
                    ("ABC科技有限公司", "科技"))
         cursor.execute("INSERT INTO companies (name, industry) VALUES (?, ?)",
@@ -536,381 +418,23 @@ def init_db():
         ]
         for insight in sample_insights:
             cursor.execute("INSERT INTO risk_insights (title, description, content, risk_level, source_data, user_id) VALUES (?, ?, ?, ?, ?, ?)", insight)
-    # 以下为迁移：仅加表/加列，不删数据（生产与开发均执行）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS company_media_reviews (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER NOT NULL,
-            platform TEXT,
-            title TEXT,
-            content TEXT,
-            sentiment TEXT,
-            source_url TEXT,
-            llm_summary TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    # LLM 配置表
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS llm_config (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL UNIQUE,
-            api_key TEXT,
-            base_url TEXT,
-            model TEXT DEFAULT 'gpt-4o-mini',
-            enable_web_search INTEGER DEFAULT 0,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    # 兼容旧表：添加 enable_web_search 列（若不存在）
-    try:
-        cursor.execute("ALTER TABLE llm_config ADD COLUMN enable_web_search INTEGER DEFAULT 0")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 兼容旧表：documents 添加 analysis_result（若表存在且无此列）
-    try:
-        cursor.execute("ALTER TABLE documents ADD COLUMN analysis_result TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 兼容旧表：companies 添加 llm_status, media_status, news_status（三灯：工商、相关新闻、社会评价）
-    for col in ('llm_status', 'media_status', 'news_status'):
-        try:
-            cursor.execute(f"ALTER TABLE companies ADD COLUMN {col} TEXT DEFAULT 'pending'")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    # 用户收藏企业表（红心：仅影响是否标星，取消收藏后企业仍在「我的企业」中）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_company_favorites (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            company_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, company_id),
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    # 用户关联企业表：用户添加的企业（与收藏分离，取消红心后企业仍可见）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_companies (
-            user_id INTEGER NOT NULL,
-            company_id INTEGER NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, company_id),
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    try:
-        cursor.execute("INSERT OR IGNORE INTO user_companies (user_id, company_id) SELECT user_id, company_id FROM user_company_favorites")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 用户提交链接表
-    # 企业关键词（词云）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS company_keywords (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER NOT NULL,
-            keyword TEXT NOT NULL,
-            weight INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    # 企业关联新闻/资讯（滚动）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS company_news (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER,
-            title TEXT NOT NULL,
-            content TEXT,
-            source TEXT,
-            source_url TEXT,
-            sentiment_score REAL,
-            risk_level TEXT,
-            category TEXT,
-            keywords TEXT,
-            publish_date TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    # 用户设置：搜索间隔、报告格式
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL UNIQUE,
-            search_interval_minutes INTEGER DEFAULT 30,
-            report_template TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    if not skip_drop:
         cursor.execute("SELECT id, name FROM companies LIMIT 3")
         for cid, cname in cursor.fetchall():
             cursor.execute("""INSERT INTO company_news (company_id, title, content, source, sentiment_score, risk_level, category, publish_date)
                 VALUES (?,?,?,?,?,?,?,?)""",
                 (cid, f'关于{cname}的最新动态', '企业持续稳健发展，市场关注度较高。', '示例来源', 0.6, '低', '经营', datetime.now().strftime('%Y-%m-%d')))
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_links (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            company_id INTEGER,
-            url TEXT NOT NULL,
-            title TEXT,
-            status TEXT DEFAULT 'pending',
-            analysis_result TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    # 尽调补充：企业 AI 助手对话记录与归集摘要
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS company_supplements (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            company_id INTEGER NOT NULL,
-            user_id INTEGER NOT NULL,
-            role TEXT NOT NULL,
-            content TEXT NOT NULL,
-            merged_fields TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id),
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    try:
-        cursor.execute("ALTER TABLE companies ADD COLUMN supplement_notes TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 宏观政策摘要（大模型每日更新，右侧面板展示）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS macro_policy_digest (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # 政策与市场环境：多维度新闻，每条单独一条记录（不按时间跨度总结）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS macro_policy_news (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            content TEXT NOT NULL,
-            source TEXT,
-            dimension TEXT,
-            published_at TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # 宏观指数：按日汇总，由 macro_policy_news 计算得到，供风险预测等使用
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS macro_daily_index (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts_date TEXT NOT NULL UNIQUE,
-            policy_score REAL NOT NULL DEFAULT 0,
-            macro_risk_score REAL NOT NULL DEFAULT 0,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # 企业事件特征表：新闻 / 舆情 / 政策 / 工商变更 等结构化事件，供风险聚合与预测使用
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS enterprise_event_feature (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            enterprise_id INTEGER NOT NULL,
-            source_type TEXT NOT NULL,          -- NEWS / SOCIAL / POLICY / BIZ_REG
-            source_id INTEGER,                  -- 对应原始记录主键（如 company_news.id）
-            event_date TEXT NOT NULL,           -- 事件日期（YYYY-MM-DD）
-            event_type TEXT NOT NULL,           -- LEGAL_PENALTY / LITIGATION / FINANCIAL_STRESS / MANAGEMENT_CHANGE / PUBLIC_OPINION / OTHER ...
-            sentiment_label TEXT,               -- NEG / NEU / POS
-            sentiment_score REAL,               -- -1 ~ 1
-            severity_score REAL,                -- 0 ~ 1
-            policy_direction TEXT,              -- POSITIVE / NEUTRAL / NEGATIVE（仅 POLICY）
-            policy_strength REAL,               -- 0 ~ 1（仅 POLICY）
-            biz_change_type TEXT,               -- 高管变更 / 注册资本变更 等（仅 BIZ_REG）
-            extra_json TEXT,                    -- 其他 LLM 抽取字段（JSON）
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (enterprise_id) REFERENCES companies (id)
-        )
-    ''')
-    # 企业风险时间序列表：按日聚合各维度风险得分与辅助特征
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS enterprise_risk_timeseries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            enterprise_id INTEGER NOT NULL,
-            ts_date TEXT NOT NULL,              -- 日期（YYYY-MM-DD）
-            score_legal REAL NOT NULL,          -- 0~1 法律与合规风险
-            score_business REAL NOT NULL,       -- 0~1 经营与财务风险
-            score_media REAL NOT NULL,          -- 0~1 舆情与媒体风险
-            score_policy REAL NOT NULL,         -- 0~1 政策与监管风险
-            score_industry REAL NOT NULL,       -- 0~1 行业与宏观风险
-            risk_score REAL NOT NULL,           -- 0~100 综合风险得分
-            news_count INTEGER NOT NULL DEFAULT 0,
-            neg_news_ratio REAL NOT NULL DEFAULT 0,
-            sentiment_index REAL,               -- 当日情绪指数（平均 sentiment_score）
-            sentiment_vol REAL,                 -- 过去 N 日情绪波动率
-            policy_impact REAL,                 -- 政策负面影响指数
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(enterprise_id, ts_date),
-            FOREIGN KEY (enterprise_id) REFERENCES companies (id)
-        )
-    ''')
-    # 预测回测指标：MAE、残差标准差等，供预测区间与准确性评估
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS backtest_metrics (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            metric_name TEXT NOT NULL UNIQUE,
-            value_real REAL,
-            value_text TEXT,
-            extra_json TEXT,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    # 预测与宏观参数：可配置权重与中性值，便于客观调参
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS prediction_config (
-            key TEXT NOT NULL PRIMARY KEY,
-            value_text TEXT NOT NULL,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
+    # 收藏过的企业补进「我的企业」
+    cursor.execute("INSERT OR IGNORE INTO user_companies (user_id, company_id) SELECT user_id, company_id FROM user_company_favorites")
     for cfg_key, cfg_val in [('macro_adjustment_scale', '20'), ('macro_neutral', '0.5'), ('prediction_interval_z', '1.96')]:
-        try:
-            cursor.execute("INSERT OR IGNORE INTO prediction_config (key, value_text, updated_at) VALUES (?, ?, ?)", (cfg_key, cfg_val, datetime.now().isoformat()))
-        except sqlite3.OperationalError:
-            pass
-    # 企业风险标签：用于训练 ML 模型（如爆雷/高风险事件标签）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS enterprise_risk_label (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            enterprise_id INTEGER NOT NULL,
-            as_of_date TEXT NOT NULL,           -- 标签对应的观察起点日（YYYY-MM-DD）
-            label_type TEXT NOT NULL,           -- explosion / default / penalty 等
-            label_value INTEGER NOT NULL,       -- 0/1
-            note TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(enterprise_id, as_of_date, label_type),
-            FOREIGN KEY (enterprise_id) REFERENCES companies (id)
-        )
-    ''')
-    # company_news 多维度风险
-    try:
-        cursor.execute("ALTER TABLE company_news ADD COLUMN risk_dimensions TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 企业专属标签：写入时存当前企业名，筛选时只返回标签与当前企业名一致的新闻，避免串企业
-    try:
-        cursor.execute("ALTER TABLE company_news ADD COLUMN company_tag TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
+        cursor.execute("INSERT OR IGNORE INTO prediction_config (key, value_text, updated_at) VALUES (?, ?, ?)", (cfg_key, cfg_val, datetime.now().isoformat()))
     # 一次性清空 company/4 相关新闻（按用户要求不再显示）
-    try:
-        cursor.execute("DELETE FROM company_news WHERE company_id=4")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 系统设置（管理员在管理后台配置，如 SMTP 发件人）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS system_settings (
-            key TEXT PRIMARY KEY,
-            value TEXT
-        )
-    ''')
-    # 操作审计日志（谁在何时做了什么，便于合规）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS audit_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            action TEXT NOT NULL,
-            resource_type TEXT,
-            resource_id TEXT,
-            detail TEXT,
-            ip TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    # 预警规则（可配置：风险升级、分类阈值、情感阈值等）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alert_rules (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            name TEXT NOT NULL,
-            rule_type TEXT NOT NULL,
-            config TEXT,
-            enabled INTEGER DEFAULT 1,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    try:
-        cursor.execute("ALTER TABLE companies ADD COLUMN tags TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 站内通知
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS notifications (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            type TEXT NOT NULL,
-            title TEXT NOT NULL,
-            body TEXT,
-            related_type TEXT,
-            related_id TEXT,
-            read_at TIMESTAMP,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    # 任务执行记录（爬取/新闻搜索等）
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS task_runs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            task_type TEXT NOT NULL,
-            company_id INTEGER,
-            status TEXT NOT NULL,
-            message TEXT,
-            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            finished_at TIMESTAMP,
-            FOREIGN KEY (company_id) REFERENCES companies (id)
-        )
-    ''')
-    try:
-        cursor.execute("ALTER TABLE risk_alerts ADD COLUMN processed_at TIMESTAMP")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    try:
-        cursor.execute("ALTER TABLE company_news ADD COLUMN risk_dimensions TEXT")
-        conn.commit()
-    except sqlite3.OperationalError:
-        pass
-    # 用户扩展设置与忘记密码
-    for col, ctype in [
-        ('alert_threshold', 'TEXT'), ('two_factor_enabled', 'INTEGER DEFAULT 0'),
-        ('two_factor_secret', 'TEXT'),
-        ('backup_enabled', 'INTEGER DEFAULT 0'), ('backup_frequency', 'TEXT'),
-        ('reset_token', 'TEXT'), ('reset_token_expires', 'TEXT')
-    ]:
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN %s %s" % (col, ctype))
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass
-    
+    cursor.execute("DELETE FROM company_news WHERE company_id=4")
     conn.commit()
+    # 版本化迁移（PRAGMA user_version）：补齐旧库缺失的列、热点查询索引等；之后各路由按最新表结构查询
+    from backend.services import schema_migrations
+    applied = schema_migrations.migrate(conn)
+    if applied:
+        logger.info('Schema migrations applied: %s', applied)
     conn.close()
 
 # JWT token decorator
@@ -943,7 +467,7 @@ def admin_required(f):
     """要求当前用户为 admin 角色，与 token_required 同时使用：先 token_required 再 admin_required"""
     @wraps(f)
     def decorated(current_user_id, *args, **kwargs):
-        conn = sqlite3.connect(_DB_PATH)
+        conn = _db_conn()
         cur = conn.cursor()
         cur.execute("SELECT role FROM users WHERE id = ?", (current_user_id,))
         row = cur.fetchone()
@@ -1004,6 +528,14 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Credentials', 'true')
     return response
 
+
+@app.teardown_request
+def release_db_connections(exc=None):
+    """请求结束：归还本线程仍借出的数据库连接（异常路径上未执行 conn.close() 的连接）"""
+    n = db_pool.release_thread()
+    if n:
+        logger.debug('db_pool: reclaimed %d connection(s) after %s', n, request.path)
+
 # Authentication routes
 @app.route('/api/auth/login', methods=['POST', 'OPTIONS'])
 def login():
@@ -1016,7 +548,7 @@ def login():
     username = data.get('username')
     password = data.get('password')
     
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute(
         "SELECT id, username, password_hash, role, two_factor_enabled FROM users WHERE username=?",
@@ -1085,7 +617,7 @@ def _temp_2fa_token_required(f):
 def two_fa_setup(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT username FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -1119,7 +651,7 @@ def two_fa_verify(current_user_id):
     code = (data.get('code') or '').strip().replace(' ', '')
     if not code or len(code) != 6:
         return jsonify({'message': '请输入 6 位验证码'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT two_factor_secret FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -1129,7 +661,7 @@ def two_fa_verify(current_user_id):
     totp = pyotp.TOTP(row[0])
     if not totp.verify(code, valid_window=1):
         return jsonify({'message': '验证码错误或已过期'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET two_factor_enabled=1 WHERE id=?", (current_user_id,))
     conn.commit()
@@ -1146,13 +678,13 @@ def two_fa_disable(current_user_id):
     code = (data.get('code') or '').strip().replace(' ', '')
     if not code or len(code) != 6:
         return jsonify({'message': '请输入 6 位验证码'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT two_factor_secret FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
     conn.close()
     if not row or not row[0]:
-        conn2 = sqlite3.connect(_DB_PATH)
+        conn2 = _db_conn()
         cur = conn2.cursor()
         cur.execute("UPDATE users SET two_factor_enabled=0, two_factor_secret=NULL WHERE id=?", (current_user_id,))
         conn2.commit()
@@ -1162,7 +694,7 @@ def two_fa_disable(current_user_id):
     totp = pyotp.TOTP(row[0])
     if not totp.verify(code, valid_window=1):
         return jsonify({'message': '验证码错误或已过期'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("UPDATE users SET two_factor_enabled=0, two_factor_secret=NULL WHERE id=?", (current_user_id,))
     conn.commit()
@@ -1180,7 +712,7 @@ def two_fa_verify_login(current_user_id):
     code = (data.get('code') or '').strip().replace(' ', '')
     if not code or len(code) != 6:
         return jsonify({'message': '请输入 6 位验证码'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT username, role, two_factor_secret FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -1208,7 +740,7 @@ def two_fa_verify_login(current_user_id):
 def auth_me(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, email, role, created_at FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -1216,19 +748,16 @@ def auth_me(current_user_id):
         conn.close()
         return jsonify({'message': 'User not found'}), 404
     out = {'id': row[0], 'username': row[1], 'email': row[2], 'role': row[3], 'created_at': row[4]}
-    try:
-        cursor.execute(
-            "SELECT alert_threshold, two_factor_enabled, backup_enabled, backup_frequency FROM users WHERE id=?",
-            (current_user_id,)
-        )
-        r = cursor.fetchone()
-        if r:
-            out['alert_threshold'] = r[0]
-            out['two_factor_enabled'] = bool(r[1]) if r[1] is not None else False
-            out['backup_enabled'] = bool(r[2]) if r[2] is not None else False
-            out['backup_frequency'] = r[3]
-    except sqlite3.OperationalError:
-        pass
+    cursor.execute(
+        "SELECT alert_threshold, two_factor_enabled, backup_enabled, backup_frequency FROM users WHERE id=?",
+        (current_user_id,)
+    )
+    r = cursor.fetchone()
+    if r:
+        out['alert_threshold'] = r[0]
+        out['two_factor_enabled'] = bool(r[1]) if r[1] is not None else False
+        out['backup_enabled'] = bool(r[2]) if r[2] is not None else False
+        out['backup_frequency'] = r[3]
     conn.close()
     return jsonify(out)
 
@@ -1242,7 +771,7 @@ def change_password(current_user_id):
     new_pwd = data.get('new_password')
     if not old_pwd or not new_pwd:
         return jsonify({'detail': '缺少参数'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT password_hash FROM users WHERE id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -1265,7 +794,7 @@ def update_profile(current_user_id):
     alert_threshold = data.get('alert_threshold')
     backup_enabled = data.get('backup_enabled')
     backup_frequency = data.get('backup_frequency')
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     try:
         if username is not None:
@@ -1273,20 +802,11 @@ def update_profile(current_user_id):
         if email is not None:
             cursor.execute("UPDATE users SET email=? WHERE id=?", (email.strip(), current_user_id))
         if alert_threshold is not None:
-            try:
-                cursor.execute("UPDATE users SET alert_threshold=? WHERE id=?", (str(alert_threshold), current_user_id))
-            except sqlite3.OperationalError:
-                pass
+            cursor.execute("UPDATE users SET alert_threshold=? WHERE id=?", (str(alert_threshold), current_user_id))
         if backup_enabled is not None:
-            try:
-                cursor.execute("UPDATE users SET backup_enabled=? WHERE id=?", (1 if backup_enabled else 0, current_user_id))
-            except sqlite3.OperationalError:
-                pass
+            cursor.execute("UPDATE users SET backup_enabled=? WHERE id=?", (1 if backup_enabled else 0, current_user_id))
         if backup_frequency is not None:
-            try:
-                cursor.execute("UPDATE users SET backup_frequency=? WHERE id=?", (str(backup_frequency), current_user_id))
-            except sqlite3.OperationalError:
-                pass
+            cursor.execute("UPDATE users SET backup_frequency=? WHERE id=?", (str(backup_frequency), current_user_id))
         conn.commit()
         cursor.execute("SELECT id, username, email, role, created_at FROM users WHERE id=?", (current_user_id,))
         row = cursor.fetchone()
@@ -1306,7 +826,7 @@ def update_profile(current_user_id):
 def backup_status(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT value FROM system_settings WHERE key=?", ('last_backup',))
     row = cursor.fetchone()
@@ -1325,7 +845,7 @@ def forgot_password():
     email = (data.get('email') or '').strip()
     if not email:
         return jsonify({'message': '请提供邮箱'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE email=?", (email,))
     row = cursor.fetchone()
@@ -1334,23 +854,11 @@ def forgot_password():
         return jsonify({'message': '若该邮箱已注册，将收到重置链接'}), 200
     reset_token = secrets.token_urlsafe(32)
     expires = (datetime.utcnow() + timedelta(hours=1)).isoformat()
-    try:
-        cursor.execute(
-            "UPDATE users SET reset_token=?, reset_token_expires=? WHERE id=?",
-            (reset_token, expires, row[0])
-        )
-        conn.commit()
-    except sqlite3.OperationalError:
-        try:
-            cursor.execute("ALTER TABLE users ADD COLUMN reset_token TEXT")
-            cursor.execute("ALTER TABLE users ADD COLUMN reset_token_expires TEXT")
-            cursor.execute(
-                "UPDATE users SET reset_token=?, reset_token_expires=? WHERE id=?",
-                (reset_token, expires, row[0])
-            )
-            conn.commit()
-        except Exception:
-            pass
+    cursor.execute(
+        "UPDATE users SET reset_token=?, reset_token_expires=? WHERE id=?",
+        (reset_token, expires, row[0])
+    )
+    conn.commit()
     conn.close()
     # 若已配置 SMTP：发送重置链接邮件，且不向前端返回 token（安全）；否则开发模式返回 token 便于测试
     if _smtp_configured() and row:
@@ -1372,14 +880,10 @@ def reset_password():
     new_password = data.get('new_password') or data.get('password') or ''
     if not token or not new_password:
         return jsonify({'message': '请提供重置令牌和新密码'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT id, reset_token_expires FROM users WHERE reset_token=?", (token,))
-        row = cursor.fetchone()
-    except sqlite3.OperationalError:
-        conn.close()
-        return jsonify({'message': '重置功能不可用'}), 503
+    cursor.execute("SELECT id, reset_token_expires FROM users WHERE reset_token=?", (token,))
+    row = cursor.fetchone()
     if not row:
         conn.close()
         return jsonify({'message': '无效或过期的重置链接'}), 400
@@ -1410,7 +914,7 @@ def register():
     email = data.get('email')
     password = data.get('password')
     
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     
     try:
@@ -1460,7 +964,7 @@ def send_risk_digest(current_user_id):
     """向当前用户邮箱发送风险速览（高风险企业数量等）。"""
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT risk_level, COUNT(*) FROM companies GROUP BY risk_level")
     rows = cursor.fetchall()
@@ -1497,7 +1001,7 @@ def get_news(current_user_id):
     skip = int(request.args.get('skip', 0))
     limit = int(request.args.get('limit', 10))
     
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     
     query = "SELECT id, title, content, category, source_url, scraped_at, created_at FROM news_items WHERE user_id = ?"
@@ -1538,7 +1042,7 @@ def get_risk_insights(current_user_id):
     skip = int(request.args.get('skip', 0))
     limit = int(request.args.get('limit', 10))
     
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     
     query = "SELECT id, title, description, content, risk_level, generated_at, created_at FROM risk_insights WHERE user_id = ?"
@@ -1577,7 +1081,7 @@ def get_macro_policy_digest(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
     db_path = _DB_PATH
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     cursor.execute(
         "SELECT id, title, content, updated_at FROM macro_policy_digest ORDER BY updated_at DESC LIMIT 1"
@@ -1617,7 +1121,7 @@ def get_macro_policy_news(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
     db_path = _DB_PATH
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     try:
         cursor.execute(
@@ -1665,7 +1169,7 @@ def add_test_data(current_user_id):
         return jsonify({})
         
     # Add test news data if not exists
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     
     # Check if test data already exists for this user
@@ -1723,71 +1227,12 @@ def get_companies(current_user_id):
                   'risk_level': "CASE WHEN c.risk_level='高' THEN 1 WHEN c.risk_level='中' THEN 2 ELSE 3 END, c.name ASC"}
     order_clause = valid_sorts.get(sort, valid_sorts['last_updated'])
 
-    conn = sqlite3.connect(_DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT company_id FROM user_company_favorites WHERE user_id=?", (current_user_id,))
-    fav_ids = {r[0] for r in cursor.fetchall()}
-
-    # 基础列表：用户关联的企业（user_companies）；favorite_only 时再限定为收藏
-    where_parts = ["c.id IN (SELECT company_id FROM user_companies WHERE user_id = ?)"]
-    params = [current_user_id]
-    if search:
-        where_parts.append("(c.name LIKE ? OR c.legal_representative LIKE ?)")
-        params.extend(['%' + search + '%', '%' + search + '%'])
-    if risk_level:
-        where_parts.append("c.risk_level = ?")
-        params.append(risk_level)
-    if industry:
-        where_parts.append("(c.industry LIKE ? OR c.industry = ?)")
-        params.extend(['%' + industry + '%', industry])
-    if favorite_only:
-        where_parts.append("c.id IN (SELECT company_id FROM user_company_favorites WHERE user_id = ?)")
-        params.append(current_user_id)  # 仅显示收藏的企业
-    where_sql = " AND ".join(where_parts) if where_parts else "1=1"
-
-    try:
-        cursor.execute("""
-            SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
-                   COUNT(ra.id) as alert_count, c.legal_representative, c.registered_capital, c.business_status, c.crawl_status,
-                   c.llm_status, c.media_status, c.news_status
-            FROM companies c
-            LEFT JOIN risk_alerts ra ON c.id = ra.company_id
-            WHERE """ + where_sql + """
-            GROUP BY c.id
-            ORDER BY """ + order_clause, tuple(params))
-    except sqlite3.OperationalError:
-        cursor.execute("""
-            SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
-                   COUNT(ra.id) as alert_count, c.legal_representative, c.registered_capital, c.business_status, c.crawl_status,
-                   c.llm_status, c.media_status
-            FROM companies c
-            LEFT JOIN risk_alerts ra ON c.id = ra.company_id
-            WHERE """ + where_sql + """
-            GROUP BY c.id
-            ORDER BY """ + order_clause, tuple(params))
-    company_rows = cursor.fetchall()
-    companies = []
-    for row in company_rows:
-        cid = row[0]
-        llm_s = row[10] if len(row) > 10 else 'pending'
-        media_s = row[11] if len(row) > 11 else 'pending'
-        news_s = row[12] if len(row) > 12 else 'pending'
-        companies.append({
-            'id': cid,
-            'name': row[1],
-            'industry': row[2],
-            'risk_level': row[3],
-            'last_updated': row[4],
-            'alert_count': row[5],
-            'legal_representative': row[6] or '',
-            'registered_capital': row[7] or '',
-            'business_status': row[8] or '',
-            'crawl_status': row[9] or 'pending',
-            'llm_status': llm_s or 'pending',
-            'media_status': media_s or 'pending',
-            'news_status': news_s or 'pending',
-            'is_favorite': cid in fav_ids
-        })
+    # 基础列表：用户关联的企业（user_companies）；计数读 company_stats 汇总行，收藏随查询一并取出
+    from backend.services import company_stats
+    conn = _db_conn()
+    companies = company_stats.list_companies(conn, current_user_id, search=search, risk_level=risk_level,
+                                             industry=industry, favorite_only=favorite_only,
+                                             order_clause=order_clause)
     conn.close()
     return jsonify(companies)
 
@@ -1798,7 +1243,7 @@ def get_company_industries(current_user_id):
     """返回当前用户企业的行业列表（用于筛选下拉）"""
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cids = _user_company_ids(cursor, current_user_id)
     if not cids:
@@ -1817,29 +1262,19 @@ def get_company(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
         
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     
-    try:
-        cursor.execute("""
-            SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
-                   c.legal_representative, c.registered_capital, c.business_status,
-                   c.registered_address, c.business_scope, c.equity_structure,
-                   c.social_evaluation, c.crawl_status, c.established_date,
-                   c.legal_cases, c.equity_changes, c.capital_changes, c.supplement_notes, c.tags
-            FROM companies c
-            WHERE c.id = ?
-        """, (company_id,))
-    except sqlite3.OperationalError:
-        cursor.execute("""
-            SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
-                   c.legal_representative, c.registered_capital, c.business_status,
-                   c.registered_address, c.business_scope, c.equity_structure,
-                   c.social_evaluation, c.crawl_status, c.established_date,
-                   c.legal_cases, c.equity_changes, c.capital_changes, c.supplement_notes
-            FROM companies c
-            WHERE c.id = ?
-        """, (company_id,))
+    cursor.execute("""
+        SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
+               c.legal_representative, c.registered_capital, c.business_status,
+               c.registered_address, c.business_scope, c.equity_structure,
+               c.social_evaluation, c.crawl_status, c.established_date,
+               c.legal_cases, c.equity_changes, c.capital_changes, c.supplement_notes, c.tags,
+               c.llm_status, c.media_status, c.news_status
+        FROM companies c
+        WHERE c.id = ?
+    """, (company_id,))
     company = cursor.fetchone()
     if not company:
         conn.close()
@@ -1850,29 +1285,8 @@ def get_company(current_user_id, company_id):
         conn.close()
         return jsonify({'message': '无权限访问该企业'}), 403
     
-    try:
-        cursor.execute("SELECT llm_status, media_status, news_status FROM companies WHERE id=?", (company_id,))
-        r = cursor.fetchone()
-        if r and len(r) >= 3:
-            llm_s, media_s, news_s = (r[0] or 'pending', r[1] or 'pending', r[2] or 'pending')
-        elif r:
-            llm_s, media_s = (r[0] or 'pending', r[1] or 'pending')
-            news_s = 'pending'
-        else:
-            llm_s = media_s = news_s = 'pending'
-    except sqlite3.OperationalError:
-        try:
-            cursor.execute("SELECT llm_status, media_status FROM companies WHERE id=?", (company_id,))
-            r = cursor.fetchone()
-            llm_s, media_s = (r[0] or 'pending', r[1] or 'pending') if r else ('pending', 'pending')
-            news_s = 'pending'
-        except Exception:
-            llm_s = media_s = news_s = 'pending'
-    except Exception:
-        llm_s = media_s = news_s = 'pending'
     cursor.execute("SELECT 1 FROM user_company_favorites WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     is_fav = cursor.fetchone() is not None
-    n = len(company)
     result = {
         'id': company[0],
         'name': company[1],
@@ -1887,15 +1301,15 @@ def get_company(current_user_id, company_id):
         'equity_structure': company[10] or '',
         'social_evaluation': company[11] or '',
         'crawl_status': company[12] or 'pending',
-        'llm_status': llm_s,
-        'media_status': media_s,
-        'news_status': news_s,
+        'llm_status': company[19] or 'pending',
+        'media_status': company[20] or 'pending',
+        'news_status': company[21] or 'pending',
         'established_date': company[13] or '',
-        'legal_cases': company[14] if n > 14 else '',
-        'equity_changes': company[15] if n > 15 else '',
-        'capital_changes': company[16] if n > 16 else '',
-        'supplement_notes': company[17] if n > 17 else '',
-        'tags': company[18] if n > 18 else ''
+        'legal_cases': company[14],
+        'equity_changes': company[15],
+        'capital_changes': company[16],
+        'supplement_notes': company[17],
+        'tags': company[18]
     }
     
     # Get risk alerts for this company
@@ -1940,7 +1354,7 @@ def get_company_risk_timeseries(current_user_id, company_id):
         days_int = 90
     days_int = max(7, min(365, days_int))
 
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     # 权限检查：只允许访问自己关联的企业
     cids = _user_company_ids(cursor, current_user_id)
@@ -2005,7 +1419,7 @@ def predict_risk(current_user_id):
     except (TypeError, ValueError):
         return jsonify({'message': 'enterprise_id 非法'}), 400
 
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cids = _user_company_ids(cursor, current_user_id)
     if enterprise_id not in cids:
@@ -2030,12 +1444,80 @@ def predict_risk(current_user_id):
         return jsonify({'message': '预测失败', 'error': str(e)}), 500
 
 
+_PREDICT_BATCH_MAX = 1000
+
+
+@app.route('/api/v1/predict/risk/batch', methods=['POST', 'OPTIONS'])
+@token_required
+def predict_risk_batch(current_user_id):
+    """
+    组合批量风险预测：一次请求返回多个企业的预测结果。
+    请求体：
+    {
+      "enterprise_ids": [1, 2, 3],   // 省略时为当前用户关注的全部企业
+      "horizon_days": 30,
+      "include_history": false
+    }
+    无权限的企业 id 放在 denied 中返回，不参与预测。
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    data = request.get_json() or {}
+
+    conn = _db_conn()
+    cursor = conn.cursor()
+    cids = set(_user_company_ids(cursor, current_user_id))
+    conn.close()
+
+    raw_ids = data.get('enterprise_ids')
+    if raw_ids is None:
+        enterprise_ids = sorted(cids)
+    else:
+        if not isinstance(raw_ids, list):
+            return jsonify({'message': 'enterprise_ids 须为数组'}), 400
+        try:
+            enterprise_ids = [int(x) for x in raw_ids]
+        except (TypeError, ValueError):
+            return jsonify({'message': 'enterprise_ids 非法'}), 400
+    if len(enterprise_ids) > _PREDICT_BATCH_MAX:
+        return jsonify({'message': '单次最多预测 %d 个企业' % _PREDICT_BATCH_MAX}), 400
+    allowed = [eid for eid in enterprise_ids if eid in cids]
+    denied = [eid for eid in enterprise_ids if eid not in cids]
+
+    horizon_days = data.get('horizon_days') or 30
+    try:
+        horizon_days = int(horizon_days)
+    except (TypeError, ValueError):
+        horizon_days = 30
+    horizon_days = max(7, min(90, horizon_days))
+
+    try:
+        from backend.services import prediction_service as ps
+        ps.DB_PATH = _DB_PATH
+        result = ps.predict_risk_batch(
+            allowed,
+            horizon_days=horizon_days,
+            include_history=bool(data.get('include_history')),
+        )
+        result['denied'] = denied
+        return jsonify(result)
+    except Exception as e:
+        logger.exception('predict_risk_batch error')
+        return jsonify({'message': '批量预测失败', 'error': str(e)}), 500
+
+
+# 同步回测在请求内计算的企业数上限；超出（含 max_enterprises=all）转为后台回测任务
+_SYNC_BACKTEST_MAX_ENTERPRISES = 200
+
+
 @app.route('/api/v1/predict/backtest', methods=['GET', 'POST', 'OPTIONS'])
 @token_required
 def predict_backtest(current_user_id):
     """
     运行预测回测，得到 MAE、RMSE、方向准确率、相对朴素基准提升、残差标准差等，
     用于评估准确性并为预测区间提供依据。结果会写入 backtest_metrics 表。
+    请求内最多计算 _SYNC_BACKTEST_MAX_ENTERPRISES 家企业；要求全部或更多企业时创建后台回测任务，
+    返回 202 与任务 id（同 POST /api/v1/predict/backtest/jobs）。
     """
     if request.method == 'OPTIONS':
         return jsonify({})
@@ -2048,16 +1530,128 @@ def predict_backtest(current_user_id):
         lookback, horizon = 30, 7
     lookback = max(7, min(90, lookback))
     horizon = max(1, min(90, horizon))
+    # horizons=7,14,30：一次读取时间序列做多 horizon 回测
+    horizons = _parse_backtest_horizons(request.args.get('horizons') or '', default=())
+    # max_enterprises=all（或 0）表示全部企业
+    max_ent = (request.args.get('max_enterprises') or '').strip().lower()
+    if max_ent in ('all', '0'):
+        max_enterprises = None
+    else:
+        try:
+            max_enterprises = max(1, int(max_ent)) if max_ent else 200
+        except ValueError:
+            max_enterprises = 200
+    engine = (request.args.get('engine') or '').strip() or None
+    if max_enterprises is None or max_enterprises > _SYNC_BACKTEST_MAX_ENTERPRISES:
+        try:
+            from backend.services import backtest_job_service as bjs
+            bjs.DB_PATH = _DB_PATH
+            job = bjs.create_job(lookback_days=lookback, horizons=horizons or [horizon],
+                                 max_enterprises=max_enterprises, db_path=_DB_PATH)
+            bjs.start_job_in_background(job['job_id'], db_path=_DB_PATH)
+            _audit_log(current_user_id, 'backtest_job_create', resource_type='backtest_job', resource_id=job['job_id'],
+                       detail=f'lookback={lookback} horizons={horizons or [horizon]}')
+            return jsonify({'message': '企业数超过同步回测上限，已转为后台回测任务', **job}), 202
+        except Exception as e:
+            logger.exception('predict_backtest job error')
+            return jsonify({'error': str(e)}), 500
     try:
         from backend.services import backtest_service as bts
         bts.DB_PATH = _DB_PATH
-        result = bts.run_backtest(lookback_days=lookback, horizon_days=horizon, db_path=_DB_PATH)
+        if horizons:
+            result = bts.run_backtest_sweep(lookback_days=lookback, horizons=horizons, max_enterprises=max_enterprises, db_path=_DB_PATH, engine=engine)
+        else:
+            result = bts.run_backtest(lookback_days=lookback, horizon_days=horizon, max_enterprises=max_enterprises, db_path=_DB_PATH, engine=engine)
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.exception('predict_backtest error')
         return jsonify({'error': str(e)}), 500
 
 
+def _parse_backtest_horizons(raw, default=(7, 14, 30)):
+    """解析 horizons（"7,14,30" 或数组），非法项忽略，结果裁剪到 1~90。"""
+    items = raw.split(',') if isinstance(raw, str) else (raw or [])
+    horizons = []
+    for h in items:
+        try:
+            horizons.append(max(1, min(90, int(h))))
+        except (TypeError, ValueError):
+            continue
+    return horizons or list(default)
+
+
+@app.route('/api/v1/predict/backtest/jobs', methods=['POST', 'OPTIONS'])
+@token_required
+def create_backtest_job(current_user_id):
+    """
+    创建并在后台执行全量多 horizon 回测任务，立即返回任务 id；进度见 task_runs / GET 任务接口。
+    请求体：{"lookback_days": 30, "horizons": [7, 14, 30], "max_enterprises": null, "workers": 4}
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    data = request.get_json() or {}
+    try:
+        lookback = max(7, min(90, int(data.get('lookback_days') or 30)))
+    except (TypeError, ValueError):
+        lookback = 30
+    horizons = _parse_backtest_horizons(data.get('horizons'))
+    max_enterprises = data.get('max_enterprises')
+    try:
+        max_enterprises = int(max_enterprises) if max_enterprises else None
+    except (TypeError, ValueError):
+        max_enterprises = None
+    try:
+        workers = max(1, min(16, int(data.get('workers') or 4)))
+    except (TypeError, ValueError):
+        workers = 4
+    try:
+        from backend.services import backtest_job_service as bjs
+        bjs.DB_PATH = _DB_PATH
+        job = bjs.create_job(lookback_days=lookback, horizons=horizons, max_enterprises=max_enterprises, db_path=_DB_PATH)
+        bjs.start_job_in_background(job['job_id'], db_path=_DB_PATH, workers=workers)
+        _audit_log(current_user_id, 'backtest_job_create', resource_type='backtest_job', resource_id=job['job_id'],
+                   detail=f'lookback={lookback} horizons={horizons}')
+        return jsonify({'message': '回测任务已在后台启动', **job}), 202
+    except Exception as e:
+        logger.exception('create_backtest_job error')
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/v1/predict/backtest/jobs/<int:job_id>', methods=['GET', 'OPTIONS'])
+@token_required
+def get_backtest_job(current_user_id, job_id):
+    """回测任务状态、进度与汇总指标；include_enterprises=1 时附带逐企业误差分布（可按 horizon_days 过滤）。"""
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    from backend.services import backtest_job_service as bjs
+    bjs.DB_PATH = _DB_PATH
+    job = bjs.get_job(job_id)
+    if not job:
+        return jsonify({'message': '回测任务不存在'}), 404
+    if request.args.get('include_enterprises', '').lower() in ('1', 'true', 'yes'):
+        job['enterprises'] = bjs.get_job_enterprise_results(job_id, horizon_days=request.args.get('horizon_days', type=int))
+    return jsonify(job)
+
+
+@app.route('/api/v1/predict/backtest/jobs/<int:job_id>/resume', methods=['POST', 'OPTIONS'])
+@token_required
+def resume_backtest_job(current_user_id, job_id):
+    """从检查点续跑中断的回测任务（已完成的企业不会重算）。"""
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    from backend.services import backtest_job_service as bjs
+    bjs.DB_PATH = _DB_PATH
+    job = bjs.get_job(job_id)
+    if not job:
+        return jsonify({'message': '回测任务不存在'}), 404
+    if job['status'] == 'success':
+        return jsonify({'message': '任务已完成，无需续跑', 'job_id': job_id})
+    bjs.start_job_in_background(job_id, db_path=_DB_PATH)
+    return jsonify({'message': '已在后台续跑回测任务', 'job_id': job_id}), 202
+
+
 def _run_company_crawl_and_news_pipeline(company_id, company_name, current_user_id):
     """单企业全流程：工商信息 + 相关新闻搜索 + 媒体舆情爬取。供添加企业、批量导入、重新爬取共用。"""
     try:
@@ -2176,12 +1770,9 @@ def _run_company_crawl_and_news_pipeline(company_id, company_name, current_user_
         print('Crawl error:', e)
         try:
             cx = _db_conn()
-            cu = cx.cursor()
-            for col, val in [('llm_status', 'error'), ('media_status', 'error'), ('news_status', 'error')]:
-                try:
-                    cu.execute("UPDATE companies SET %s=? WHERE id=?" % col, (val, company_id))
-                except sqlite3.OperationalError:
-                    pass
+            cx.cursor().execute(
+                "UPDATE companies SET llm_status='error', media_status='error', news_status='error' WHERE id=?",
+                (company_id,))
             cx.commit()
             cx.close()
         except Exception:
@@ -2237,7 +1828,7 @@ def update_company(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
     data = request.get_json() or {}
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     if not cursor.fetchone():
@@ -2274,7 +1865,7 @@ def update_company(current_user_id, company_id):
 def toggle_company_favorite(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM companies WHERE id=?", (company_id,))
     if not cursor.fetchone():
@@ -2302,7 +1893,7 @@ def toggle_company_favorite(current_user_id, company_id):
 def delete_company(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     if not cursor.fetchone():
@@ -2330,7 +1921,7 @@ def delete_company(current_user_id, company_id):
 def trigger_company_crawl(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     if not cursor.fetchone():
@@ -2354,7 +1945,7 @@ def search_company_news_api(current_user_id, company_id):
     """大模型联网搜索企业相关新闻，整理后保存到 company_news"""
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT name FROM companies WHERE id=?", (company_id,))
     row = cursor.fetchone()
@@ -2378,7 +1969,7 @@ def search_company_news_api(current_user_id, company_id):
     try:
         from backend.services.llm_service import search_company_news
         news_list = search_company_news(row[0], api_key, base_url, model, enable_web_search=enable_web_search)
-        conn2 = sqlite3.connect(db_path)
+        conn2 = _db_conn(db_path)
         cur = conn2.cursor()
         cur.execute("UPDATE task_runs SET status=?, message=?, finished_at=? WHERE id=?", ('success', f'共{len(news_list)}条', datetime.utcnow().isoformat(), task_run_id))
         # 严格替换：先清空该企业原有相关新闻，再写入本次搜索结果，避免在原基础上追加导致混入别家/旧数据
@@ -2395,10 +1986,7 @@ def search_company_news_api(current_user_id, company_id):
             if (rl or '').strip() == '高':
                 _create_risk_alert(cur, company_id, 'news', 'high', (n.get('title') or '')[:200], n.get('source') or '')
                 _notify_alert_created(conn2, company_id, 'news', 'high', (n.get('title') or '')[:200])
-        try:
-            cur.execute("UPDATE companies SET news_status='success' WHERE id=?", (company_id,))
-        except sqlite3.OperationalError:
-            pass
+        cur.execute("UPDATE companies SET news_status='success' WHERE id=?", (company_id,))
         conn2.commit()
         conn2.close()
         _sync_risk_pipeline_after_news(company_id)
@@ -2655,7 +2243,7 @@ def export_company_pdf(current_user_id, company_id):
 def get_llm_config(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT api_key, base_url, model, enable_web_search FROM llm_config WHERE user_id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -2673,7 +2261,7 @@ def put_llm_config(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
     data = request.get_json() or {}
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     enable_web = 1 if data.get('enable_web_search') else 0
     cursor.execute("""INSERT OR REPLACE INTO llm_config (user_id, api_key, base_url, model, enable_web_search, updated_at)
@@ -2691,7 +2279,7 @@ def test_llm_company(current_user_id):
         return jsonify({})
     data = request.get_json() or {}
     name = data.get('name', '美团')
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cur = conn.cursor()
     cur.execute("SELECT api_key, base_url, model, enable_web_search FROM llm_config WHERE user_id=?", (current_user_id,))
     row = cur.fetchone()
@@ -2739,7 +2327,7 @@ def get_system_status(current_user_id):
     services.append({'id': 'backend', 'name': '后端 API', 'endpoint': base_url, 'status': 'online'})
     # 2. 数据库
     try:
-        conn = sqlite3.connect(_DB_PATH)
+        conn = _db_conn()
         conn.execute("SELECT 1")
         conn.close()
         services.append({'id': 'database', 'name': '数据库', 'endpoint': 'SQLite', 'status': 'online'})
@@ -2747,7 +2335,7 @@ def get_system_status(current_user_id):
         services.append({'id': 'database', 'name': '数据库', 'endpoint': 'SQLite', 'status': 'offline', 'message': str(e)[:50]})
     # 3. 企业信息（LLM/爬虫）
     try:
-        conn = sqlite3.connect(_DB_PATH)
+        conn = _db_conn()
         cur = conn.cursor()
         cur.execute("SELECT api_key, enable_web_search FROM llm_config WHERE api_key IS NOT NULL AND api_key != '' LIMIT 1")
         row = cur.fetchone()
@@ -3144,53 +2732,38 @@ def get_rolling_news(current_user_id):
             filter_company_id = int(company_id_raw)
         except (TypeError, ValueError):
             return jsonify([])
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
-    try:
-        cids = _user_company_ids(cursor, current_user_id)
-        if filter_company_id is not None:
-            if filter_company_id not in cids:
-                conn.close()
-                return jsonify([])
-            # 按企业专属标签筛选：只返回 company_id 匹配且 company_tag 与当前企业名一致的新闻（无标签的旧数据不再展示）
-            cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at, risk_dimensions
-                FROM company_news WHERE company_id=? AND company_tag = (SELECT name FROM companies WHERE id=?)
-                ORDER BY created_at DESC LIMIT ?""", (filter_company_id, filter_company_id, limit))
-        else:
-            if not cids:
-                conn.close()
-                return jsonify([])
-            placeholders = ','.join('?' * len(cids))
-            cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at, risk_dimensions
-                FROM company_news WHERE company_id IN (""" + placeholders + """) ORDER BY created_at DESC LIMIT ?""", tuple(cids) + (limit,))
-        rows = cursor.fetchall()
-        news = [{'id': r[0], 'company_id': r[1], 'company_name': '', 'title': r[2], 'content': r[3],
-                 'source': r[4], 'source_url': r[5], 'sentiment_score': r[6], 'risk_level': r[7], 'category': r[8],
-                 'publish_date': r[9], 'created_at': r[10], 'risk_dimensions': r[11] if len(r) > 11 and r[11] else None} for r in rows]
-        # 按企业过滤时只保留 company_id 与请求一致的条目，防止表内错误数据导致串企业
-        if filter_company_id is not None:
-            news = [n for n in news if n.get('company_id') == filter_company_id]
-    except sqlite3.OperationalError:
-        if filter_company_id is not None:
-            cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at
-                FROM company_news WHERE company_id=? AND company_tag = (SELECT name FROM companies WHERE id=?)
-                ORDER BY created_at DESC LIMIT ?""", (filter_company_id, filter_company_id, limit))
-            rows = cursor.fetchall()
-        else:
-            if cids:
-                ph = ','.join('?' * len(cids))
-                cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at
-                    FROM company_news WHERE company_id IN (""" + ph + """) ORDER BY created_at DESC LIMIT ?""", tuple(cids) + (limit,))
-                rows = cursor.fetchall()
-            else:
-                rows = []
-        news = [{'id': r[0], 'company_id': r[1], 'company_name': '', 'title': r[2], 'content': r[3],
-                 'source': r[4], 'source_url': r[5], 'sentiment_score': r[6], 'risk_level': r[7], 'category': r[8],
-                 'publish_date': r[9], 'created_at': r[10], 'risk_dimensions': None} for r in rows]
-        if filter_company_id is not None:
-            news = [n for n in news if n.get('company_id') == filter_company_id]
-    cursor.execute("SELECT id, name FROM companies")
-    company_map = {r[0]: r[1] for r in cursor.fetchall()}
+    cids = _user_company_ids(cursor, current_user_id)
+    if filter_company_id is not None:
+        if filter_company_id not in cids:
+            conn.close()
+            return jsonify([])
+        # 按企业专属标签筛选：只返回 company_id 匹配且 company_tag 与当前企业名一致的新闻（无标签的旧数据不再展示）
+        cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at, risk_dimensions
+            FROM company_news WHERE company_id=? AND company_tag = (SELECT name FROM companies WHERE id=?)
+            ORDER BY created_at DESC LIMIT ?""", (filter_company_id, filter_company_id, limit))
+    else:
+        if not cids:
+            conn.close()
+            return jsonify([])
+        placeholders = ','.join('?' * len(cids))
+        cursor.execute("""SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at, risk_dimensions
+            FROM company_news WHERE company_id IN (""" + placeholders + """) ORDER BY created_at DESC LIMIT ?""", tuple(cids) + (limit,))
+    rows = cursor.fetchall()
+    news = [{'id': r[0], 'company_id': r[1], 'company_name': '', 'title': r[2], 'content': r[3],
+             'source': r[4], 'source_url': r[5], 'sentiment_score': r[6], 'risk_level': r[7], 'category': r[8],
+             'publish_date': r[9], 'created_at': r[10], 'risk_dimensions': r[11] or None} for r in rows]
+    # 按企业过滤时只保留 company_id 与请求一致的条目，防止表内错误数据导致串企业
+    if filter_company_id is not None:
+        news = [n for n in news if n.get('company_id') == filter_company_id]
+    # 只查本页新闻涉及的企业名称
+    news_cids = sorted({n['company_id'] for n in news if n['company_id'] is not None})
+    company_map = {}
+    if news_cids:
+        cursor.execute("SELECT id, name FROM companies WHERE id IN (" + ','.join('?' * len(news_cids)) + ")",
+                       tuple(news_cids))
+        company_map = {r[0]: r[1] for r in cursor.fetchall()}
     for n in news:
         n['company_name'] = company_map.get(n['company_id'], '')
     conn.close()
@@ -3201,7 +2774,7 @@ def get_rolling_news(current_user_id):
 def get_dashboard(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cids = _user_company_ids(cursor, current_user_id)
     if not cids:
@@ -3252,7 +2825,7 @@ def get_dashboard_risk_distribution(current_user_id):
     """企业风险等级分布（用于仪表盘图表），仅统计当前用户企业"""
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cids = _user_company_ids(cursor, current_user_id)
     if not cids:
@@ -3300,7 +2873,7 @@ def search(current_user_id):
     q = (request.args.get('q') or '').strip()
     if not q:
         return jsonify({'companies': [], 'news': []})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cids = _user_company_ids(cursor, current_user_id)
     if not cids:
@@ -3322,7 +2895,7 @@ def search(current_user_id):
 def get_company_wordcloud(current_user_id, company_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT keyword, weight FROM company_keywords WHERE company_id=?", (company_id,))
     keywords = [{'word': r[0], 'weight': r[1]} for r in cursor.fetchall()]
@@ -3343,7 +2916,7 @@ def get_company_supplements(current_user_id, company_id):
     """获取企业尽调补充对话历史"""
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     if not cursor.fetchone():
@@ -3375,7 +2948,7 @@ def supplement_chat(current_user_id, company_id):
     if len(text) > 5000:
         return jsonify({'message': '补充内容不超过 5000 字'}), 400
     db_path = _DB_PATH
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (current_user_id, company_id))
     if not cursor.fetchone():
@@ -3400,19 +2973,33 @@ def supplement_chat(current_user_id, company_id):
     conn.close()
     if not llm_row or not (llm_row[0] and str(llm_row[0]).strip()):
         return jsonify({'message': '请先在系统设置中配置 LLM API Key'}), 400
+    if _wants_stream(data):
+        from backend.services.llm_service import stream_supplement_chat
+
+        def _finish(result):
+            return _save_supplement_result(company_id, current_user_id, text, result)
+        return _sse_response(
+            stream_supplement_chat(name, company_summary, text, llm_row[0], llm_row[1] or '', llm_row[2] or 'gpt-4o-mini'),
+            on_done=_finish,
+        )
     from backend.services.llm_service import process_supplement_chat
     result = process_supplement_chat(name, company_summary, text, llm_row[0], llm_row[1] or '', llm_row[2] or 'gpt-4o-mini')
+    return jsonify(_save_supplement_result(company_id, current_user_id, text, result))
+
+
+def _save_supplement_result(company_id, user_id, text, result):
+    """写入尽调补充对话记录并把 LLM 提取的字段归集到企业档案，返回给前端的结构化结果。"""
     updates = result.get('updates') or {}
     summary = result.get('summary') or '已记录'
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute(
         "INSERT INTO company_supplements (company_id, user_id, role, content, merged_fields) VALUES (?,?,?,?,?)",
-        (company_id, current_user_id, 'user', text, None)
+        (company_id, user_id, 'user', text, None)
     )
     cursor.execute(
         "INSERT INTO company_supplements (company_id, user_id, role, content, merged_fields) VALUES (?,?,?,?,?)",
-        (company_id, current_user_id, 'assistant', summary, json.dumps(updates, ensure_ascii=False))
+        (company_id, user_id, 'assistant', summary, json.dumps(updates, ensure_ascii=False))
     )
     set_clauses = ["last_updated=?"]
     params = [datetime.now().isoformat()]
@@ -3425,7 +3012,58 @@ def supplement_chat(current_user_id, company_id):
         cursor.execute("UPDATE companies SET " + ", ".join(set_clauses) + " WHERE id=?", tuple(params))
     conn.commit()
     conn.close()
-    return jsonify({'message': '已归集', 'summary': summary, 'updates': updates})
+    _schedule_retrieval_sync(company_id)
+    return {'message': '已归集', 'summary': summary, 'updates': updates}
+
+
+def _wants_stream(data=None):
+    """客户端是否请求 SSE 流式输出：Accept: text/event-stream、?stream=1 或请求体 stream=true。"""
+    if 'text/event-stream' in (request.headers.get('Accept') or ''):
+        return True
+    if str(request.args.get('stream') or '').lower() in ('1', 'true'):
+        return True
+    return bool((data or {}).get('stream') is True)
+
+
+def _sse_frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(events, on_done=None):
+    """
+    把 (event, data) 生成器包装为 text/event-stream 响应：token 事件逐段下发，空闲时发送注释心跳，
+    done 事件的数据先经 on_done 处理（如落库）再下发。
+    每个流在结束前占用一个 WSGI 处理线程，同时进行的流数受 LLM_MAX_STREAMS 限制，名额已满时返回 429。
+    """
+    from backend.services.llm_service import acquire_stream_slot, release_stream_slot
+    if not acquire_stream_slot():
+        events.close()
+        return jsonify({'message': '当前进行中的问答过多，请稍后重试'}), 429
+
+    def _generate():
+        try:
+            # 立即下发一帧，使首字节不依赖模型首个 token 的到达时间
+            yield ": stream-open\n\n"
+            for event, data in events:
+                if event == 'ping':
+                    yield ": ping\n\n"
+                    continue
+                if event == 'done' and on_done is not None:
+                    try:
+                        data = on_done(data)
+                    except Exception as e:
+                        logger.warning("SSE on_done failed: %s", e)
+                        yield _sse_frame('error', {'message': '结果保存失败'})
+                        return
+                yield _sse_frame(event, data)
+        finally:
+            events.close()
+            release_stream_slot()
+
+    resp = Response(_generate(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
 
 
 @app.route('/api/companies/<int:company_id>/ask', methods=['POST', 'OPTIONS'])
@@ -3455,17 +3093,30 @@ def ask_company(current_user_id, company_id):
         return jsonify({'message': 'Company not found'}), 404
     name = row[0]
     context_parts = [f"企业：{name}", f"行业：{row[1] or '-'}", f"风险等级：{row[2] or '-'}", f"法人：{row[3] or '-'}", f"注册资本：{row[4] or '-'}", f"经营状态：{row[5] or '-'}", f"社会评价：{row[8] or '-'}", f"尽调备注：{row[9] or '-'}"]
-    cursor.execute("SELECT title, content, source, risk_level, category FROM company_news WHERE company_id=? ORDER BY created_at DESC LIMIT 30", (company_id,))
-    for r in cursor.fetchall():
-        context_parts.append(f"新闻：{r[0] or ''} | {r[2] or ''} | 风险:{r[3] or '-'} | {(r[1] or '')[:150]}")
-    cursor.execute("SELECT role, content FROM company_supplements WHERE company_id=? ORDER BY created_at DESC LIMIT 20", (company_id,))
-    for r in cursor.fetchall():
-        context_parts.append(f"补充({r[0]}): {(r[1] or '')[:200]}")
+    # 只送入与问题相关的资料片段（BM25 检索新闻、舆情、尽调补充与上传文档）；检索不可用或无命中时回退为最近资料
+    passages = None
+    try:
+        from backend.services.company_retrieval import top_passages
+        passages = top_passages(_DB_PATH, company_id, question)
+    except Exception as e:
+        logger.warning("company retrieval failed: %s", e)
+    if passages:
+        context_parts.extend(passages)
+    else:
+        cursor.execute("SELECT title, content, source, risk_level, category FROM company_news WHERE company_id=? ORDER BY created_at DESC LIMIT 30", (company_id,))
+        for r in cursor.fetchall():
+            context_parts.append(f"新闻：{r[0] or ''} | {r[2] or ''} | 风险:{r[3] or '-'} | {(r[1] or '')[:150]}")
+        cursor.execute("SELECT role, content FROM company_supplements WHERE company_id=? ORDER BY created_at DESC LIMIT 20", (company_id,))
+        for r in cursor.fetchall():
+            context_parts.append(f"补充({r[0]}): {(r[1] or '')[:200]}")
     cursor.execute("SELECT api_key, base_url, model FROM llm_config WHERE user_id=?", (current_user_id,))
     llm_row = cursor.fetchone()
     conn.close()
     if not llm_row or not (llm_row[0] and str(llm_row[0]).strip()):
         return jsonify({'message': '请先在系统设置中配置 LLM API Key'}), 400
+    if _wants_stream(data):
+        from backend.services.llm_service import stream_company_answer
+        return _sse_response(stream_company_answer(name, '\n'.join(context_parts), question, llm_row[0], llm_row[1] or '', llm_row[2] or 'gpt-4o-mini'))
     from backend.services.llm_service import ask_company_question
     result = ask_company_question(name, '\n'.join(context_parts), question, llm_row[0], llm_row[1] or '', llm_row[2] or 'gpt-4o-mini')
     return jsonify(result)
@@ -3476,7 +3127,7 @@ def ask_company(current_user_id, company_id):
 def get_search_interval(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT search_interval_minutes, report_template FROM user_settings WHERE user_id=?", (current_user_id,))
     row = cursor.fetchone()
@@ -3492,7 +3143,7 @@ def put_search_interval(current_user_id):
     interval = int(data.get('search_interval_minutes', 30))
     template = data.get('report_template', '')
     interval = max(10, min(1440, interval))
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM user_settings WHERE user_id=?", (current_user_id,))
     if cursor.fetchone():
@@ -3509,7 +3160,7 @@ def _analyze_and_classify_link(link_id, user_id, url, title, company_id):
     """后台分析链接并归类到企业、写入资讯"""
     db_path = _DB_PATH
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cur = conn.cursor()
         cur.execute("SELECT api_key, base_url, model FROM llm_config WHERE user_id=?", (user_id,))
         llm_row = cur.fetchone()
@@ -3523,7 +3174,7 @@ def _analyze_and_classify_link(link_id, user_id, url, title, company_id):
         cid = result.get('company_id')
         if cid is None and company_id:
             cid = int(company_id)
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cur = conn.cursor()
         cur.execute("UPDATE user_links SET company_id=?, analysis_result=?, status='analyzed' WHERE id=?",
             (cid, json.dumps(result, ensure_ascii=False), link_id))
@@ -3555,12 +3206,14 @@ def _analyze_and_classify_link(link_id, user_id, url, title, company_id):
                     cur.execute("INSERT OR IGNORE INTO company_keywords (company_id, keyword, weight) VALUES (?,?,1)", (cid, kw))
         conn.commit()
         conn.close()
+        if cid:
+            _schedule_retrieval_sync(cid)
         if result.get('is_news') and cid:
             _sync_risk_pipeline_after_news(cid)
     except Exception as e:
         print('[Link] analyze error:', e)
         try:
-            conn = sqlite3.connect(db_path)
+            conn = _db_conn(db_path)
             cur = conn.cursor()
             cur.execute("UPDATE user_links SET status='failed', analysis_result=? WHERE id=?", (json.dumps({'error': str(e)}, ensure_ascii=False), link_id))
             conn.commit()
@@ -3580,7 +3233,7 @@ def add_link(current_user_id):
     title = data.get('title', '')
     if not url:
         return jsonify({'message': 'URL is required'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("INSERT INTO user_links (user_id, company_id, url, title, status) VALUES (?,?,?,?,'pending')",
         (current_user_id, company_id, url, title))
@@ -3598,7 +3251,7 @@ def get_links(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
     company_id = request.args.get('company_id')
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     if company_id:
         cursor.execute("SELECT id, company_id, url, title, status, analysis_result, created_at FROM user_links WHERE user_id=? AND company_id=? ORDER BY created_at DESC",
@@ -3612,11 +3265,8 @@ def get_links(current_user_id):
 
 def _create_risk_alert(cursor, company_id, alert_type, severity, description, source=None):
     """在 risk_alerts 表中插入一条警报（企业风险升高或高风险新闻等）。"""
-    try:
-        cursor.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
-            (company_id, alert_type, severity or 'high', description or '', source or ''))
-    except sqlite3.OperationalError:
-        pass
+    cursor.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
+        (company_id, alert_type, severity or 'high', description or '', source or ''))
 
 
 def _notify_alert_created(conn, company_id, alert_type, severity, description, company_name=None):
@@ -3650,61 +3300,51 @@ def _notify_alert_created(conn, company_id, alert_type, severity, description, c
 @app.route('/api/alerts', methods=['GET', 'OPTIONS'])
 @token_required
 def get_alerts(current_user_id):
+    """
+    风险警报列表（键集分页）：?severity=high|medium|low|高|中|低 &processed=0|1 &company_id= &since=&until=(YYYY-MM-DD)
+    &limit=50 &before_ts=&before_id=（取上一页返回的 next_cursor）。返回 {items, next_cursor}。
+    """
     if request.method == 'OPTIONS':
         return jsonify({})
-    severity_filter = request.args.get('severity', '').strip().lower()
+    from backend.services import alert_service
+    args = request.args
+    severity = (args.get('severity') or '').strip().lower()
+    if severity not in alert_service.SEVERITY_ALIASES:
+        severity = None
+    processed_raw = (args.get('processed') or '').strip().lower()
+    processed = None
+    if processed_raw in ('1', 'true', 'yes'):
+        processed = True
+    elif processed_raw in ('0', 'false', 'no'):
+        processed = False
+    try:
+        company_id = int(args['company_id']) if args.get('company_id') else None
+        before_id = int(args['before_id']) if args.get('before_id') else None
+        limit = int(args.get('limit') or alert_service.DEFAULT_LIMIT)
+        since = _parse_date_arg(args.get('since'))
+        until = _parse_date_arg(args.get('until'))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'company_id / before_id / limit 须为整数，since / until 须为 YYYY-MM-DD'}), 400
+    before_ts = (args.get('before_ts') or '').strip() or None
+    if (before_ts is None) != (before_id is None):
+        return jsonify({'message': 'before_ts 与 before_id 须同时提供'}), 400
     conn = _db_conn()
-    cursor = conn.cursor()
-    cids = _user_company_ids(cursor, current_user_id)
-    if not cids:
-        conn.close()
-        return jsonify([])
-    placeholders = ','.join('?' * len(cids))
-    sql = """
-        SELECT ra.id, ra.company_id, ra.alert_type, ra.severity, ra.description, ra.source, ra.timestamp,
-               c.name as company_name
-        FROM risk_alerts ra
-        JOIN companies c ON ra.company_id = c.id
-        WHERE ra.company_id IN (""" + placeholders + """)
-    """
-    params = list(cids)
     try:
-        sql = sql.replace("ra.timestamp,", "ra.timestamp, ra.processed_at,")
-        sql += " ORDER BY ra.timestamp DESC LIMIT 50"
-        cursor.execute(sql, tuple(params))
-        rows = cursor.fetchall()
-        alerts = []
-        for row in rows:
-            alerts.append({
-                'id': row[0],
-                'company_id': row[1],
-                'alert_type': row[2],
-                'severity': row[3],
-                'description': row[4],
-                'source': row[5],
-                'timestamp': row[6],
-                'processed_at': row[7] if len(row) > 7 else None,
-                'company_name': row[8] if len(row) > 8 else row[7]
-            })
-    except sqlite3.OperationalError:
-        sql = """
-            SELECT ra.id, ra.company_id, ra.alert_type, ra.severity, ra.description, ra.source, ra.timestamp,
-                   c.name as company_name
-            FROM risk_alerts ra
-            JOIN companies c ON ra.company_id = c.id
-            WHERE ra.company_id IN (""" + placeholders + """)
-            ORDER BY ra.timestamp DESC
-            LIMIT 50
-        """
-        cursor.execute(sql, tuple(cids))
-        alerts = [{'id': row[0], 'company_id': row[1], 'alert_type': row[2], 'severity': row[3], 'description': row[4],
-                   'source': row[5], 'timestamp': row[6], 'company_name': row[7], 'processed_at': None} for row in cursor.fetchall()]
-    conn.close()
-    if severity_filter and severity_filter in ('high', '中', '高', 'medium', '低', 'low'):
-        sev_map = {'high': ('高', 'high'), 'medium': ('中', 'medium'), 'low': ('低', 'low'), '中': ('中', 'medium'), '高': ('高', 'high'), '低': ('低', 'low')}
-        want_tuple = sev_map.get(severity_filter, (severity_filter,))
-        alerts = [a for a in alerts if (a.get('severity') or '') in want_tuple or (a.get('severity') or '').lower() == severity_filter]
-    return jsonify(alerts)
+        page = alert_service.list_alerts(
+            conn, current_user_id, severity=severity, processed=processed, company_id=company_id,
+            since=since, until=until, before_ts=before_ts, before_id=before_id, limit=limit,
+        )
+    finally:
+        conn.close()
+    return jsonify(page)
+
+
+def _parse_date_arg(value):
+    """YYYY-MM-DD 查询参数；空值返回 None，格式错误抛 ValueError。"""
+    value = (value or '').strip()
+    if not value:
+        return None
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
 
 
 @app.route('/api/alerts/<int:alert_id>', methods=['PATCH', 'OPTIONS'])
@@ -3723,11 +3363,7 @@ def mark_alert_processed(current_user_id, alert_id):
     if not cursor.fetchone():
         conn.close()
         return jsonify({'message': '警报不存在或无权限'}), 404
-    try:
-        cursor.execute("UPDATE risk_alerts SET processed_at=? WHERE id=?", (datetime.utcnow().isoformat(), alert_id))
-    except sqlite3.OperationalError:
-        conn.close()
-        return jsonify({'message': '当前版本不支持标记已处理'}), 501
+    cursor.execute("UPDATE risk_alerts SET processed_at=? WHERE id=?", (datetime.utcnow().isoformat(), alert_id))
     conn.commit()
     conn.close()
     return jsonify({'message': '已标记为已处理'})
@@ -3738,7 +3374,7 @@ def _analyze_and_classify_document(doc_id, user_id, filepath, filename, company_
     try:
         from backend.services.document_service import extract_text_from_file
         content = extract_text_from_file(filepath)
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cur = conn.cursor()
         cur.execute("SELECT api_key, base_url, model FROM llm_config WHERE user_id=?", (user_id,))
         llm_row = cur.fetchone()
@@ -3751,7 +3387,7 @@ def _analyze_and_classify_document(doc_id, user_id, filepath, filename, company_
         cid = result.get('company_id')
         if cid is None and company_id:
             cid = int(company_id)
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cur = conn.cursor()
         cur.execute("UPDATE documents SET company_id=?, analysis_result=?, status='analyzed' WHERE id=?",
             (cid, json.dumps(result, ensure_ascii=False), doc_id))
@@ -3783,12 +3419,14 @@ def _analyze_and_classify_document(doc_id, user_id, filepath, filename, company_
                     cur.execute("INSERT OR IGNORE INTO company_keywords (company_id, keyword, weight) VALUES (?,?,1)", (cid, kw))
         conn.commit()
         conn.close()
+        if cid:
+            _schedule_retrieval_sync(cid)
         if result.get('is_news') and cid:
             _sync_risk_pipeline_after_news(cid)
     except Exception as e:
         print('[Document] analyze error:', e)
         try:
-            conn = sqlite3.connect(db_path)
+            conn = _db_conn(db_path)
             cur = conn.cursor()
             cur.execute("UPDATE documents SET status='failed', analysis_result=? WHERE id=?", (json.dumps({'error': str(e)}, ensure_ascii=False), doc_id))
             conn.commit()
@@ -3834,7 +3472,7 @@ def upload_document(current_user_id):
     
     file.save(filepath)
     
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("""
         INSERT INTO documents (user_id, company_id, filename, filepath, status)
@@ -4160,7 +3798,11 @@ def restore_backup(current_user_id):
         return jsonify({'message': '备份文件不存在'}), 404
     try:
         import shutil
+        db_pool.get_pool(_DB_PATH).close_idle()
         shutil.copy2(path, _DB_PATH)
+        _invalidate_feature_store()
+        from backend.services import company_retrieval
+        company_retrieval.reset_index(_DB_PATH)
         _audit_log(current_user_id, 'restore_backup', 'system', None, filename)
         return jsonify({'message': '已恢复，请重启后端使数据生效'})
     except Exception as e:
@@ -4226,7 +3868,7 @@ def api_docs_ui():
 # ---------- 健康检查（含依赖状态） ----------
 @app.route('/api/health/detailed', methods=['GET'])
 def health_detailed():
-    """健康检查：db、可选 LLM 配置、MediaCrawler 路径"""
+    """健康检查：db、可选 LLM 配置、MediaCrawler 路径、ML 模型加载/推理计数、LLM 缓存命中率与网关限流统计"""
     out = {'status': 'ok', 'db': 'ok', 'llm_configured': False, 'mediacrawler_path': bool(os.environ.get('MEDIACRAWLER_PATH'))}
     try:
         c = _db_conn()
@@ -4243,9 +3885,45 @@ def health_detailed():
         conn.close()
     except Exception:
         pass
+    try:
+        from backend.ml import model_registry
+        out['ml_models'] = model_registry.stats()
+    except Exception:
+        out['ml_models'] = None
+    try:
+        from backend.services import llm_cache
+        out['llm_cache'] = llm_cache.stats()
+    except Exception:
+        out['llm_cache'] = None
+    try:
+        from backend.services import llm_gateway
+        out['llm_gateway'] = llm_gateway.stats()
+    except Exception:
+        out['llm_gateway'] = None
+    try:
+        from backend.services import llm_policy
+        out['llm_policy'] = llm_policy.stats()
+    except Exception:
+        out['llm_policy'] = None
+    out['db_pool'] = db_pool.stats().get(_DB_PATH)
     return jsonify(out)
 
 
+@app.route('/api/health/llm-stats', methods=['GET', 'OPTIONS'])
+@token_required
+@admin_required
+def health_llm_stats(current_user_id):
+    """LLM 调用遥测（管理员）：最近 ?hours=24 小时按任务/模型汇总调用数、token 用量、耗时与估算费用"""
+    if request.method == 'OPTIONS':
+        return jsonify({})
+    try:
+        hours = max(1, min(24 * 14, int(request.args.get('hours', 24))))
+    except (TypeError, ValueError):
+        return jsonify({'message': 'hours 须为整数'}), 400
+    from backend.services import llm_telemetry
+    return jsonify(llm_telemetry.summary(hours, db_path=_DB_PATH))
+
+
 # Admin routes (require admin role)
 @app.route('/api/admin/users', methods=['GET', 'OPTIONS'])
 @token_required
@@ -4253,7 +3931,7 @@ def health_detailed():
 def get_users(current_user_id):
     if request.method == 'OPTIONS':
         return jsonify({})
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, email, role, created_at FROM users ORDER BY created_at DESC")
     users = []
@@ -4288,7 +3966,7 @@ def admin_create_user(current_user_id):
         return jsonify({'message': '请填写用户名'}), 400
     if not password or len(password) < 6:
         return jsonify({'message': '密码至少 6 位'}), 400
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO users (username, email, password_hash, role) VALUES (?, ?, ?, ?)",
@@ -4312,7 +3990,7 @@ def admin_update_user(current_user_id, user_id):
     if user_id == current_user_id:
         return jsonify({'message': '不能修改自己的角色'}), 400
     data = request.get_json() or {}
-    conn = sqlite3.connect(_DB_PATH)
+    conn = _db_conn()
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE id=?", (user_id,))
     if not cursor.fetchone():
@@ -4349,7 +4027,7 @@ def admin_delete_user(current_user_id, user_id):
     if user_id == current_user_id:
         return jsonify({'message': '不能删除自己'}), 400
     db_path = _DB_PATH
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id FROM users WHERE id=?", (user_id,))
     if not cursor.fetchone():
@@ -4389,7 +4067,7 @@ def admin_system_settings(current_user_id):
     if request.method in ('PUT', 'PATCH'):
         data = request.get_json() or {}
         allowed = ('smtp_host', 'smtp_port', 'smtp_user', 'smtp_from', 'smtp_password')
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cursor = conn.cursor()
         for key in allowed:
             if key not in data:
@@ -4402,7 +4080,7 @@ def admin_system_settings(current_user_id):
         conn.commit()
         conn.close()
         return jsonify({'message': '已保存'})
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT key, value FROM system_settings WHERE key LIKE 'smtp_%'")
     rows = cursor.fetchall()
@@ -4438,7 +4116,7 @@ def admin_risk_labels(current_user_id):
     if request.method == 'GET':
         enterprise_id = request.args.get('enterprise_id')
         label_type = request.args.get('label_type')
-        conn = sqlite3.connect(db_path)
+        conn = _db_conn(db_path)
         cursor = conn.cursor()
         sql = "SELECT id, enterprise_id, as_of_date, label_type, label_value, note, created_at FROM enterprise_risk_label WHERE 1=1"
         params = []
@@ -4486,7 +4164,7 @@ def admin_risk_labels(current_user_id):
     if val not in (0, 1):
         return jsonify({'message': 'label_value 必须是 0 或 1'}), 400
 
-    conn = sqlite3.connect(db_path)
+    conn = _db_conn(db_path)
     cursor = conn.cursor()
     cursor.execute(
         """
@@ -4544,16 +4222,28 @@ def _update_company_risk_level_from_news(conn, company_id):
     conn.commit()
 
 
+def _schedule_retrieval_sync(company_id):
+    """企业资料（新闻、舆情、尽调补充、文档）写入后登记检索索引的后台同步，问答请求内不再同步。"""
+    try:
+        from backend.services import company_retrieval
+        company_retrieval.schedule_sync(_DB_PATH, company_id)
+    except Exception as e:
+        logger.warning('schedule retrieval sync failed: %s', e)
+
+
 def _sync_risk_pipeline_after_news(company_id=None):
-    """company_news 有新数据写入后，自动更新该企业（或全库）的事件特征与时间序列，并依新闻汇总更新企业风险等级。"""
+    """company_news 有新数据写入后，增量更新该企业（或全库）的事件特征、只重算受影响日期的时间序列，并依新闻汇总更新企业风险等级。"""
+    if company_id is not None:
+        _schedule_retrieval_sync(company_id)
     try:
         from backend.services import feature_extraction_service as fes
         from backend.services import risk_timeseries_service as rts
         fes.DB_PATH = _DB_PATH
         rts.DB_PATH = _DB_PATH
-        fes.rebuild_news_features(db_path=_DB_PATH, enterprise_id=company_id)
+        result = fes.update_news_features(db_path=_DB_PATH, enterprise_id=company_id)
+        for eid, dates in result['dirty_dates'].items():
+            rts.recompute_timeseries_days(eid, dates, db_path=_DB_PATH)
         if company_id is not None:
-            rts.rebuild_timeseries_for_enterprise(company_id, db_path=_DB_PATH)
             conn = _db_conn()
             try:
                 _update_company_risk_level_from_news(conn, company_id)
@@ -4566,7 +4256,6 @@ def _sync_risk_pipeline_after_news(company_id=None):
                 cur.execute("SELECT id FROM companies")
                 cids = [row[0] for row in cur.fetchall()]
                 for cid in cids:
-                    rts.rebuild_timeseries_for_enterprise(cid, db_path=_DB_PATH)
                     _update_company_risk_level_from_news(conn, cid)
             finally:
                 conn.close()
@@ -4729,6 +4418,8 @@ def admin_db_table_row(current_user_id, table_name):
             conn.commit()
             rid = cur.lastrowid
             conn.close()
+            if safe_name == 'enterprise_risk_timeseries':
+                _invalidate_feature_store()
             return jsonify({'message': '已插入', 'id': rid})
 
         if request.method == 'PUT':
@@ -4751,6 +4442,8 @@ def admin_db_table_row(current_user_id, table_name):
             )
             conn.commit()
             conn.close()
+            if safe_name == 'enterprise_risk_timeseries':
+                _invalidate_feature_store()
             return jsonify({'message': '已更新', 'rows': cur.rowcount})
 
         if request.method == 'DELETE':
@@ -4764,6 +4457,8 @@ def admin_db_table_row(current_user_id, table_name):
             cur.execute("DELETE FROM %s WHERE %s=?" % (safe_name, pk), (pk_val,))
             conn.commit()
             conn.close()
+            if safe_name == 'enterprise_risk_timeseries':
+                _invalidate_feature_store()
             return jsonify({'message': '已删除', 'rows': cur.rowcount})
     except Exception as e:
         logger.exception('admin_db_table_row error')
@@ -4779,20 +4474,19 @@ def admin_rebuild_risk_timeseries(current_user_id):
         return jsonify({})
     data = request.get_json() or {}
     enterprise_id = data.get('enterprise_id')
+    # 聚合引擎：sql（默认，按日 GROUP BY 下推到 SQLite）/ python（逐行计算，用于比对）
+    engine = data.get('engine') or None
+    if isinstance(engine, str):
+        engine = engine.strip() or None
     try:
         from backend.services import risk_timeseries_service as rts
         rts.DB_PATH = _DB_PATH
-        total = 0
+        if engine not in (None, rts.ENGINE_SQL, rts.ENGINE_PYTHON):
+            return jsonify({'message': 'engine 仅支持 sql / python'}), 400
         if enterprise_id:
-            total = rts.rebuild_timeseries_for_enterprise(int(enterprise_id))
+            total = rts.rebuild_timeseries_for_enterprise(int(enterprise_id), engine=engine)
         else:
-            conn = sqlite3.connect(_DB_PATH)
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM companies")
-            ids = [row[0] for row in cur.fetchall()]
-            conn.close()
-            for cid in ids:
-                total += rts.rebuild_timeseries_for_enterprise(cid)
+            total = rts.rebuild_timeseries_for_all(engine=engine)
         _audit_log(
             current_user_id,
             'admin_rebuild_risk_timeseries',
@@ -4981,9 +4675,22 @@ def run_standalone_server():
             '若为生产环境可能导致数据库被清空，请务必在 .env 或环境中配置。'
         )
     init_db()
+    try:
+        from backend.services import llm_telemetry
+        llm_telemetry.DB_PATH = _DB_PATH
+    except Exception as e:
+        logger.warning('LLM telemetry init error: %s', e)
+    try:
+        from backend.services import backtest_job_service as bjs
+        bjs.DB_PATH = _DB_PATH
+        resumed = bjs.resume_interrupted_jobs(_DB_PATH)
+        if resumed:
+            logger.info('Resuming interrupted backtest jobs: %s', resumed)
+    except Exception as e:
+        logger.warning('Backtest job resume error: %s', e)
     try:
         from backend.services.scheduler_service import start_scheduler
-        conn = sqlite3.connect(_DB_PATH)
+        conn = _db_conn()
         cur = conn.cursor()
         cur.execute("SELECT search_interval_minutes FROM user_settings WHERE search_interval_minutes > 0 LIMIT 1")
         row = cur.fetchone()
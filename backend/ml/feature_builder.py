@@ -1,20 +1,24 @@
 # -*- coding: utf-8 -*-
 """
-ML 特征构建骨架（阶段 2）
--------------------------
+ML 特征构建（阶段 2）
+---------------------
 作用：
 - 从 SQLite（enterprise_risk_timeseries + enterprise_risk_label 等）构建训练/预测所需特征
-- 目前仅提供函数签名与基本结构，方便后续逐步填充
+- 时间序列经列式特征缓存（feature_store）读取，每个企业只加载一次
+- 窗口统计（均值/标准差/最后值/斜率）由 SeriesIndex 的前缀和得出，训练集可按企业分组多进程计算
 """
 
 from __future__ import annotations
 
 import sqlite3
-from datetime import datetime, timedelta
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from typing import Optional, Tuple, List, Dict, Any
 
 import numpy as np
 
+from backend.ml import feature_store
+
 DB_PATH: Optional[str] = None
 
 
@@ -25,17 +29,89 @@ def _get_conn(db_path: Optional[str] = None) -> sqlite3.Connection:
     return sqlite3.connect(path, timeout=30)
 
 
-def _linear_trend(xs: List[float]) -> float:
-    """简单线性斜率，用于趋势特征。"""
-    n = len(xs)
-    if n < 2:
-        return 0.0
-    x_vals = list(range(n))
-    mean_x = sum(x_vals) / n
-    mean_y = sum(xs) / n
-    num = sum((x - mean_x) * (y - mean_y) for x, y in zip(x_vals, xs))
-    den = sum((x - mean_x) ** 2 for x in x_vals) or 1.0
-    return num / den
+# 特征列：综合分 + 四个维度分（feature_store.STORE_COLUMNS 的前 5 列）；每列取窗口内 均值/标准差/最后值/斜率
+SCORE_COLUMNS: Tuple[str, ...] = feature_store.STORE_COLUMNS[:5]
+_STATS: Tuple[str, ...] = ("mean", "std", "last", "slope")
+FEATURE_NAMES: List[str] = ["%s_%s" % (c, s) for c in SCORE_COLUMNS for s in _STATS]
+
+# 日期窗口按企业分组交给子进程时，每个任务至少包含的企业数
+_ENTERPRISES_PER_TASK = 20
+
+
+class SeriesIndex:
+    """
+    单个企业的风险时间序列（按日期升序）及前缀和。
+    任意 [start, end] 日期窗口用二分定位下标区间，再由前缀和 O(1) 得出均值/标准差/斜率，
+    同一企业的所有 as_of_date 只需加载一次序列。
+    """
+
+    def __init__(self, dates: Any, values: np.ndarray):
+        # dates 可为 'YYYY-MM-DD' 字符串序列或 feature_store 中的天数数组
+        days = np.asarray(dates)
+        self.days = days.astype(np.int64) if days.dtype.kind in "iu" else feature_store.to_days(dates)
+        vals = np.asarray(values, dtype=float).reshape(len(self.days), len(SCORE_COLUMNS))
+        k = np.arange(len(self.days), dtype=float)[:, None]
+        zero = np.zeros((1, vals.shape[1]))
+        self.values = vals
+        self._cs = np.vstack([zero, np.cumsum(vals, axis=0)])
+        self._cs2 = np.vstack([zero, np.cumsum(vals * vals, axis=0)])
+        self._cky = np.vstack([zero, np.cumsum(k * vals, axis=0)])
+
+    def features(self, as_of_date: str, lookback_days: int = 90) -> np.ndarray:
+        """[as_of_date - lookback_days, as_of_date] 窗口的特征行；窗口内无数据时返回空数组。"""
+        end = int(feature_store.to_days([as_of_date])[0])
+        lo = int(np.searchsorted(self.days, end - lookback_days, side="left"))
+        hi = int(np.searchsorted(self.days, end, side="right"))
+        n = hi - lo
+        if n <= 0:
+            return np.zeros((0,))
+        s = self._cs[hi] - self._cs[lo]
+        s2 = self._cs2[hi] - self._cs2[lo]
+        mean = s / n
+        std = np.sqrt(np.maximum(s2 / n - mean * mean, 0.0))
+        last = self.values[hi - 1]
+        if n >= 2:
+            # 窗口内下标 x=0..n-1：Σ(x-x̄)(y-ȳ) = Σ k·y - lo·Σy - x̄·Σy，Σ(x-x̄)² = n(n²-1)/12
+            sxy = (self._cky[hi] - self._cky[lo]) - (lo + (n - 1) / 2.0) * s
+            slope = sxy / (n * (n * n - 1) / 12.0)
+        else:
+            slope = np.zeros_like(mean)
+        return np.column_stack([mean, std, last, slope]).reshape(-1)
+
+
+def _features_for_enterprise(
+    dates: List[str],
+    values: np.ndarray,
+    requests: List[Tuple[int, str]],
+    lookback_days: int,
+) -> List[Tuple[int, np.ndarray]]:
+    """对一个企业的全部 (label 序号, as_of_date) 计算特征；无窗口数据的样本跳过。"""
+    index = SeriesIndex(dates, values)
+    out: List[Tuple[int, np.ndarray]] = []
+    for pos, as_of in requests:
+        feat = index.features(as_of, lookback_days)
+        if feat.size:
+            out.append((pos, feat))
+    return out
+
+
+def _features_for_group(
+    group: List[Tuple[List[str], np.ndarray, List[Tuple[int, str]]]],
+    lookback_days: int,
+) -> List[Tuple[int, np.ndarray]]:
+    out: List[Tuple[int, np.ndarray]] = []
+    for dates, values, requests in group:
+        out.extend(_features_for_enterprise(dates, values, requests, lookback_days))
+    return out
+
+
+def _load_series(db_path: str, enterprise_ids: List[int]) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    从列式特征缓存读取若干企业的 (天数, SCORE_COLUMNS 值矩阵)；
+    缓存中缺失的企业由 feature_store 从 SQLite 一次补齐。
+    """
+    stored = feature_store.load_many(db_path, enterprise_ids)
+    return {eid: (arr["date"], arr["values"][:, :len(SCORE_COLUMNS)]) for eid, arr in stored.items()}
 
 
 def build_ml_dataset(
@@ -43,20 +119,21 @@ def build_ml_dataset(
     lookback_days: int = 90,
     horizon_days: int = 30,
     db_path: Optional[str] = None,
+    workers: int = 1,
 ) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]:
     """
     从数据库构建用于训练的 (X, y, meta)：
-    - X: (n_samples, n_features) 的特征矩阵
+    - X: (n_samples, len(FEATURE_NAMES)) 的特征矩阵
     - y: (n_samples,) 的标签（0/1）
     - meta: 每一行对应的 {enterprise_id, as_of_date, label_type}
 
-    最小可用实现（简单特征）：
-    - 对每条 enterprise_risk_label 记录：
-      - 在 enterprise_risk_timeseries 中取 [as_of_date - lookback_days, as_of_date] 的窗口
-      - 提取 risk_score 的均值/标准差/最后值/斜率 等 4 个特征
+    实现：
+    - 时间序列来自列式特征缓存（feature_store，缺失时一次从 SQLite 补齐）；
+      每个企业的序列只加载一次，所有 as_of_date 窗口用二分 + 前缀和求解
+    - 对 SCORE_COLUMNS 每列提取 [as_of_date - lookback_days, as_of_date] 窗口的均值/标准差/最后值/斜率
+    - workers > 1 时按企业分组交给进程池并行计算（打包后的桌面应用中始终单进程）
     """
     conn = _get_conn(db_path)
-    conn.row_factory = sqlite3.Row
     cu = conn.cursor()
 
     cu.execute(
@@ -72,48 +149,45 @@ def build_ml_dataset(
     if not label_rows:
         conn.close()
         return np.zeros((0, 0)), np.zeros((0,)), []
+    conn.close()
+    series = _load_series(db_path or DB_PATH, sorted({int(r[0]) for r in label_rows}))
+
+    requests: Dict[int, List[Tuple[int, str]]] = {}
+    for pos, (eid, as_of, _) in enumerate(label_rows):
+        if int(eid) in series:
+            requests.setdefault(int(eid), []).append((pos, as_of))
+    tasks = [(series[eid][0], series[eid][1], reqs) for eid, reqs in requests.items()]
+
+    features: Dict[int, np.ndarray] = {}
+    if workers <= 1 or len(tasks) <= _ENTERPRISES_PER_TASK or getattr(sys, "frozen", False):
+        features.update(_features_for_group(tasks, lookback_days))
+    else:
+        import multiprocessing
+
+        size = max(_ENTERPRISES_PER_TASK, -(-len(tasks) // (workers * 4)))
+        groups = [tasks[i : i + size] for i in range(0, len(tasks), size)]
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(groups)), mp_context=ctx) as pool:
+            for part in pool.map(_features_for_group, groups, [lookback_days] * len(groups)):
+                features.update(part)
 
     X_list: List[np.ndarray] = []
     y_list: List[int] = []
     meta: List[Dict[str, Any]] = []
-
-    for lr in label_rows:
-        eid = int(lr["enterprise_id"])
-        as_of = lr["as_of_date"]
-        # 取窗口数据
-        as_of_dt = datetime.strptime(as_of[:10], "%Y-%m-%d").date()
-        start_dt = as_of_dt - timedelta(days=lookback_days)
-        cu.execute(
-            """
-            SELECT ts_date, risk_score
-            FROM enterprise_risk_timeseries
-            WHERE enterprise_id=? AND ts_date BETWEEN ? AND ?
-            ORDER BY ts_date ASC
-            """,
-            (eid, start_dt.isoformat(), as_of_dt.isoformat()),
-        )
-        ts_rows = cu.fetchall()
-        if not ts_rows:
+    for pos, (eid, as_of, label_value) in enumerate(label_rows):
+        feat = features.get(pos)
+        if feat is None:
             continue
-        scores = [float(r["risk_score"]) for r in ts_rows]
-        arr = np.array(scores, dtype=float)
-        mean = float(arr.mean())
-        std = float(arr.std())
-        last = float(arr[-1])
-        slope = float(_linear_trend(scores))
-        feat = np.array([mean, std, last, slope], dtype=float)
         X_list.append(feat)
-        y_list.append(int(lr["label_value"]))
+        y_list.append(int(label_value))
         meta.append(
             {
-                "enterprise_id": eid,
+                "enterprise_id": int(eid),
                 "as_of_date": as_of,
                 "label_type": label_type,
             }
         )
 
-    conn.close()
-
     if not X_list:
         return np.zeros((0, 0)), np.zeros((0,)), []
 
@@ -122,6 +196,22 @@ def build_ml_dataset(
     return X, y, meta
 
 
+def features_from_series(
+    dates: List[str],
+    values: Any,
+    as_of_date: str,
+    lookback_days: int = 90,
+) -> np.ndarray:
+    """
+    由已在内存中的（按日期升序）时间序列计算单行特征，与 build_ml_dataset 口径一致。
+    values 为 (n, len(SCORE_COLUMNS)) 的矩阵，列顺序同 SCORE_COLUMNS。
+    供批量预测在一次性读取全部序列后复用，不再逐企业查询。
+    """
+    if not dates:
+        return np.zeros((0,))
+    return SeriesIndex(dates, values).features(as_of_date, lookback_days)
+
+
 def build_features_for_single(
     enterprise_id: int,
     as_of_date: str,
@@ -130,36 +220,12 @@ def build_features_for_single(
 ) -> np.ndarray:
     """
     为单个企业、某个 as_of_date 构建一行特征，用于在线预测。
-
-    当前实现与 build_ml_dataset 使用一致的 4 维特征：
-    - 过去 lookback_days 内 risk_score 的均值/标准差/最后值/斜率
+    特征与 build_ml_dataset 一致（见 FEATURE_NAMES），序列读取自列式特征缓存。
     """
-    conn = _get_conn(db_path)
-    conn.row_factory = sqlite3.Row
-    cu = conn.cursor()
-
-    as_of_dt = datetime.strptime(as_of_date[:10], "%Y-%m-%d").date()
-    start_dt = as_of_dt - timedelta(days=lookback_days)
-    cu.execute(
-        """
-        SELECT ts_date, risk_score
-        FROM enterprise_risk_timeseries
-        WHERE enterprise_id=? AND ts_date BETWEEN ? AND ?
-        ORDER BY ts_date ASC
-        """,
-        (enterprise_id, start_dt.isoformat(), as_of_dt.isoformat()),
-    )
-    rows = cu.fetchall()
-    conn.close()
-
-    if not rows:
+    path = db_path or DB_PATH
+    if not path:
+        raise RuntimeError("ml.feature_builder.DB_PATH 未设置")
+    series = _load_series(path, [enterprise_id]).get(int(enterprise_id))
+    if series is None:
         return np.zeros((0,))
-
-    scores = [float(r["risk_score"]) for r in rows]
-    arr = np.array(scores, dtype=float)
-    mean = float(arr.mean())
-    std = float(arr.std())
-    last = float(arr[-1])
-    slope = float(_linear_trend(scores))
-    return np.array([mean, std, last, slope], dtype=float)
-
+    return SeriesIndex(*series).features(as_of_date, lookback_days)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+列式特征缓存（feature store）
+----------------------------
+作用：
+- 将每个企业的风险时间序列（综合分 + 各维度分）以 .npy 结构化数组存放在数据目录下，
+  读取时 np.load(mmap_mode="r") 零拷贝映射，训练与组合预测无需再查询 SQLite
+- 由 risk_timeseries_service 在写入时间序列后同步更新（全量替换或按日合并）
+- 某企业文件缺失时从 SQLite 一次查询补齐并写入，之后的读取都走缓存
+- 读取时用 (行数, 最后日期) 与 SQLite 校验（只走 (enterprise_id, ts_date) 唯一索引，不读数据行），
+  绕过上述写入路径的改动（管理员改表、开发环境重置、从备份恢复）使文件失效后自动重建；
+  这些路径另外会调用 invalidate 整体清空，覆盖行数与日期都不变的原地修改
+
+文件布局：<数据库所在目录>/feature_store/<enterprise_id>.npy
+每行：date（自 1970-01-01 起的天数，int64）+ values（STORE_COLUMNS 顺序的 float64）。
+设置环境变量 RISKGUARD_FEATURE_STORE=0 可关闭缓存，全部回退到 SQLite。
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+from itertools import groupby
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STORE_COLUMNS = ("risk_score", "score_legal", "score_business", "score_media", "score_policy", "score_industry")
+
+DTYPE = np.dtype([("date", "<i8"), ("values", "<f8", (len(STORE_COLUMNS),))])
+
+# 单条 SQL 中 IN (...) 参数个数上限，低于 SQLite 默认的 999
+_MAX_IN_PARAMS = 500
+
+# 同进程内的写入与补齐串行化，避免旧快照覆盖新数据
+_write_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return os.environ.get("RISKGUARD_FEATURE_STORE", "1") != "0"
+
+
+def store_dir(db_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "feature_store")
+
+
+def _path(db_path: str, enterprise_id: int) -> str:
+    return os.path.join(store_dir(db_path), "%d.npy" % int(enterprise_id))
+
+
+def to_days(dates: Iterable[str]) -> np.ndarray:
+    """'YYYY-MM-DD' 字符串 -> 天数（int64）。"""
+    return np.array([d[:10] for d in dates], dtype="datetime64[D]").astype(np.int64)
+
+
+def to_date_strings(days: np.ndarray) -> List[str]:
+    return [str(d) for d in np.asarray(days, dtype=np.int64).astype("datetime64[D]")]
+
+
+def _make(days: np.ndarray, values: np.ndarray) -> np.ndarray:
+    arr = np.empty(len(days), dtype=DTYPE)
+    arr["date"] = days
+    arr["values"] = np.asarray(values, dtype=float).reshape(len(days), len(STORE_COLUMNS))
+    return arr
+
+
+def _write_atomic(db_path: str, enterprise_id: int, arr: np.ndarray) -> None:
+    path = _path(db_path, enterprise_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        np.save(f, arr, allow_pickle=False)
+    os.replace(tmp, path)
+
+
+def _drop(db_path: str, enterprise_id: int) -> None:
+    try:
+        os.remove(_path(db_path, enterprise_id))
+    except FileNotFoundError:
+        pass
+
+
+def _safe(fn):
+    """写入失败时删除该企业的缓存文件，读取方自动回退到 SQLite，保证不会读到过期数据。"""
+
+    def wrapper(db_path, enterprise_id, *args, **kwargs):
+        if not enabled():
+            return
+        try:
+            with _write_lock:
+                fn(db_path, enterprise_id, *args, **kwargs)
+        except Exception as e:
+            logger.warning("feature_store write failed for enterprise %s: %s", enterprise_id, e)
+            try:
+                _drop(db_path, enterprise_id)
+            except OSError:
+                pass
+
+    wrapper.__name__ = fn.__name__
+    wrapper.__doc__ = fn.__doc__
+    return wrapper
+
+
+def load(db_path: str, enterprise_id: int) -> Optional[np.ndarray]:
+    """只读内存映射读取某企业的序列；文件不存在时返回 None。"""
+    path = _path(db_path, enterprise_id)
+    try:
+        arr = np.load(path, mmap_mode="r", allow_pickle=False)
+    except (FileNotFoundError, ValueError):
+        return None
+    if arr.dtype != DTYPE:
+        return None
+    return arr
+
+
+@_safe
+def write_series(db_path: str, enterprise_id: int, dates: Sequence[str], values: np.ndarray) -> None:
+    """整体替换某企业的序列（按日期升序）；无数据时删除文件。"""
+    if not len(dates):
+        _drop(db_path, enterprise_id)
+        return
+    _write_atomic(db_path, enterprise_id, _make(to_days(dates), values))
+
+
+@_safe
+def upsert_days(
+    db_path: str,
+    enterprise_id: int,
+    dates: Sequence[str],
+    values: np.ndarray,
+    deleted_dates: Sequence[str] = (),
+) -> None:
+    """
+    按日合并：dates 对应的行新增或覆盖，deleted_dates 对应的行删除。
+    文件不存在时不做任何事（下次读取时从 SQLite 完整补齐）。
+    新日期全部晚于已有最后一天时走追加路径，无需重新排序。
+    """
+    old = load(db_path, enterprise_id)
+    if old is None:
+        return
+    new = _make(to_days(dates), values) if len(dates) else np.empty(0, dtype=DTYPE)
+    if not len(deleted_dates) and (not len(old) or not len(new) or new["date"].min() > old["date"][-1]):
+        merged = np.concatenate([np.asarray(old), np.sort(new, order="date")])
+    else:
+        drop = np.concatenate([new["date"], to_days(deleted_dates)]) if len(deleted_dates) else new["date"]
+        kept = np.asarray(old)[~np.isin(old["date"], drop)]
+        merged = np.sort(np.concatenate([kept, new]), order="date")
+    del old
+    if not len(merged):
+        _drop(db_path, enterprise_id)
+        return
+    _write_atomic(db_path, enterprise_id, merged)
+
+
+def _fetch_from_db(db_path: str, enterprise_ids: List[int]) -> Dict[int, np.ndarray]:
+    """从 SQLite 一次（按 IN 分块）读取若干企业的序列。"""
+    out: Dict[int, np.ndarray] = {}
+    cols = ", ".join("COALESCE(%s, 0)" % c for c in STORE_COLUMNS)
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        cu = conn.cursor()
+        for i in range(0, len(enterprise_ids), _MAX_IN_PARAMS):
+            chunk = enterprise_ids[i : i + _MAX_IN_PARAMS]
+            cu.execute(
+                "SELECT enterprise_id, ts_date, %s FROM enterprise_risk_timeseries "
+                "WHERE enterprise_id IN (%s) ORDER BY enterprise_id ASC, ts_date ASC"
+                % (cols, ",".join("?" * len(chunk))),
+                chunk,
+            )
+            for eid, rows in groupby(cu.fetchall(), key=lambda r: r[0]):
+                rows = list(rows)
+                out[int(eid)] = _make(to_days(r[1] for r in rows), np.array([r[2:] for r in rows], dtype=float))
+    finally:
+        conn.close()
+    return out
+
+
+def _db_marks(db_path: str, enterprise_ids: List[int]) -> Dict[int, Tuple[int, str]]:
+    """各企业在 SQLite 中的 (行数, 最后日期)；由 (enterprise_id, ts_date) 唯一索引直接得出。"""
+    out: Dict[int, Tuple[int, str]] = {}
+    conn = sqlite3.connect(db_path, timeout=30)
+    try:
+        cu = conn.cursor()
+        for i in range(0, len(enterprise_ids), _MAX_IN_PARAMS):
+            chunk = enterprise_ids[i : i + _MAX_IN_PARAMS]
+            cu.execute(
+                "SELECT enterprise_id, COUNT(*), MAX(ts_date) FROM enterprise_risk_timeseries "
+                "WHERE enterprise_id IN (%s) GROUP BY enterprise_id" % ",".join("?" * len(chunk)),
+                chunk,
+            )
+            for eid, n, last in cu.fetchall():
+                out[int(eid)] = (int(n), last)
+    finally:
+        conn.close()
+    return out
+
+
+def _matches(arr: np.ndarray, mark: Optional[Tuple[int, str]]) -> bool:
+    if mark is None or len(arr) != mark[0] or not len(arr):
+        return False
+    return int(arr["date"][-1]) == int(to_days([mark[1]])[0])
+
+
+def load_many(db_path: str, enterprise_ids: Iterable[int]) -> Dict[int, np.ndarray]:
+    """
+    读取多个企业的序列：已缓存且与 SQLite 校验一致的直接内存映射，缺失或过期的从 SQLite 一次补齐并写入缓存。
+    无时间序列的企业不出现在返回值中。缓存关闭时全部从 SQLite 读取。
+    """
+    ids = [int(e) for e in dict.fromkeys(enterprise_ids)]
+    if not enabled():
+        return _fetch_from_db(db_path, ids)
+    out: Dict[int, np.ndarray] = {}
+    missing: List[int] = []
+    cached: Dict[int, np.ndarray] = {}
+    for eid in ids:
+        arr = load(db_path, eid)
+        if arr is None:
+            missing.append(eid)
+        else:
+            cached[eid] = arr
+    if cached:
+        marks = _db_marks(db_path, list(cached))
+        stale = {eid for eid, arr in cached.items() if not _matches(arr, marks.get(eid))}
+        if stale:
+            logger.info("feature_store: %d stale file(s) rebuilt from SQLite", len(stale))
+            with _write_lock:
+                for eid in stale:
+                    _drop(db_path, eid)
+            missing.extend(eid for eid in cached if eid in stale)
+        for eid, arr in cached.items():
+            if eid not in stale:
+                out[eid] = arr
+    if not missing:
+        return out
+    fetched = _fetch_from_db(db_path, missing)
+    with _write_lock:
+        for eid, arr in fetched.items():
+            # 读取 SQLite 期间若已有写入方生成了文件，以写入方为准
+            existing = load(db_path, eid)
+            if existing is not None:
+                out[eid] = existing
+                continue
+            try:
+                _write_atomic(db_path, eid, arr)
+            except OSError as e:
+                logger.warning("feature_store fill failed for enterprise %s: %s", eid, e)
+            out[eid] = arr
+    return out
+
+
+def invalidate(db_path: str, enterprise_ids: Optional[Iterable[int]] = None) -> None:
+    """删除缓存文件（全部或指定企业），下次读取时从 SQLite 重建。"""
+    with _write_lock:
+        if enterprise_ids is not None:
+            for eid in enterprise_ids:
+                _drop(db_path, eid)
+            return
+        d = store_dir(db_path)
+        if os.path.isdir(d):
+            for name in os.listdir(d):
+                if name.endswith(".npy"):
+                    _drop(db_path, int(name[:-4]))
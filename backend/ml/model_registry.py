@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+进程内模型注册表
+----------------
+作用：
+- 每个模型只反序列化一次，按 (label_type, version) 缓存
+- 按文件 mtime 热更新：重新训练后覆盖模型文件即可生效，无需重启服务
+- 记录加载耗时与推理耗时计数，便于观察在线预测的延迟构成
+
+模型文件约定（位于项目根目录 models/ 下）：
+- risk_classifier_<label_type>.pkl              version="latest"
+- risk_classifier_<label_type>_<version>.pkl    指定版本
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+MODELS_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "models"))
+
+LATEST = "latest"
+
+# mtime 检查的最小间隔（秒）；高频请求下不必每次都 stat
+DEFAULT_CHECK_INTERVAL = 2.0
+
+
+def _joblib_load(path: str) -> Any:
+    import joblib  # type: ignore
+
+    return joblib.load(path)
+
+
+class _Entry:
+    __slots__ = ("model", "path", "mtime", "loaded_at", "checked_at")
+
+    def __init__(self, model: Any, path: str, mtime: float):
+        self.model = model
+        self.path = path
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self.checked_at = time.monotonic()
+
+
+class ModelRegistry:
+    """线程安全的模型缓存；loader 默认使用 joblib.load。"""
+
+    def __init__(
+        self,
+        models_dir: Optional[str] = None,
+        loader: Optional[Callable[[str], Any]] = None,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+    ):
+        self.models_dir = models_dir or MODELS_DIR
+        self._loader = loader or _joblib_load
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._load_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._counters: Dict[str, float] = {
+            "loads": 0,
+            "reloads": 0,
+            "load_failures": 0,
+            "load_seconds_total": 0.0,
+            "cache_hits": 0,
+            "misses": 0,
+            "inferences": 0,
+            "inference_rows": 0,
+            "inference_failures": 0,
+            "inference_seconds_total": 0.0,
+        }
+
+    def model_path(self, label_type: str, version: Optional[str] = None) -> str:
+        if not version or version == LATEST:
+            name = "risk_classifier_%s.pkl" % label_type
+        else:
+            name = "risk_classifier_%s_%s.pkl" % (label_type, version)
+        return os.path.join(self.models_dir, name)
+
+    def get(self, label_type: str = "explosion", version: Optional[str] = None) -> Optional[Any]:
+        """
+        返回已加载的模型；文件缺失或加载失败时返回 None。文件 mtime 变化时自动重新加载。
+        反序列化在注册表锁之外进行，加载期间其他模型的读取不受阻塞；同一模型只由一个线程加载。
+        """
+        key = (label_type, version or LATEST)
+        entry, mtime = self._check(key, label_type, version)
+        if mtime is None:
+            return entry.model if entry is not None else None
+
+        with self._key_lock(key):
+            # 双重检查：等待期间其他线程可能已加载了同一文件
+            with self._lock:
+                current = self._entries.get(key)
+                if current is not None and current.mtime == mtime:
+                    self._counters["cache_hits"] += 1
+                    return current.model
+            path = self.model_path(label_type, version)
+            t0 = time.perf_counter()
+            try:
+                model = self._loader(path)
+            except Exception:
+                with self._lock:
+                    self._counters["load_failures"] += 1
+                    # 新文件损坏或写入中：继续使用旧模型，check_interval 后再试
+                    if current is not None:
+                        current.checked_at = time.monotonic()
+                return current.model if current is not None else None
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                self._counters["load_seconds_total"] += elapsed
+                self._counters["loads"] += 1
+                if current is not None:
+                    self._counters["reloads"] += 1
+                self._entries[key] = _Entry(model, path, mtime)
+            return model
+
+    def _check(self, key: Tuple[str, str], label_type: str, version: Optional[str]) -> Tuple[Optional[_Entry], Optional[float]]:
+        """
+        持锁检查缓存：返回 (缓存项, 需要加载的文件 mtime)。mtime 为 None 表示直接使用缓存项
+        （缓存项为 None 即文件缺失）。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry is not None and now - entry.checked_at < self.check_interval:
+                self._counters["cache_hits"] += 1
+                return entry, None
+
+            try:
+                mtime = os.stat(self.model_path(label_type, version)).st_mtime
+            except OSError:
+                self._entries.pop(key, None)
+                self._counters["misses"] += 1
+                return None, None
+
+            if entry is not None and entry.mtime == mtime:
+                entry.checked_at = now
+                self._counters["cache_hits"] += 1
+                return entry, None
+            return entry, mtime
+
+    def _key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            lock = self._load_locks.get(key)
+            if lock is None:
+                lock = self._load_locks[key] = threading.Lock()
+            return lock
+
+    def predict_proba(self, model: Any, X: Any) -> Any:
+        """调用 model.predict_proba 并记录推理耗时；异常原样抛出。"""
+        t0 = time.perf_counter()
+        try:
+            out = model.predict_proba(X)
+        except Exception:
+            with self._lock:
+                self._counters["inference_failures"] += 1
+            raise
+        elapsed = time.perf_counter() - t0
+        with self._lock:
+            self._counters["inferences"] += 1
+            self._counters["inference_rows"] += int(getattr(X, "shape", (1,))[0])
+            self._counters["inference_seconds_total"] += elapsed
+        return out
+
+    def invalidate(self, label_type: Optional[str] = None) -> None:
+        """丢弃缓存（全部或某个 label_type 的所有版本），下次 get 时重新加载。"""
+        with self._lock:
+            if label_type is None:
+                self._entries.clear()
+            else:
+                for key in [k for k in self._entries if k[0] == label_type]:
+                    del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            c = dict(self._counters)
+            models = [
+                {
+                    "label_type": k[0],
+                    "version": k[1],
+                    "file": os.path.basename(e.path),
+                    "mtime": e.mtime,
+                    "loaded_at": e.loaded_at,
+                }
+                for k, e in self._entries.items()
+            ]
+        c["avg_load_ms"] = round(1000.0 * c["load_seconds_total"] / c["loads"], 3) if c["loads"] else None
+        c["avg_inference_ms"] = (
+            round(1000.0 * c["inference_seconds_total"] / c["inferences"], 3) if c["inferences"] else None
+        )
+        c["models"] = models
+        return c
+
+
+registry = ModelRegistry()
+
+
+def get_model(label_type: str = "explosion", version: Optional[str] = None) -> Optional[Any]:
+    return registry.get(label_type, version)
+
+
+def predict_proba(model: Any, X: Any) -> Any:
+    return registry.predict_proba(model, X)
+
+
+def stats() -> Dict[str, Any]:
+    return registry.stats()
@@ -38,7 +38,12 @@ def main():
 
     print("构建训练数据集...")
     try:
-        X, y, meta = fb.build_ml_dataset(label_type="explosion", lookback_days=90, horizon_days=30)
+        X, y, meta = fb.build_ml_dataset(
+            label_type="explosion",
+            lookback_days=90,
+            horizon_days=30,
+            workers=max(1, (os.cpu_count() or 1) - 1),
+        )
     except NotImplementedError:
         print("build_ml_dataset 尚未实现，请先在 backend/ml/feature_builder.py 中补充逻辑。")
         return
@@ -68,7 +73,10 @@ def main():
 
     os.makedirs("models", exist_ok=True)
     out_path = os.path.join("models", "risk_classifier_explosion.pkl")
-    joblib.dump(model, out_path)
+    # 先写临时文件再原子替换：在线服务按 mtime 热加载，避免读到写了一半的文件
+    tmp_path = out_path + ".tmp"
+    joblib.dump(model, tmp_path)
+    os.replace(tmp_path, out_path)
     print("模型已保存到:", out_path)
 
 
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+风险警报列表查询
+----------------
+/api/alerts 的筛选与分页全部在 SQL 中完成：严重程度、是否已处理、企业、日期范围，
+按 (timestamp, id) 倒序做键集分页（before_ts / before_id），返回 next_cursor 供取下一页。
+
+- 指定企业时走 risk_alerts(company_id, timestamp) 索引：等值 company_id 后按 (timestamp, rowid) 有序，无需排序
+- 不指定企业时走 risk_alerts(timestamp) 索引倒序扫描，逐行判断企业归属，取满一页即停；
+  company_id 前加一元 + 让优化器不选 company_id 索引（否则要先取出全部企业的警报再排序）
+"""
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# 严重程度筛选值 -> 库中可能出现的取值（中文 / 英文）
+SEVERITY_ALIASES = {
+    'high': ('高', 'high', 'HIGH', 'High'),
+    'medium': ('中', 'medium', 'MEDIUM', 'Medium'),
+    'low': ('低', 'low', 'LOW', 'Low'),
+}
+SEVERITY_ALIASES['高'] = SEVERITY_ALIASES['high']
+SEVERITY_ALIASES['中'] = SEVERITY_ALIASES['medium']
+SEVERITY_ALIASES['低'] = SEVERITY_ALIASES['low']
+
+
+def list_alerts(conn, user_id, severity=None, processed=None, company_id=None, since=None, until=None,
+                before_ts=None, before_id=None, limit=DEFAULT_LIMIT):
+    """
+    返回用户关联企业的警报一页：{'items': [...], 'next_cursor': {'before_ts', 'before_id'} 或 None}。
+    severity：high/medium/low 或 高/中/低；processed：True 只看已处理，False 只看未处理，None 不限；
+    since / until：YYYY-MM-DD（含首尾两天）；before_ts + before_id：上一页 next_cursor 的值。
+    """
+    limit = max(1, min(MAX_LIMIT, int(limit or DEFAULT_LIMIT)))
+    if company_id is None:
+        where = ["+ra.company_id IN (SELECT company_id FROM user_companies WHERE user_id = ?)"]
+        params = [user_id]
+    else:
+        where = ["ra.company_id = ?",
+                 "ra.company_id IN (SELECT company_id FROM user_companies WHERE user_id = ?)"]
+        params = [company_id, user_id]
+    if severity:
+        values = SEVERITY_ALIASES.get(severity.lower(), (severity,))
+        where.append("ra.severity IN (%s)" % ','.join('?' * len(values)))
+        params.extend(values)
+    if processed is True:
+        where.append("ra.processed_at IS NOT NULL")
+    elif processed is False:
+        where.append("ra.processed_at IS NULL")
+    if since:
+        where.append("ra.timestamp >= ?")
+        params.append(since)
+    if until:
+        where.append("ra.timestamp < date(?, '+1 day')")
+        params.append(until)
+    if before_ts is not None and before_id is not None:
+        where.append("(ra.timestamp, ra.id) < (?, ?)")
+        params.extend([before_ts, before_id])
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT ra.id, ra.company_id, ra.alert_type, ra.severity, ra.description, ra.source, ra.timestamp,
+               ra.processed_at, c.name
+        FROM risk_alerts ra
+        JOIN companies c ON c.id = ra.company_id
+        WHERE """ + " AND ".join(where) + """
+        ORDER BY ra.timestamp DESC, ra.id DESC
+        LIMIT ?
+    """, tuple(params) + (limit + 1,))
+    rows = cur.fetchall()
+    items = [{'id': r[0], 'company_id': r[1], 'alert_type': r[2], 'severity': r[3], 'description': r[4],
+              'source': r[5], 'timestamp': r[6], 'processed_at': r[7], 'company_name': r[8]}
+             for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = {'before_ts': last['timestamp'], 'before_id': last['id']}
+    return {'items': items, 'next_cursor': next_cursor}
@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+"""
+回测任务服务
+------------
+把全量、多 horizon 回测从 HTTP 请求中拆出来，作为可续跑的后台任务执行：
+- 企业按分片分发到进程池（或在当前进程内顺序执行），每个分片独立读取自己的时间序列；
+- 每个企业、每个 horizon 的误差统计与误差分布分位数写入 backtest_enterprise_results；
+- 候选企业在创建任务时确定并保存在 backtest_jobs.enterprise_ids，续跑时不随新数据变化；
+- 每完成一个分片即提交，已写入的企业就是检查点，中断后 resume 只补跑缺失的企业；
+- 进度写入 task_runs（task_type='backtest'），任务参数与汇总结果写入 backtest_jobs。
+全部分片完成后，按充分统计量汇总出各 horizon 的 MAE / RMSE / 方向准确率 / 残差标准差，
+并与同步回测一样写入 backtest_metrics，供预测区间使用。
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterable
+
+from backend.services import backtest_service as bts
+
+DB_PATH: Optional[str] = None
+
+# 每个分片的企业数：也是检查点粒度
+SHARD_SIZE = 50
+# 进程池默认大小；<=1 时在当前进程内顺序执行
+DEFAULT_WORKERS = 4
+
+_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# 当前进程内正在执行的任务，避免同一任务被重复启动
+_running_jobs: set = set()
+_running_lock = threading.Lock()
+
+
+def _get_conn(db_path: Optional[str] = None) -> sqlite3.Connection:
+    path = db_path or DB_PATH
+    if not path:
+        raise RuntimeError("backtest_job_service.DB_PATH 未设置")
+    return sqlite3.connect(path, timeout=30)
+
+
+def _quantiles(values: List[float]) -> List[float]:
+    """线性插值分位数（与 numpy.percentile 默认方式一致）。"""
+    xs = sorted(values)
+    n = len(xs)
+    out = []
+    for q in _QUANTILES:
+        pos = q * (n - 1)
+        lo = int(pos)
+        hi = min(lo + 1, n - 1)
+        out.append(xs[lo] + (xs[hi] - xs[lo]) * (pos - lo))
+    return out
+
+
+def _enterprise_stats(scores: List[float], lookback_days: int, horizon_days: int, engine: str) -> Dict[str, Any]:
+    """单个企业、单个 horizon 的误差充分统计量与分布。样本不足时 n_samples=0、其余为空。"""
+    stats: Dict[str, Any] = {"n_samples": 0}
+    if len(scores) < lookback_days + horizon_days:
+        return stats
+    if engine == bts.ENGINE_NUMPY:
+        np = bts.np
+        em, en, dc = bts._enterprise_errors_numpy(scores, lookback_days, horizon_days)
+        n = int(em.size)
+        if not n:
+            return stats
+        stats.update(
+            n_samples=n,
+            sum_err=float(em.sum()),
+            sum_abs_err=float(np.abs(em).sum()),
+            sum_sq_err=float((em * em).sum()),
+            sum_abs_err_naive=float(np.abs(en).sum()),
+            direction_correct=dc,
+            quantiles=[float(v) for v in np.percentile(em, [q * 100 for q in _QUANTILES])],
+        )
+    else:
+        em, en, dc = bts._enterprise_errors_python(scores, lookback_days, horizon_days)
+        n = len(em)
+        if not n:
+            return stats
+        stats.update(
+            n_samples=n,
+            sum_err=sum(em),
+            sum_abs_err=sum(abs(e) for e in em),
+            sum_sq_err=sum(e * e for e in em),
+            sum_abs_err_naive=sum(abs(e) for e in en),
+            direction_correct=dc,
+            quantiles=_quantiles(em),
+        )
+    mean = stats["sum_err"] / n
+    stats["mae"] = stats["sum_abs_err"] / n
+    stats["rmse"] = (stats["sum_sq_err"] / n) ** 0.5
+    stats["residual_std"] = (max(0.0, stats["sum_sq_err"] - n * mean * mean) / max(1, n - 1)) ** 0.5
+    return stats
+
+
+def _run_shard(
+    db_path: str,
+    enterprise_ids: List[int],
+    lookback_days: int,
+    horizons: List[int],
+    engine: str,
+) -> List[tuple]:
+    """
+    进程池工作函数：读取一个分片内企业的时间序列，返回待写入 backtest_enterprise_results 的行
+    （不含 job_id）。只读数据库，写入统一由调度线程完成。
+    """
+    conn = sqlite3.connect(db_path, timeout=30)
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT enterprise_id, risk_score FROM enterprise_risk_timeseries
+        WHERE enterprise_id IN (%s)
+        ORDER BY enterprise_id, ts_date
+        """ % ",".join("?" * len(enterprise_ids)),
+        tuple(enterprise_ids),
+    )
+    series: Dict[int, List[float]] = {eid: [] for eid in enterprise_ids}
+    for eid, score in cur.fetchall():
+        series[eid].append(float(score))
+    conn.close()
+
+    rows = []
+    for eid in enterprise_ids:
+        for h in horizons:
+            st = _enterprise_stats(series[eid], lookback_days, h, engine)
+            q = st.get("quantiles") or [None] * len(_QUANTILES)
+            rows.append((
+                eid, h, st["n_samples"],
+                st.get("sum_err"), st.get("sum_abs_err"), st.get("sum_sq_err"), st.get("sum_abs_err_naive"),
+                st.get("direction_correct"), st.get("mae"), st.get("rmse"), st.get("residual_std"),
+                *q,
+            ))
+    return rows
+
+
+def _set_progress(conn: sqlite3.Connection, job: Dict[str, Any], done: int, total: int, status: str = "running", message: Optional[str] = None) -> None:
+    cur = conn.cursor()
+    msg = message or "回测进行中：已完成 %d/%d 企业" % (done, total)
+    finished = datetime.utcnow().isoformat() if status != "running" else None
+    cur.execute(
+        "UPDATE backtest_jobs SET status=?, total_enterprises=?, done_enterprises=?, finished_at=? WHERE id=?",
+        (status, total, done, finished, job["id"]),
+    )
+    if job.get("task_run_id"):
+        cur.execute(
+            "UPDATE task_runs SET status=?, message=?, finished_at=? WHERE id=?",
+            (status, msg, finished, job["task_run_id"]),
+        )
+    conn.commit()
+
+
+def _load_job(conn: sqlite3.Connection, job_id: int) -> Optional[Dict[str, Any]]:
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    cur.execute("SELECT * FROM backtest_jobs WHERE id=?", (job_id,))
+    row = cur.fetchone()
+    conn.row_factory = None
+    if not row:
+        return None
+    job = dict(row)
+    job["horizons"] = [int(h) for h in json.loads(job["horizons"])]
+    ids = job.get("enterprise_ids")
+    job["enterprise_ids"] = [int(e) for e in json.loads(ids)] if ids else None
+    return job
+
+
+def _candidate_enterprises(
+    conn: sqlite3.Connection, lookback_days: int, horizons: List[int], max_enterprises: Optional[int]
+) -> List[int]:
+    """时间序列长度至少为 lookback + 最短 horizon 的企业，按 id 升序，最多 max_enterprises 家。"""
+    cur = conn.cursor()
+    sql = """
+        SELECT enterprise_id FROM enterprise_risk_timeseries
+        GROUP BY enterprise_id
+        HAVING COUNT(*) >= ?
+        ORDER BY enterprise_id
+        """
+    params: List[Any] = [lookback_days + min(horizons)]
+    if max_enterprises:
+        sql += " LIMIT ?"
+        params.append(max_enterprises)
+    cur.execute(sql, params)
+    return [r[0] for r in cur.fetchall()]
+
+
+def _pending_enterprises(conn: sqlite3.Connection, job: Dict[str, Any]) -> tuple:
+    """
+    返回 (全部候选企业, 尚未完成的企业)。候选企业取任务创建时保存的列表；
+    旧任务没有保存时按当前数据计算一次并写回，之后的续跑都用这份列表。
+    已为全部 horizon 写入结果的企业视为完成（检查点）。
+    """
+    candidates = job["enterprise_ids"]
+    if candidates is None:
+        candidates = _candidate_enterprises(conn, job["lookback_days"], job["horizons"], job["max_enterprises"])
+        conn.execute("UPDATE backtest_jobs SET enterprise_ids=? WHERE id=?", (json.dumps(candidates), job["id"]))
+        conn.commit()
+        job["enterprise_ids"] = candidates
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT enterprise_id FROM backtest_enterprise_results
+        WHERE job_id=?
+        GROUP BY enterprise_id
+        HAVING COUNT(*) >= ?
+        """,
+        (job["id"], len(job["horizons"])),
+    )
+    done = {r[0] for r in cur.fetchall()}
+    return candidates, [eid for eid in candidates if eid not in done]
+
+
+def _write_shard(conn: sqlite3.Connection, job_id: int, rows: List[tuple]) -> None:
+    conn.executemany(
+        """
+        INSERT OR REPLACE INTO backtest_enterprise_results (
+            job_id, enterprise_id, horizon_days, n_samples,
+            sum_err, sum_abs_err, sum_sq_err, sum_abs_err_naive, direction_correct,
+            mae, rmse, residual_std, err_p05, err_p25, err_p50, err_p75, err_p95
+        ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+        """,
+        [(job_id, *r) for r in rows],
+    )
+    conn.commit()
+
+
+def _aggregate(conn: sqlite3.Connection, job: Dict[str, Any], db_path: Optional[str]) -> Dict[str, Any]:
+    """由各企业的充分统计量汇总每个 horizon 的整体指标，并写入 backtest_metrics。"""
+    cur = conn.cursor()
+    cur.execute(
+        """
+        SELECT horizon_days, SUM(n_samples), COUNT(*), SUM(sum_err), SUM(sum_abs_err),
+               SUM(sum_sq_err), SUM(sum_abs_err_naive), SUM(direction_correct)
+        FROM backtest_enterprise_results
+        WHERE job_id=? AND n_samples > 0
+        GROUP BY horizon_days
+        """,
+        (job["id"],),
+    )
+    results: Dict[int, Dict[str, Any]] = {}
+    for h, n, n_ent, s_err, s_abs, s_sq, s_abs_naive, dir_ok in cur.fetchall():
+        mean = s_err / n
+        mae_model = s_abs / n
+        mae_naive = s_abs_naive / n
+        residual_std = (max(0.0, s_sq - n * mean * mean) / max(1, n - 1)) ** 0.5
+        dir_acc = dir_ok / n
+        out = {
+            "n_samples": n,
+            "n_enterprises": n_ent,
+            "lookback_days": job["lookback_days"],
+            "horizon_days": h,
+            "mae": round(mae_model, 4),
+            "rmse": round((s_sq / n) ** 0.5, 4),
+            "mae_naive": round(mae_naive, 4),
+            "improvement_vs_naive": round((mae_naive - mae_model) / mae_naive if mae_naive else 0.0, 4),
+            "direction_accuracy": round(dir_acc, 4),
+            "residual_std": round(residual_std, 4),
+            "job_id": job["id"],
+            "updated_at": datetime.utcnow().isoformat() + "Z",
+        }
+        bts._save_metrics(out, (mae_model, residual_std, dir_acc), db_path=db_path)
+        results[h] = out
+    return results
+
+
+def create_job(
+    lookback_days: int = 30,
+    horizons: Iterable[int] = bts.DEFAULT_SWEEP_HORIZONS,
+    max_enterprises: Optional[int] = None,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    登记一个回测任务（含 task_runs 进度记录），同时固定候选企业列表，
+    返回 {"job_id", "task_run_id", "total_enterprises"}，不执行。
+    """
+    hs = sorted(set(int(h) for h in horizons))
+    if not hs:
+        raise ValueError("horizons 不能为空")
+    conn = _get_conn(db_path)
+    candidates = _candidate_enterprises(conn, lookback_days, hs, max_enterprises)
+    cur = conn.cursor()
+    cur.execute(
+        "INSERT INTO task_runs (task_type, company_id, status, message) VALUES (?,?,?,?)",
+        ("backtest", None, "pending", "回测任务已创建"),
+    )
+    task_run_id = cur.lastrowid
+    cur.execute(
+        """
+        INSERT INTO backtest_jobs (task_run_id, lookback_days, horizons, max_enterprises, enterprise_ids,
+                                   total_enterprises, status, created_at)
+        VALUES (?,?,?,?,?,?,?,?)
+        """,
+        (task_run_id, lookback_days, json.dumps(hs), max_enterprises, json.dumps(candidates), len(candidates),
+         "pending", datetime.utcnow().isoformat()),
+    )
+    job_id = cur.lastrowid
+    conn.commit()
+    conn.close()
+    return {"job_id": job_id, "task_run_id": task_run_id, "total_enterprises": len(candidates)}
+
+
+def run_job(
+    job_id: int,
+    db_path: Optional[str] = None,
+    workers: int = DEFAULT_WORKERS,
+    engine: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    执行（或续跑）回测任务：只处理尚未写入结果的企业，分片提交，最后汇总。
+    同一进程内同一任务不会并发执行。返回任务状态（同 get_job）。
+    """
+    path = db_path or DB_PATH
+    engine = bts._resolve_engine(engine)
+    with _running_lock:
+        if job_id in _running_jobs:
+            return get_job(job_id, db_path=path) or {}
+        _running_jobs.add(job_id)
+    conn = _get_conn(path)
+    try:
+        job = _load_job(conn, job_id)
+        if not job:
+            raise ValueError("回测任务不存在: %s" % job_id)
+        candidates, pending = _pending_enterprises(conn, job)
+        total = len(candidates)
+        done = total - len(pending)
+        _set_progress(conn, job, done, total)
+
+        shards = [pending[i : i + SHARD_SIZE] for i in range(0, len(pending), SHARD_SIZE)]
+        args = (job["lookback_days"], job["horizons"], engine)
+        # 打包后的桌面应用中不启用子进程，避免重复拉起应用入口
+        if workers <= 1 or len(shards) <= 1 or getattr(sys, "frozen", False):
+            for shard in shards:
+                _write_shard(conn, job_id, _run_shard(path, shard, *args))
+                done += len(shard)
+                _set_progress(conn, job, done, total)
+        else:
+            import multiprocessing
+
+            ctx = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(shards)), mp_context=ctx) as pool:
+                futures = {pool.submit(_run_shard, path, shard, *args): shard for shard in shards}
+                for fut in as_completed(futures):
+                    _write_shard(conn, job_id, fut.result())
+                    done += len(futures[fut])
+                    _set_progress(conn, job, done, total)
+
+        results = _aggregate(conn, job, path)
+        conn.execute(
+            "UPDATE backtest_jobs SET result_json=? WHERE id=?",
+            (json.dumps({str(h): r for h, r in results.items()}, ensure_ascii=False), job_id),
+        )
+        _set_progress(conn, job, done, total, status="success", message="回测完成：%d 家企业" % total)
+    except Exception as e:
+        try:
+            job = _load_job(conn, job_id)
+            if job:
+                _set_progress(conn, job, job["done_enterprises"], job["total_enterprises"], status="error", message=str(e)[:200])
+        except Exception:
+            pass
+        raise
+    finally:
+        conn.close()
+        with _running_lock:
+            _running_jobs.discard(job_id)
+    return get_job(job_id, db_path=path) or {}
+
+
+def start_job_in_background(job_id: int, db_path: Optional[str] = None, workers: int = DEFAULT_WORKERS) -> None:
+    """在后台线程中执行/续跑任务，供 HTTP 接口立即返回。"""
+
+    def _target():
+        try:
+            run_job(job_id, db_path=db_path, workers=workers)
+        except Exception as e:
+            print("backtest job error:", job_id, e)
+
+    threading.Thread(target=_target, daemon=True).start()
+
+
+def get_job(job_id: int, db_path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """任务参数、进度与（完成后的）各 horizon 汇总指标。"""
+    conn = _get_conn(db_path)
+    try:
+        job = _load_job(conn, job_id)
+    finally:
+        conn.close()
+    if not job:
+        return None
+    job["results"] = json.loads(job.pop("result_json") or "{}")
+    return job
+
+
+def get_job_enterprise_results(job_id: int, horizon_days: Optional[int] = None, db_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """某任务的逐企业误差统计与分布分位数。"""
+    conn = _get_conn(db_path)
+    conn.row_factory = sqlite3.Row
+    cur = conn.cursor()
+    sql = "SELECT * FROM backtest_enterprise_results WHERE job_id=?"
+    params: List[Any] = [job_id]
+    if horizon_days is not None:
+        sql += " AND horizon_days=?"
+        params.append(horizon_days)
+    cur.execute(sql + " ORDER BY enterprise_id, horizon_days", params)
+    rows = [dict(r) for r in cur.fetchall()]
+    conn.close()
+    return rows
+
+
+def resume_interrupted_jobs(db_path: Optional[str] = None, workers: int = DEFAULT_WORKERS) -> List[int]:
+    """服务启动时在后台依次续跑上次进程退出时仍处于 pending/running 的任务，返回续跑的任务 id。"""
+    conn = _get_conn(db_path)
+    cur = conn.cursor()
+    cur.execute("SELECT id FROM backtest_jobs WHERE status IN ('pending', 'running') ORDER BY id")
+    ids = [r[0] for r in cur.fetchall()]
+    conn.close()
+    if not ids:
+        return []
+
+    def _target():
+        for job_id in ids:
+            try:
+                run_job(job_id, db_path=db_path, workers=workers)
+            except Exception as e:
+                print("backtest job resume error:", job_id, e)
+
+    threading.Thread(target=_target, daemon=True).start()
+    return ids
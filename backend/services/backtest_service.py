@@ -8,11 +8,22 @@
 from __future__ import annotations
 
 import sqlite3
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List, Tuple
+from datetime import datetime
+from typing import Optional, Dict, Any, List, Iterable, Tuple
+
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # numpy 为可选依赖，缺失时回退到纯 Python 引擎
+    np = None
 
 DB_PATH: Optional[str] = None
 
+# 回测引擎：numpy 对单个企业的全部滑动窗口一次性向量化求斜率与误差；python 为逐窗口循环的参考实现
+ENGINE_NUMPY = "numpy"
+ENGINE_PYTHON = "python"
+
+DEFAULT_SWEEP_HORIZONS = (7, 14, 30)
+
 # 与 prediction_service 一致的线性趋势与预测逻辑（不含宏观，回测时宏观历史难复现）
 def _linear_trend(xs: List[float]) -> float:
     n = len(xs)
@@ -33,86 +44,129 @@ def _get_conn(db_path: Optional[str] = None) -> sqlite3.Connection:
     return sqlite3.connect(path, timeout=30)
 
 
-def run_backtest(
-    lookback_days: int = 30,
-    horizon_days: int = 7,
-    max_enterprises: Optional[int] = 200,
-    db_path: Optional[str] = None,
-) -> Dict[str, Any]:
-    """
-    对 enterprise_risk_timeseries 做历史回测：
-    - 对每个企业、每个满足条件的日期 T，用 [T-lookback, T] 预测 T+horizon_days，与真实值比较。
-    - 同时计算“朴素基准”（预测值=当日值）的 MAE，得到相对提升。
-    - 返回 MAE、RMSE、方向准确率、残差标准差、相对基准提升，并写入 backtest_metrics 表供预测区间使用。
-    """
+def _load_series(db_path: Optional[str] = None) -> Dict[int, List[float]]:
+    """一次读取全部企业的 risk_score 序列（按日期升序），按企业分组。"""
     conn = _get_conn(db_path)
-    conn.row_factory = sqlite3.Row
     cur = conn.cursor()
     cur.execute(
         """
-        SELECT enterprise_id, ts_date, risk_score
+        SELECT enterprise_id, risk_score
         FROM enterprise_risk_timeseries
         ORDER BY enterprise_id, ts_date
         """
     )
-    rows = cur.fetchall()
+    by_enterprise: Dict[int, List[float]] = {}
+    for eid, score in cur.fetchall():
+        by_enterprise.setdefault(eid, []).append(float(score))
     conn.close()
-    if not rows:
-        return {"error": "无时间序列数据", "n_samples": 0}
+    return by_enterprise
 
-    # 按企业分组，每个企业一组 (date, score)
-    by_enterprise: Dict[int, List[Tuple[str, float]]] = {}
-    for r in rows:
-        eid = r["enterprise_id"]
-        if eid not in by_enterprise:
-            by_enterprise[eid] = []
-        by_enterprise[eid].append((r["ts_date"], float(r["risk_score"])))
 
-    need_total = lookback_days + horizon_days
+def _enterprise_errors_python(scores: List[float], lookback_days: int, horizon_days: int):
+    """逐窗口回测单个企业，返回 (模型误差列表, 朴素误差列表, 方向正确数)。"""
     errors_model: List[float] = []
     errors_naive: List[float] = []
     directions_correct = 0
-    directions_total = 0
+    for i in range(lookback_days, len(scores) - horizon_days):
+        window = scores[i - lookback_days : i]
+        base = window[-1]
+        slope = _linear_trend(window)
+        pred_model = max(0.0, min(100.0, base + slope * horizon_days))
+        actual = scores[i + horizon_days]
+        pred_naive = base  # 朴素：预测值 = 当日值
+        errors_model.append(pred_model - actual)
+        errors_naive.append(pred_naive - actual)
+        # 方向：相对当日是升还是降
+        change_actual = actual - base
+        change_pred_model = pred_model - base
+        if change_actual * change_pred_model >= 0:
+            directions_correct += 1
+    return errors_model, errors_naive, directions_correct
+
+
+def _enterprise_errors_numpy(scores: List[float], lookback_days: int, horizon_days: int):
+    """
+    向量化回测单个企业：用 sliding_window_view 取出全部长度为 lookback_days 的窗口（零拷贝视图），
+    与中心化的 x 做一次矩阵乘得到所有窗口的 OLS 斜率，再整体计算误差。
+    返回值与 _enterprise_errors_python 对应，误差为 ndarray。
+    """
+    s = np.asarray(scores, dtype=float)
+    n_windows = len(s) - horizon_days - lookback_days
+    if n_windows <= 0:
+        return np.zeros(0), np.zeros(0), 0
+    if lookback_days >= 2:
+        xc = np.arange(lookback_days, dtype=float) - (lookback_days - 1) / 2.0
+        windows = np.lib.stride_tricks.sliding_window_view(s, lookback_days)[:n_windows]
+        slopes = windows @ xc / float(xc @ xc)
+    else:
+        slopes = np.zeros(n_windows)
+    base = s[lookback_days - 1 : lookback_days - 1 + n_windows]
+    actual = s[lookback_days + horizon_days : lookback_days + horizon_days + n_windows]
+    pred_model = np.clip(base + slopes * horizon_days, 0.0, 100.0)
+    errors_model = pred_model - actual
+    errors_naive = base - actual
+    directions_correct = int(np.count_nonzero((actual - base) * (pred_model - base) >= 0))
+    return errors_model, errors_naive, directions_correct
+
+
+def _evaluate_horizon(
+    by_enterprise: Dict[int, List[float]],
+    lookback_days: int,
+    horizon_days: int,
+    max_enterprises: Optional[int],
+    engine: str,
+) -> Tuple[Dict[str, Any], Optional[Tuple[float, float, float]]]:
+    """
+    在已加载的序列上评估单个 horizon（不落库）。
+    返回 (汇总指标, 未取整的 (mae, residual_std, direction_accuracy))；无样本时后者为 None。
+    """
+    need_total = lookback_days + horizon_days
+    per_enterprise = _enterprise_errors_numpy if engine == ENGINE_NUMPY else _enterprise_errors_python
+    errors_model: List[Any] = []
+    errors_naive: List[Any] = []
+    directions_correct = 0
     n_enterprises = 0
-    for eid, series in by_enterprise.items():
+    for eid, scores in by_enterprise.items():
         if max_enterprises is not None and n_enterprises >= max_enterprises:
             break
-        if len(series) < need_total:
+        if len(scores) < need_total:
             continue
         n_enterprises += 1
-        dates = [s[0] for s in series]
-        scores = [s[1] for s in series]
-        for i in range(lookback_days, len(series) - horizon_days):
-            window = scores[i - lookback_days : i]
-            base = window[-1]
-            slope = _linear_trend(window)
-            pred_model = max(0.0, min(100.0, base + slope * horizon_days))
-            actual = scores[i + horizon_days]
-            pred_naive = base  # 朴素：预测值 = 当日值
-            errors_model.append(pred_model - actual)
-            errors_naive.append(pred_naive - actual)
-            # 方向：相对当日是升还是降
-            change_actual = actual - base
-            change_pred_model = pred_model - base
-            if change_actual * change_pred_model >= 0:
-                directions_correct += 1
-            directions_total += 1
-
-    if not errors_model:
+        em, en, dc = per_enterprise(scores, lookback_days, horizon_days)
+        errors_model.append(em)
+        errors_naive.append(en)
+        directions_correct += dc
+
+    if engine == ENGINE_NUMPY:
+        em_all = np.concatenate(errors_model) if errors_model else np.zeros(0)
+        en_all = np.concatenate(errors_naive) if errors_naive else np.zeros(0)
+        n = int(em_all.size)
+    else:
+        em_all = [e for part in errors_model for e in part]
+        en_all = [e for part in errors_naive for e in part]
+        n = len(em_all)
+
+    if not n:
         return {
             "error": "无有效回测样本（需企业至少有 %d 天时间序列）" % need_total,
             "n_samples": 0,
-        }
-
-    n = len(errors_model)
-    mae_model = sum(abs(e) for e in errors_model) / n
-    mae_naive = sum(abs(e) for e in errors_naive) / n
-    rmse_model = (sum(e * e for e in errors_model) / n) ** 0.5
-    residual_std = (sum((e - (sum(errors_model) / n)) ** 2 for e in errors_model) / max(1, n - 1)) ** 0.5
-    dir_acc = directions_correct / directions_total if directions_total else 0.0
+        }, None
+
+    if engine == ENGINE_NUMPY:
+        mae_model = float(np.abs(em_all).mean())
+        mae_naive = float(np.abs(en_all).mean())
+        rmse_model = float(np.sqrt((em_all * em_all).mean()))
+        residual_std = float(np.sqrt(((em_all - em_all.mean()) ** 2).sum() / max(1, n - 1)))
+    else:
+        mae_model = sum(abs(e) for e in em_all) / n
+        mae_naive = sum(abs(e) for e in en_all) / n
+        rmse_model = (sum(e * e for e in em_all) / n) ** 0.5
+        mean_err = sum(em_all) / n
+        residual_std = (sum((e - mean_err) ** 2 for e in em_all) / max(1, n - 1)) ** 0.5
+    dir_acc = directions_correct / n
     improvement_vs_naive = (mae_naive - mae_model) / mae_naive if mae_naive else 0.0
 
-    out = {
+    return {
         "n_samples": n,
         "n_enterprises": n_enterprises,
         "lookback_days": lookback_days,
@@ -123,10 +177,15 @@ def run_backtest(
         "improvement_vs_naive": round(improvement_vs_naive, 4),
         "direction_accuracy": round(dir_acc, 4),
         "residual_std": round(residual_std, 4),
+        "engine": engine,
         "updated_at": datetime.utcnow().isoformat() + "Z",
-    }
+    }, (mae_model, residual_std, dir_acc)
 
-    # 写入 backtest_metrics，供预测区间使用
+
+def _save_metrics(out: Dict[str, Any], raw: Tuple[float, float, float], db_path: Optional[str] = None) -> None:
+    """写入 backtest_metrics，供预测区间使用。"""
+    mae_model, residual_std, dir_acc = raw
+    horizon_days = out["horizon_days"]
     try:
         conn = _get_conn(db_path)
         cur = conn.cursor()
@@ -151,4 +210,62 @@ def run_backtest(
         conn.close()
     except Exception:
         pass
+
+
+def _resolve_engine(engine: Optional[str]) -> str:
+    if engine is None:
+        return ENGINE_NUMPY if np is not None else ENGINE_PYTHON
+    if engine not in (ENGINE_NUMPY, ENGINE_PYTHON):
+        raise ValueError("未知的回测引擎: %s" % engine)
+    if engine == ENGINE_NUMPY and np is None:
+        raise RuntimeError("numpy 未安装，无法使用 numpy 回测引擎")
+    return engine
+
+
+def run_backtest(
+    lookback_days: int = 30,
+    horizon_days: int = 7,
+    max_enterprises: Optional[int] = 200,
+    db_path: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    对 enterprise_risk_timeseries 做历史回测：
+    - 对每个企业、每个满足条件的日期 T，用 [T-lookback, T] 预测 T+horizon_days，与真实值比较。
+    - 同时计算“朴素基准”（预测值=当日值）的 MAE，得到相对提升。
+    - 返回 MAE、RMSE、方向准确率、残差标准差、相对基准提升，并写入 backtest_metrics 表供预测区间使用。
+    - engine 默认 numpy（已安装时），否则 python；两者指标一致。
+    """
+    engine = _resolve_engine(engine)
+    by_enterprise = _load_series(db_path)
+    if not by_enterprise:
+        return {"error": "无时间序列数据", "n_samples": 0}
+    out, raw = _evaluate_horizon(by_enterprise, lookback_days, horizon_days, max_enterprises, engine)
+    if raw is not None:
+        _save_metrics(out, raw, db_path)
     return out
+
+
+def run_backtest_sweep(
+    lookback_days: int = 30,
+    horizons: Iterable[int] = DEFAULT_SWEEP_HORIZONS,
+    max_enterprises: Optional[int] = None,
+    db_path: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    多 horizon 回测（默认 7/14/30 天）：时间序列只读取一次，依次评估各 horizon，
+    每个 horizon 的 residual_std_<h>d 都写入 backtest_metrics，供对应预测区间使用。
+    返回 {"lookback_days": ..., "results": {horizon: 指标}}。
+    """
+    engine = _resolve_engine(engine)
+    by_enterprise = _load_series(db_path)
+    if not by_enterprise:
+        return {"error": "无时间序列数据", "n_samples": 0}
+    results: Dict[int, Dict[str, Any]] = {}
+    for h in sorted(set(int(h) for h in horizons)):
+        out, raw = _evaluate_horizon(by_enterprise, lookback_days, h, max_enterprises, engine)
+        if raw is not None:
+            _save_metrics(out, raw, db_path)
+        results[h] = out
+    return {"lookback_days": lookback_days, "engine": engine, "results": results}
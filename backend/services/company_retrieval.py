@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+企业资料检索（BM25）
+--------------------
+为「问这家企业」挑选与问题相关的资料片段，替代按时间倒序整批拼接上下文。
+
+- 语料：每家企业的新闻（company_news）、媒体舆情（company_media_reviews）、
+  尽调补充（company_supplements）、已分析的上传文档（documents，按段切分）
+- 存储：主库同目录下的 retrieval_index.db，SQLite FTS5 虚表，排序使用内置 bm25()
+- 分词：中文按相邻二字切分（无需分词词典，索引与查询一致），英文/数字按词小写
+- 变更水位：主库 retrieval_versions 按 (企业, 来源) 记录版本号，由明细表上的触发器维护——
+  新增行只加 version，修改检索相关列或删除行同时加 rebuild_version；原地修改也能被发现
+- 同步：资料写入后由 schedule_sync() 登记，后台线程执行 sync_company()：只有新增时追加 id 大于
+  已同步最大 id 的行，rebuild_version 变化时重建该来源。问答请求内不做同步（文档抽取较慢），
+  search() 只比较版本号，落后时登记后台同步并使用当前索引
+
+当前 SQLite 不支持 FTS5、或该企业尚未建立索引时 search() 返回 None，调用方回退到原来的拼接方式。
+"""
+import os
+import queue
+import re
+import sqlite3
+import threading
+
+TOP_K = 12
+# 送入提示词的片段总字数上限
+CONTEXT_CHARS = 4000
+PASSAGE_CHARS = 400
+PASSAGE_OVERLAP = 50
+MAX_PASSAGES_PER_DOCUMENT = 40
+
+_WORD_RE = re.compile(r'[A-Za-z0-9]+')
+_SPLIT_RE = re.compile(r'[\u4e00-\u9fff\u3400-\u4dbf]+|[A-Za-z0-9]+')
+
+# (来源, 主库查询, 额外过滤)：查询均返回 id 及格式化所需字段
+_SOURCES = (
+    ('news', "SELECT id, title, content, source, risk_level FROM company_news WHERE company_id=?", ''),
+    ('media', "SELECT id, platform, title, content FROM company_media_reviews WHERE company_id=?", ''),
+    ('supplement', "SELECT id, role, content FROM company_supplements WHERE company_id=?", ''),
+    ('document', "SELECT id, filename, filepath, analysis_result FROM documents WHERE company_id=?", " AND status='analyzed'"),
+)
+_SOURCE_TABLES = {'news': 'company_news', 'media': 'company_media_reviews',
+                  'supplement': 'company_supplements', 'document': 'documents'}
+
+# (来源, 明细表中参与检索的列)：这些列或 company_id 被修改时重建该来源
+_SOURCE_COLUMNS = (
+    ('news', 'title, content, source, risk_level'),
+    ('media', 'platform, title, content'),
+    ('supplement', 'role, content'),
+    ('document', 'filename, filepath, status, analysis_result'),
+)
+
+CREATE_VERSIONS_SQL = """
+CREATE TABLE IF NOT EXISTS retrieval_versions (
+    company_id INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0,
+    rebuild_version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (company_id, source)
+)
+"""
+
+_lock = threading.Lock()
+_fts5_available = None
+
+# 后台同步队列：同一 (库, 企业) 排队中时不重复登记
+_sync_queue = queue.Queue()
+_sync_pending = set()
+_sync_pending_lock = threading.Lock()
+_sync_thread = None
+
+
+def _bump(row, source, rebuild):
+    return """
+    INSERT INTO retrieval_versions (company_id, source, version, rebuild_version)
+    SELECT {r}.company_id, '{s}', 1, {rb} WHERE {r}.company_id IS NOT NULL
+    ON CONFLICT(company_id, source) DO UPDATE SET version = version + 1,
+        rebuild_version = rebuild_version + {rb};""".format(r=row, s=source, rb=1 if rebuild else 0)
+
+
+def _triggers():
+    for source, columns in _SOURCE_COLUMNS:
+        table = _SOURCE_TABLES[source]
+        yield ('trg_retrieval_%s_ins' % source, table, 'AFTER INSERT', _bump('NEW', source, False))
+        yield ('trg_retrieval_%s_del' % source, table, 'AFTER DELETE', _bump('OLD', source, True))
+        yield ('trg_retrieval_%s_upd' % source, table, 'AFTER UPDATE OF company_id, %s' % columns,
+               _bump('OLD', source, True) + _bump('NEW', source, True))
+
+
+def install(conn):
+    """在主库建 retrieval_versions 表及维护触发器（已存在则跳过）。在调用方的事务中执行；明细表缺失时报错。"""
+    conn.execute(CREATE_VERSIONS_SQL)
+    for name, table, timing, body in _triggers():
+        conn.execute("CREATE TRIGGER IF NOT EXISTS %s %s ON %s FOR EACH ROW BEGIN%s\nEND" % (name, timing, table, body))
+
+
+def tokenize(text):
+    """中文连续字符切为相邻二字（单字保留），英文/数字按词小写。"""
+    tokens = []
+    for m in _SPLIT_RE.finditer(text or ''):
+        run = m.group(0)
+        if _WORD_RE.fullmatch(run):
+            tokens.append(run.lower())
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _chunks(text, size=PASSAGE_CHARS, overlap=PASSAGE_OVERLAP):
+    text = (text or '').strip()
+    if len(text) <= size:
+        return [text] if text else []
+    step = max(1, size - overlap)
+    return [text[i:i + size] for i in range(0, len(text) - overlap, step)]
+
+
+def index_path(db_path):
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), 'retrieval_index.db')
+
+
+def _index_conn(db_path):
+    conn = sqlite3.connect(index_path(db_path), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+        cid, tokens, company_id UNINDEXED, source UNINDEXED, source_id UNINDEXED, body UNINDEXED)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+        company_id INTEGER NOT NULL,
+        source TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        rebuild_version INTEGER NOT NULL,
+        max_id INTEGER NOT NULL,
+        PRIMARY KEY (company_id, source))""")
+    return conn
+
+
+def fts5_available():
+    global _fts5_available
+    if _fts5_available is None:
+        try:
+            conn = sqlite3.connect(':memory:')
+            conn.execute("CREATE VIRTUAL TABLE t USING fts5(a)")
+            conn.close()
+            _fts5_available = True
+        except sqlite3.OperationalError:
+            _fts5_available = False
+    return _fts5_available
+
+
+def _company_token(company_id):
+    return 'c%d' % int(company_id)
+
+
+def _document_text(filepath, analysis_result):
+    from backend.services.document_service import extract_text_from_file
+    text = extract_text_from_file(filepath)
+    if not text and analysis_result:
+        try:
+            import json
+            text = (json.loads(analysis_result) or {}).get('summary') or ''
+        except (ValueError, TypeError, AttributeError):
+            text = ''
+    return text
+
+
+def _passages_for_row(source, row):
+    """把主库一行转成若干 (检索文本, 送入提示词的片段)。片段格式与原先拼接上下文时一致。"""
+    if source == 'news':
+        _, title, content, src, risk = row
+        head = f"新闻：{title or ''} | {src or ''} | 风险:{risk or '-'} | "
+        return [(f"{title or ''} {c}", head + c) for c in (_chunks(content) or [''])]
+    if source == 'media':
+        _, platform, title, content = row
+        head = f"舆情({platform or '-'})：{title or ''} | "
+        return [(f"{title or ''} {c}", head + c) for c in (_chunks(content) or [''])]
+    if source == 'supplement':
+        _, role, content = row
+        return [(c, f"补充({role}): {c}") for c in _chunks(content)]
+    _, filename, filepath, analysis_result = row
+    chunks = _chunks(_document_text(filepath, analysis_result))[:MAX_PASSAGES_PER_DOCUMENT]
+    return [(f"{filename or ''} {c}", f"文档《{filename or ''}》：{c}") for c in chunks]
+
+
+def _index_rows(idx, company_id, source, rows):
+    cid = _company_token(company_id)
+    params = []
+    for row in rows:
+        for text, body in _passages_for_row(source, row):
+            toks = tokenize(text)
+            if toks:
+                params.append((cid, ' '.join(toks), company_id, source, row[0], body))
+    idx.executemany(
+        "INSERT INTO passages (cid, tokens, company_id, source, source_id, body) VALUES (?,?,?,?,?,?)", params
+    )
+    return len(params)
+
+
+def _versions(src, company_id):
+    return {r[0]: (r[1], r[2]) for r in src.execute(
+        "SELECT source, version, rebuild_version FROM retrieval_versions WHERE company_id=?", (company_id,))}
+
+
+def sync_company(db_path, company_id):
+    """
+    把主库中该企业的资料变更同步到索引，返回新增片段数。
+    版本号未变的来源跳过；只有新增时追加 id 大于已同步最大 id 的行；有修改或删除时整源重建。
+    """
+    company_id = int(company_id)
+    src = sqlite3.connect(db_path, timeout=30)
+    added = 0
+    with _lock:
+        idx = _index_conn(db_path)
+        try:
+            state = {r[0]: r[1:] for r in idx.execute(
+                "SELECT source, version, rebuild_version, max_id FROM sync_state WHERE company_id=?", (company_id,))}
+            # 版本号与明细在同一读快照中读取：之后提交的写入会让版本号继续前进，下次同步补上
+            src.execute("BEGIN")
+            versions = _versions(src, company_id)
+            for source, sql, extra in _SOURCES:
+                version, rebuild_version = versions.get(source, (0, 0))
+                old = state.get(source)
+                if old is not None and old[:2] == (version, rebuild_version):
+                    continue
+                if old is None or old[1] != rebuild_version:
+                    idx.execute(
+                        "DELETE FROM passages WHERE rowid IN (SELECT rowid FROM passages WHERE passages MATCH ?) AND source=?",
+                        ('cid:' + _company_token(company_id), source),
+                    )
+                    max_id = 0
+                else:
+                    max_id = old[2]
+                rows = src.execute(sql + extra + " AND id>? ORDER BY id", (company_id, max_id)).fetchall()
+                added += _index_rows(idx, company_id, source, rows)
+                if rows:
+                    max_id = rows[-1][0]
+                idx.execute(
+                    "INSERT INTO sync_state (company_id, source, version, rebuild_version, max_id) VALUES (?,?,?,?,?) "
+                    "ON CONFLICT(company_id, source) DO UPDATE SET version=excluded.version, "
+                    "rebuild_version=excluded.rebuild_version, max_id=excluded.max_id",
+                    (company_id, source, version, rebuild_version, max_id),
+                )
+            idx.commit()
+        finally:
+            idx.close()
+            src.close()
+    return added
+
+
+def reset_index(db_path):
+    """删除索引库文件：主库被整体替换（开发环境重置、从备份恢复）后调用，之后各企业首次同步时整源重建。"""
+    with _lock:
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(index_path(db_path) + suffix)
+            except FileNotFoundError:
+                pass
+
+
+def _sync_worker():
+    while True:
+        key = _sync_queue.get()
+        with _sync_pending_lock:
+            _sync_pending.discard(key)
+        try:
+            sync_company(*key)
+        except Exception as e:
+            print('Retrieval index sync error:', key[1], e)
+        finally:
+            _sync_queue.task_done()
+
+
+def schedule_sync(db_path, company_id):
+    """登记该企业的后台索引同步（排队中时不重复登记）。资料写入后调用；不支持 FTS5 时不做任何事。"""
+    global _sync_thread
+    if not fts5_available():
+        return
+    key = (db_path, int(company_id))
+    with _sync_pending_lock:
+        if key in _sync_pending:
+            return
+        _sync_pending.add(key)
+        if _sync_thread is None:
+            _sync_thread = threading.Thread(target=_sync_worker, name='retrieval-sync', daemon=True)
+            _sync_thread.start()
+    _sync_queue.put(key)
+
+
+def _match_expr(company_id, query):
+    terms = sorted(set(tokenize(query)))
+    if not terms:
+        return None
+    quoted = ' OR '.join('"%s"' % t.replace('"', '""') for t in terms)
+    return 'cid:%s AND tokens:(%s)' % (_company_token(company_id), quoted)
+
+
+def search(db_path, company_id, query, k=TOP_K):
+    """
+    返回与 query 最相关的至多 k 个片段：[{'source', 'source_id', 'text', 'score'}]，按相关度降序。
+    不在请求内同步：索引落后于主库时登记后台同步，本次使用当前索引。
+    不支持 FTS5 或该企业尚未建立索引时返回 None。
+    """
+    if not fts5_available():
+        return None
+    company_id = int(company_id)
+    idx = _index_conn(db_path)
+    try:
+        synced = {r[0]: (r[1], r[2]) for r in idx.execute(
+            "SELECT source, version, rebuild_version FROM sync_state WHERE company_id=?", (company_id,))}
+        src = sqlite3.connect(db_path, timeout=30)
+        try:
+            versions = _versions(src, company_id)
+        finally:
+            src.close()
+        if any(synced.get(source) != versions.get(source, (0, 0)) for source, _, _ in _SOURCES):
+            schedule_sync(db_path, company_id)
+        if not synced:
+            return None
+        expr = _match_expr(company_id, query)
+        if expr is None:
+            return []
+        rows = idx.execute(
+            "SELECT source, source_id, body, bm25(passages, 0.0, 1.0) AS s FROM passages "
+            "WHERE passages MATCH ? ORDER BY s LIMIT ?",
+            (expr, int(k)),
+        ).fetchall()
+    finally:
+        idx.close()
+    return [{'source': r[0], 'source_id': r[1], 'text': r[2], 'score': round(-r[3], 4)} for r in rows]
+
+
+def top_passages(db_path, company_id, query, k=TOP_K, max_chars=CONTEXT_CHARS):
+    """search() 结果按字数上限截断后的片段文本列表；不支持 FTS5 或尚未建立索引时返回 None。"""
+    hits = search(db_path, company_id, query, k)
+    if hits is None:
+        return None
+    out, used = [], 0
+    for h in hits:
+        if used + len(h['text']) > max_chars and out:
+            break
+        out.append(h['text'])
+        used += len(h['text'])
+    return out
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+企业汇总统计（company_stats）
+----------------------------
+企业列表需要的聚合值预先物化到每企业一行的窄表：警报数、未处理警报数、新闻数及按风险等级分布、
+最新新闻时间、当前风险分。由 risk_alerts / company_news / enterprise_risk_timeseries 上的触发器增量维护：
+_create_risk_alert 插入警报、各处新闻写入（路由、调度器写线程、服务模块）、标记警报已处理、删除企业及其数据，
+都在同一事务里顺带更新汇总行，不需要每个写入点单独调用。
+
+- 计数按行加减；删除新闻时最新新闻时间走 company_news(company_id, created_at) 索引重新取 MAX
+- 当前风险分取 enterprise_risk_timeseries 中该企业 ts_date 最新一天的 risk_score
+- rebuild() 从明细表全量重算，迁移时回填已有数据，也可用于校验
+"""
+
+# 新闻风险等级取值（中文 / 英文）
+_HIGH = "('高', 'high', 'HIGH')"
+_MEDIUM = "('中', 'medium', 'MEDIUM')"
+_LOW = "('低', 'low', 'LOW')"
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS company_stats (
+    company_id INTEGER PRIMARY KEY,
+    alert_count INTEGER NOT NULL DEFAULT 0,
+    unprocessed_alert_count INTEGER NOT NULL DEFAULT 0,
+    news_count INTEGER NOT NULL DEFAULT 0,
+    news_high_count INTEGER NOT NULL DEFAULT 0,
+    news_medium_count INTEGER NOT NULL DEFAULT 0,
+    news_low_count INTEGER NOT NULL DEFAULT 0,
+    latest_news_at TIMESTAMP,
+    risk_score REAL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+)
+"""
+
+COLUMNS = ('alert_count', 'unprocessed_alert_count', 'news_count', 'news_high_count', 'news_medium_count',
+           'news_low_count', 'latest_news_at', 'risk_score')
+
+
+def _level(row, levels):
+    return "(CASE WHEN %s.risk_level IN %s THEN 1 ELSE 0 END)" % (row, levels)
+
+
+# 以下语句中 row 为触发器里的 NEW / OLD。加计数用 INSERT ... SELECT ... WHERE 跳过 company_id 为空的行；
+# 减计数按 company_id 等值更新，为空时自然不命中
+def _alert_add(row):
+    return """
+    INSERT INTO company_stats (company_id, alert_count, unprocessed_alert_count)
+    SELECT {r}.company_id, 1, {r}.processed_at IS NULL WHERE {r}.company_id IS NOT NULL
+    ON CONFLICT(company_id) DO UPDATE SET alert_count = alert_count + 1,
+        unprocessed_alert_count = unprocessed_alert_count + ({r}.processed_at IS NULL),
+        updated_at = CURRENT_TIMESTAMP;""".format(r=row)
+
+
+def _alert_remove(row):
+    return """
+    UPDATE company_stats SET alert_count = alert_count - 1,
+        unprocessed_alert_count = unprocessed_alert_count - ({r}.processed_at IS NULL),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE company_id = {r}.company_id;""".format(r=row)
+
+
+def _news_add(row):
+    return """
+    INSERT INTO company_stats (company_id, news_count, news_high_count, news_medium_count, news_low_count, latest_news_at)
+    SELECT {r}.company_id, 1, {high}, {medium}, {low}, {r}.created_at WHERE {r}.company_id IS NOT NULL
+    ON CONFLICT(company_id) DO UPDATE SET news_count = news_count + 1,
+        news_high_count = news_high_count + {high}, news_medium_count = news_medium_count + {medium},
+        news_low_count = news_low_count + {low},
+        latest_news_at = CASE WHEN latest_news_at IS NULL OR {r}.created_at > latest_news_at
+                              THEN {r}.created_at ELSE latest_news_at END,
+        updated_at = CURRENT_TIMESTAMP;""".format(
+        r=row, high=_level(row, _HIGH), medium=_level(row, _MEDIUM), low=_level(row, _LOW))
+
+
+def _news_remove(row):
+    return """
+    UPDATE company_stats SET news_count = news_count - 1,
+        news_high_count = news_high_count - {high}, news_medium_count = news_medium_count - {medium},
+        news_low_count = news_low_count - {low},
+        latest_news_at = (SELECT MAX(created_at) FROM company_news WHERE company_id = {r}.company_id),
+        updated_at = CURRENT_TIMESTAMP
+    WHERE company_id = {r}.company_id;""".format(
+        r=row, high=_level(row, _HIGH), medium=_level(row, _MEDIUM), low=_level(row, _LOW))
+
+
+def _risk_score(row):
+    return """
+    INSERT INTO company_stats (company_id, risk_score)
+    SELECT {r}.enterprise_id, (SELECT risk_score FROM enterprise_risk_timeseries WHERE enterprise_id = {r}.enterprise_id
+                               ORDER BY ts_date DESC LIMIT 1)
+    WHERE {r}.enterprise_id IS NOT NULL
+    ON CONFLICT(company_id) DO UPDATE SET risk_score = excluded.risk_score, updated_at = CURRENT_TIMESTAMP;""".format(
+        r=row)
+
+
+# (触发器名, 表, 时机, 语句)：更新按“先减旧行、再加新行”处理，改企业归属时计数也随之转移
+TRIGGERS = (
+    ('trg_company_stats_alert_ins', 'risk_alerts', 'AFTER INSERT', _alert_add('NEW')),
+    ('trg_company_stats_alert_del', 'risk_alerts', 'AFTER DELETE', _alert_remove('OLD')),
+    ('trg_company_stats_alert_upd', 'risk_alerts', 'AFTER UPDATE OF company_id, processed_at',
+     _alert_remove('OLD') + _alert_add('NEW')),
+    ('trg_company_stats_news_ins', 'company_news', 'AFTER INSERT', _news_add('NEW')),
+    ('trg_company_stats_news_del', 'company_news', 'AFTER DELETE', _news_remove('OLD')),
+    ('trg_company_stats_news_upd', 'company_news', 'AFTER UPDATE OF company_id, risk_level, created_at',
+     _news_remove('OLD') + _news_add('NEW')),
+    ('trg_company_stats_risk_ins', 'enterprise_risk_timeseries', 'AFTER INSERT', _risk_score('NEW')),
+    ('trg_company_stats_risk_upd', 'enterprise_risk_timeseries', 'AFTER UPDATE', _risk_score('NEW')),
+    ('trg_company_stats_risk_del', 'enterprise_risk_timeseries', 'AFTER DELETE', _risk_score('OLD')),
+    ('trg_company_stats_company_del', 'companies', 'AFTER DELETE',
+     "\n    DELETE FROM company_stats WHERE company_id = OLD.id;"),
+)
+
+
+def install(conn):
+    """
+    建表并创建维护触发器（已存在则跳过），随后全量回填。在调用方的事务中执行；
+    明细表缺失时报错，迁移随之回滚、不会在缺少触发器的情况下被标记为已应用。
+    """
+    conn.execute(CREATE_TABLE_SQL)
+    for name, table, timing, body in TRIGGERS:
+        conn.execute("CREATE TRIGGER IF NOT EXISTS %s %s ON %s FOR EACH ROW BEGIN%s\nEND"
+                     % (name, timing, table, body))
+    rebuild(conn)
+
+
+def rebuild(conn):
+    """按明细表全量重算 company_stats：每个企业一行，明细为空的企业计数为 0。返回企业数。"""
+    alerts = """SELECT company_id, COUNT(*) AS total, SUM(processed_at IS NULL) AS unprocessed
+                FROM risk_alerts GROUP BY company_id"""
+    news = """SELECT company_id, COUNT(*) AS total, SUM(%s) AS high, SUM(%s) AS medium, SUM(%s) AS low,
+                     MAX(created_at) AS latest
+              FROM company_news GROUP BY company_id""" % (
+        _level('company_news', _HIGH), _level('company_news', _MEDIUM), _level('company_news', _LOW))
+    score = """(SELECT risk_score FROM enterprise_risk_timeseries WHERE enterprise_id = c.id
+                ORDER BY ts_date DESC LIMIT 1)"""
+    conn.execute("DELETE FROM company_stats")
+    cur = conn.execute("""
+        INSERT INTO company_stats (company_id, %s)
+        SELECT c.id, COALESCE(a.total, 0), COALESCE(a.unprocessed, 0), COALESCE(n.total, 0),
+               COALESCE(n.high, 0), COALESCE(n.medium, 0), COALESCE(n.low, 0), n.latest, %s
+        FROM companies c
+        LEFT JOIN (%s) a ON a.company_id = c.id
+        LEFT JOIN (%s) n ON n.company_id = c.id
+    """ % (', '.join(COLUMNS), score, alerts, news))
+    return cur.rowcount
+
+
+def get(conn, company_id):
+    """单个企业的汇总行（dict），没有明细时返回全 0。"""
+    row = conn.execute("SELECT %s FROM company_stats WHERE company_id = ?" % ', '.join(COLUMNS),
+                       (company_id,)).fetchone()
+    if not row:
+        return {c: (None if c in ('latest_news_at', 'risk_score') else 0) for c in COLUMNS}
+    return dict(zip(COLUMNS, row))
+
+
+def list_companies(conn, user_id, search=None, risk_level=None, industry=None, favorite_only=False,
+                   order_clause='c.last_updated DESC'):
+    """
+    企业列表：user_companies -> companies -> company_stats，收藏用 LEFT JOIN 一并取出，每个企业一行、无 GROUP BY。
+    order_clause 由调用方从白名单中选取。
+    """
+    where = ["uc.user_id = ?"]
+    params = [user_id]
+    if search:
+        where.append("(c.name LIKE ? OR c.legal_representative LIKE ?)")
+        params.extend(['%' + search + '%', '%' + search + '%'])
+    if risk_level:
+        where.append("c.risk_level = ?")
+        params.append(risk_level)
+    if industry:
+        where.append("(c.industry LIKE ? OR c.industry = ?)")
+        params.extend(['%' + industry + '%', industry])
+    if favorite_only:
+        where.append("f.company_id IS NOT NULL")
+    rows = conn.execute("""
+        SELECT c.id, c.name, c.industry, c.risk_level, c.last_updated,
+               c.legal_representative, c.registered_capital, c.business_status, c.crawl_status,
+               c.llm_status, c.media_status, c.news_status, f.company_id IS NOT NULL,
+               COALESCE(s.alert_count, 0), COALESCE(s.unprocessed_alert_count, 0), COALESCE(s.news_count, 0),
+               COALESCE(s.news_high_count, 0), COALESCE(s.news_medium_count, 0), COALESCE(s.news_low_count, 0),
+               s.latest_news_at, s.risk_score
+        FROM user_companies uc
+        JOIN companies c ON c.id = uc.company_id
+        LEFT JOIN company_stats s ON s.company_id = c.id
+        LEFT JOIN user_company_favorites f ON f.user_id = uc.user_id AND f.company_id = c.id
+        WHERE """ + " AND ".join(where) + """
+        ORDER BY """ + order_clause, tuple(params)).fetchall()
+    return [{
+        'id': r[0],
+        'name': r[1],
+        'industry': r[2],
+        'risk_level': r[3],
+        'last_updated': r[4],
+        'legal_representative': r[5] or '',
+        'registered_capital': r[6] or '',
+        'business_status': r[7] or '',
+        'crawl_status': r[8] or 'pending',
+        'llm_status': r[9] or 'pending',
+        'media_status': r[10] or 'pending',
+        'news_status': r[11] or 'pending',
+        'is_favorite': bool(r[12]),
+        'alert_count': r[13],
+        'unprocessed_alert_count': r[14],
+        'news_count': r[15],
+        'news_by_risk_level': {'high': r[16], 'medium': r[17], 'low': r[18]},
+        'latest_news_at': r[19],
+        'risk_score': r[20],
+    } for r in rows]
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接池
+-------------
+后端路由原先每次请求新建连接（多个辅助函数还各开一个），且 synchronous / cache_size / mmap_size /
+temp_store 等按连接生效的 PRAGMA 从未设置。这里按数据库路径维护空闲连接池：
+
+- acquire() 取一个空闲连接（没有则新建并设置 PRAGMA），连接对象的 close() 改为归还到池中，
+  原有 conn = ...; ...; conn.close() 的写法无需改动
+- 归还时回滚未提交的事务、重置 row_factory / text_factory / isolation_level，下一个使用者拿到的是干净连接
+- 每个线程记录自己借出的连接，连接上记录借用线程（_owner）；请求结束（teardown）时 release_thread() 只归还
+  本线程仍持有的连接——在其他线程 close()、甚至已被再次借出的连接不会被误归还
+- 空闲连接数上限 POOL_SIZE，超出的直接关闭；借出数量不设上限（SQLite 由 busy_timeout 排队写锁）
+- stats() 返回新建/复用/归还/泄漏回收次数，供健康检查展示
+
+Flask 开发服务器每个请求一个新线程，因此连接在线程之间复用（check_same_thread=False），
+同一时刻只被一个线程使用。
+"""
+import os
+import sqlite3
+import threading
+from collections import deque
+
+POOL_SIZE = int(os.environ.get('RISKGUARD_DB_POOL_SIZE', '16'))
+BUSY_TIMEOUT_SECONDS = 30
+
+# 每个新连接执行一次；journal_mode=WAL 写入数据库文件，其余按连接生效
+PRAGMAS = (
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',   # WAL 下 NORMAL 不会损坏数据库，只可能丢最后一次提交，换取每次提交少一次 fsync
+    'PRAGMA cache_size=-16000',    # 每连接约 16MB 页缓存（负数单位为 KB）
+    'PRAGMA mmap_size=268435456',  # 256MB 内存映射读
+    'PRAGMA temp_store=MEMORY',    # 排序 / 临时索引放内存
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """close() 归还到所属连接池而不是真正关闭。"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+        self._in_use = False
+        self._owner = None
+
+    def close(self):
+        if self._pool is None:
+            super().close()
+        else:
+            self._pool.release(self)
+
+    def close_now(self):
+        self._pool = None
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, path, size=None, timeout=BUSY_TIMEOUT_SECONDS):
+        self.path = path
+        self.size = POOL_SIZE if size is None else size
+        self.timeout = timeout
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {'created': 0, 'reused': 0, 'released': 0, 'discarded': 0, 'reclaimed': 0, 'in_use': 0}
+
+    def _new_connection(self):
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=PooledConnection)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        conn._pool = self
+        return conn
+
+    def _held(self):
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = self._local.held = []
+        return held
+
+    def acquire(self):
+        conn = None
+        with self._lock:
+            if self._idle:
+                conn = self._idle.pop()  # 后进先出：最近用过的连接页缓存最热
+                self._stats['reused'] += 1
+        if conn is None:
+            conn = self._new_connection()
+            with self._lock:
+                self._stats['created'] += 1
+        conn._in_use = True
+        conn._owner = threading.get_ident()
+        with self._lock:
+            self._stats['in_use'] += 1
+        held = self._held()
+        if conn not in held:
+            held.append(conn)
+        return conn
+
+    def release(self, conn):
+        if not conn._in_use:
+            return  # 重复 close
+        conn._in_use = False
+        # 在借用线程上归还时从其记录中移除；在其他线程归还的，借用线程的记录在其 release_thread() 时按 _owner 跳过
+        if conn._owner == threading.get_ident():
+            held = self._held()
+            if conn in held:
+                held.remove(conn)
+        conn._owner = None
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.row_factory = None
+            conn.text_factory = str
+            conn.isolation_level = ''  # sqlite3.connect 的默认值
+        except sqlite3.Error:
+            with self._lock:
+                self._stats['in_use'] -= 1
+                self._stats['discarded'] += 1
+            conn.close_now()
+            return
+        with self._lock:
+            self._stats['in_use'] -= 1
+            self._stats['released'] += 1
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+            self._stats['discarded'] += 1
+        conn.close_now()
+
+    def release_thread(self):
+        """归还当前线程仍持有的连接（请求结束时调用），返回归还个数。"""
+        me = threading.get_ident()
+        held = self._held()
+        mine = [conn for conn in held if conn._in_use and conn._owner == me]
+        del held[:]
+        for conn in mine:
+            self.release(conn)
+        if mine:
+            with self._lock:
+                self._stats['reclaimed'] += len(mine)
+        return len(mine)
+
+    def close_idle(self):
+        """关闭全部空闲连接（如恢复备份覆盖数据库文件前）。"""
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            conn.close_now()
+        return len(idle)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+            out['idle'] = len(self._idle)
+        out['size'] = self.size
+        total = out['created'] + out['reused']
+        out['reuse_rate'] = round(out['reused'] / total, 4) if total else None
+        return out
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def connect(path):
+    """从 path 对应的连接池借一个连接；用完照常 conn.close() 即归还。"""
+    return get_pool(path).acquire()
+
+
+def release_thread():
+    """归还当前线程在所有连接池中仍借出的连接。"""
+    return sum(pool.release_thread() for pool in list(_pools.values()))
+
+
+def stats():
+    return {path: pool.stats() for path, pool in list(_pools.items())}
@@ -0,0 +1,461 @@
+# -*- coding: utf-8 -*-
+"""
+数据库表结构
+------------
+init_db 的建表语句集中于此：CREATE TABLE IF NOT EXISTS，可重复执行，生产与开发环境共用。
+最初版本之后新增的列、索引、汇总表由 schema_migrations 按版本补齐；
+init_db 与测试都执行 create_tables + schema_migrations.migrate，得到同一份表结构。
+"""
+
+# (表名, 建表语句)，按外键依赖顺序排列
+TABLES = (
+    # 用户
+    ('users', '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        email TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'user',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    '''),
+    # 企业
+    ('companies', '''
+    CREATE TABLE IF NOT EXISTS companies (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        industry TEXT,
+        risk_level TEXT DEFAULT '未知',
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        legal_representative TEXT,
+        registered_capital TEXT,
+        business_status TEXT,
+        registered_address TEXT,
+        business_scope TEXT,
+        equity_structure TEXT,
+        social_evaluation TEXT,
+        crawl_status TEXT DEFAULT 'pending',
+        established_date TEXT,
+        legal_cases TEXT,
+        equity_changes TEXT,
+        capital_changes TEXT
+    )
+    '''),
+    # 风险警报
+    ('risk_alerts', '''
+    CREATE TABLE IF NOT EXISTS risk_alerts (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER,
+        alert_type TEXT NOT NULL,
+        severity TEXT NOT NULL,
+        description TEXT,
+        source TEXT,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 上传文档
+    ('documents', '''
+    CREATE TABLE IF NOT EXISTS documents (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        company_id INTEGER,
+        filename TEXT NOT NULL,
+        filepath TEXT NOT NULL,
+        upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        status TEXT DEFAULT 'uploaded',
+        analysis_result TEXT,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 风险资讯（示例数据）
+    ('news_items', '''
+    CREATE TABLE IF NOT EXISTS news_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        category TEXT NOT NULL,
+        source_url TEXT,
+        scraped_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 风险洞察（示例数据）
+    ('risk_insights', '''
+    CREATE TABLE IF NOT EXISTS risk_insights (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        description TEXT NOT NULL,
+        content TEXT NOT NULL,
+        risk_level TEXT NOT NULL,
+        source_data TEXT,
+        generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        user_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 企业舆情（社会评价）
+    ('company_media_reviews', '''
+    CREATE TABLE IF NOT EXISTS company_media_reviews (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER NOT NULL,
+        platform TEXT,
+        title TEXT,
+        content TEXT,
+        sentiment TEXT,
+        source_url TEXT,
+        llm_summary TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # LLM 配置表
+    ('llm_config', '''
+    CREATE TABLE IF NOT EXISTS llm_config (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE,
+        api_key TEXT,
+        base_url TEXT,
+        model TEXT DEFAULT 'gpt-4o-mini',
+        enable_web_search INTEGER DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 用户收藏企业表（红心：仅影响是否标星，取消收藏后企业仍在「我的企业」中）
+    ('user_company_favorites', '''
+    CREATE TABLE IF NOT EXISTS user_company_favorites (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        company_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, company_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 用户关联企业表：用户添加的企业（与收藏分离，取消红心后企业仍可见）
+    ('user_companies', '''
+    CREATE TABLE IF NOT EXISTS user_companies (
+        user_id INTEGER NOT NULL,
+        company_id INTEGER NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(user_id, company_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 企业关键词（词云）
+    ('company_keywords', '''
+    CREATE TABLE IF NOT EXISTS company_keywords (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER NOT NULL,
+        keyword TEXT NOT NULL,
+        weight INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 企业关联新闻/资讯（滚动）
+    ('company_news', '''
+    CREATE TABLE IF NOT EXISTS company_news (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER,
+        title TEXT NOT NULL,
+        content TEXT,
+        source TEXT,
+        source_url TEXT,
+        sentiment_score REAL,
+        risk_level TEXT,
+        category TEXT,
+        keywords TEXT,
+        publish_date TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 用户设置：搜索间隔、报告格式
+    ('user_settings', '''
+    CREATE TABLE IF NOT EXISTS user_settings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL UNIQUE,
+        search_interval_minutes INTEGER DEFAULT 30,
+        report_template TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 用户提交链接
+    ('user_links', '''
+    CREATE TABLE IF NOT EXISTS user_links (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        company_id INTEGER,
+        url TEXT NOT NULL,
+        title TEXT,
+        status TEXT DEFAULT 'pending',
+        analysis_result TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+    # 尽调补充：企业 AI 助手对话记录与归集摘要
+    ('company_supplements', '''
+    CREATE TABLE IF NOT EXISTS company_supplements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        company_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        merged_fields TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 宏观政策摘要（大模型每日更新，右侧面板展示）
+    ('macro_policy_digest', '''
+    CREATE TABLE IF NOT EXISTS macro_policy_digest (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    '''),
+    # 政策与市场环境：多维度新闻，每条单独一条记录（不按时间跨度总结）
+    ('macro_policy_news', '''
+    CREATE TABLE IF NOT EXISTS macro_policy_news (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        source TEXT,
+        dimension TEXT,
+        published_at TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        risk_score REAL
+    )
+    '''),
+    # 宏观指数：按日汇总，由 macro_policy_news 计算得到，供风险预测等使用
+    ('macro_daily_index', '''
+    CREATE TABLE IF NOT EXISTS macro_daily_index (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts_date TEXT NOT NULL UNIQUE,
+        policy_score REAL NOT NULL DEFAULT 0,
+        macro_risk_score REAL NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        item_count INTEGER NOT NULL DEFAULT 0,
+        score_sum REAL NOT NULL DEFAULT 0,
+        last_item_id INTEGER NOT NULL DEFAULT 0
+    )
+    '''),
+    # 企业事件特征表：新闻 / 舆情 / 政策 / 工商变更 等结构化事件，供风险聚合与预测使用
+    ('enterprise_event_feature', '''
+    CREATE TABLE IF NOT EXISTS enterprise_event_feature (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        enterprise_id INTEGER NOT NULL,
+        source_type TEXT NOT NULL,          -- NEWS / SOCIAL / POLICY / BIZ_REG
+        source_id INTEGER,                  -- 对应原始记录主键（如 company_news.id）
+        event_date TEXT NOT NULL,           -- 事件日期（YYYY-MM-DD）
+        event_type TEXT NOT NULL,           -- LEGAL_PENALTY / LITIGATION / FINANCIAL_STRESS / MANAGEMENT_CHANGE / PUBLIC_OPINION / OTHER ...
+        sentiment_label TEXT,               -- NEG / NEU / POS
+        sentiment_score REAL,               -- -1 ~ 1
+        severity_score REAL,                -- 0 ~ 1
+        policy_direction TEXT,              -- POSITIVE / NEUTRAL / NEGATIVE（仅 POLICY）
+        policy_strength REAL,               -- 0 ~ 1（仅 POLICY）
+        biz_change_type TEXT,               -- 高管变更 / 注册资本变更 等（仅 BIZ_REG）
+        extra_json TEXT,                    -- 其他 LLM 抽取字段（JSON）
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (enterprise_id) REFERENCES companies (id)
+    )
+    '''),
+    # 特征增量抽取状态：记录每个企业已抽取到的来源表主键高水位（如 company_news.id）
+    ('feature_extraction_state', '''
+    CREATE TABLE IF NOT EXISTS feature_extraction_state (
+        enterprise_id INTEGER NOT NULL,
+        source_type TEXT NOT NULL,          -- NEWS / SOCIAL / POLICY / BIZ_REG
+        last_source_id INTEGER NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (enterprise_id, source_type)
+    )
+    '''),
+    # 企业风险时间序列表：按日聚合各维度风险得分与辅助特征
+    ('enterprise_risk_timeseries', '''
+    CREATE TABLE IF NOT EXISTS enterprise_risk_timeseries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        enterprise_id INTEGER NOT NULL,
+        ts_date TEXT NOT NULL,              -- 日期（YYYY-MM-DD）
+        score_legal REAL NOT NULL,          -- 0~1 法律与合规风险
+        score_business REAL NOT NULL,       -- 0~1 经营与财务风险
+        score_media REAL NOT NULL,          -- 0~1 舆情与媒体风险
+        score_policy REAL NOT NULL,         -- 0~1 政策与监管风险
+        score_industry REAL NOT NULL,       -- 0~1 行业与宏观风险
+        risk_score REAL NOT NULL,           -- 0~100 综合风险得分
+        news_count INTEGER NOT NULL DEFAULT 0,
+        neg_news_ratio REAL NOT NULL DEFAULT 0,
+        sentiment_index REAL,               -- 当日情绪指数（平均 sentiment_score）
+        sentiment_vol REAL,                 -- 过去 N 日情绪波动率
+        policy_impact REAL,                 -- 政策负面影响指数
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(enterprise_id, ts_date),
+        FOREIGN KEY (enterprise_id) REFERENCES companies (id)
+    )
+    '''),
+    # 预测回测指标：MAE、残差标准差等，供预测区间与准确性评估
+    ('backtest_metrics', '''
+    CREATE TABLE IF NOT EXISTS backtest_metrics (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        metric_name TEXT NOT NULL UNIQUE,
+        value_real REAL,
+        value_text TEXT,
+        extra_json TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    '''),
+    # 回测任务：参数、状态与各 horizon 汇总结果；进度同步写入 task_runs
+    ('backtest_jobs', '''
+    CREATE TABLE IF NOT EXISTS backtest_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_run_id INTEGER,
+        lookback_days INTEGER NOT NULL,
+        horizons TEXT NOT NULL,             -- JSON 数组，如 [7, 14, 30]
+        max_enterprises INTEGER,            -- NULL 表示全部企业
+        status TEXT NOT NULL DEFAULT 'pending',
+        total_enterprises INTEGER NOT NULL DEFAULT 0,
+        done_enterprises INTEGER NOT NULL DEFAULT 0,
+        result_json TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (task_run_id) REFERENCES task_runs (id)
+    )
+    '''),
+    # 回测逐企业结果：每个企业、每个 horizon 的误差充分统计量与分布分位数；已写入的企业即续跑检查点
+    ('backtest_enterprise_results', '''
+    CREATE TABLE IF NOT EXISTS backtest_enterprise_results (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        job_id INTEGER NOT NULL,
+        enterprise_id INTEGER NOT NULL,
+        horizon_days INTEGER NOT NULL,
+        n_samples INTEGER NOT NULL DEFAULT 0,
+        sum_err REAL,
+        sum_abs_err REAL,
+        sum_sq_err REAL,
+        sum_abs_err_naive REAL,
+        direction_correct INTEGER,
+        mae REAL,
+        rmse REAL,
+        residual_std REAL,
+        err_p05 REAL,
+        err_p25 REAL,
+        err_p50 REAL,
+        err_p75 REAL,
+        err_p95 REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(job_id, enterprise_id, horizon_days),
+        FOREIGN KEY (job_id) REFERENCES backtest_jobs (id)
+    )
+    '''),
+    # 预测与宏观参数：可配置权重与中性值，便于客观调参
+    ('prediction_config', '''
+    CREATE TABLE IF NOT EXISTS prediction_config (
+        key TEXT NOT NULL PRIMARY KEY,
+        value_text TEXT NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    '''),
+    # 企业风险标签：用于训练 ML 模型（如爆雷/高风险事件标签）
+    ('enterprise_risk_label', '''
+    CREATE TABLE IF NOT EXISTS enterprise_risk_label (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        enterprise_id INTEGER NOT NULL,
+        as_of_date TEXT NOT NULL,           -- 标签对应的观察起点日（YYYY-MM-DD）
+        label_type TEXT NOT NULL,           -- explosion / default / penalty 等
+        label_value INTEGER NOT NULL,       -- 0/1
+        note TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(enterprise_id, as_of_date, label_type),
+        FOREIGN KEY (enterprise_id) REFERENCES companies (id)
+    )
+    '''),
+    # 系统设置（管理员在管理后台配置，如 SMTP 发件人）
+    ('system_settings', '''
+    CREATE TABLE IF NOT EXISTS system_settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    '''),
+    # 操作审计日志（谁在何时做了什么，便于合规）
+    ('audit_log', '''
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        action TEXT NOT NULL,
+        resource_type TEXT,
+        resource_id TEXT,
+        detail TEXT,
+        ip TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 预警规则（可配置：风险升级、分类阈值、情感阈值等）
+    ('alert_rules', '''
+    CREATE TABLE IF NOT EXISTS alert_rules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        rule_type TEXT NOT NULL,
+        config TEXT,
+        enabled INTEGER DEFAULT 1,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 站内通知
+    ('notifications', '''
+    CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        title TEXT NOT NULL,
+        body TEXT,
+        related_type TEXT,
+        related_id TEXT,
+        read_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )
+    '''),
+    # 任务执行记录（爬取/新闻搜索等）
+    ('task_runs', '''
+    CREATE TABLE IF NOT EXISTS task_runs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        task_type TEXT NOT NULL,
+        company_id INTEGER,
+        status TEXT NOT NULL,
+        message TEXT,
+        started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP,
+        FOREIGN KEY (company_id) REFERENCES companies (id)
+    )
+    '''),
+)
+
+
+def create_tables(conn):
+    """创建缺失的表与 init_db 阶段的唯一索引；已有的表不做改动（缺失的列由迁移补齐）。"""
+    for _, ddl in TABLES:
+        conn.execute(ddl)
+    # 同一来源记录只对应一条特征，供增量抽取按 (source_type, source_id) upsert；建唯一索引前先去掉历史重复
+    conn.execute("""
+        DELETE FROM enterprise_event_feature
+        WHERE source_id IS NOT NULL AND id NOT IN (
+            SELECT MIN(id) FROM enterprise_event_feature GROUP BY source_type, source_id
+        )
+    """)
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_event_feature_source ON enterprise_event_feature (source_type, source_id)")
@@ -14,7 +14,7 @@ from __future__ import annotations
 
 import sqlite3
 from datetime import datetime
-from typing import Iterable, Dict, Any, Optional
+from typing import Iterable, Dict, Any, Optional, Set
 
 DB_PATH = None  # 由调用方传入，或在 app.py 中注入
 
@@ -96,18 +96,57 @@ def _map_news_to_event(row: sqlite3.Row) -> Dict[str, Any]:
     }
 
 
+_EVENT_COLUMNS = (
+    "enterprise_id", "source_type", "source_id", "event_date", "event_type",
+    "sentiment_label", "sentiment_score", "severity_score",
+    "policy_direction", "policy_strength", "biz_change_type", "extra_json",
+)
+
+_INSERT_EVENT_SQL = "INSERT INTO enterprise_event_feature (%s) VALUES (%s)" % (
+    ", ".join(_EVENT_COLUMNS),
+    ",".join("?" * len(_EVENT_COLUMNS)),
+)
+
+# 以 (source_type, source_id) 为键的 upsert，依赖 init_db 中的唯一索引 idx_event_feature_source
+_UPSERT_EVENT_SQL = _INSERT_EVENT_SQL + " ON CONFLICT(source_type, source_id) DO UPDATE SET %s" % ", ".join(
+    "%s=excluded.%s" % (c, c) for c in _EVENT_COLUMNS if c not in ("source_type", "source_id")
+)
+
+
+def _event_params(ev: Dict[str, Any]) -> tuple:
+    return tuple(ev[c] for c in _EVENT_COLUMNS)
+
+
+def _save_high_water_marks(cu: sqlite3.Cursor, marks: Dict[int, int]) -> None:
+    """记录各企业已抽取到的 company_news.id 高水位。"""
+    if not marks:
+        return
+    now = datetime.utcnow().isoformat()
+    cu.executemany(
+        """
+        INSERT INTO feature_extraction_state (enterprise_id, source_type, last_source_id, updated_at)
+        VALUES (?, 'NEWS', ?, ?)
+        ON CONFLICT(enterprise_id, source_type) DO UPDATE SET
+            last_source_id=MAX(last_source_id, excluded.last_source_id),
+            updated_at=excluded.updated_at
+        """,
+        [(eid, sid, now) for eid, sid in marks.items()],
+    )
+
+
 def rebuild_news_features(db_path: Optional[str] = None, enterprise_id: Optional[int] = None) -> int:
     """
-    从 company_news 重建 NEWS 类 enterprise_event_feature 记录。
+    从 company_news 全量重建 NEWS 类 enterprise_event_feature 记录。
     - 若指定 enterprise_id，则只处理该企业；
     - 否则处理全量。
+    删除与写入在同一事务内完成，并同步重置增量抽取的高水位。
     返回新写入的记录数。
     """
     conn = _get_conn(db_path)
     conn.row_factory = sqlite3.Row
     cu = conn.cursor()
 
-    where = ""
+    where = "WHERE company_id IS NOT NULL"
     params: Iterable[Any] = ()
     if enterprise_id is not None:
         where = "WHERE company_id = ?"
@@ -116,45 +155,111 @@ def rebuild_news_features(db_path: Optional[str] = None, enterprise_id: Optional
     cu.execute(f"SELECT * FROM company_news {where}", params)
     rows = cu.fetchall()
 
-    # 为避免重复，先删除对应企业的 NEWS 来源特征
+    # 为避免重复，先删除对应企业的 NEWS 来源特征与高水位
     if enterprise_id is not None:
         cu.execute(
             "DELETE FROM enterprise_event_feature WHERE enterprise_id=? AND source_type='NEWS'",
             (enterprise_id,),
         )
+        cu.execute(
+            "DELETE FROM feature_extraction_state WHERE enterprise_id=? AND source_type='NEWS'",
+            (enterprise_id,),
+        )
     else:
         cu.execute("DELETE FROM enterprise_event_feature WHERE source_type='NEWS'")
-    conn.commit()
+        cu.execute("DELETE FROM feature_extraction_state WHERE source_type='NEWS'")
 
-    count = 0
+    events = [_map_news_to_event(row) for row in rows]
+    cu.executemany(_INSERT_EVENT_SQL, [_event_params(ev) for ev in events])
+
+    marks: Dict[int, int] = {}
     for row in rows:
-        ev = _map_news_to_event(row)
+        eid = row["company_id"]
+        marks[eid] = max(marks.get(eid, 0), row["id"])
+    _save_high_water_marks(cu, marks)
+
+    conn.commit()
+    conn.close()
+    return len(events)
+
+
+def update_news_features(db_path: Optional[str] = None, enterprise_id: Optional[int] = None) -> Dict[str, Any]:
+    """
+    增量同步 NEWS 类 enterprise_event_feature 记录（新闻写入后的常规路径）。
+    - 只映射 company_news.id 高于该企业高水位的新行，按 (source_type, source_id) 批量 upsert；
+    - 原始新闻已被删除的特征行一并删除（重新搜索新闻时旧行被删、新行以新 id 写入，即“变更”）；
+    - 若指定 enterprise_id，则只处理该企业，否则处理全量。
+    全部写入在一个事务内完成。返回：
+    {"written": 写入/更新数, "deleted": 删除数, "dirty_dates": {enterprise_id: [受影响的 event_date, ...]}}，
+    dirty_dates 供 risk_timeseries_service.recompute_timeseries_days 只重算受影响的日桶。
+    """
+    conn = _get_conn(db_path)
+    conn.row_factory = sqlite3.Row
+    cu = conn.cursor()
+
+    ent_filter = ""
+    params: Iterable[Any] = ()
+    if enterprise_id is not None:
+        ent_filter = "AND f.enterprise_id = ?"
+        params = (enterprise_id,)
+
+    # 原始新闻已不存在的特征
+    cu.execute(
+        f"""
+        SELECT f.id, f.enterprise_id, f.event_date FROM enterprise_event_feature f
+        LEFT JOIN company_news n ON n.id = f.source_id
+        WHERE f.source_type='NEWS' AND n.id IS NULL {ent_filter}
+        """,
+        params,
+    )
+    stale = cu.fetchall()
+    stale_ids = [(r["id"],) for r in stale]
+    dirty: Dict[int, Set[str]] = {}
+    for r in stale:
+        dirty.setdefault(r["enterprise_id"], set()).add(r["event_date"])
+
+    # 高于高水位的新行
+    ent_filter = ""
+    if enterprise_id is not None:
+        ent_filter = "AND n.company_id = ?"
+    cu.execute(
+        f"""
+        SELECT n.* FROM company_news n
+        LEFT JOIN feature_extraction_state s
+            ON s.enterprise_id = n.company_id AND s.source_type = 'NEWS'
+        WHERE n.company_id IS NOT NULL AND n.id > COALESCE(s.last_source_id, 0) {ent_filter}
+        ORDER BY n.id
+        """,
+        params,
+    )
+    rows = cu.fetchall()
+
+    if stale_ids:
+        cu.executemany("DELETE FROM enterprise_event_feature WHERE id=?", stale_ids)
+    if rows:
+        # upsert 可能改写已有特征的日期，旧日期同样需要重算
+        new_ids = {row["id"] for row in rows}
         cu.execute(
-            """
-            INSERT INTO enterprise_event_feature (
-                enterprise_id, source_type, source_id, event_date, event_type,
-                sentiment_label, sentiment_score, severity_score,
-                policy_direction, policy_strength, biz_change_type, extra_json
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-            (
-                ev["enterprise_id"],
-                ev["source_type"],
-                ev["source_id"],
-                ev["event_date"],
-                ev["event_type"],
-                ev["sentiment_label"],
-                ev["sentiment_score"],
-                ev["severity_score"],
-                ev["policy_direction"],
-                ev["policy_strength"],
-                ev["biz_change_type"],
-                ev["extra_json"],
-            ),
+            "SELECT source_id, enterprise_id, event_date FROM enterprise_event_feature WHERE source_type='NEWS' AND source_id >= ?",
+            (rows[0]["id"],),
         )
-        count += 1
+        for r in cu.fetchall():
+            if r["source_id"] in new_ids:
+                dirty.setdefault(r["enterprise_id"], set()).add(r["event_date"])
+        events = [_map_news_to_event(row) for row in rows]
+        for ev in events:
+            dirty.setdefault(ev["enterprise_id"], set()).add(ev["event_date"])
+        cu.executemany(_UPSERT_EVENT_SQL, [_event_params(ev) for ev in events])
+        marks: Dict[int, int] = {}
+        for row in rows:
+            eid = row["company_id"]
+            marks[eid] = max(marks.get(eid, 0), row["id"])
+        _save_high_water_marks(cu, marks)
 
     conn.commit()
     conn.close()
-    return count
-
+    return {
+        "written": len(rows),
+        "deleted": len(stale_ids),
+        "dirty_dates": {eid: sorted(dates) for eid, dates in dirty.items()},
+    }
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 响应缓存（内容寻址）
+------------------------
+- 键：sha256(任务名, 提示词模板, 模型, 接口地址, 归一化后的输入)，输入相同则命中，与调用时间无关；
+  同名模型在不同服务商（base_url）下的结果互不串用
+- 存储：数据目录下独立的 SQLite 文件 llm_cache.db（WAL），不占用主库写锁
+- 淘汰：按任务 TTL 过期；条目数或总字节数超限时按最近命中时间淘汰最旧条目
+- 统计：按任务记录命中/未命中/过期次数，stats() 返回命中率
+
+设置环境变量 RISKGUARD_LLM_CACHE=0 可关闭缓存。
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+# 按任务覆盖 TTL（秒）
+TASK_TTL_SECONDS = {
+    'news_analyze': 30 * 24 * 3600,
+    'sentiment': 3 * 24 * 3600,
+    'keywords': 30 * 24 * 3600,
+}
+MAX_ENTRIES = 50000
+MAX_BYTES = 100 * 1024 * 1024
+# 每写入多少条检查一次容量，避免每次 put 都做聚合查询
+EVICT_CHECK_EVERY = 200
+
+_local = threading.local()
+_lock = threading.Lock()
+_counters = {}
+_puts_since_check = 0
+
+_WS_RE = re.compile(r'\s+')
+
+
+def enabled():
+    return os.environ.get('RISKGUARD_LLM_CACHE', '1') != '0'
+
+
+def get_cache_path():
+    data_dir = os.environ.get('RISKGUARD_DATA_DIR', '').strip() or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data'
+    )
+    return os.path.join(data_dir, 'llm_cache.db')
+
+
+CACHE_PATH = None  # 为 None 时使用 get_cache_path()，测试可覆盖
+
+
+def _conn():
+    path = CACHE_PATH or get_cache_path()
+    conn = getattr(_local, 'conn', None)
+    if conn is not None and getattr(_local, 'path', None) == path:
+        return conn
+    if conn is not None:
+        conn.close()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key TEXT PRIMARY KEY,
+            task TEXT NOT NULL,
+            value_json TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            last_hit_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_last_hit ON llm_cache (last_hit_at)')
+    conn.commit()
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+
+def normalize(text):
+    """归一化输入：None -> ''，折叠连续空白并去除首尾空白。"""
+    if text is None:
+        return ''
+    return _WS_RE.sub(' ', str(text)).strip()
+
+
+def make_key(task, template, model, *inputs, base_url=None):
+    payload = json.dumps(
+        [task, hashlib.sha256(template.encode('utf-8')).hexdigest(), model or '', (base_url or '').strip().rstrip('/'),
+         [normalize(x) for x in inputs]],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _count(task, name):
+    with _lock:
+        c = _counters.setdefault(task, {'hits': 0, 'misses': 0, 'expired': 0, 'stores': 0})
+        c[name] += 1
+
+
+def get(task, key):
+    """命中返回缓存的值（每次重新反序列化，可安全修改）；未命中或已过期返回 None。"""
+    if not enabled():
+        return None
+    try:
+        conn = _conn()
+        row = conn.execute('SELECT value_json, created_at FROM llm_cache WHERE cache_key=?', (key,)).fetchone()
+        now = time.time()
+        if row is None:
+            _count(task, 'misses')
+            return None
+        if now - row[1] > TASK_TTL_SECONDS.get(task, DEFAULT_TTL_SECONDS):
+            conn.execute('DELETE FROM llm_cache WHERE cache_key=?', (key,))
+            conn.commit()
+            _count(task, 'expired')
+            _count(task, 'misses')
+            return None
+        conn.execute('UPDATE llm_cache SET hits=hits+1, last_hit_at=? WHERE cache_key=?', (now, key))
+        conn.commit()
+        _count(task, 'hits')
+        return json.loads(row[0])
+    except Exception as e:
+        print('LLM cache read error:', e)
+        return None
+
+
+def put(task, key, value):
+    global _puts_since_check
+    if not enabled() or value is None:
+        return
+    try:
+        raw = json.dumps(value, ensure_ascii=False)
+        now = time.time()
+        conn = _conn()
+        conn.execute(
+            '''INSERT INTO llm_cache (cache_key, task, value_json, size, created_at, last_hit_at, hits)
+               VALUES (?,?,?,?,?,?,0)
+               ON CONFLICT(cache_key) DO UPDATE SET value_json=excluded.value_json, size=excluded.size,
+                   created_at=excluded.created_at, last_hit_at=excluded.last_hit_at''',
+            (key, task, raw, len(raw.encode('utf-8')), now, now),
+        )
+        conn.commit()
+        _count(task, 'stores')
+        with _lock:
+            _puts_since_check += 1
+            check = _puts_since_check >= EVICT_CHECK_EVERY
+            if check:
+                _puts_since_check = 0
+        if check:
+            evict()
+    except Exception as e:
+        print('LLM cache write error:', e)
+
+
+def evict():
+    """删除过期条目；超出 MAX_ENTRIES / MAX_BYTES 时按 last_hit_at 从旧到新淘汰。返回删除条数。"""
+    conn = _conn()
+    now = time.time()
+    deleted = 0
+    for task, ttl in TASK_TTL_SECONDS.items():
+        deleted += conn.execute('DELETE FROM llm_cache WHERE task=? AND created_at < ?', (task, now - ttl)).rowcount
+    known = list(TASK_TTL_SECONDS)
+    deleted += conn.execute(
+        'DELETE FROM llm_cache WHERE task NOT IN (%s) AND created_at < ?' % ','.join('?' * len(known)),
+        (*known, now - DEFAULT_TTL_SECONDS),
+    ).rowcount
+    count, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+    if count > MAX_ENTRIES or total > MAX_BYTES:
+        # 按最近命中时间从新到旧累计，超出上限之后的条目全部删除
+        keep_rows = min(count, MAX_ENTRIES)
+        cutoff = None
+        acc = 0
+        for i, (last_hit_at, size) in enumerate(
+            conn.execute('SELECT last_hit_at, size FROM llm_cache ORDER BY last_hit_at DESC')
+        ):
+            acc += size
+            if i >= keep_rows or acc > MAX_BYTES:
+                cutoff = last_hit_at
+                break
+        if cutoff is not None:
+            deleted += conn.execute('DELETE FROM llm_cache WHERE last_hit_at <= ?', (cutoff,)).rowcount
+    conn.commit()
+    return deleted
+
+
+def clear():
+    conn = _conn()
+    conn.execute('DELETE FROM llm_cache')
+    conn.commit()
+    reset_stats()
+
+
+def reset_stats():
+    with _lock:
+        _counters.clear()
+
+
+def stats():
+    with _lock:
+        tasks = {t: dict(c) for t, c in _counters.items()}
+    hits = sum(c['hits'] for c in tasks.values())
+    misses = sum(c['misses'] for c in tasks.values())
+    for c in tasks.values():
+        looked = c['hits'] + c['misses']
+        c['hit_rate'] = round(c['hits'] / looked, 4) if looked else None
+    out = {
+        'enabled': enabled(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        'tasks': tasks,
+    }
+    try:
+        count, total = _conn().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache').fetchone()
+        out['entries'] = count
+        out['bytes'] = total
+    except Exception:
+        pass
+    return out
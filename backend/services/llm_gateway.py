@@ -0,0 +1,510 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 网关（asyncio）
+-------------------
+所有对大模型提供方的请求经由同一个后台事件循环发出，统一做流量控制：
+- 令牌桶限流：按 (base_url, model) 各自一个桶，控制每秒请求数与突发量
+- 在途并发上限：全局信号量，限制同时进行中的请求数
+- 请求合并：完全相同的请求（key/base_url/model/消息/参数）在途时只发一次，结果共享
+- 重试：429 / 5xx / 连接超时按指数退避 + 抖动重试，优先遵循 Retry-After
+- 流式：stream() 逐段返回模型输出，上游读取在网关事件循环中完成，调用线程只从队列取数据；
+  尚未输出任何内容前的失败按上述规则重试，之后的失败直接抛给调用方
+
+同步调用方（Flask 处理线程、定时任务线程）使用 complete() / stream()；协程内使用 get_gateway().acomplete()。
+"""
+import asyncio
+import atexit
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+DEFAULT_RATE_PER_SECOND = float(os.environ.get('RISKGUARD_LLM_RPS', '2'))
+DEFAULT_BURST = int(os.environ.get('RISKGUARD_LLM_BURST', '5'))
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get('RISKGUARD_LLM_MAX_INFLIGHT', '8'))
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+# 同步等待结果的总时长上限（含排队与重试）
+DEFAULT_WAIT_TIMEOUT = 600.0
+# 流式：两段输出之间超过该秒数时向调用方返回 None（用于发送心跳）；整个流的总时长上限
+STREAM_IDLE_SECONDS = 10.0
+STREAM_MAX_SECONDS = 300.0
+
+_RETRYABLE_ERRORS = ('APIConnectionError', 'APITimeoutError', 'ConnectError', 'ReadTimeout', 'ConnectTimeout')
+
+
+def _status_of(exc):
+    status = getattr(exc, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(exc, 'response', None), 'status_code', None)
+    return status
+
+
+def _retryable(exc):
+    status = _status_of(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return type(exc).__name__ in _RETRYABLE_ERRORS
+
+
+def _retry_after(exc):
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    try:
+        value = float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, min(value, BACKOFF_MAX_SECONDS))
+
+
+def _backoff_delay(exc, attempt):
+    delay = _retry_after(exc)
+    if delay is None:
+        # 指数退避 + 全抖动，避免多个请求同时重试
+        delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+    return delay
+
+
+_STREAM_END = object()
+
+
+class LLMText(str):
+    """回复文本；usage 为提供方返回的 (prompt_tokens, completion_tokens)，未返回时为 None。"""
+    usage = None
+
+
+class StreamUsage(tuple):
+    """流式回复的用量 (prompt_tokens, completion_tokens)：streamer 在全部增量文本之后产出，网关记入遥测，不交给调用方。"""
+
+
+def _record(task, model, outcome, seconds, usage=None):
+    try:
+        from backend.services import llm_telemetry
+        llm_telemetry.record(task, model, outcome, seconds, usage)
+    except Exception:
+        pass
+
+
+class TokenBucket:
+    """令牌桶：rate 为每秒补充的令牌数，capacity 为突发上限。只在网关事件循环内使用。"""
+
+    def __init__(self, rate, capacity):
+        self.rate = max(rate, 1e-6)
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """取得一个令牌，返回等待的秒数。"""
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            delay = (1 - self.tokens) / self.rate
+            waited += delay
+            await asyncio.sleep(delay)
+
+
+def _async_client(gateway, api_key, base_url):
+    """每个 (api_key, base_url) 复用一个 AsyncOpenAI 客户端；重试由网关负责，客户端自身不重试。"""
+    from backend.services import llm_service
+
+    key = (api_key, base_url or llm_service.DEFAULT_BASE_URL)
+    client = gateway._clients.get(key)
+    if client is None:
+        import httpx
+        from openai import AsyncOpenAI
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=llm_service.LLM_POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=llm_service.LLM_POOL_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(llm_service.LLM_READ_TIMEOUT, connect=llm_service.LLM_CONNECT_TIMEOUT),
+        )
+        client = AsyncOpenAI(api_key=api_key, base_url=key[1], http_client=http_client, max_retries=0)
+        gateway._clients[key] = client
+    return client
+
+
+async def _openai_sender(gateway, api_key, base_url, model, messages, temperature, extra_body):
+    """默认发送函数。"""
+    client = _async_client(gateway, api_key, base_url)
+    kwargs = {'model': model, 'messages': messages, 'temperature': temperature}
+    if extra_body:
+        kwargs['extra_body'] = extra_body
+    resp = await client.chat.completions.create(**kwargs)
+    from backend.services import llm_telemetry
+    text = LLMText((resp.choices[0].message.content or '').strip())
+    text.usage = llm_telemetry.usage_of(resp)
+    return text
+
+
+async def _openai_streamer(gateway, api_key, base_url, model, messages, temperature, extra_body):
+    """
+    默认流式发送函数：stream=True，逐段产出增量文本。
+    请求 include_usage，提供方在最后一个（choices 为空的）分片中返回用量，结束时以 StreamUsage 产出。
+    """
+    from backend.services import llm_telemetry
+
+    client = _async_client(gateway, api_key, base_url)
+    kwargs = {'model': model, 'messages': messages, 'temperature': temperature, 'stream': True,
+              'stream_options': {'include_usage': True}}
+    if extra_body:
+        kwargs['extra_body'] = extra_body
+    stream = await client.chat.completions.create(**kwargs)
+    usage = None
+    try:
+        async for chunk in stream:
+            usage = llm_telemetry.usage_of(chunk) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                yield delta
+        if usage is not None:
+            yield StreamUsage(usage)
+    finally:
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            await close()
+
+
+class LLMGateway:
+    def __init__(self, rate=None, burst=None, max_in_flight=None, max_retries=DEFAULT_MAX_RETRIES, sender=None,
+                 streamer=None):
+        self.rate = DEFAULT_RATE_PER_SECOND if rate is None else rate
+        self.burst = DEFAULT_BURST if burst is None else burst
+        self.max_in_flight = DEFAULT_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.max_retries = max_retries
+        self._sender = sender or _openai_sender
+        self._streamer = streamer or _openai_streamer
+        self._limits = {}  # (base_url, model) -> (rate, burst)，覆盖默认限流
+        self._buckets = {}
+        self._inflight = {}
+        self._clients = {}
+        self._sem = None
+        self._loop = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0, 'coalesced': 0, 'sent': 0, 'retries': 0, 'rate_limited': 0,
+            'errors': 0, 'in_flight': 0, 'throttle_wait_seconds': 0.0, 'latency_seconds_total': 0.0,
+            'streams': 0, 'streams_cancelled': 0, 'stream_first_tokens': 0, 'first_token_seconds_total': 0.0,
+        }
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def _run():
+                asyncio.set_event_loop(loop)
+                self._sem = asyncio.Semaphore(max(1, self.max_in_flight))
+                ready.set()
+                loop.run_forever()
+
+            self._thread = threading.Thread(target=_run, name='llm-gateway', daemon=True)
+            self._thread.start()
+            ready.wait()
+            self._loop = loop
+            return loop
+
+    def shutdown(self):
+        with self._start_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+
+        async def _close():
+            for c in list(self._clients.values()):
+                try:
+                    await c.close()
+                except Exception:
+                    pass
+            self._clients.clear()
+
+        try:
+            asyncio.run_coroutine_threadsafe(_close(), loop).result(5)
+        except Exception:
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        if self._thread is not None:
+            self._thread.join(5)
+
+    # ---------- 配置与统计 ----------
+    def configure_limit(self, base_url, model, rate, burst=None):
+        """为某个 (base_url, model) 单独设置限流（每秒请求数、突发量）。"""
+        key = (base_url or '', model or '')
+        self._limits[key] = (rate, burst or self.burst)
+        self._buckets.pop(key, None)
+
+    def _bucket(self, base_url, model):
+        key = (base_url or '', model or '')
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            rate, burst = self._limits.get(key, (self.rate, self.burst))
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self._stats[name] += value
+
+    def stats(self):
+        with self._stats_lock:
+            out = dict(self._stats)
+        out['avg_latency_ms'] = round(1000.0 * out['latency_seconds_total'] / out['sent'], 1) if out['sent'] else None
+        n = out['stream_first_tokens']
+        out['avg_first_token_ms'] = round(1000.0 * out['first_token_seconds_total'] / n, 1) if n else None
+        out['rate_per_second'] = self.rate
+        out['burst'] = self.burst
+        out['max_in_flight'] = self.max_in_flight
+        return out
+
+    # ---------- 请求 ----------
+    @staticmethod
+    def request_key(api_key, base_url, model, messages, temperature, extra_body):
+        raw = json.dumps([api_key, base_url or '', model, messages, temperature, extra_body],
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    async def acomplete(self, api_key, base_url, model, messages, temperature=0.3, extra_body=None, coalesce=True,
+                        task=None, on_send=None):
+        """
+        发送一次对话补全请求，返回回复文本；失败时抛出最后一次异常。需在网关事件循环中调用。
+        coalesce=False 时不与在途的相同请求合并（对冲请求需要真正再发一次）。
+        task 为调用方的任务类型，用于遥测统计（每次真正发出的上游请求记一次，合并的请求不重复计）。
+        on_send 在请求通过限流与并发名额、首次真正发出时回调一次（合并到已发出的请求时立即回调），
+        调用方据此把排队时间排除在时延预算之外。
+        调用方被取消且没有其他等待者时，底层请求一并取消，释放并发名额。
+        """
+        self._count('requests')
+        if not coalesce:
+            return await self._send_with_retry(api_key, base_url, model, messages, temperature, extra_body, task,
+                                               on_send)
+        key = self.request_key(api_key, base_url, model, messages, temperature, extra_body)
+        entry = self._inflight.get(key)
+        if entry is None:
+            # [底层请求, 等待者数, 发出前登记的回调（发出后为 None）]
+            entry = [None, 0, []]
+
+            def _sent():
+                callbacks, entry[2] = entry[2], None
+                for cb in callbacks or ():
+                    cb()
+
+            fut = asyncio.ensure_future(
+                self._send_with_retry(api_key, base_url, model, messages, temperature, extra_body, task, _sent)
+            )
+            entry[0] = fut
+            self._inflight[key] = entry
+            fut.add_done_callback(lambda _t: self._inflight.pop(key, None))
+        else:
+            self._count('coalesced')
+        if on_send is not None:
+            if entry[2] is None:
+                on_send()
+            else:
+                entry[2].append(on_send)
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not entry[0].done():
+                entry[0].cancel()
+            raise
+        finally:
+            entry[1] -= 1
+
+    async def _send_with_retry(self, api_key, base_url, model, messages, temperature, extra_body, task=None,
+                               on_send=None):
+        attempt = 0
+        while True:
+            waited = await self._bucket(base_url, model).acquire()
+            if waited:
+                self._count('throttle_wait_seconds', waited)
+            async with self._sem:
+                if on_send is not None:
+                    on_send()
+                    on_send = None
+                self._count('in_flight')
+                t0 = time.perf_counter()
+                try:
+                    text = await self._sender(self, api_key, base_url, model, messages, temperature, extra_body)
+                    elapsed = time.perf_counter() - t0
+                    self._count('sent')
+                    self._count('latency_seconds_total', elapsed)
+                    _record(task, model, 'ok', elapsed, getattr(text, 'usage', None))
+                    return text
+                except asyncio.CancelledError:
+                    _record(task, model, 'cancelled', time.perf_counter() - t0)
+                    raise
+                except Exception as e:
+                    _record(task, model, 'error', time.perf_counter() - t0)
+                    if _status_of(e) == 429:
+                        self._count('rate_limited')
+                    if attempt >= self.max_retries or not _retryable(e):
+                        self._count('errors')
+                        raise
+                    delay = _backoff_delay(e, attempt)
+                finally:
+                    self._count('in_flight', -1)
+            attempt += 1
+            self._count('retries')
+            await asyncio.sleep(delay)
+
+    def complete(self, api_key, base_url, model, messages, temperature=0.3, extra_body=None, timeout=DEFAULT_WAIT_TIMEOUT,
+                 task=None):
+        """同步调用入口：提交到网关事件循环并等待结果。"""
+        loop = self.start()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('LLMGateway.complete 不能在网关事件循环线程中调用，请使用 acomplete')
+        fut = asyncio.run_coroutine_threadsafe(
+            self.acomplete(api_key, base_url, model, messages, temperature, extra_body, task=task), loop
+        )
+        try:
+            return fut.result(timeout)
+        except FutureTimeoutError:
+            fut.cancel()
+            raise
+
+    async def _pump_stream(self, out, api_key, base_url, model, messages, temperature, extra_body, task=None):
+        """在网关事件循环中读取上游流，增量文本逐段放入线程安全队列 out；正常结束放入 _STREAM_END，失败放入异常。"""
+        t_start = time.perf_counter()
+        emitted = False
+        usage = None
+        attempt = 0
+        try:
+            while True:
+                waited = await self._bucket(base_url, model).acquire()
+                if waited:
+                    self._count('throttle_wait_seconds', waited)
+                async with self._sem:
+                    self._count('in_flight')
+                    t0 = time.perf_counter()
+                    try:
+                        async for piece in self._streamer(self, api_key, base_url, model, messages, temperature, extra_body):
+                            if isinstance(piece, StreamUsage):
+                                usage = tuple(piece)
+                                continue
+                            if not emitted:
+                                emitted = True
+                                self._count('stream_first_tokens')
+                                self._count('first_token_seconds_total', time.perf_counter() - t_start)
+                            out.put(piece)
+                        elapsed = time.perf_counter() - t0
+                        self._count('sent')
+                        self._count('latency_seconds_total', elapsed)
+                        _record(task, model, 'ok', elapsed, usage)
+                        break
+                    except asyncio.CancelledError:
+                        _record(task, model, 'cancelled', time.perf_counter() - t0)
+                        raise
+                    except Exception as e:
+                        _record(task, model, 'error', time.perf_counter() - t0)
+                        if _status_of(e) == 429:
+                            self._count('rate_limited')
+                        # 已经输出过内容的流无法透明重试（调用方已拿到前半段）
+                        if emitted or attempt >= self.max_retries or not _retryable(e):
+                            self._count('errors')
+                            raise
+                        delay = _backoff_delay(e, attempt)
+                    finally:
+                        self._count('in_flight', -1)
+                attempt += 1
+                self._count('retries')
+                await asyncio.sleep(delay)
+            out.put(_STREAM_END)
+        except asyncio.CancelledError:
+            self._count('streams_cancelled')
+            raise
+        except Exception as e:
+            out.put(e)
+
+    def stream(self, api_key, base_url, model, messages, temperature=0.3, extra_body=None,
+               idle_timeout=STREAM_IDLE_SECONDS, max_seconds=STREAM_MAX_SECONDS, task=None):
+        """
+        同步流式入口：返回生成器，逐段产出模型输出的增量文本。
+        超过 idle_timeout 秒没有新内容时产出 None，调用方可借此发送心跳；总时长超过 max_seconds 抛出 TimeoutError。
+        生成器被提前关闭（例如客户端断开连接）时取消上游请求，释放并发名额。
+        流式请求不参与合并。
+        """
+        loop = self.start()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError('LLMGateway.stream 不能在网关事件循环线程中调用')
+        self._count('streams')
+        out = queue.Queue()
+        fut = asyncio.run_coroutine_threadsafe(
+            self._pump_stream(out, api_key, base_url, model, messages, temperature, extra_body, task), loop
+        )
+        deadline = time.monotonic() + max_seconds
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise FutureTimeoutError('LLM stream exceeded %.0fs' % max_seconds)
+                try:
+                    item = out.get(timeout=min(idle_timeout, remaining))
+                except queue.Empty:
+                    yield None
+                    continue
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            if not fut.done():
+                fut.cancel()
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = LLMGateway()
+        return _gateway
+
+
+def complete(api_key, base_url, model, messages, temperature=0.3, extra_body=None, timeout=DEFAULT_WAIT_TIMEOUT, task=None):
+    return get_gateway().complete(api_key, base_url, model, messages, temperature, extra_body, timeout, task)
+
+
+def stream(api_key, base_url, model, messages, temperature=0.3, extra_body=None,
+           idle_timeout=STREAM_IDLE_SECONDS, max_seconds=STREAM_MAX_SECONDS, task=None):
+    return get_gateway().stream(api_key, base_url, model, messages, temperature, extra_body, idle_timeout, max_seconds,
+                                task)
+
+
+def stats():
+    return get_gateway().stats()
+
+
+def shutdown():
+    global _gateway
+    with _gateway_lock:
+        gw, _gateway = _gateway, None
+    if gw is not None:
+        gw.shutdown()
+
+
+atexit.register(shutdown)
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用策略（按任务类型）
+--------------------------
+每类调用（新闻分析、工商信息、问答……）各有一条策略，在 llm_gateway 的事件循环上执行：
+- 时延预算：从主请求真正发出（通过网关限流与并发名额）时开始计，之后的重试、对冲、降级都在 budget_seconds 内，
+  超时即放弃并抛出 TimeoutError；在网关排队的时间不计入预算，但排队超过 MAX_QUEUE_SECONDS 同样放弃
+- 主/备模型：model 为空时使用用户配置的模型；fallback_model 为空时按 FALLBACK_MODELS 取同一提供方的备用模型，
+  表中没有的模型备用与主模型相同
+- 对冲：主请求耗时超过该路由近期 p95（样本不足时不对冲）仍未返回，则向备用模型再发一份，取先返回者，另一份取消
+- 降级：主请求失败后，若备用配置与主配置不同（换模型，或联网任务去掉联网），在剩余预算内再试一次
+- 指标：按任务统计调用/成功/超时/对冲/降级次数与端到端时延分位；按 (任务, 模型) 路由统计尝试次数与时延分位
+
+策略可通过环境变量 RISKGUARD_LLM_POLICY（JSON，{任务: {字段: 值}}）或 configure() 覆盖。
+"""
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# 对冲前需要的最少样本数；对冲等待时间下限（秒）
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_SECONDS = 2.0
+# 每条路由保留的最近时延样本数
+LATENCY_WINDOW = 200
+# 主请求在网关排队（限流、并发名额）的最长时间；排队不计入时延预算
+MAX_QUEUE_SECONDS = 120.0
+
+# 默认备用模型：主模型 -> 同一提供方（同一 base_url / API Key 可用）中更快、更便宜的模型
+FALLBACK_MODELS = {
+    'gpt-4o': 'gpt-4o-mini',
+    'gpt-4o-mini': 'gpt-4.1-mini',
+    'gpt-4.1': 'gpt-4.1-mini',
+    'gpt-4.1-mini': 'gpt-4o-mini',
+    'qwen3-max': 'qwen-plus',
+    'qwen-max': 'qwen-plus',
+    'qwen-plus': 'qwen-turbo',
+    'qwen-turbo': 'qwen-plus',
+    'deepseek-reasoner': 'deepseek-chat',
+}
+
+_DEFAULT = {'budget_seconds': 60.0, 'model': None, 'fallback_model': None, 'hedge': True}
+
+TASK_POLICIES = {
+    'default': {},
+    'news_analyze': {'budget_seconds': 30.0},
+    'news_batch': {'budget_seconds': 60.0},
+    'sentiment': {'budget_seconds': 30.0},
+    'keywords': {'budget_seconds': 20.0},
+    'doc_analyze': {'budget_seconds': 45.0},
+    'supplement': {'budget_seconds': 45.0},
+    'ask': {'budget_seconds': 60.0},
+    # 联网搜索类：耗时长、费用高，不对冲；失败时去掉联网再试
+    'company_info': {'budget_seconds': 90.0, 'hedge': False},
+    'news_search': {'budget_seconds': 90.0, 'hedge': False},
+    'macro_policy': {'budget_seconds': 120.0, 'hedge': False},
+}
+
+
+def _load_env_overrides():
+    raw = os.environ.get('RISKGUARD_LLM_POLICY', '').strip()
+    if not raw:
+        return
+    try:
+        overrides = json.loads(raw)
+    except ValueError as e:
+        print('[LLM policy] RISKGUARD_LLM_POLICY 不是合法 JSON:', e)
+        return
+    for task, fields in (overrides or {}).items():
+        if isinstance(fields, dict):
+            TASK_POLICIES.setdefault(task, {}).update(fields)
+
+
+_load_env_overrides()
+
+
+def configure(task, **fields):
+    """覆盖某类任务的策略字段（budget_seconds / model / fallback_model / hedge）。"""
+    TASK_POLICIES.setdefault(task, {}).update(fields)
+
+
+def secondary_model(policy, primary_model):
+    """备用模型：策略指定的 fallback_model，否则查 FALLBACK_MODELS，都没有时与主模型相同。"""
+    return policy['fallback_model'] or FALLBACK_MODELS.get(primary_model) or primary_model
+
+
+def get_policy(task):
+    policy = dict(_DEFAULT)
+    policy.update(TASK_POLICIES.get(task) or TASK_POLICIES.get('default') or {})
+    return policy
+
+
+# ---------- 指标 ----------
+def _percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tasks = {}
+        self.routes = {}
+
+    def _task(self, task):
+        t = self.tasks.get(task)
+        if t is None:
+            t = self.tasks[task] = {'calls': 0, 'ok': 0, 'failed': 0, 'timeouts': 0, 'hedges': 0,
+                                    'hedge_wins': 0, 'fallbacks': 0, 'fallback_wins': 0,
+                                    'latency': deque(maxlen=LATENCY_WINDOW)}
+        return t
+
+    def _route(self, task, model):
+        key = (task, model)
+        r = self.routes.get(key)
+        if r is None:
+            r = self.routes[key] = {'attempts': 0, 'ok': 0, 'errors': 0, 'cancelled': 0,
+                                    'latency': deque(maxlen=LATENCY_WINDOW)}
+        return r
+
+    def count(self, task, name):
+        with self._lock:
+            self._task(task)[name] += 1
+
+    def finish(self, task, ok, elapsed):
+        with self._lock:
+            t = self._task(task)
+            t['calls'] += 1
+            t['ok' if ok else 'failed'] += 1
+            if ok:
+                t['latency'].append(elapsed)
+
+    def attempt(self, task, model, outcome, elapsed=None):
+        with self._lock:
+            r = self._route(task, model)
+            r['attempts'] += 1
+            r[outcome] += 1
+            if outcome == 'ok' and elapsed is not None:
+                r['latency'].append(elapsed)
+
+    def hedge_delay(self, task, model):
+        with self._lock:
+            samples = list(self._route(task, model)['latency'])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_SECONDS, _percentile(samples, 0.95))
+
+    def snapshot(self):
+        def _ms(v):
+            return round(v * 1000.0, 1) if v is not None else None
+
+        with self._lock:
+            tasks = {}
+            for name, t in self.tasks.items():
+                lat = list(t['latency'])
+                out = {k: v for k, v in t.items() if k != 'latency'}
+                out['p50_ms'] = _ms(_percentile(lat, 0.5))
+                out['p95_ms'] = _ms(_percentile(lat, 0.95))
+                tasks[name] = out
+            routes = {}
+            for (task, model), r in self.routes.items():
+                lat = list(r['latency'])
+                out = {k: v for k, v in r.items() if k != 'latency'}
+                out['p50_ms'] = _ms(_percentile(lat, 0.5))
+                out['p95_ms'] = _ms(_percentile(lat, 0.95))
+                routes['%s/%s' % (task, model)] = out
+        return {'tasks': tasks, 'routes': routes}
+
+    def reset(self):
+        with self._lock:
+            self.tasks.clear()
+            self.routes.clear()
+
+
+metrics = _Metrics()
+
+
+def stats():
+    out = metrics.snapshot()
+    out['policies'] = {task: get_policy(task) for task in TASK_POLICIES}
+    return out
+
+
+# ---------- 执行 ----------
+async def _attempt(gw, task, model, enable_search, api_key, base_url, messages, temperature, coalesce, on_send=None):
+    sent = [time.monotonic()]
+
+    def _sent():
+        # 路由时延从请求发出时计，与对冲等待的起点一致
+        sent[0] = time.monotonic()
+        if on_send is not None:
+            on_send()
+
+    extra_body = {'enable_search': True} if enable_search else None
+    try:
+        text = await gw.acomplete(api_key, base_url, model, messages, temperature, extra_body, coalesce=coalesce,
+                                  task=task, on_send=_sent)
+    except asyncio.CancelledError:
+        metrics.attempt(task, model, 'cancelled')
+        raise
+    except Exception:
+        metrics.attempt(task, model, 'errors')
+        raise
+    metrics.attempt(task, model, 'ok', time.monotonic() - sent[0])
+    return text
+
+
+async def arun(gw, task, messages, api_key, base_url, model, enable_search=False, temperature=0.3):
+    """
+    在网关事件循环中按策略执行一次调用，返回回复文本。
+    预算耗尽或排队超时抛出 TimeoutError，全部失败抛出最后一个异常。
+    """
+    policy = get_policy(task)
+    primary_model = policy['model'] or model
+    backup_model = secondary_model(policy, primary_model)
+    budget = float(policy['budget_seconds'])
+    start = time.monotonic()
+    hedge_delay = metrics.hedge_delay(task, primary_model) if policy['hedge'] else None
+    # 主请求失败后的降级配置：与主配置不同才有意义
+    fallback = (backup_model, False)
+    can_fallback = fallback != (primary_model, bool(enable_search))
+    # 主请求发出的时刻：预算与对冲等待都从这里开始计
+    sent_at = []
+    sent = asyncio.Event()
+
+    def on_send():
+        if not sent_at:
+            sent_at.append(time.monotonic())
+            sent.set()
+
+    def launch(model_name, search, coalesce=True, notify=None):
+        return asyncio.ensure_future(
+            _attempt(gw, task, model_name, search, api_key, base_url, messages, temperature, coalesce, notify)
+        )
+
+    first = launch(primary_model, enable_search, notify=on_send)
+    sent_waiter = asyncio.ensure_future(sent.wait())
+    pending = {first}
+    kinds = {first: 'primary'}
+    hedged = False
+    last_exc = None
+    deadline = start + MAX_QUEUE_SECONDS
+    try:
+        while pending:
+            now = time.monotonic()
+            watch = set(pending)
+            if sent_at:
+                deadline = sent_at[0] + budget
+            else:
+                watch.add(sent_waiter)
+            remaining = deadline - now
+            if remaining <= 0:
+                break
+            wait = remaining
+            if sent_at and hedge_delay is not None and not hedged:
+                wait = min(wait, max(0.0, sent_at[0] + hedge_delay - now))
+            done, _ = await asyncio.wait(watch, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+            # 只是主请求刚发出：回到循环开头按预算重新计算截止时间
+            just_sent = sent_waiter in done
+            done.discard(sent_waiter)
+            pending -= done
+            for t in done:
+                if t.exception() is None:
+                    kind = kinds[t]
+                    if kind == 'hedge':
+                        metrics.count(task, 'hedge_wins')
+                    elif kind == 'fallback':
+                        metrics.count(task, 'fallback_wins')
+                    metrics.finish(task, True, time.monotonic() - start)
+                    return t.result()
+                last_exc = t.exception()
+            if just_sent and not done:
+                continue
+            if not done and hedge_delay is not None and not hedged and time.monotonic() < deadline:
+                # 主请求发出后超过 p95 仍未返回：对冲到备用模型（不与在途请求合并）
+                hedged = True
+                metrics.count(task, 'hedges')
+                h = launch(backup_model, enable_search, coalesce=False)
+                kinds[h] = 'hedge'
+                pending.add(h)
+                if (backup_model, enable_search) == fallback:
+                    can_fallback = False
+                continue
+            if done and not pending and can_fallback and time.monotonic() < deadline:
+                can_fallback = False
+                metrics.count(task, 'fallbacks')
+                f = launch(*fallback)
+                kinds[f] = 'fallback'
+                pending.add(f)
+    finally:
+        sent_waiter.cancel()
+        for t in pending:
+            t.cancel()
+    metrics.finish(task, False, time.monotonic() - start)
+    if pending or last_exc is None:
+        metrics.count(task, 'timeouts')
+        if not sent_at:
+            raise TimeoutError('LLM task %s queued longer than %.0fs' % (task, MAX_QUEUE_SECONDS))
+        raise TimeoutError('LLM task %s exceeded %.0fs budget' % (task, budget))
+    raise last_exc
+
+
+def run(task, messages, api_key, base_url, model, enable_search=False, temperature=0.3, gateway=None):
+    """同步入口：在网关事件循环上执行 arun()，调用线程最多阻塞排队上限加该任务的时延预算。"""
+    from backend.services import llm_gateway
+    gw = gateway or llm_gateway.get_gateway()
+    loop = gw.start()
+    budget = float(get_policy(task)['budget_seconds'])
+    fut = asyncio.run_coroutine_threadsafe(
+        arun(gw, task, messages, api_key, base_url, model, enable_search, temperature), loop
+    )
+    try:
+        # 协程内部已按排队上限与预算退出，这里多留一点余量
+        return fut.result(MAX_QUEUE_SECONDS + budget + 5)
+    except llm_gateway.FutureTimeoutError:
+        if fut.done():
+            raise  # arun() 自身的超时（预算耗尽或排队超时），保留原消息
+        fut.cancel()
+        raise TimeoutError('LLM task %s exceeded %.0fs budget' % (task, budget))
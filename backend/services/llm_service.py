@@ -9,6 +9,8 @@ LLM 服务：接入 OpenAI 及兼容 API
 import os
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 # 中英字段名映射：LLM 可能返回中文 key
@@ -47,7 +49,7 @@ PROMPT_KEYWORDS = """从以下文本中提取 5-15 个与"{company_name}"相关
 文本：
 {text}
 
-请以 JSON 格式回复：{"keywords": ["词1", "词2", ...]}
+请以 JSON 格式回复：{{"keywords": ["词1", "词2", ...]}}
 只输出 JSON。"""
 
 PROMPT_COMPANY_INFO = """请根据企业名称"{company_name}"，基于你的知识库整理该企业的公开信息（如已知），以 JSON 格式输出：
@@ -143,27 +145,24 @@ PROMPT_MACRO_POLICY = """请联网搜索并整理「国内及国际近期与商
 }
 content 建议 400-1000 字。"""
 
-# 多维度政策与市场新闻：每条单独一条，范围扩大至宏观、国际、流动性、行业景气等
-PROMPT_MACRO_POLICY_NEWS = """请联网搜索国内及国际近期与「政策、监管、金融、产业、合规、市场环境、宏观、国际」相关的多条新闻或动态。
+MACRO_DIMENSIONS = ('政策', '监管', '金融', '产业', '合规', '市场环境', '宏观', '国际')
+
+# 单维度政策与市场新闻：各维度分别联网搜索、并发请求，单次回复更短、更快
+PROMPT_MACRO_POLICY_NEWS_DIMENSION = """请联网搜索国内及国际近期与「{dimension}」维度相关的新闻或动态（政策文件、监管动态、重要会议、宏观数据、国际形势等与该维度相关者）。
 
 要求：
-1. 从多维度分别搜集：监管政策、金融动态、产业政策、合规要求、市场环境、宏观形势（如利率、流动性、景气指数）、国际局势与跨境政策等，每个维度可有多条。
-2. 每条新闻单独一条，不要合并成一份时间跨度总结。每条包含：标题、简明内容/摘要、来源、所属维度。
-3. 至少返回 8 条、最多 30 条。每条内容 80-200 字。
-4. 严格只输出 JSON，不要其他文字，格式如下：
-{
+1. 每条新闻单独一条，不要合并成总结。每条包含：标题、简明内容/摘要、来源。
+2. 返回 2-5 条，每条内容 80-200 字。
+3. 严格只输出 JSON，不要其他文字，格式如下：
+{{
   "items": [
-    { "title": "新闻标题", "content": "该条新闻的简明摘要或要点", "source": "来源名称或网站", "dimension": "政策|监管|金融|产业|合规|市场环境|宏观|国际" },
-    ...
+    {{ "title": "新闻标题", "content": "该条新闻的简明摘要或要点", "source": "来源名称或网站" }}
   ]
-}}
-dimension 只能是：政策、监管、金融、产业、合规、市场环境、宏观、国际 之一。"""
+}}"""
 
 
-def generate_macro_policy_news_items(api_key=None, base_url=None, model=None, enable_web_search=True):
-    """联网搜索多维度政策与市场新闻，每条单独返回。返回 [{"title","content","source","dimension"}, ...] 或 []"""
-    prompt = PROMPT_MACRO_POLICY_NEWS
-    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search)
+def _macro_news_items(result, dimension=None):
+    """解析政策新闻回复为 [{"title","content","source","dimension"}, ...]；dimension 不为空时统一归入该维度。"""
     if not result or not isinstance(result, dict):
         return []
     items = result.get('items') or result.get('list') or []
@@ -176,17 +175,48 @@ def generate_macro_policy_news_items(api_key=None, base_url=None, model=None, en
         if not title and not content:
             continue
         source = (x.get('source') or x.get('来源') or '').strip()
-        dimension = (x.get('dimension') or x.get('维度') or '政策').strip()
-        if dimension not in ('政策', '监管', '金融', '产业', '合规', '市场环境', '宏观', '国际'):
-            dimension = '政策'
-        out.append({'title': title or '政策动态', 'content': content, 'source': source, 'dimension': dimension})
+        dim = dimension or (x.get('dimension') or x.get('维度') or '政策').strip()
+        if dim not in MACRO_DIMENSIONS:
+            dim = '政策'
+        out.append({'title': title or '政策动态', 'content': content, 'source': source, 'dimension': dim})
+    return out
+
+
+def generate_macro_policy_news_by_dimension(api_key=None, base_url=None, model=None, enable_web_search=True,
+                                            dimensions=None):
+    """
+    按维度并发联网搜索政策与市场新闻（每个维度一次请求，经网关统一限流），按维度顺序合并、按标题去重。
+    某个维度失败只少该维度的条目；全部失败返回 []。
+    """
+    dims = list(dimensions or MACRO_DIMENSIONS)
+    if not dims:
+        return []
+
+    def _one(dim):
+        prompt = PROMPT_MACRO_POLICY_NEWS_DIMENSION.format(dimension=dim)
+        try:
+            result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search, task='macro_policy')
+        except Exception as e:
+            print('[LLM] macro policy dimension %s error: %s' % (dim, e))
+            return []
+        return _macro_news_items(result, dimension=dim)
+
+    with ThreadPoolExecutor(max_workers=len(dims)) as pool:
+        per_dim = list(pool.map(_one, dims))
+    out, seen = [], set()
+    for items in per_dim:
+        for it in items:
+            if it['title'] in seen:
+                continue
+            seen.add(it['title'])
+            out.append(it)
     return out
 
 
 def generate_macro_policy_digest(api_key=None, base_url=None, model=None, enable_web_search=True):
     """生成宏观政策摘要，使用联网搜索获取最新信息。返回 {"title": str, "content": str} 或 None"""
     prompt = PROMPT_MACRO_POLICY
-    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search)
+    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search, task='macro_policy')
     if result and isinstance(result, dict):
         title = result.get('title') or result.get('标题') or '宏观政策与市场环境摘要'
         content = result.get('content') or result.get('正文') or result.get('content_text') or ''
@@ -195,67 +225,57 @@ def generate_macro_policy_digest(api_key=None, base_url=None, model=None, enable
     return None
 
 
-def call_llm(prompt, api_key=None, base_url=None, model='gpt-4o-mini', enable_search=False):
-    """调用 OpenAI 或兼容 API。enable_search=True 时传 extra_body（通义千问 qwen3-max 等支持联网搜索）"""
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+# LLM 网关（llm_gateway）按 (api_key, base_url) 复用的 AsyncOpenAI 客户端的连接参数
+LLM_POOL_MAX_CONNECTIONS = int(os.environ.get('RISKGUARD_LLM_POOL_SIZE', '20'))
+LLM_CONNECT_TIMEOUT = 10.0
+LLM_READ_TIMEOUT = 120.0  # 联网搜索类调用耗时较长
+
+
+def call_llm(prompt, api_key=None, base_url=None, model='gpt-4o-mini', enable_search=False, task='default'):
+    """
+    调用 OpenAI 或兼容 API。enable_search=True 时传 extra_body（通义千问 qwen3-max 等支持联网搜索）。
+    按 task 对应的 llm_policy 策略执行：时延预算、主/备模型、p95 对冲；联网失败时在预算内去掉联网再试。
+    请求经 llm_gateway 统一限流、控制并发、合并相同请求并在 429/5xx 时重试。
+    """
     if not api_key:
         return None
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key, base_url=base_url or 'https://api.openai.com/v1')
-        kwargs = {
-            'model': model or 'gpt-4o-mini',
-            'messages': [{'role': 'user', 'content': prompt}],
-            'temperature': 0.3
-        }
-        if enable_search:
-            kwargs['extra_body'] = {'enable_search': True}
-        resp = client.chat.completions.create(**kwargs)
-        text = resp.choices[0].message.content.strip()
-        # 尝试解析 JSON：支持 ```json ... ``` 或前后带说明文字
-        parsed = _extract_json_from_text(text)
-        if parsed is not None:
-            return parsed
-        if text.startswith('```'):
-            text = text.split('```')[1]
-            if text.startswith('json'):
-                text = text[4:].strip()
-        try:
-            return json.loads(text)
-        except json.JSONDecodeError:
-            return None
+        from backend.services import llm_policy
+        text = llm_policy.run(
+            task, [{'role': 'user', 'content': prompt}], api_key, base_url, model or 'gpt-4o-mini',
+            enable_search=enable_search, temperature=0.3,
+        )
     except Exception as e:
-        print('LLM call error:', e)
-        # 若 enable_search 失败，部分模型（如 qwen-plus）不支持联网，尝试不带 enable_search 重试
-        if enable_search:
-            try:
-                from openai import OpenAI
-                c = OpenAI(api_key=api_key, base_url=base_url or 'https://api.openai.com/v1')
-                kwargs2 = {
-                    'model': model or 'gpt-4o-mini',
-                    'messages': [{'role': 'user', 'content': prompt}],
-                    'temperature': 0.3
-                }
-                resp = c.chat.completions.create(**kwargs2)
-                text = resp.choices[0].message.content.strip()
-                parsed = _extract_json_from_text(text)
-                if parsed is not None:
-                    print('LLM retry without enable_search succeeded (model may not support web search)')
-                    return parsed
-                if text.startswith('```'):
-                    text = text.split('```')[1]
-                    if text.startswith('json'):
-                        text = text[4:].strip()
-                return json.loads(text)
-            except Exception as e2:
-                print('LLM retry error:', e2)
+        print('LLM call error (%s):' % task, e)
         return None
+    return _extract_json_from_text(text)
+
+
+def _call_llm_cached(task, template, inputs, prompt, api_key=None, base_url=None, model=None):
+    """
+    带内容寻址缓存的 call_llm：键为 (task, 模板, 模型, base_url, 归一化输入) 的哈希。
+    只缓存成功解析的结果；未配置 API Key 时不读写缓存。
+    """
+    if not api_key:
+        return call_llm(prompt, api_key, base_url, model, task=task)
+    from backend.services import llm_cache
+    key = llm_cache.make_key(task, template, model or 'gpt-4o-mini', *inputs, base_url=base_url or DEFAULT_BASE_URL)
+    cached = llm_cache.get(task, key)
+    if cached is not None:
+        return cached
+    result = call_llm(prompt, api_key, base_url, model, task=task)
+    if result:
+        llm_cache.put(task, key, result)
+    return result
 
 
 def analyze_sentiment_and_keywords(company_name, reviews_text, api_key=None, base_url=None, model=None):
     """分析媒体舆情，返回情绪分数、摘要、关键词"""
     text = (reviews_text or '')[:3000] or '无'
     prompt = PROMPT_SENTIMENT.format(company_name=company_name) + "\n\n评论内容：\n" + text
-    result = call_llm(prompt, api_key, base_url, model)
+    result = _call_llm_cached('sentiment', PROMPT_SENTIMENT, (company_name, text), prompt, api_key, base_url, model)
     if result:
         return result
     return {
@@ -268,40 +288,128 @@ def analyze_sentiment_and_keywords(company_name, reviews_text, api_key=None, bas
 
 def extract_keywords(company_name, text, api_key=None, base_url=None, model=None):
     """从文本提取关键词"""
-    prompt = PROMPT_KEYWORDS.format(company_name=company_name, text=((text or '')[:2000] or ''))
-    result = call_llm(prompt, api_key, base_url, model)
+    text = (text or '')[:2000] or ''
+    prompt = PROMPT_KEYWORDS.format(company_name=company_name, text=text)
+    result = _call_llm_cached('keywords', PROMPT_KEYWORDS, (company_name, text), prompt, api_key, base_url, model)
     if result and 'keywords' in result:
         return result['keywords']
     return []
 
 
+# JSON 提取：预编译模式，C 实现的 raw_decode 负责常见形态；只有格式有瑕疵时才做括号匹配修复
+_JSON_DECODER = json.JSONDecoder()
+_JSON_OBJECT_START_RE = re.compile(r'\{')
+# 字符串整体跳过，只在字符串外匹配括号
+_JSON_SCAN_RE = re.compile(r'"(?:[^"\\]|\\.)*"|[{}\[\]]')
+# 尾随逗号（跳过字符串内容）：",}" / ",]"
+_JSON_TRAILING_COMMA_RE = re.compile(r'("(?:[^"\\]|\\.)*")|,\s*([}\]])')
+_CODE_FENCE_OPEN_RE = re.compile(r'```(?:json)?\s*', re.IGNORECASE)
+# 从前往后按括号配对截取的候选对象数上限，避免病态输入退化为平方复杂度；超出后走代码块 / 最后一个对象的兜底
+_JSON_MAX_CANDIDATES = 8
+# 兜底时只尝试可能是对象开头的 '{'（后接键名或直接闭合），从后往前最多尝试的个数
+_JSON_KEYED_OBJECT_RE = re.compile(r'\{\s*["}]')
+_JSON_MAX_FALLBACK_CANDIDATES = 256
+
+
+def _balanced_end(text, start):
+    """从 text[start] 处的 '{' 开始做括号匹配，返回与之配对的 '}' 之后的下标；不完整时返回 -1。"""
+    depth = 0
+    for m in _JSON_SCAN_RE.finditer(text, start):
+        ch = m.group(0)
+        if ch[0] == '"':
+            continue
+        if ch in '{[':
+            depth += 1
+        else:
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    return -1
+
+
+def _drop_trailing_commas(raw):
+    return _JSON_TRAILING_COMMA_RE.sub(lambda m: m.group(1) or m.group(2), raw)
+
+
+def _fenced_json(text):
+    """依次解析回复中的 ```json 代码块（内容以 { 或 [ 开头），允许尾随逗号；都不是 JSON 时返回 None。"""
+    pos = 0
+    while True:
+        m = _CODE_FENCE_OPEN_RE.search(text, pos)
+        if not m:
+            return None
+        close = text.find('```', m.end())
+        if close < 0:
+            return None
+        body = text[m.end():close].strip()
+        if body[:1] in ('{', '['):
+            try:
+                return json.loads(_drop_trailing_commas(body))
+            except ValueError:
+                pass
+        pos = close + 3
+
+
+def _last_json_object(text):
+    """
+    从后往前尝试可能是对象开头的 '{'，返回结束位置最靠后的对象，即最后一个最外层对象（内层对象结束得更早）。
+    解析失败时构造异常要计算行列号（与位置成正比），因此先用正则排除说明文字中的 '{'，并限制尝试个数。
+    """
+    starts = [m.start() for m in _JSON_KEYED_OBJECT_RE.finditer(text)]
+    best, best_end = None, -1
+    for pos in reversed(starts[-_JSON_MAX_FALLBACK_CANDIDATES:]):
+        try:
+            obj, end = _JSON_DECODER.raw_decode(text, pos)
+        except (ValueError, RecursionError):
+            continue
+        if end > best_end:
+            best, best_end = obj, end
+    return best
+
+
 def _extract_json_from_text(text):
-    """从可能包含前后文字的回复中提取 JSON 对象"""
+    """
+    从可能包含 ```json 代码块、前后说明文字的回复中提取 JSON。
+    - 整体（去掉代码块标记后）就是 JSON 时直接解析，支持数组
+    - 否则依次从每个 '{' 处解析一个对象，忽略其后的文字；解析失败时按括号配对截取并去掉尾随逗号再试
+    - 前 _JSON_MAX_CANDIDATES 个候选都失败（如正文前有大量说明用的花括号）时，
+      依次取 ```json 代码块、最后一个最外层对象
+    """
     if not text or not isinstance(text, str):
         return None
     text = text.strip()
-    # 先尝试 ```json ... ``` 块
-    m = re.search(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', text)
-    if m:
+    body = text
+    if body.startswith('```'):
+        body = body[_CODE_FENCE_OPEN_RE.match(body).end():]
+        if body.endswith('```'):
+            body = body[:-3]
+    if body[:1] in ('{', '['):
         try:
-            return json.loads(m.group(1))
-        except json.JSONDecodeError:
+            return json.loads(body)
+        except ValueError:
             pass
-    # 尝试直接找第一个 { ... }
-    m = re.search(r'\{[\s\S]*\}', text)
-    if m:
-        raw = m.group(0)
-        # 去除可能的尾随逗号
-        raw = re.sub(r',\s*}', '}', raw)
-        raw = re.sub(r',\s*]', ']', raw)
+    pos = 0
+    for _ in range(_JSON_MAX_CANDIDATES):
+        m = _JSON_OBJECT_START_RE.search(text, pos)
+        if not m:
+            break
+        start = m.start()
         try:
-            return json.loads(raw)
-        except json.JSONDecodeError:
+            return _JSON_DECODER.raw_decode(text, start)[0]
+        except ValueError:
             pass
-    try:
-        return json.loads(text)
-    except json.JSONDecodeError:
-        return None
+        end = _balanced_end(text, start)
+        if end >= 0:
+            try:
+                return json.loads(_drop_trailing_commas(text[start:end]))
+            except ValueError:
+                pass
+        pos = start + 1
+    else:
+        if _JSON_OBJECT_START_RE.search(text, pos):
+            found = _fenced_json(text)
+            return found if found is not None else _last_json_object(text)
+    return None
 
 
 def _normalize_company_info(raw):
@@ -341,7 +449,7 @@ def _normalize_company_info(raw):
 def fetch_company_info_by_llm(company_name, api_key=None, base_url=None, model=None, enable_web_search=False):
     """通过 LLM 整理企业公开信息。enable_web_search=True 时使用联网搜索（通义千问等）"""
     prompt = (PROMPT_COMPANY_INFO_WEB if enable_web_search else PROMPT_COMPANY_INFO).format(company_name=company_name)
-    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search)
+    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search, task='company_info')
     if result and isinstance(result, dict):
         return _normalize_company_info(result)
     # call_llm 可能返回解析后的 dict，若失败则 result 为 None；若返回的是 str 则再尝试提取
@@ -351,7 +459,7 @@ def fetch_company_info_by_llm(company_name, api_key=None, base_url=None, model=N
 def search_company_news(company_name, api_key=None, base_url=None, model=None, enable_web_search=False):
     """联网搜索企业近期相关新闻，整理后返回"""
     prompt = PROMPT_NEWS_SEARCH.format(company_name=company_name)
-    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search)
+    result = call_llm(prompt, api_key, base_url, model, enable_search=enable_web_search, task='news_search')
     if result and isinstance(result, dict) and 'news' in result:
         return result.get('news', [])
     return []
@@ -359,8 +467,11 @@ def search_company_news(company_name, api_key=None, base_url=None, model=None, e
 
 def analyze_news_for_company(company_name, title, content, api_key=None, base_url=None, model=None):
     """分析新闻是否与企业相关，并量化情感与风险（含统一多维度）"""
-    prompt = PROMPT_NEWS_ANALYZE.format(company_name=company_name, title=title or '', content=(content or '')[:1500])
-    result = call_llm(prompt, api_key, base_url, model)
+    content = (content or '')[:1500]
+    prompt = PROMPT_NEWS_ANALYZE.format(company_name=company_name, title=title or '', content=content)
+    result = _call_llm_cached(
+        'news_analyze', PROMPT_NEWS_ANALYZE, (company_name, title, content), prompt, api_key, base_url, model
+    )
     if result:
         _ensure_risk_dimensions(result)
         return result
@@ -380,6 +491,108 @@ def _ensure_risk_dimensions(obj):
                 rd[k] = rd.get(k) or '中'
 
 
+# 批量新闻分析：一次请求分析同一企业的多条新闻
+NEWS_BATCH_SIZE = 10
+
+PROMPT_NEWS_BATCH_ANALYZE = """逐条分析以下关于"{company_name}"的新闻/资讯，判断每条是否与该企业相关，并按统一标准量化情感与风险。
+
+{items_text}
+
+以 JSON 格式回复，items 数组中每条新闻对应一个对象，id 与上面的编号一致，不得遗漏或合并（各风险维度仅填 低/中/高）：
+{{
+  "items": [
+    {{
+      "id": 0,
+      "related": true/false,
+      "sentiment_score": -1到1,
+      "category": "法律/财务/经营/舆情/其他",
+      "risk_level": "低/中/高",
+      "risk_dimensions": {{
+        "legal_risk": "低/中/高",
+        "financial_risk": "低/中/高",
+        "operational_risk": "低/中/高",
+        "reputation_risk": "低/中/高"
+      }},
+      "confidence": "低/中/高",
+      "keywords": ["词1", "词2"]
+    }}
+  ]
+}}
+只输出 JSON。"""
+
+
+def _valid_news_analysis(obj):
+    """批量结果中的单条是否可用：需有数值型 sentiment_score 与合法 risk_level。"""
+    if not isinstance(obj, dict) or obj.get('risk_level') not in ('低', '中', '高'):
+        return False
+    try:
+        float(obj.get('sentiment_score'))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def analyze_news_batch_for_company(company_name, items, api_key=None, base_url=None, model=None, batch_size=None):
+    """
+    批量版 analyze_news_for_company：items 为 [{"title", "content"}, ...]，返回等长的分析结果列表。
+    - 已缓存的条目直接返回；其余每 batch_size 条合并为一次请求，返回 items 数组后逐条校验
+    - 缺失或无法解析的条目回退为单条调用
+    """
+    if not items:
+        return []
+    if not api_key:
+        return [analyze_news_for_company(company_name, it.get('title'), it.get('content'), api_key, base_url, model)
+                for it in items]
+    from backend.services import llm_cache
+
+    model_key = model or 'gpt-4o-mini'
+    results = [None] * len(items)
+    normalized = []
+    pending = []
+    for i, it in enumerate(items):
+        title, content = it.get('title') or '', (it.get('content') or '')[:1500]
+        key = llm_cache.make_key('news_analyze', PROMPT_NEWS_ANALYZE, model_key, company_name, title, content,
+                                 base_url=base_url or DEFAULT_BASE_URL)
+        normalized.append((title, content, key))
+        cached = llm_cache.get('news_analyze', key)
+        if cached:
+            _ensure_risk_dimensions(cached)
+            results[i] = cached
+        else:
+            pending.append(i)
+
+    size = max(1, batch_size or NEWS_BATCH_SIZE)
+    for start in range(0, len(pending), size):
+        chunk = pending[start:start + size]
+        if len(chunk) == 1:
+            continue
+        items_text = '\n\n'.join(
+            '[%d]\n标题：%s\n内容：%s' % (j, normalized[i][0], normalized[i][1]) for j, i in enumerate(chunk)
+        )
+        prompt = PROMPT_NEWS_BATCH_ANALYZE.format(company_name=company_name, items_text=items_text)
+        result = call_llm(prompt, api_key, base_url, model, task='news_batch')
+        entries = result.get('items') if isinstance(result, dict) else None
+        for entry in entries if isinstance(entries, list) else []:
+            if not isinstance(entry, dict):
+                continue
+            try:
+                j = int(entry.get('id'))
+            except (TypeError, ValueError):
+                continue
+            if not 0 <= j < len(chunk) or results[chunk[j]] is not None or not _valid_news_analysis(entry):
+                continue
+            entry = dict(entry)
+            entry.pop('id', None)
+            _ensure_risk_dimensions(entry)
+            results[chunk[j]] = entry
+            llm_cache.put('news_analyze', normalized[chunk[j]][2], entry)
+
+    for i, it in enumerate(items):
+        if results[i] is None:
+            results[i] = analyze_news_for_company(company_name, it.get('title'), it.get('content'), api_key, base_url, model)
+    return results
+
+
 PROMPT_DOC_LINK_ANALYZE = """根据以下文档/链接内容，判断其与哪些企业相关，并按统一标准量化情感与风险。
 标题：{title}
 内容（摘要）：{content}
@@ -409,7 +622,7 @@ def analyze_document_or_link_for_company(title, content, companies_list, api_key
         content=(content or '')[:2500],
         companies_str=companies_str
     )
-    result = call_llm(prompt, api_key, base_url, model)
+    result = call_llm(prompt, api_key, base_url, model, task='doc_analyze')
     if result:
         _ensure_risk_dimensions(result)
         return result
@@ -449,25 +662,29 @@ PROMPT_SUPPLEMENT = """你是企业尽调助手。用户（客户经理）正在
 updates 中只包含用户确实提到的字段；summary 为一句话，便于界面展示。"""
 
 
-def process_supplement_chat(company_name, company_summary, user_input, api_key=None, base_url=None, model=None):
-    """处理尽调补充对话：从用户输入中提取结构化更新与摘要"""
+def _supplement_prompt(company_name, company_summary, user_input):
     summary = (company_summary or '')[:1500]
-    prompt = PROMPT_SUPPLEMENT.format(
+    return PROMPT_SUPPLEMENT.format(
         company_name=company_name,
         company_summary=summary or '（暂无）',
         user_input=(user_input or '').strip()[:2000]
     )
-    result = call_llm(prompt, api_key, base_url, model)
+
+
+SUPPLEMENT_FALLBACK = {'updates': {}, 'summary': '未能解析，请重试或检查 LLM 配置。'}
+
+
+def process_supplement_chat(company_name, company_summary, user_input, api_key=None, base_url=None, model=None):
+    """处理尽调补充对话：从用户输入中提取结构化更新与摘要"""
+    prompt = _supplement_prompt(company_name, company_summary, user_input)
+    result = call_llm(prompt, api_key, base_url, model, task='supplement')
     if result and isinstance(result, dict):
         return result
-    return {'updates': {}, 'summary': '未能解析，请重试或检查 LLM 配置。'}
+    return dict(SUPPLEMENT_FALLBACK)
 
 
-def ask_company_question(company_name, context_text, question, api_key=None, base_url=None, model=None):
-    """基于企业上下文回答用户问题（RAG-lite：无向量库，直接拼接上下文）。返回 {"answer": "..."}"""
-    if not api_key or not (question or '').strip():
-        return {'answer': '请配置 LLM 并输入问题。'}
-    prompt = f"""你是一个企业风控与尽调助手。请仅根据以下「企业相关信息」回答用户问题。若信息中无法得出答案，请如实说明。
+def _ask_prompt(context_text, question):
+    return f"""你是一个企业风控与尽调助手。请仅根据以下「企业相关信息」回答用户问题。若信息中无法得出答案，请如实说明。
 
 【企业相关信息】
 {context_text[:6000] or '（暂无）'}
@@ -476,15 +693,110 @@ def ask_company_question(company_name, context_text, question, api_key=None, bas
 {(question or '').strip()[:500]}
 
 请用简洁、准确的一段话回答，直接输出答案内容，不要重复问题。"""
+
+
+def ask_company_question(company_name, context_text, question, api_key=None, base_url=None, model=None):
+    """基于企业上下文回答用户问题（RAG-lite：无向量库，直接拼接上下文）。返回 {"answer": "..."}"""
+    if not api_key or not (question or '').strip():
+        return {'answer': '请配置 LLM 并输入问题。'}
+    prompt = _ask_prompt(context_text, question)
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key, base_url=base_url or 'https://api.openai.com/v1')
-        resp = client.chat.completions.create(
-            model=model or 'gpt-4o-mini',
-            messages=[{'role': 'user', 'content': prompt}],
-            temperature=0.2
+        from backend.services import llm_policy
+        text = llm_policy.run(
+            'ask', [{'role': 'user', 'content': prompt}], api_key, base_url, model or 'gpt-4o-mini',
+            temperature=0.2,
         )
-        text = (resp.choices[0].message.content or '').strip()
         return {'answer': text or '未得到有效回答。'}
     except Exception as e:
         return {'answer': f'回答失败：{str(e)[:200]}'}
+
+
+# ---------- 流式输出（SSE） ----------
+# 同时进行的流式请求上限：WSGI 下每个流在回答结束前占用一个处理线程，超出时直接返回 429，避免慢回答占满线程池。
+# 上限按服务器处理线程数计算，流式最多占一半，另一半留给普通请求：
+# - RISKGUARD_SERVER_THREADS：WSGI 服务器的处理线程数（如 gunicorn --threads、waitress threads）
+# - 未设置时为 app.run 的开发服务器（每个请求一个线程、无固定线程池），取 DEFAULT_MAX_STREAMS
+# - RISKGUARD_LLM_MAX_STREAMS 可直接指定上限
+DEFAULT_MAX_STREAMS = 16
+
+
+def stream_limit(server_threads=None, explicit=None):
+    """同时进行的流式请求上限：显式指定优先，其次为服务器线程数的一半（至少 1），都没有时为 DEFAULT_MAX_STREAMS。"""
+    if explicit:
+        return max(1, int(explicit))
+    if server_threads:
+        return max(1, int(server_threads) // 2)
+    return DEFAULT_MAX_STREAMS
+
+
+LLM_MAX_STREAMS = stream_limit(os.environ.get('RISKGUARD_SERVER_THREADS'), os.environ.get('RISKGUARD_LLM_MAX_STREAMS'))
+_stream_slots = threading.BoundedSemaphore(LLM_MAX_STREAMS)
+
+
+def acquire_stream_slot():
+    """非阻塞地占用一个流式名额；成功返回 True，调用方须在流结束后调用 release_stream_slot()。"""
+    return _stream_slots.acquire(blocking=False)
+
+
+def release_stream_slot():
+    try:
+        _stream_slots.release()
+    except ValueError:
+        pass
+
+
+def _stream_text(prompt, api_key, base_url, model, temperature, task):
+    """
+    流式调用模型。逐个产出 (event, data)：
+    ('token', {'text': 增量文本}) / ('ping', None) 空闲心跳；结束时返回完整文本，失败时抛出异常。
+    """
+    from backend.services import llm_gateway
+    parts = []
+    for piece in llm_gateway.stream(
+        api_key, base_url, model or 'gpt-4o-mini',
+        [{'role': 'user', 'content': prompt}],
+        temperature=temperature,
+        task=task,
+    ):
+        if piece is None:
+            yield 'ping', None
+            continue
+        parts.append(piece)
+        yield 'token', {'text': piece}
+    return ''.join(parts).strip()
+
+
+def stream_company_answer(company_name, context_text, question, api_key=None, base_url=None, model=None):
+    """
+    ask_company_question 的流式版本：先逐段产出 ('token', {'text'})，最后产出 ('done', {'answer'})；
+    失败时产出 ('error', {'message'}) 后结束。
+    """
+    if not api_key or not (question or '').strip():
+        yield 'done', {'answer': '请配置 LLM 并输入问题。'}
+        return
+    try:
+        text = yield from _stream_text(_ask_prompt(context_text, question), api_key, base_url, model, 0.2, 'ask')
+    except Exception as e:
+        yield 'error', {'message': f'回答失败：{str(e)[:200]}'}
+        return
+    yield 'done', {'answer': text or '未得到有效回答。'}
+
+
+def stream_supplement_chat(company_name, company_summary, user_input, api_key=None, base_url=None, model=None):
+    """
+    process_supplement_chat 的流式版本：逐段产出模型输出 ('token', {'text'})，完整后解析为
+    ('done', {'updates', 'summary'})；失败时产出 ('error', {'message'}) 后结束。
+    """
+    if not api_key:
+        yield 'done', dict(SUPPLEMENT_FALLBACK)
+        return
+    prompt = _supplement_prompt(company_name, company_summary, user_input)
+    try:
+        text = yield from _stream_text(prompt, api_key, base_url, model, 0.3, 'supplement')
+    except Exception as e:
+        yield 'error', {'message': f'处理失败：{str(e)[:200]}'}
+        return
+    result = _extract_json_from_text(text)
+    if not isinstance(result, dict):
+        result = dict(SUPPLEMENT_FALLBACK)
+    yield 'done', result
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用遥测
+------------
+记录每次上游请求（含重试、对冲、被取消的请求）的任务类型、模型、结果、耗时与 token 用量，
+按 (小时, 任务, 模型, 结果) 聚合写入主库 llm_call_stats 表，只保留最近 RETENTION_DAYS 天。
+
+- record() 只在内存中累加（网关事件循环线程调用，不做 IO）
+- 后台线程每 FLUSH_SECONDS 秒把累加结果合并写入数据库；进程退出时再写一次
+- summary() 供管理端接口按任务/模型汇总调用量、token、耗时与估算费用
+
+单价通过环境变量 RISKGUARD_LLM_PRICES 配置（JSON，{模型: [每千输入 token 价格, 每千输出 token 价格]}），
+未配置单价的模型不估算费用。设置 RISKGUARD_LLM_TELEMETRY=0 可关闭记录。
+"""
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+RETENTION_DAYS = 14
+FLUSH_SECONDS = 15.0
+
+DB_PATH = None  # 为 None 时使用数据目录下的 risk_platform.db；app 启动时设置为实际路径
+
+
+def _default_db_path():
+    data_dir = os.environ.get('RISKGUARD_DATA_DIR', '').strip() or os.path.join(
+        os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'data'
+    )
+    return os.path.join(data_dir, 'risk_platform.db')
+
+
+def _load_prices():
+    raw = os.environ.get('RISKGUARD_LLM_PRICES', '').strip()
+    if not raw:
+        return {}
+    try:
+        return {m: (float(p[0]), float(p[1])) for m, p in json.loads(raw).items()}
+    except (ValueError, TypeError, IndexError, AttributeError) as e:
+        print('[LLM telemetry] RISKGUARD_LLM_PRICES 格式错误:', e)
+        return {}
+
+
+MODEL_PRICES_PER_1K = _load_prices()
+
+_lock = threading.Lock()
+_pending = {}
+_flusher = None
+_last_prune = 0.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_call_stats (
+    bucket TEXT NOT NULL,
+    task TEXT NOT NULL,
+    model TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 0,
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    calls_without_usage INTEGER NOT NULL DEFAULT 0,
+    latency_ms_total REAL NOT NULL DEFAULT 0,
+    latency_ms_max REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, task, model, outcome)
+)
+"""
+
+
+def enabled():
+    return os.environ.get('RISKGUARD_LLM_TELEMETRY', '1') != '0'
+
+
+def _bucket(ts=None):
+    return datetime.fromtimestamp(ts or time.time()).strftime('%Y-%m-%d %H:00')
+
+
+def usage_of(resp):
+    """从 OpenAI 兼容响应中取出 (prompt_tokens, completion_tokens)；提供方未返回用量时为 None。"""
+    usage = getattr(resp, 'usage', None)
+    if usage is None:
+        return None
+    prompt = getattr(usage, 'prompt_tokens', None)
+    completion = getattr(usage, 'completion_tokens', None)
+    if prompt is None and completion is None:
+        return None
+    return int(prompt or 0), int(completion or 0)
+
+
+def record(task, model, outcome, latency_seconds, usage=None):
+    """累加一次上游请求。outcome：ok / error / cancelled；usage 为 (prompt_tokens, completion_tokens) 或 None。"""
+    if not enabled():
+        return
+    key = (_bucket(), task or 'default', model or '', outcome)
+    ms = float(latency_seconds) * 1000.0
+    with _lock:
+        agg = _pending.get(key)
+        if agg is None:
+            agg = _pending[key] = [0, 0, 0, 0, 0.0, 0.0]
+        agg[0] += 1
+        if usage is None:
+            agg[3] += 1
+        else:
+            agg[1] += usage[0]
+            agg[2] += usage[1]
+        agg[4] += ms
+        agg[5] = max(agg[5], ms)
+    _ensure_flusher()
+
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _lock:
+        if _flusher is not None:
+            return
+
+        def _loop():
+            while True:
+                time.sleep(FLUSH_SECONDS)
+                flush()
+
+        _flusher = threading.Thread(target=_loop, name='llm-telemetry', daemon=True)
+        _flusher.start()
+
+
+def _connect(db_path=None):
+    conn = sqlite3.connect(db_path or DB_PATH or _default_db_path(), timeout=30)
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def flush(db_path=None):
+    """把内存中的累加结果合并写入 llm_call_stats，并清理过期的小时桶。返回写入的行数。"""
+    global _last_prune
+    with _lock:
+        rows = [k + tuple(v) for k, v in _pending.items()]
+        _pending.clear()
+    if not rows:
+        return 0
+    try:
+        conn = _connect(db_path)
+        try:
+            conn.executemany(
+                """INSERT INTO llm_call_stats (bucket, task, model, outcome, calls, prompt_tokens, completion_tokens,
+                       calls_without_usage, latency_ms_total, latency_ms_max)
+                   VALUES (?,?,?,?,?,?,?,?,?,?)
+                   ON CONFLICT(bucket, task, model, outcome) DO UPDATE SET
+                       calls = calls + excluded.calls,
+                       prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                       completion_tokens = completion_tokens + excluded.completion_tokens,
+                       calls_without_usage = calls_without_usage + excluded.calls_without_usage,
+                       latency_ms_total = latency_ms_total + excluded.latency_ms_total,
+                       latency_ms_max = MAX(latency_ms_max, excluded.latency_ms_max)""",
+                rows,
+            )
+            now = time.time()
+            if now - _last_prune > 3600:
+                cutoff = _bucket(now - RETENTION_DAYS * 86400)
+                conn.execute("DELETE FROM llm_call_stats WHERE bucket < ?", (cutoff,))
+                _last_prune = now
+            conn.commit()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print('[LLM telemetry] flush error:', e)
+        return 0
+    return len(rows)
+
+
+atexit.register(flush)
+
+
+def _cost(model, prompt_tokens, completion_tokens):
+    price = MODEL_PRICES_PER_1K.get(model)
+    if not price:
+        return None
+    return round(prompt_tokens / 1000.0 * price[0] + completion_tokens / 1000.0 * price[1], 6)
+
+
+def summary(hours=24, db_path=None):
+    """最近 hours 小时按 (任务, 模型) 汇总：调用数、成功/失败/取消、token、平均/最大耗时、估算费用。"""
+    flush(db_path)
+    since = (datetime.now() - timedelta(hours=hours)).strftime('%Y-%m-%d %H:00')
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(
+            """SELECT task, model, outcome, SUM(calls), SUM(prompt_tokens), SUM(completion_tokens),
+                      SUM(calls_without_usage), SUM(latency_ms_total), MAX(latency_ms_max)
+               FROM llm_call_stats WHERE bucket >= ? GROUP BY task, model, outcome""",
+            (since,),
+        ).fetchall()
+    finally:
+        conn.close()
+    routes = {}
+    for task, model, outcome, calls, pt, ct, no_usage, lat_total, lat_max in rows:
+        r = routes.setdefault((task, model), {
+            'task': task, 'model': model, 'calls': 0, 'ok': 0, 'error': 0, 'cancelled': 0,
+            'prompt_tokens': 0, 'completion_tokens': 0, 'calls_without_usage': 0,
+            'latency_ms_total': 0.0, 'max_latency_ms': 0.0,
+        })
+        r['calls'] += calls
+        r[outcome] = r.get(outcome, 0) + calls
+        r['prompt_tokens'] += pt
+        r['completion_tokens'] += ct
+        r['calls_without_usage'] += no_usage
+        r['latency_ms_total'] += lat_total
+        r['max_latency_ms'] = max(r['max_latency_ms'], lat_max)
+    items = []
+    for r in routes.values():
+        r['avg_latency_ms'] = round(r.pop('latency_ms_total') / r['calls'], 1) if r['calls'] else None
+        r['max_latency_ms'] = round(r['max_latency_ms'], 1)
+        r['total_tokens'] = r['prompt_tokens'] + r['completion_tokens']
+        r['est_cost'] = _cost(r['model'], r['prompt_tokens'], r['completion_tokens'])
+        items.append(r)
+    # 按总耗时排序，最先看到最耗时的任务
+    items.sort(key=lambda r: -(r['avg_latency_ms'] or 0) * r['calls'])
+    totals = {
+        'calls': sum(r['calls'] for r in items),
+        'prompt_tokens': sum(r['prompt_tokens'] for r in items),
+        'completion_tokens': sum(r['completion_tokens'] for r in items),
+    }
+    costs = [r['est_cost'] for r in items if r['est_cost'] is not None]
+    totals['est_cost'] = round(sum(costs), 6) if costs else None
+    return {'hours': hours, 'items': items, 'totals': totals}
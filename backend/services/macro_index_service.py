@@ -3,6 +3,11 @@
 宏观指数服务
 ------------
 从 macro_policy_news 计算按日的宏观风险/政策指数，写入 macro_daily_index，供风险预测等使用。
+
+- 每条政策新闻只打一次分，存于 macro_policy_news.risk_score（写入时打分，旧数据在计算时补打）
+- 每天一行：当天首次计算以当前全部条目为基线，之后只把 id 大于 last_item_id 的新条目累加进
+  item_count / score_sum，不重扫、不覆盖当天已有的结果；历史日期的行保持不变
+- 刷新时被移除的条目若已计入当日指数，在删除它们的同一事务中按其 risk_score 从当日 item_count / score_sum 扣除
 """
 from __future__ import annotations
 
@@ -38,7 +43,7 @@ def _get_conn(db_path: Optional[str] = None) -> sqlite3.Connection:
     return sqlite3.connect(path, timeout=30)
 
 
-def _item_score(dimension: str, title: str, content: str) -> float:
+def item_score(dimension: str, title: str, content: str) -> float:
     """单条政策新闻的宏观风险得分 0~1。"""
     dim = (dimension or "政策").strip()
     base = DIMENSION_RISK_WEIGHT.get(dim, 0.5)
@@ -48,44 +53,123 @@ def _item_score(dimension: str, title: str, content: str) -> float:
     return base
 
 
+def _scores(item_count: int, score_sum: float) -> tuple:
+    """由条目数与得分和计算 (policy_score, macro_risk_score)。"""
+    policy_score = score_sum / item_count
+    macro_risk_score = min(1.0, policy_score * 1.05)  # 可与 policy_score 区分更细，目前略抬一点
+    return policy_score, macro_risk_score
+
+
+def _score_unscored(cur: sqlite3.Cursor) -> int:
+    """为尚未打分的条目（旧数据或外部写入）补打分，返回补打条数。"""
+    cur.execute(
+        "SELECT id, title, content, dimension FROM macro_policy_news WHERE risk_score IS NULL"
+    )
+    rows = cur.fetchall()
+    if rows:
+        cur.executemany(
+            "UPDATE macro_policy_news SET risk_score = ? WHERE id = ?",
+            [(item_score(r[3], r[1] or "", r[2] or ""), r[0]) for r in rows],
+        )
+    return len(rows)
+
+
 def compute_and_save_macro_index(db_path: Optional[str] = None, ts_date: Optional[str] = None) -> bool:
     """
-    根据当前 macro_policy_news 表的数据计算当日宏观指数，写入 macro_daily_index。
+    把 macro_policy_news 中的条目增量计入当日宏观指数（macro_daily_index 一天一行）。
+    当天首次计算以当前全部条目为基线；之后只累加上次计算以来新增的条目。
     ts_date 不传则用今天（本地日期 YYYY-MM-DD）。
-    返回是否写入成功。
+    返回是否写入成功（当天无任何条目时为 False）。
     """
     conn = _get_conn(db_path)
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
-    cur.execute(
-        "SELECT id, title, content, dimension FROM macro_policy_news"
-    )
-    rows = cur.fetchall()
-    if not rows:
+    try:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        _score_unscored(cur)
+        date_str = ts_date or datetime.now().strftime("%Y-%m-%d")
+        cur.execute(
+            "SELECT item_count, score_sum, last_item_id FROM macro_daily_index WHERE ts_date = ?",
+            (date_str,),
+        )
+        row = cur.fetchone()
+        item_count, score_sum, last_id = (row[0] or 0, row[1] or 0.0, row[2] or 0) if row else (0, 0.0, 0)
+        if not item_count:
+            last_id = 0  # 当天首次（或旧版本写入的行）：以当前全部条目为基线
+        cur.execute(
+            "SELECT COUNT(*), SUM(risk_score), MAX(id) FROM macro_policy_news WHERE id > ?",
+            (last_id,),
+        )
+        new_count, new_sum, new_max = cur.fetchone()
+        if not item_count and not new_count:
+            conn.rollback()
+            return False
+        item_count += new_count
+        score_sum += new_sum or 0.0
+        policy_score, macro_risk_score = _scores(item_count, score_sum)
+        cur.execute(
+            """
+            INSERT INTO macro_daily_index
+                (ts_date, policy_score, macro_risk_score, item_count, score_sum, last_item_id, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(ts_date) DO UPDATE SET
+                policy_score = excluded.policy_score,
+                macro_risk_score = excluded.macro_risk_score,
+                item_count = excluded.item_count,
+                score_sum = excluded.score_sum,
+                last_item_id = excluded.last_item_id,
+                updated_at = excluded.updated_at
+            """,
+            (date_str, policy_score, macro_risk_score, item_count, score_sum,
+             max(last_id, new_max or 0), datetime.now().isoformat()),
+        )
+        conn.commit()
+        return True
+    finally:
         conn.close()
-        return False
+
+
+def discount_removed_items(cur: sqlite3.Cursor, removed_ids, ts_date: Optional[str] = None) -> int:
+    """
+    在调用方删除 macro_policy_news 条目的事务中、删除之前调用：已计入当日指数（id 不大于 last_item_id）的条目
+    按其 risk_score 从当日 item_count / score_sum 扣除并重算分数。返回扣除的条数。
+    扣到 0 条时当日行在下次计算时以当前全部条目为新基线。
+    """
+    if not removed_ids:
+        return 0
     date_str = ts_date or datetime.now().strftime("%Y-%m-%d")
-    scores = [
-        _item_score(
-            r["dimension"],
-            r["title"] or "",
-            r["content"] or "",
-        )
-        for r in rows
-    ]
-    policy_score = sum(scores) / len(scores)
-    macro_risk_score = min(1.0, policy_score * 1.05)  # 可与 policy_score 区分更细，目前略抬一点
-    now = datetime.now().isoformat()
     cur.execute(
-        """
-        INSERT OR REPLACE INTO macro_daily_index (ts_date, policy_score, macro_risk_score, updated_at)
-        VALUES (?, ?, ?, ?)
-        """,
-        (date_str, policy_score, macro_risk_score, now),
+        "SELECT item_count, score_sum, last_item_id FROM macro_daily_index WHERE ts_date = ?", (date_str,)
     )
-    conn.commit()
-    conn.close()
-    return True
+    row = cur.fetchone()
+    if not row or not row[0]:
+        return 0
+    item_count, score_sum, last_id = row
+    counted = [i for i in removed_ids if i <= last_id]
+    if not counted:
+        return 0
+    removed_count, removed_sum = 0, 0.0
+    for i in range(0, len(counted), 500):
+        chunk = counted[i:i + 500]
+        n, total = cur.execute(
+            "SELECT COUNT(*), SUM(risk_score) FROM macro_policy_news WHERE id IN (%s)" % ",".join("?" * len(chunk)),
+            chunk,
+        ).fetchone()
+        removed_count += n
+        removed_sum += total or 0.0
+    item_count = max(0, item_count - removed_count)
+    if item_count:
+        score_sum = max(0.0, score_sum - removed_sum)
+        cur.execute(
+            "UPDATE macro_daily_index SET item_count = ?, score_sum = ?, policy_score = ?, macro_risk_score = ?, "
+            "updated_at = ? WHERE ts_date = ?",
+            (item_count, score_sum) + _scores(item_count, score_sum) + (datetime.now().isoformat(), date_str),
+        )
+    else:
+        cur.execute(
+            "UPDATE macro_daily_index SET item_count = 0, score_sum = 0, updated_at = ? WHERE ts_date = ?",
+            (datetime.now().isoformat(), date_str),
+        )
+    return removed_count
 
 
 def get_macro_index_history(
@@ -38,11 +38,8 @@ def save_media_reviews_dedup(db_path, company_id, company_name, reviews, api_key
             cu.execute("UPDATE companies SET social_evaluation=?, risk_level=?, media_status='success' WHERE id=?",
                        (summary, result.get('risk_level', ''), company_id))
             if new_level == '高' and old_level != '高':
-                try:
-                    cu.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
-                        (company_id, 'company', 'high', '企业风险等级升至高风险', 'media_crawl'))
-                except sqlite3.OperationalError:
-                    pass
+                cu.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
+                    (company_id, 'company', 'high', '企业风险等级升至高风险', 'media_crawl'))
             cu.execute("DELETE FROM company_keywords WHERE company_id=?", (company_id,))
             for kw in result.get('keywords', [])[:20]:
                 cu.execute("INSERT INTO company_keywords (company_id, keyword, weight) VALUES (?,?,1)", (company_id, kw))
@@ -52,3 +49,5 @@ def save_media_reviews_dedup(db_path, company_id, company_name, reviews, api_key
         cu.execute("UPDATE companies SET media_status='success' WHERE id=?", (company_id,))
     conn.commit()
     conn.close()
+    from backend.services import company_retrieval
+    company_retrieval.schedule_sync(db_path, company_id)
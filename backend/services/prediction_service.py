@@ -9,11 +9,25 @@
 
 from __future__ import annotations
 
-import os
 import sqlite3
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any, List
 
+try:
+    import numpy as np  # type: ignore
+except ImportError:  # numpy 可选，缺失时回退到纯 Python 计算
+    np = None  # type: ignore
+
+# 特征构建与模型注册表依赖 numpy；导入一次，缺失时 ML 概率返回 None
+try:
+    from backend.ml import feature_builder as _fb  # type: ignore
+    from backend.ml import feature_store as _feature_store  # type: ignore
+    from backend.ml import model_registry as _model_registry  # type: ignore
+except Exception:
+    _fb = None  # type: ignore
+    _feature_store = None  # type: ignore
+    _model_registry = None  # type: ignore
+
 DB_PATH: Optional[str] = None
 
 
@@ -47,31 +61,42 @@ def _linear_trend(xs: List[float]) -> float:
     return num / den
 
 
-def _safe_ml_risk_probability(enterprise_id: int, as_of_date: str, db_path: Optional[str]) -> Optional[float]:
-    """
-    阶段 2 占位：尝试加载 ML 模型并返回爆雷/高风险概率。
-    - 若未安装相关依赖或模型文件缺失，返回 None，不影响整体接口。
-    """
-    try:
-        from backend.ml import feature_builder as fb  # type: ignore
-        import joblib  # type: ignore
-    except Exception:
+def _load_ml_model(label_type: str = "explosion") -> Any:
+    """从进程内模型注册表取爆雷分类模型（只在首次或文件更新时反序列化）；不可用时返回 None。"""
+    if _model_registry is None:
         return None
+    return _model_registry.get_model(label_type)
+
 
+def _feature_builder(db_path: Optional[str]) -> Any:
+    fb = _fb
+    if fb is None:
+        return None
     # 设置 DB_PATH（若尚未设置）
     if fb.DB_PATH is None:
         fb.DB_PATH = db_path or DB_PATH
     if not fb.DB_PATH:
         return None
+    return fb
 
-    model_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "..", "models", "risk_classifier_explosion.pkl")
-    model_path = os.path.abspath(model_path)
-    if not os.path.isfile(model_path):
-        return None
 
-    try:
-        model = joblib.load(model_path)
-    except Exception:
+def _safe_ml_risk_probability(
+    enterprise_id: int,
+    as_of_date: str,
+    db_path: Optional[str],
+    model: Any = None,
+) -> Optional[float]:
+    """
+    阶段 2 占位：尝试加载 ML 模型并返回爆雷/高风险概率。
+    - 若未安装相关依赖或模型文件缺失，返回 None，不影响整体接口。
+    - 批量场景可传入已加载的 model，避免重复反序列化。
+    """
+    fb = _feature_builder(db_path)
+    if fb is None:
+        return None
+    if model is None:
+        model = _load_ml_model()
+    if model is None:
         return None
 
     try:
@@ -79,12 +104,53 @@ def _safe_ml_risk_probability(enterprise_id: int, as_of_date: str, db_path: Opti
         x = fb.build_features_for_single(enterprise_id, as_of_date, db_path=fb.DB_PATH)
         if x is None or (isinstance(x, np.ndarray) and x.size == 0):
             return None
-        proba = model.predict_proba(x.reshape(1, -1))[0, 1]
+        proba = _model_registry.predict_proba(model, x.reshape(1, -1))[0, 1]
         return float(proba)
     except Exception:
         return None
 
 
+def _safe_ml_risk_probabilities(
+    histories: Dict[int, List[Dict[str, Any]]],
+    db_path: Optional[str],
+) -> Dict[int, Optional[float]]:
+    """
+    批量版 ML 概率：模型只加载一次，特征由内存中的时间序列构建，一次 predict_proba 完成。
+    任一环节不可用时全部返回 None。
+    """
+    out: Dict[int, Optional[float]] = {eid: None for eid in histories}
+    fb = _feature_builder(db_path)
+    if fb is None or not histories:
+        return out
+    model = _load_ml_model()
+    if model is None:
+        return out
+    try:
+        import numpy as np  # type: ignore
+        eids: List[int] = []
+        rows = []
+        for eid, history in histories.items():
+            if not history:
+                continue
+            x = fb.features_from_series(
+                [h["date"] for h in history],
+                [[h[c] for c in fb.SCORE_COLUMNS] for h in history],
+                history[-1]["date"],
+            )
+            if x.size == 0:
+                continue
+            eids.append(eid)
+            rows.append(x)
+        if not rows:
+            return out
+        proba = _model_registry.predict_proba(model, np.vstack(rows))[:, 1]
+        for eid, p in zip(eids, proba):
+            out[eid] = float(p)
+    except Exception:
+        pass
+    return out
+
+
 def _get_prediction_config(db_path: Optional[str] = None) -> Dict[str, Any]:
     """从 prediction_config 表读取可配置参数，便于客观调参与审计。"""
     conn = _get_conn(db_path)
@@ -113,7 +179,10 @@ def _get_prediction_config(db_path: Optional[str] = None) -> Dict[str, Any]:
     return cfg
 
 
-def _get_macro_adjustment(db_path: Optional[str] = None) -> tuple[float, bool]:
+def _get_macro_adjustment(
+    db_path: Optional[str] = None,
+    cfg: Optional[Dict[str, Any]] = None,
+) -> tuple[float, bool]:
     """
     从 macro_daily_index 取最新宏观指数，计算对风险分的调整量（可正可负）。
     权重与中性值从 prediction_config 读取，保证可配置、可审计。
@@ -127,7 +196,8 @@ def _get_macro_adjustment(db_path: Optional[str] = None) -> tuple[float, bool]:
         return 0.0, False
     if not history:
         return 0.0, False
-    cfg = _get_prediction_config(db_path)
+    if cfg is None:
+        cfg = _get_prediction_config(db_path)
     scale = cfg.get("macro_adjustment_scale", 20.0)
     neutral = cfg.get("macro_neutral", 0.5)
     latest = history[0]
@@ -138,85 +208,146 @@ def _get_macro_adjustment(db_path: Optional[str] = None) -> tuple[float, bool]:
 
 
 def _get_residual_std(horizon_days: int, db_path: Optional[str] = None) -> Optional[float]:
-    """从 backtest_metrics 读取对应 horizon 的残差标准差，用于预测区间。"""
+    """
+    从 backtest_metrics 读取对应 horizon 的残差标准差，用于预测区间。
+    若没有对应 horizon，依次回退到 7d、30d；一次查询取齐候选值。
+    """
+    candidates = [horizon_days] + [h for h in (7, 30) if h != horizon_days]
+    names = ["residual_std_%dd" % h for h in candidates]
     conn = _get_conn(db_path)
     cur = conn.cursor()
     cur.execute(
-        "SELECT value_real FROM backtest_metrics WHERE metric_name = ?",
-        ("residual_std_%dd" % horizon_days,),
+        "SELECT metric_name, value_real FROM backtest_metrics WHERE metric_name IN (%s)"
+        % ",".join("?" * len(names)),
+        names,
     )
-    row = cur.fetchone()
+    found = {r[0]: r[1] for r in cur.fetchall()}
     conn.close()
-    if row and row[0] is not None:
-        return float(row[0])
-    # 若没有对应 horizon，尝试 7d 或 30d
-    for h in (7, 30):
-        if h == horizon_days:
-            continue
-        conn = _get_conn(db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT value_real FROM backtest_metrics WHERE metric_name = ?", ("residual_std_%dd" % h,))
-        row = cur.fetchone()
-        conn.close()
-        if row and row[0] is not None:
-            return float(row[0])
+    for name in names:
+        if found.get(name) is not None:
+            return float(found[name])
     return None
 
 
-def predict_risk_for_enterprise(
-    enterprise_id: int,
-    horizon_days: int = 30,
-    db_path: Optional[str] = None,
-) -> Dict[str, Any]:
+def _load_prediction_context(horizon_days: int, db_path: Optional[str] = None) -> Dict[str, Any]:
+    """预测所需的全局参数（配置、宏观调整、残差标准差），批量预测时只取一次。"""
+    cfg = _get_prediction_config(db_path)
+    macro_adj, macro_used = _get_macro_adjustment(db_path, cfg=cfg)
+    return {
+        "macro_adj": macro_adj,
+        "macro_used": macro_used,
+        "z": cfg.get("prediction_interval_z", 1.96),
+        "residual_std": _get_residual_std(horizon_days, db_path),
+    }
+
+
+_HISTORY_SQL = """
+    SELECT enterprise_id, ts_date, risk_score, score_legal, score_business, score_media,
+           score_policy, score_industry
+    FROM enterprise_risk_timeseries
+    WHERE enterprise_id IN (%s)
+    ORDER BY enterprise_id ASC, ts_date ASC
+"""
+
+_MAX_IN_PARAMS = 500
+
+
+def _load_histories(enterprise_ids: List[int], db_path: Optional[str] = None) -> Dict[int, List[Dict[str, Any]]]:
     """
-    基于 enterprise_risk_timeseries 对单个 enterprise 做简单预测；
-    若存在 macro_daily_index 则纳入宏观指数对预测分数做水平调整。
-    返回包含 base 场景的预测结果（未来 horizon_days 每日一条）。
+    按企业读取完整风险时间序列（按日期升序）。
+    优先读取列式特征缓存（feature_store）；不可用时查询 SQLite，IN 列表按 _MAX_IN_PARAMS 分块。
     """
+    histories: Dict[int, List[Dict[str, Any]]] = {eid: [] for eid in enterprise_ids}
+    if not enterprise_ids:
+        return histories
+    path = db_path or DB_PATH
+    if _feature_store is not None and path:
+        cols = _feature_store.STORE_COLUMNS
+        for eid, arr in _feature_store.load_many(path, enterprise_ids).items():
+            dates = _feature_store.to_date_strings(arr["date"])
+            histories[eid] = [dict(zip(cols, v), date=d) for d, v in zip(dates, arr["values"].tolist())]
+        return histories
     conn = _get_conn(db_path)
     conn.row_factory = sqlite3.Row
     cu = conn.cursor()
-    cu.execute(
-        """
-        SELECT ts_date, risk_score, score_legal, score_business, score_media,
-               score_policy, score_industry
-        FROM enterprise_risk_timeseries
-        WHERE enterprise_id=?
-        ORDER BY ts_date ASC
-        """,
-        (enterprise_id,),
-    )
-    rows = cu.fetchall()
+    for i in range(0, len(enterprise_ids), _MAX_IN_PARAMS):
+        chunk = enterprise_ids[i:i + _MAX_IN_PARAMS]
+        cu.execute(_HISTORY_SQL % ",".join("?" * len(chunk)), chunk)
+        for r in cu.fetchall():
+            histories[r["enterprise_id"]].append(
+                {
+                    "date": r["ts_date"],
+                    "risk_score": float(r["risk_score"]),
+                    "score_legal": float(r["score_legal"]),
+                    "score_business": float(r["score_business"]),
+                    "score_media": float(r["score_media"]),
+                    "score_policy": float(r["score_policy"]),
+                    "score_industry": float(r["score_industry"]),
+                }
+            )
     conn.close()
-    if not rows:
-        return {
-            "enterprise_id": enterprise_id,
-            "history": [],
-            "predictions": [],
-            "message": "no_timeseries_data",
-            "macro_considered": False,
-            "macro_note": "当前预测仅基于企业自身风险时间序列，未纳入宏观因素；可参考右侧「最新政策与市场环境」做综合判断。",
-        }
+    return histories
+
+
+def _trend_slopes(windows: List[List[float]]) -> List[float]:
+    """
+    批量计算各窗口的最小二乘斜率，与 _linear_trend 口径一致。
+    有 numpy 时把不等长窗口补齐成矩阵后一次算完；否则逐个调用 _linear_trend。
+    """
+    if np is None or not windows:
+        return [_linear_trend(w) for w in windows]
+    width = max(len(w) for w in windows)
+    n = np.array([len(w) for w in windows], dtype=float)
+    mask = np.arange(width)[None, :] < n[:, None]
+    y = np.zeros((len(windows), width), dtype=float)
+    for i, w in enumerate(windows):
+        y[i, :len(w)] = w
+    x = np.broadcast_to(np.arange(width, dtype=float), y.shape)
+    safe_n = np.maximum(n, 1.0)
+    mean_x = (n - 1.0) / 2.0
+    mean_y = y.sum(axis=1) / safe_n
+    dx = np.where(mask, x - mean_x[:, None], 0.0)
+    num = (dx * (y - mean_y[:, None])).sum(axis=1)
+    den = (dx * dx).sum(axis=1)
+    den = np.where(den > 0, den, 1.0)
+    slopes = np.where(n >= 2, num / den, 0.0)
+    return [float(v) for v in slopes]
+
+
+def _project_scores(bases: List[float], slopes: List[float], horizon_days: int, macro_adj: float) -> List[List[float]]:
+    """线性外推 + 宏观调整 + [0,100] 裁剪，返回每个企业未来 horizon_days 的分数。"""
+    if np is None:
+        return [
+            [max(0.0, min(100.0, b + k * i + macro_adj)) for i in range(1, horizon_days + 1)]
+            for b, k in zip(bases, slopes)
+        ]
+    steps = np.arange(1, horizon_days + 1, dtype=float)
+    mat = np.asarray(bases, dtype=float)[:, None] + np.asarray(slopes, dtype=float)[:, None] * steps + macro_adj
+    return np.clip(mat, 0.0, 100.0).tolist()
 
-    # 最近窗口（例如 30 天）用于趋势估计
-    history = [
-        {
-            "date": r["ts_date"],
-            "risk_score": float(r["risk_score"]),
-            "score_legal": float(r["score_legal"]),
-            "score_business": float(r["score_business"]),
-            "score_media": float(r["score_media"]),
-            "score_policy": float(r["score_policy"]),
-            "score_industry": float(r["score_industry"]),
-        }
-        for r in rows
-    ]
-    window = history[-min(30, len(history)):]
-    last = window[-1]
-    base_score = last["risk_score"]
-    scores = [h["risk_score"] for h in window]
-    slope = _linear_trend(scores)
 
+def _empty_prediction(enterprise_id: int) -> Dict[str, Any]:
+    return {
+        "enterprise_id": enterprise_id,
+        "history": [],
+        "predictions": [],
+        "message": "no_timeseries_data",
+        "macro_considered": False,
+        "macro_note": "当前预测仅基于企业自身风险时间序列，未纳入宏观因素；可参考右侧「最新政策与市场环境」做综合判断。",
+    }
+
+
+def _build_prediction(
+    enterprise_id: int,
+    history: List[Dict[str, Any]],
+    horizon_days: int,
+    slope: float,
+    future_scores: List[float],
+    ctx: Dict[str, Any],
+    ml_prob: Optional[float],
+    include_history: bool = True,
+) -> Dict[str, Any]:
+    """由已算好的斜率与外推分数组装单个企业的预测结果。"""
     # 解释趋势：正斜率 => 上升，负斜率 => 下降
     if slope > 0.3:
         trend_desc = "近期风险有明显上升趋势"
@@ -225,23 +356,16 @@ def predict_risk_for_enterprise(
     else:
         trend_desc = "近期风险总体较为平稳"
 
-    # 宏观指数调整（基于 macro_daily_index，若有则对预测分数做水平平移）
-    macro_adj, macro_used = _get_macro_adjustment(db_path)
-
     # 预测区间：用回测残差标准差与配置的 z 值得到约 95% 区间
-    cfg = _get_prediction_config(db_path)
-    z = cfg.get("prediction_interval_z", 1.96)
-    residual_std = _get_residual_std(horizon_days, db_path)
+    residual_std = ctx["residual_std"]
+    half = ctx["z"] * residual_std if residual_std is not None and residual_std > 0 else None
 
-    # 未来预测：简单线性外推 + 宏观调整 + 边界裁剪 + 可选预测区间
-    last_date = datetime.strptime(last["date"], "%Y-%m-%d").date()
+    last_date = datetime.strptime(history[-1]["date"], "%Y-%m-%d").date()
     preds: List[Dict[str, Any]] = []
-    for i in range(1, horizon_days + 1):
+    for i, s in enumerate(future_scores, start=1):
         d = last_date + timedelta(days=i)
-        s = max(0.0, min(100.0, base_score + slope * i + macro_adj))
         interval = None
-        if residual_std is not None and residual_std > 0:
-            half = z * residual_std
+        if half is not None:
             interval = [max(0.0, s - half), min(100.0, s + half)]
         preds.append(
             {
@@ -256,13 +380,12 @@ def predict_risk_for_enterprise(
             }
         )
 
-    ml_prob = _safe_ml_risk_probability(enterprise_id, last["date"], db_path)
-
+    macro_used = ctx["macro_used"]
     return {
         "enterprise_id": enterprise_id,
         "generated_at": datetime.utcnow().isoformat() + "Z",
         "horizon_days": horizon_days,
-        "history": history,
+        "history": history if include_history else [],
         "predictions": preds,
         "trend_description": trend_desc,
         "ml_risk_probability": ml_prob,
@@ -271,3 +394,75 @@ def predict_risk_for_enterprise(
         "confidence_interval_based_on_backtest": residual_std is not None,
     }
 
+
+def predict_risk_for_enterprise(
+    enterprise_id: int,
+    horizon_days: int = 30,
+    db_path: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    基于 enterprise_risk_timeseries 对单个 enterprise 做简单预测；
+    若存在 macro_daily_index 则纳入宏观指数对预测分数做水平调整。
+    返回包含 base 场景的预测结果（未来 horizon_days 每日一条）。
+    """
+    history = _load_histories([enterprise_id], db_path)[enterprise_id]
+    if not history:
+        return _empty_prediction(enterprise_id)
+
+    # 最近窗口（例如 30 天）用于趋势估计
+    window = history[-min(30, len(history)):]
+    base_score = window[-1]["risk_score"]
+    slope = _linear_trend([h["risk_score"] for h in window])
+
+    ctx = _load_prediction_context(horizon_days, db_path)
+    # 未来预测：简单线性外推 + 宏观调整 + 边界裁剪 + 可选预测区间
+    future = [
+        max(0.0, min(100.0, base_score + slope * i + ctx["macro_adj"]))
+        for i in range(1, horizon_days + 1)
+    ]
+    ml_prob = _safe_ml_risk_probability(enterprise_id, window[-1]["date"], db_path)
+    return _build_prediction(enterprise_id, history, horizon_days, slope, future, ctx, ml_prob)
+
+
+def predict_risk_batch(
+    enterprise_ids: List[int],
+    horizon_days: int = 30,
+    db_path: Optional[str] = None,
+    include_history: bool = False,
+) -> Dict[str, Any]:
+    """
+    面向整个组合的批量预测，结果与逐个调用 predict_risk_for_enterprise 一致：
+    - 配置、残差标准差、宏观调整、ML 模型各只加载一次
+    - 全部时间序列一次查询取回，斜率与外推分数按矩阵批量计算
+    include_history=False 时不回传历史序列，减小组合视图的响应体积。
+    """
+    ids: List[int] = []
+    seen = set()
+    for eid in enterprise_ids:
+        if eid not in seen:
+            seen.add(eid)
+            ids.append(eid)
+
+    histories = _load_histories(ids, db_path)
+    ctx = _load_prediction_context(horizon_days, db_path)
+    with_data = [eid for eid in ids if histories[eid]]
+    windows = [[h["risk_score"] for h in histories[eid][-30:]] for eid in with_data]
+    slopes = _trend_slopes(windows)
+    futures = _project_scores([w[-1] for w in windows], slopes, horizon_days, ctx["macro_adj"])
+    ml_probs = _safe_ml_risk_probabilities({eid: histories[eid] for eid in with_data}, db_path)
+
+    built: Dict[int, Dict[str, Any]] = {}
+    for eid, slope, future in zip(with_data, slopes, futures):
+        built[eid] = _build_prediction(
+            eid, histories[eid], horizon_days, slope, future, ctx, ml_probs.get(eid),
+            include_history=include_history,
+        )
+    results = [built[eid] if eid in built else _empty_prediction(eid) for eid in ids]
+    return {
+        "generated_at": datetime.utcnow().isoformat() + "Z",
+        "horizon_days": horizon_days,
+        "count": len(results),
+        "macro_considered": ctx["macro_used"],
+        "confidence_interval_based_on_backtest": ctx["residual_std"] is not None,
+        "results": results,
+    }
@@ -10,7 +10,13 @@
 from __future__ import annotations
 
 import sqlite3
-from typing import Optional, Dict, Any, Iterable
+from itertools import groupby
+from typing import Optional, Dict, Any, Iterable, List
+
+try:
+    from backend.ml import feature_store as _feature_store
+except Exception:  # numpy 缺失时不启用列式特征缓存
+    _feature_store = None
 
 DB_PATH = None  # 由调用方设置或在 app 中传入
 
@@ -70,12 +76,31 @@ def _compute_scores_for_day(rows: Iterable[sqlite3.Row]) -> Dict[str, Any]:
     def avg_or_default(values, default=0.0):
         return float(sum(values) / len(values)) if values else default
 
-    score_legal = avg_or_default(dims["legal"])
-    score_business = avg_or_default(dims["business"])
-    score_media = avg_or_default(dims["media"])
-    score_policy = avg_or_default(dims["policy"])
-    score_industry = avg_or_default(dims["industry"])  # 目前可能为 0
+    return _finalize_scores(
+        score_legal=avg_or_default(dims["legal"]),
+        score_business=avg_or_default(dims["business"]),
+        score_media=avg_or_default(dims["media"]),
+        score_policy=avg_or_default(dims["policy"]),
+        score_industry=avg_or_default(dims["industry"]),  # 目前可能为 0
+        news_count=news_count,
+        neg_news=neg_news,
+        sentiment_index=avg_or_default(sentiment_values),
+        policy_impact=avg_or_default(policy_impact),
+    )
+
 
+def _finalize_scores(
+    score_legal: float,
+    score_business: float,
+    score_media: float,
+    score_policy: float,
+    score_industry: float,
+    news_count: int,
+    neg_news: int,
+    sentiment_index: float,
+    policy_impact: float,
+) -> Dict[str, Any]:
+    """由当日各维度平均严重度等聚合量得到综合风险分；python / sql 两种聚合引擎共用。"""
     # 简单综合风险分（加权平均）
     wL, wB, wM, wP, wI = 0.25, 0.25, 0.2, 0.15, 0.15
     risk_score = 100.0 * (
@@ -92,8 +117,6 @@ def _compute_scores_for_day(rows: Iterable[sqlite3.Row]) -> Dict[str, Any]:
 
     news_count = int(news_count)
     neg_ratio = float(neg_news) / news_count if news_count > 0 else 0.0
-    sentiment_index = avg_or_default(sentiment_values)
-    policy_impact_val = avg_or_default(policy_impact)
 
     return {
         "score_legal": score_legal,
@@ -105,108 +128,238 @@ def _compute_scores_for_day(rows: Iterable[sqlite3.Row]) -> Dict[str, Any]:
         "news_count": news_count,
         "neg_news_ratio": neg_ratio,
         "sentiment_index": sentiment_index,
-        "policy_impact": policy_impact_val,
+        "policy_impact": policy_impact,
     }
 
 
-def rebuild_timeseries_for_enterprise(enterprise_id: int, db_path: Optional[str] = None) -> int:
+# 聚合引擎：python 逐行遍历特征并在 Python 中求均值（_compute_scores_for_day）；
+# sql 把按日、按维度的均值/计数下推到一条 GROUP BY 查询，只把每日一行聚合结果取回 Python。
+ENGINE_PYTHON = "python"
+ENGINE_SQL = "sql"
+DEFAULT_ENGINE = ENGINE_SQL
+
+# 与 _compute_scores_for_day 逐项对应的按日聚合；行业维度尚无来源，恒为 0
+_DAILY_AGGREGATE_SQL = """
+    SELECT enterprise_id, event_date,
+        COALESCE(AVG(CASE WHEN et IN ('LEGAL_PENALTY', 'LITIGATION') THEN sev END), 0.0) AS score_legal,
+        COALESCE(AVG(CASE WHEN et = 'BUSINESS' THEN sev
+                          WHEN et = 'FINANCIAL_STRESS' THEN MIN(1.0, sev + 0.1) END), 0.0) AS score_business,
+        COALESCE(AVG(CASE WHEN et = 'PUBLIC_OPINION' THEN sev END), 0.0) AS score_media,
+        COALESCE(AVG(CASE WHEN source_type = 'POLICY' THEN sev END), 0.0) AS score_policy,
+        COALESCE(SUM(source_type = 'NEWS'), 0) AS news_count,
+        COALESCE(SUM(source_type = 'NEWS' AND sent <= -0.2), 0) AS neg_news,
+        COALESCE(AVG(CASE WHEN source_type = 'NEWS' THEN sent END), 0.0) AS sentiment_index,
+        COALESCE(AVG(CASE WHEN source_type = 'POLICY' AND UPPER(policy_direction) = 'NEGATIVE'
+                          THEN MAX(0.0, COALESCE(policy_strength, sev)) END), 0.0) AS policy_impact
+    FROM (
+        SELECT enterprise_id, event_date, source_type,
+               UPPER(COALESCE(event_type, '')) AS et,
+               COALESCE(severity_score, 0.0) AS sev,
+               COALESCE(sentiment_score, 0.0) AS sent,
+               policy_direction, policy_strength
+        FROM enterprise_event_feature
+        WHERE %s
+    )
+    GROUP BY enterprise_id, event_date
+    ORDER BY enterprise_id, event_date
+"""
+
+
+def _aggregate_days_sql(cu: sqlite3.Cursor, where: str, params: Iterable[Any]) -> List[tuple]:
+    """执行按日 GROUP BY 聚合，返回 [(enterprise_id, ts_date, scores), ...]。"""
+    cu.execute(_DAILY_AGGREGATE_SQL % where, tuple(params))
+    out = []
+    for r in cu.fetchall():
+        scores = _finalize_scores(
+            score_legal=float(r[2]),
+            score_business=float(r[3]),
+            score_media=float(r[4]),
+            score_policy=float(r[5]),
+            score_industry=0.0,
+            news_count=r[6],
+            neg_news=r[7],
+            sentiment_index=float(r[8]),
+            policy_impact=float(r[9]),
+        )
+        out.append((r[0], r[1], scores))
+    return out
+
+
+def _aggregate_days_python(cu: sqlite3.Cursor, where: str, params: Iterable[Any]) -> List[tuple]:
+    """逐行取回特征并按 (enterprise_id, event_date) 分桶，交给 _compute_scores_for_day。"""
+    cu.execute(
+        "SELECT * FROM enterprise_event_feature WHERE %s ORDER BY enterprise_id, event_date" % where,
+        tuple(params),
+    )
+    return [
+        (key[0], key[1], _compute_scores_for_day(list(bucket)))
+        for key, bucket in groupby(cu.fetchall(), key=lambda r: (r["enterprise_id"], r["event_date"]))
+    ]
+
+
+def _aggregate_days(cu: sqlite3.Cursor, where: str, params: Iterable[Any], engine: Optional[str]) -> List[tuple]:
+    engine = engine or DEFAULT_ENGINE
+    if engine == ENGINE_SQL:
+        return _aggregate_days_sql(cu, where, params)
+    if engine == ENGINE_PYTHON:
+        return _aggregate_days_python(cu, where, params)
+    raise ValueError("未知的聚合引擎: %s" % engine)
+
+
+_TS_COLUMNS = (
+    "enterprise_id", "ts_date",
+    "score_legal", "score_business", "score_media", "score_policy", "score_industry",
+    "risk_score", "news_count", "neg_news_ratio", "sentiment_index", "sentiment_vol", "policy_impact",
+)
+
+_INSERT_TS_SQL = "INSERT INTO enterprise_risk_timeseries (%s) VALUES (%s)" % (
+    ", ".join(_TS_COLUMNS),
+    ",".join("?" * len(_TS_COLUMNS)),
+)
+
+# 以 (enterprise_id, ts_date) 为键的 upsert，对应表上的 UNIQUE(enterprise_id, ts_date)
+_UPSERT_TS_SQL = _INSERT_TS_SQL + " ON CONFLICT(enterprise_id, ts_date) DO UPDATE SET %s" % ", ".join(
+    "%s=excluded.%s" % (c, c) for c in _TS_COLUMNS[2:]
+)
+
+# 单条 SQL 中 IN (...) 参数个数上限，低于 SQLite 默认的 999
+_MAX_IN_PARAMS = 500
+
+
+def _timeseries_params(enterprise_id: int, ts_date: str, scores: Dict[str, Any]) -> tuple:
+    return (
+        enterprise_id,
+        ts_date,
+        scores["score_legal"],
+        scores["score_business"],
+        scores["score_media"],
+        scores["score_policy"],
+        scores["score_industry"],
+        scores["risk_score"],
+        scores["news_count"],
+        scores["neg_news_ratio"],
+        scores["sentiment_index"],
+        None,  # sentiment_vol 暂未计算
+        scores["policy_impact"],
+    )
+
+
+def _store_columns(params: List[tuple]) -> tuple:
+    """_timeseries_params 行 -> (dates, values)，values 列顺序同 feature_store.STORE_COLUMNS。"""
+    dates = [p[1] for p in params]
+    values = [(p[7], p[2], p[3], p[4], p[5], p[6]) for p in params]
+    return dates, values
+
+
+def _store_replace(db_path: Optional[str], by_enterprise: Dict[int, List[tuple]]) -> None:
+    """时间序列整体重建后同步替换特征缓存；空列表表示该企业已无数据。"""
+    if _feature_store is None:
+        return
+    path = db_path or DB_PATH
+    for eid, params in by_enterprise.items():
+        _feature_store.write_series(path, eid, *_store_columns(params))
+
+
+def rebuild_timeseries_for_enterprise(
+    enterprise_id: int,
+    db_path: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> int:
     """
     重新计算某个 enterprise 的全部时间序列风险记录。
+    engine 为 "sql"（默认）或 "python"，两者结果一致。
     返回写入的记录数。
     """
     conn = _get_conn(db_path)
     conn.row_factory = sqlite3.Row
     cu = conn.cursor()
 
-    cu.execute(
-        """
-        SELECT * FROM enterprise_event_feature
-        WHERE enterprise_id=?
-        ORDER BY event_date
-        """,
-        (enterprise_id,),
-    )
-    rows = cu.fetchall()
-    if not rows:
-        # 没有事件时，清空已有 TS 记录
-        cu.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id=?", (enterprise_id,))
-        conn.commit()
-        conn.close()
-        return 0
+    # 按日期分组聚合
+    days = _aggregate_days(cu, "enterprise_id=?", (enterprise_id,), engine)
 
-    # 删除旧记录
+    # 删除旧记录（没有事件时即清空已有 TS 记录）
     cu.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id=?", (enterprise_id,))
+    params = [_timeseries_params(eid, d, scores) for eid, d, scores in days]
+    cu.executemany(_INSERT_TS_SQL, params)
+
     conn.commit()
+    conn.close()
+    _store_replace(db_path, {enterprise_id: params})
+    return len(params)
 
-    # 按日期分组
-    current_date = None
-    bucket = []
-    written = 0
-    for r in rows:
-        d = r["event_date"]
-        if current_date is None:
-            current_date = d
-        if d != current_date:
-            scores = _compute_scores_for_day(bucket)
-            cu.execute(
-                """
-                INSERT INTO enterprise_risk_timeseries (
-                    enterprise_id, ts_date,
-                    score_legal, score_business, score_media, score_policy, score_industry,
-                    risk_score, news_count, neg_news_ratio, sentiment_index, sentiment_vol, policy_impact
-                ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """,
-                (
-                    enterprise_id,
-                    current_date,
-                    scores["score_legal"],
-                    scores["score_business"],
-                    scores["score_media"],
-                    scores["score_policy"],
-                    scores["score_industry"],
-                    scores["risk_score"],
-                    scores["news_count"],
-                    scores["neg_news_ratio"],
-                    scores["sentiment_index"],
-                    None,  # sentiment_vol 暂未计算
-                    scores["policy_impact"],
-                ),
+
+def rebuild_timeseries_for_all(db_path: Optional[str] = None, engine: Optional[str] = None) -> int:
+    """
+    重新计算 companies 中所有企业的时间序列风险记录（管理员全量重建）。
+    sql 引擎下全库只执行一条 GROUP BY 查询，并在一个事务内批量写入。
+    返回写入的记录数。
+    """
+    conn = _get_conn(db_path)
+    conn.row_factory = sqlite3.Row
+    cu = conn.cursor()
+
+    days = _aggregate_days(cu, "enterprise_id IN (SELECT id FROM companies)", (), engine)
+    cu.execute("SELECT id FROM companies")
+    by_enterprise: Dict[int, List[tuple]] = {r[0]: [] for r in cu.fetchall()}
+
+    cu.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id IN (SELECT id FROM companies)")
+    params = [_timeseries_params(eid, d, scores) for eid, d, scores in days]
+    cu.executemany(_INSERT_TS_SQL, params)
+
+    conn.commit()
+    conn.close()
+    for p in params:
+        by_enterprise.setdefault(p[0], []).append(p)
+    _store_replace(db_path, by_enterprise)
+    return len(params)
+
+
+def recompute_timeseries_days(
+    enterprise_id: int,
+    dates: Iterable[str],
+    db_path: Optional[str] = None,
+    engine: Optional[str] = None,
+) -> int:
+    """
+    只重算某个 enterprise 指定日期（通常为特征增量抽取返回的 dirty_dates）的日桶：
+    - 当日仍有事件：重算后按 (enterprise_id, ts_date) upsert；
+    - 当日已无事件：删除该日记录，与全量重建结果保持一致。
+    所有写入在一个事务内完成，返回写入（含更新）的日数。
+    """
+    days = sorted({d for d in dates if d})
+    if not days:
+        return 0
+    conn = _get_conn(db_path)
+    conn.row_factory = sqlite3.Row
+    cu = conn.cursor()
+
+    aggregated = []
+    for i in range(0, len(days), _MAX_IN_PARAMS):
+        chunk = days[i : i + _MAX_IN_PARAMS]
+        aggregated.extend(
+            _aggregate_days(
+                cu,
+                "enterprise_id=? AND event_date IN (%s)" % ",".join("?" * len(chunk)),
+                (enterprise_id, *chunk),
+                engine,
             )
-            written += 1
-            current_date = d
-            bucket = []
-        bucket.append(r)
-
-    # 最后一桶
-    if bucket:
-        scores = _compute_scores_for_day(bucket)
-        cu.execute(
-            """
-            INSERT INTO enterprise_risk_timeseries (
-                enterprise_id, ts_date,
-                score_legal, score_business, score_media, score_policy, score_industry,
-                risk_score, news_count, neg_news_ratio, sentiment_index, sentiment_vol, policy_impact
-            ) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-            (
-                enterprise_id,
-                current_date,
-                scores["score_legal"],
-                scores["score_business"],
-                scores["score_media"],
-                scores["score_policy"],
-                scores["score_industry"],
-                scores["risk_score"],
-                scores["news_count"],
-                scores["neg_news_ratio"],
-                scores["sentiment_index"],
-                None,
-                scores["policy_impact"],
-            ),
         )
-        written += 1
+
+    params = [_timeseries_params(eid, d, scores) for eid, d, scores in aggregated]
+    written_days = {p[1] for p in params}
+    empty_days = [(enterprise_id, d) for d in days if d not in written_days]
+
+    if empty_days:
+        cu.executemany("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id=? AND ts_date=?", empty_days)
+    cu.executemany(_UPSERT_TS_SQL, params)
 
     conn.commit()
     conn.close()
-    return written
-
+    if _feature_store is not None:
+        _feature_store.upsert_days(
+            db_path or DB_PATH,
+            enterprise_id,
+            *_store_columns(params),
+            deleted_dates=[d for _, d in empty_days],
+        )
+    return len(params)
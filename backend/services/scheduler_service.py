@@ -3,11 +3,13 @@
 定时任务：每 30 分钟（或用户自定义间隔）刷新企业信息；每日自动备份数据库。
 """
 import os
+import queue
 import shutil
 import json
 import sqlite3
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 
 DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'risk_platform.db')
@@ -19,116 +21,285 @@ def get_db_path():
     return DB_PATH
 
 
-def refresh_all_companies():
-    """刷新所有企业的工商/舆情/新闻信息"""
+# 刷新流水线：LLM/抓取在有界线程池中并发，写库由单个写线程分批提交
+REFRESH_WORKERS = int(os.environ.get('RISKGUARD_REFRESH_WORKERS', '4'))
+WRITE_BATCH_SIZE = 10
+WRITE_FLUSH_SECONDS = 2.0
+# 提交后的特征/时间序列同步与爬取触发在独立线程池中执行，不占用写线程
+POST_WRITE_WORKERS = 2
+
+# 防止上一轮未结束时下一轮叠加执行（APScheduler 侧同时设置 max_instances=1）
+_refresh_lock = threading.Lock()
+
+_COMPANY_INFO_FIELDS = (
+    'legal_representative', 'registered_capital', 'registered_address', 'industry', 'business_status',
+    'business_scope', 'equity_structure', 'established_date', 'legal_cases', 'equity_changes', 'capital_changes',
+)
+
+
+def _load_llm_config(cursor):
+    """返回 (api_key, base_url, model, enable_web_search)；未配置时 api_key 为 None。"""
+    cursor.execute("SELECT api_key, base_url, model, enable_web_search FROM llm_config WHERE api_key IS NOT NULL AND api_key != '' LIMIT 1")
+    llm_row = cursor.fetchone()
+    if not llm_row:
+        return None, None, None, False
+    enable_web_search = bool(llm_row[3]) if len(llm_row) > 3 else False
+    return llm_row[0], llm_row[1], llm_row[2], enable_web_search
+
+
+def _normalize_llm_info(llm_info):
+    info = {}
+    for k, v in llm_info.items():
+        if v is None:
+            continue
+        if isinstance(v, (list, dict)):
+            info[k] = json.dumps(v, ensure_ascii=False) if v else ''
+        elif v not in ('-', '', '无', '未知'):
+            info[k] = str(v).strip()
+        else:
+            info.setdefault(k, '')
+    for f in _COMPANY_INFO_FIELDS:
+        info.setdefault(f, '')
+    return info
+
+
+def _collect_company(cid, cname, llm):
+    """
+    流水线第一阶段（工作线程）：只读查询 + 外部调用，不写库。
+    返回该企业需要写入的全部数据，交给写线程处理。
+    """
+    from backend.services.enterprise_crawler import fetch_company_info, fetch_news_for_company
+    from backend.services.llm_service import (
+        analyze_sentiment_and_keywords, analyze_news_batch_for_company, fetch_company_info_by_llm,
+    )
+    api_key, base_url, model, enable_web_search = llm
+
+    # 企业工商、法律等信息：仅用大模型联网搜索
+    info = None
+    if api_key:
+        llm_info = fetch_company_info_by_llm(cname, api_key, base_url, model, enable_web_search=enable_web_search)
+        if llm_info:
+            info = _normalize_llm_info(llm_info)
+    if info is None:
+        info = fetch_company_info(cname)
+
+    # 获取媒体舆情文本并分析
+    conn = sqlite3.connect(DB_PATH, timeout=30)
     try:
-        from backend.services.enterprise_crawler import fetch_company_info, fetch_news_for_company
-        from backend.services.llm_service import analyze_sentiment_and_keywords, analyze_news_for_company
-        from backend.services.wordcloud_service import generate_wordcloud
+        rows = conn.execute("SELECT content FROM company_media_reviews WHERE company_id=?", (cid,)).fetchall()
+    finally:
+        conn.close()
+    reviews_text = ' '.join(r[0] or '' for r in rows)
+    sentiment = analyze_sentiment_and_keywords(cname, reviews_text or '暂无', api_key, base_url, model)
 
-        conn = sqlite3.connect(DB_PATH, timeout=30)
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM companies")
-        companies = cursor.fetchall()
-        cursor.execute("SELECT api_key, base_url, model, enable_web_search FROM llm_config WHERE api_key IS NOT NULL AND api_key != '' LIMIT 1")
-        llm_row = cursor.fetchone()
-        api_key = base_url = model = None
-        enable_web_search = False
-        if llm_row:
-            api_key, base_url, model = llm_row[0], llm_row[1], llm_row[2]
-            enable_web_search = bool(llm_row[3]) if len(llm_row) > 3 else False
-        from backend.services.llm_service import fetch_company_info_by_llm
-
-        for cid, cname in companies:
-            try:
-                # 企业工商、法律等信息：仅用大模型联网搜索
-                info = None
-                if api_key:
-                    llm_info = fetch_company_info_by_llm(cname, api_key, base_url, model, enable_web_search=enable_web_search)
-                    if llm_info:
-                        info = {}
-                        for k, v in llm_info.items():
-                            if v is None:
-                                continue
-                            if isinstance(v, (list, dict)):
-                                info[k] = json.dumps(v, ensure_ascii=False) if v else ''
-                            elif v not in ('-', '', '无', '未知'):
-                                info[k] = str(v).strip()
-                            else:
-                                info.setdefault(k, '')
-                        for f in ('legal_representative','registered_capital','registered_address','industry','business_status','business_scope','equity_structure','established_date','legal_cases','equity_changes','capital_changes'):
-                            info.setdefault(f, '')
-                if info is None:
-                    info = fetch_company_info(cname)
-                cursor.execute("""UPDATE companies SET legal_representative=?, registered_capital=?, business_status=?,
-                    registered_address=?, business_scope=?, equity_structure=?, established_date=?,
-                    industry=COALESCE(NULLIF(industry,''),?), legal_cases=?, equity_changes=?, capital_changes=?,
-                    crawl_status='crawled', last_updated=? WHERE id=?""",
-                    (info.get('legal_representative',''), info.get('registered_capital',''), info.get('business_status',''),
-                     info.get('registered_address',''), info.get('business_scope',''), info.get('equity_structure',''),
-                     info.get('established_date',''), info.get('industry',''),
-                     info.get('legal_cases',''), info.get('equity_changes',''), info.get('capital_changes',''),
-                     datetime.now().isoformat(), cid))
-
-                # 获取媒体舆情文本并分析
-                cursor.execute("SELECT content FROM company_media_reviews WHERE company_id=?", (cid,))
-                reviews_text = ' '.join(r[0] or '' for r in cursor.fetchall())
-                if reviews_text or True:
-                    result = analyze_sentiment_and_keywords(cname, reviews_text or '暂无', api_key, base_url, model)
-                    new_level = (result.get('risk_level') or '').strip()
-                    old_level = ''
-                    if new_level == '高':
-                        cursor.execute("SELECT risk_level FROM companies WHERE id=?", (cid,))
-                        row = cursor.fetchone()
-                        old_level = (row[0] or '').strip() if row else ''
-                    cursor.execute("UPDATE companies SET social_evaluation=?, risk_level=? WHERE id=?",
-                        (result.get('summary',''), result.get('risk_level',''), cid))
-                    if new_level == '高' and old_level != '高':
-                        try:
-                            cursor.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
-                                (cid, 'company', 'high', '企业风险等级升至高风险', 'scheduler'))
-                        except sqlite3.OperationalError:
-                            pass
-                    for kw in result.get('keywords', [])[:20]:
-                        cursor.execute("INSERT OR IGNORE INTO company_keywords (company_id, keyword, weight) VALUES (?,?,1)", (cid, kw))
-
-                # 获取新闻并分析归类
-                news_list = fetch_news_for_company(cname)
-                for n in news_list:
-                    analysis = analyze_news_for_company(cname, n.get('title'), n.get('content'), api_key, base_url, model)
-                    cursor.execute("""INSERT INTO company_news (company_id, title, content, source, source_url, sentiment_score, risk_level, category, keywords, publish_date)
-                        VALUES (?,?,?,?,?,?,?,?,?,?)""",
-                        (cid, n.get('title',''), n.get('content',''), n.get('source',''), n.get('url',''),
-                         analysis.get('sentiment_score',0), analysis.get('risk_level',''), analysis.get('category',''),
-                         json.dumps(analysis.get('keywords',[]), ensure_ascii=False), n.get('publish_date','')))
-
-                # 新闻入库后自动更新事件特征与时间序列
+    # 获取新闻并分析归类（多条合并为一次批量请求）
+    news_list = fetch_news_for_company(cname)
+    analyses = analyze_news_batch_for_company(cname, news_list, api_key, base_url, model)
+    news = list(zip(news_list, analyses))
+    return {'cid': cid, 'cname': cname, 'info': info, 'sentiment': sentiment, 'news': news}
+
+
+def _apply_company(cursor, res):
+    """流水线第二阶段（写线程）：写入单个企业的刷新结果，调用方负责事务边界。"""
+    cid, info, result = res['cid'], res['info'], res['sentiment']
+    cursor.execute("""UPDATE companies SET legal_representative=?, registered_capital=?, business_status=?,
+        registered_address=?, business_scope=?, equity_structure=?, established_date=?,
+        industry=COALESCE(NULLIF(industry,''),?), legal_cases=?, equity_changes=?, capital_changes=?,
+        crawl_status='crawled', last_updated=? WHERE id=?""",
+        (info.get('legal_representative',''), info.get('registered_capital',''), info.get('business_status',''),
+         info.get('registered_address',''), info.get('business_scope',''), info.get('equity_structure',''),
+         info.get('established_date',''), info.get('industry',''),
+         info.get('legal_cases',''), info.get('equity_changes',''), info.get('capital_changes',''),
+         datetime.now().isoformat(), cid))
+
+    new_level = (result.get('risk_level') or '').strip()
+    old_level = ''
+    if new_level == '高':
+        cursor.execute("SELECT risk_level FROM companies WHERE id=?", (cid,))
+        row = cursor.fetchone()
+        old_level = (row[0] or '').strip() if row else ''
+    cursor.execute("UPDATE companies SET social_evaluation=?, risk_level=? WHERE id=?",
+        (result.get('summary',''), result.get('risk_level',''), cid))
+    if new_level == '高' and old_level != '高':
+        try:
+            cursor.execute("""INSERT INTO risk_alerts (company_id, alert_type, severity, description, source) VALUES (?,?,?,?,?)""",
+                (cid, 'company', 'high', '企业风险等级升至高风险', 'scheduler'))
+        except sqlite3.OperationalError:
+            pass
+    cursor.executemany("INSERT OR IGNORE INTO company_keywords (company_id, keyword, weight) VALUES (?,?,1)",
+        [(cid, kw) for kw in result.get('keywords', [])[:20]])
+
+    cursor.executemany("""INSERT INTO company_news (company_id, title, content, source, source_url, sentiment_score, risk_level, category, keywords, publish_date)
+        VALUES (?,?,?,?,?,?,?,?,?,?)""",
+        [(cid, n.get('title',''), n.get('content',''), n.get('source',''), n.get('url',''),
+          analysis.get('sentiment_score',0), analysis.get('risk_level',''), analysis.get('category',''),
+          json.dumps(analysis.get('keywords',[]), ensure_ascii=False), n.get('publish_date',''))
+         for n, analysis in res['news']])
+
+
+def _after_company_written(res, llm):
+    """提交后：更新事件特征与时间序列，登记检索索引同步，并触发媒体舆情爬取（后台线程）。"""
+    cid, cname = res['cid'], res['cname']
+    api_key, base_url, model, _ = llm
+    # 新闻入库后自动更新事件特征与时间序列
+    try:
+        from backend.services import feature_extraction_service as fes
+        from backend.services import risk_timeseries_service as rts
+        fes.DB_PATH = DB_PATH
+        rts.DB_PATH = DB_PATH
+        synced = fes.update_news_features(db_path=DB_PATH, enterprise_id=cid)
+        for eid, dates in synced['dirty_dates'].items():
+            rts.recompute_timeseries_days(eid, dates, db_path=DB_PATH)
+    except Exception as sync_err:
+        print('Scheduler sync risk pipeline error:', cid, sync_err)
+    try:
+        from backend.services import company_retrieval
+        company_retrieval.schedule_sync(DB_PATH, cid)
+    except Exception as idx_err:
+        print('Scheduler retrieval sync error:', cid, idx_err)
+
+    # 定时媒体舆情爬取：基于关键词搜索，入库时按 (company_id, platform, title) 去重，只插入新条目
+    try:
+        from backend.services.crawler import trigger_media_crawl
+        from backend.services.media_review_store import save_media_reviews_dedup
+        def _save_reviews(cid2, reviews):
+            save_media_reviews_dedup(DB_PATH, cid2, cname, reviews, api_key, base_url, model)
+        trigger_media_crawl(cid, cname, callback=_save_reviews)
+    except Exception as crawl_err:
+        print('Scheduler media crawl trigger error:', cid, cname, crawl_err)
+
+
+class _BatchWriter(threading.Thread):
+    """
+    单写线程：从队列取各企业的刷新结果，凑满 batch_size 或等待 flush_seconds 后在一个短事务内提交；
+    每个企业使用独立 SAVEPOINT，单个企业写入失败只回滚该企业。
+    提交后的 _after_company_written 交给 post_pool 执行，close() 等待其全部完成。
+    """
+
+    _STOP = object()
+
+    def __init__(self, llm, batch_size=WRITE_BATCH_SIZE, flush_seconds=WRITE_FLUSH_SECONDS):
+        super().__init__(name='refresh-writer', daemon=True)
+        self.llm = llm
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue()
+        self.post_pool = ThreadPoolExecutor(max_workers=POST_WRITE_WORKERS, thread_name_prefix='refresh-post')
+        self.written = 0
+        self.failed = 0
+
+    def put(self, res):
+        self.queue.put(res)
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self.join()
+        self.post_pool.shutdown(wait=True)
+
+    def run(self):
+        conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        try:
+            batch = []
+            deadline = None
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
                 try:
-                    from backend.services import feature_extraction_service as fes
-                    from backend.services import risk_timeseries_service as rts
-                    fes.DB_PATH = DB_PATH
-                    rts.DB_PATH = DB_PATH
-                    fes.rebuild_news_features(db_path=DB_PATH, enterprise_id=cid)
-                    rts.rebuild_timeseries_for_enterprise(cid, db_path=DB_PATH)
-                except Exception as sync_err:
-                    print('Scheduler sync risk pipeline error:', cid, sync_err)
-
-                # 定时媒体舆情爬取：基于关键词搜索，入库时按 (company_id, platform, title) 去重，只插入新条目
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                if item is self._STOP:
+                    self._flush(conn, batch)
+                    return
+                if item is not None:
+                    batch.append(item)
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_seconds
+                if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                    self._flush(conn, batch)
+                    batch = []
+                    deadline = None
+        finally:
+            conn.close()
+
+    def _flush(self, conn, batch):
+        if not batch:
+            return
+        cursor = conn.cursor()
+        done = []
+        company_failed = 0
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for res in batch:
+                cursor.execute('SAVEPOINT company')
                 try:
-                    from backend.services.crawler import trigger_media_crawl
-                    from backend.services.media_review_store import save_media_reviews_dedup
-                    def _save_reviews(cid2, reviews):
-                        save_media_reviews_dedup(DB_PATH, cid2, cname, reviews, api_key, base_url, model)
-                    trigger_media_crawl(cid, cname, callback=_save_reviews)
-                except Exception as crawl_err:
-                    print('Scheduler media crawl trigger error:', cid, cname, crawl_err)
-
-            except Exception as e:
-                print('Refresh company error:', cid, cname, e)
-        conn.commit()
-        conn.close()
+                    _apply_company(cursor, res)
+                    cursor.execute('RELEASE company')
+                    done.append(res)
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO company')
+                    cursor.execute('RELEASE company')
+                    company_failed += 1
+                    print('Refresh company error:', res['cid'], res['cname'], e)
+            cursor.execute('COMMIT')
+        except Exception as e:
+            # BEGIN/COMMIT 失败（如长时间锁等待）：整批未写入，已单独计过的企业不重复计
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            self.failed += len(batch)
+            print('Scheduler refresh write error:', e)
+            return
+        self.failed += company_failed
+        self.written += len(done)
+        for res in done:
+            self.post_pool.submit(_after_company_written, res, self.llm)
+
+
+def refresh_all_companies(workers=None):
+    """
+    刷新所有企业的工商/舆情/新闻信息。
+    - 每个企业的外部调用（LLM、抓取）在有界线程池中并发执行
+    - 结果由单个写线程分批写入，每批一个短事务
+    - 上一轮仍在执行时直接跳过本轮
+    返回 {'companies', 'written', 'failed'}；被跳过时返回 None。
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        print('Scheduler refresh skipped: previous run still in progress')
+        return None
+    try:
+        return _refresh_all_companies(workers or REFRESH_WORKERS)
     except Exception as e:
         print('Scheduler refresh error:', e)
+        return None
+    finally:
+        _refresh_lock.release()
+
+
+def _refresh_all_companies(workers):
+    conn = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name FROM companies")
+        companies = cursor.fetchall()
+        llm = _load_llm_config(cursor)
+    finally:
+        conn.close()
+
+    writer = _BatchWriter(llm)
+    writer.start()
+    failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='refresh') as pool:
+            futures = {pool.submit(_collect_company, cid, cname, llm): (cid, cname) for cid, cname in companies}
+            for fut in as_completed(futures):
+                cid, cname = futures[fut]
+                try:
+                    writer.put(fut.result())
+                except Exception as e:
+                    failed += 1
+                    print('Refresh company error:', cid, cname, e)
+    finally:
+        writer.close()
+    return {'companies': len(companies), 'written': writer.written, 'failed': failed + writer.failed}
 
 
 def refresh_macro_policy_digest():
@@ -165,40 +336,68 @@ def refresh_macro_policy_digest():
         return False, str(e)
 
 
+def _swap_macro_policy_news(items):
+    """
+    用本轮条目替换 macro_policy_news：按标题比对，一个事务内批量删除已不在本轮的旧条目、批量插入新条目；
+    仍在本轮的条目保留原行（含已打的分），新条目写入时即打分；删除的条目若已计入当日宏观指数，同一事务内扣除。
+    返回 {'items','inserted','deleted'}。
+    """
+    from backend.services import macro_index_service as mis
+    fresh = {}
+    for it in items:
+        title = (it.get('title') or '').strip()
+        if title and title not in fresh:
+            fresh[title] = it
+    conn = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            existing = conn.execute("SELECT id, title FROM macro_policy_news").fetchall()
+            kept = {title for _, title in existing if title in fresh}
+            stale = [(row_id,) for row_id, title in existing if title not in fresh]
+            now = datetime.now().isoformat()
+            rows = [
+                (title, it.get('content', ''), it.get('source', ''), it.get('dimension', '政策'), now, now,
+                 mis.item_score(it.get('dimension', '政策'), title, it.get('content', '')))
+                for title, it in fresh.items() if title not in kept
+            ]
+            mis.discount_removed_items(conn.cursor(), [row_id for row_id, in stale])
+            conn.executemany("DELETE FROM macro_policy_news WHERE id = ?", stale)
+            conn.executemany(
+                "INSERT INTO macro_policy_news (title, content, source, dimension, published_at, created_at, risk_score) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return {'items': len(fresh), 'inserted': len(rows), 'deleted': len(stale)}
+
+
 def refresh_macro_policy_news():
-    """多维度政策与市场新闻：联网搜索，每条单独写入 macro_policy_news 表。"""
+    """多维度政策与市场新闻：各维度并发联网搜索，一个事务内替换 macro_policy_news，再增量更新当日宏观指数。"""
     try:
         conn = sqlite3.connect(DB_PATH, timeout=30)
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT api_key, base_url, model, enable_web_search FROM llm_config WHERE api_key IS NOT NULL AND api_key != '' LIMIT 1"
-        )
-        row = cursor.fetchone()
+        row = _load_llm_config(cursor)
         conn.close()
-        if not row:
+        api_key, base_url, model, enable_web_search = row
+        if not api_key:
             print('refresh_macro_policy_news: 未配置 LLM API，跳过')
-            return
-        api_key, base_url, model = row[0], row[1], row[2]
-        enable_web_search = bool(row[3]) if len(row) > 3 else True
-        from backend.services.llm_service import generate_macro_policy_news_items
-        items = generate_macro_policy_news_items(
+            return None
+        from backend.services.llm_service import generate_macro_policy_news_by_dimension
+        items = generate_macro_policy_news_by_dimension(
             api_key=api_key, base_url=base_url, model=model, enable_web_search=enable_web_search
         )
         if not items:
             print('refresh_macro_policy_news: LLM 未返回条目')
-            return
-        conn = sqlite3.connect(DB_PATH, timeout=30)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM macro_policy_news")
-        now = datetime.now().isoformat()
-        for it in items:
-            cursor.execute(
-                "INSERT INTO macro_policy_news (title, content, source, dimension, published_at, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-                (it.get('title', ''), it.get('content', ''), it.get('source', ''), it.get('dimension', '政策'), now, now)
-            )
-        conn.commit()
-        conn.close()
-        print('refresh_macro_policy_news: 已写入 %d 条' % len(items))
+            return None
+        stats = _swap_macro_policy_news(items)
+        print('refresh_macro_policy_news: 已写入 %d 条（新增 %d，移除 %d）' % (
+            stats['items'], stats['inserted'], stats['deleted']))
         try:
             from backend.services import macro_index_service as mis
             mis.DB_PATH = DB_PATH
@@ -206,8 +405,10 @@ def refresh_macro_policy_news():
                 print('refresh_macro_policy_news: 已更新宏观指数 macro_daily_index')
         except Exception as ex:
             print('refresh_macro_policy_news: 更新宏观指数失败', ex)
+        return stats
     except Exception as e:
         print('refresh_macro_policy_news error:', e)
+        return None
 
 
 def run_backup():
@@ -235,7 +436,8 @@ def start_scheduler(interval_minutes=30):
     try:
         from apscheduler.schedulers.background import BackgroundScheduler
         _scheduler = BackgroundScheduler()
-        _scheduler.add_job(refresh_all_companies, 'interval', minutes=interval_minutes)
+        # 单实例 + 合并错过的触发：一轮刷新超过间隔时不会叠加执行
+        _scheduler.add_job(refresh_all_companies, 'interval', minutes=interval_minutes, max_instances=1, coalesce=True)
         # 每日早上 6:00 更新宏观政策摘要
         _scheduler.add_job(refresh_macro_policy_digest, 'cron', hour=6, minute=0)
         # 每日凌晨 2:00 自动备份数据库
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+数据库版本化迁移
+----------------
+以 SQLite 文件头中的 PRAGMA user_version 记录已执行到的版本号。migrate() 按顺序执行版本号大于它的迁移，
+每个迁移在一个事务内完成并同时写入新的 user_version；失败回滚，版本号不变，下次启动重试。
+init_db 启动时执行一次，之后任何库都是最新表结构，路由不再需要对旧表结构做 try/except 兜底查询。
+
+迁移前 init_db 先执行 db_schema.create_tables，迁移假定所有表都已存在：缺表即报错回滚，而不是跳过后记为已执行。
+迁移须可重复执行（CREATE ... IF NOT EXISTS 等）：开发环境 init_db 删表重建时会把 user_version 归零重跑。
+新增迁移：在 MIGRATIONS 末尾追加 (版本号, 说明, 函数)，版本号递增，已发布的迁移不再修改。
+"""
+
+import logging
+
+from backend.services import company_retrieval, company_stats
+
+logger = logging.getLogger(__name__)
+
+# 热点查询索引：(索引名, 表, 列)
+# enterprise_risk_timeseries(enterprise_id, ts_date) 与 user_companies(user_id, company_id) 已有 UNIQUE 约束自带的索引，
+# 这里不再重复创建；user_companies 另补按 company_id 的反查索引（删除企业、按企业找关注用户）
+HOT_PATH_INDEXES = (
+    # 企业详情 / 滚动资讯 / 问答上下文：WHERE company_id=? ORDER BY created_at DESC LIMIT n
+    ('idx_company_news_company_created', 'company_news', ('company_id', 'created_at')),
+    # 企业详情预警、企业列表预警计数、预警列表：WHERE company_id IN (...) ORDER BY timestamp DESC
+    ('idx_risk_alerts_company_ts', 'risk_alerts', ('company_id', 'timestamp')),
+    # 风险时序按企业、日期聚合
+    ('idx_event_feature_enterprise_date', 'enterprise_event_feature', ('enterprise_id', 'event_date')),
+    # 特征增量抽取：WHERE source_type='NEWS' AND source_id >= ?（db_schema 已建同名唯一索引，IF NOT EXISTS 跳过）
+    ('idx_event_feature_source', 'enterprise_event_feature', ('source_type', 'source_id')),
+    ('idx_user_companies_company', 'user_companies', ('company_id',)),
+    # 舆情去重：WHERE company_id=? AND platform=? AND title=?
+    ('idx_media_reviews_company_platform_title', 'company_media_reviews', ('company_id', 'platform', 'title')),
+    # 通知列表 / 未读数：WHERE user_id=? AND read_at IS NULL ORDER BY id DESC（rowid 即 id，隐含在索引末尾）
+    ('idx_notifications_user_read', 'notifications', ('user_id', 'read_at')),
+    # 审计日志按用户：WHERE user_id=? ORDER BY id DESC
+    ('idx_audit_log_user', 'audit_log', ('user_id', 'id')),
+)
+
+
+def _table_exists(conn, table):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)
+    ).fetchone() is not None
+
+
+def _m001_hot_path_indexes(conn):
+    # 表由 db_schema.create_tables 在迁移前建好；缺表时 CREATE INDEX 报错、迁移回滚，不会跳过后记为已执行
+    for name, table, cols in HOT_PATH_INDEXES:
+        conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (name, table, ', '.join(cols)))
+
+
+# 旧库缺失的列：(表, 列, 类型)。init_db 的 CREATE TABLE 为最初版本的表结构，之后新增的列都在这里补齐
+LEGACY_COLUMNS = (
+    ('llm_config', 'enable_web_search', 'INTEGER DEFAULT 0'),
+    ('documents', 'analysis_result', 'TEXT'),
+    # 三灯：工商、相关新闻、社会评价
+    ('companies', 'llm_status', "TEXT DEFAULT 'pending'"),
+    ('companies', 'media_status', "TEXT DEFAULT 'pending'"),
+    ('companies', 'news_status', "TEXT DEFAULT 'pending'"),
+    ('companies', 'supplement_notes', 'TEXT'),
+    ('companies', 'tags', 'TEXT'),
+    ('company_news', 'risk_dimensions', 'TEXT'),
+    # 企业专属标签：写入时存当前企业名，筛选时只返回标签与当前企业名一致的新闻，避免串企业
+    ('company_news', 'company_tag', 'TEXT'),
+    ('risk_alerts', 'processed_at', 'TIMESTAMP'),
+    # 单条政策新闻得分只算一次；宏观指数按日增量累加
+    ('macro_policy_news', 'risk_score', 'REAL'),
+    ('macro_daily_index', 'item_count', 'INTEGER NOT NULL DEFAULT 0'),
+    ('macro_daily_index', 'score_sum', 'REAL NOT NULL DEFAULT 0'),
+    ('macro_daily_index', 'last_item_id', 'INTEGER NOT NULL DEFAULT 0'),
+    # 用户扩展设置与忘记密码
+    ('users', 'alert_threshold', 'TEXT'),
+    ('users', 'two_factor_enabled', 'INTEGER DEFAULT 0'),
+    ('users', 'two_factor_secret', 'TEXT'),
+    ('users', 'backup_enabled', 'INTEGER DEFAULT 0'),
+    ('users', 'backup_frequency', 'TEXT'),
+    ('users', 'reset_token', 'TEXT'),
+    ('users', 'reset_token_expires', 'TEXT'),
+)
+
+
+def _columns(conn, table):
+    return {r[1] for r in conn.execute("PRAGMA table_info(%s)" % table).fetchall()}
+
+
+def _add_missing_columns(conn, columns):
+    existing = {}
+    for table, col, ctype in columns:
+        if table not in existing:
+            if not _table_exists(conn, table):
+                raise RuntimeError('schema migration: table %s does not exist' % table)
+            existing[table] = _columns(conn, table)
+        cols = existing[table]
+        if col not in cols:
+            conn.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, col, ctype))
+            cols.add(col)
+
+
+def _m002_legacy_columns(conn):
+    _add_missing_columns(conn, LEGACY_COLUMNS)
+
+
+def _m003_alerts_time_index(conn):
+    # 警报列表不限企业时按 (timestamp, rowid) 倒序扫描分页，取满一页即停
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_risk_alerts_ts ON risk_alerts (timestamp)")
+
+
+def _m004_company_stats(conn):
+    # 企业列表的预聚合汇总表与维护触发器，回填已有数据
+    company_stats.install(conn)
+
+
+def _m005_backtest_job_candidates(conn):
+    # 回测任务创建时固定候选企业列表（JSON 数组），续跑不随新数据变化
+    _add_missing_columns(conn, (('backtest_jobs', 'enterprise_ids', 'TEXT'),))
+
+
+def _m006_retrieval_versions(conn):
+    # 企业资料检索索引的变更水位表与维护触发器
+    company_retrieval.install(conn)
+
+
+MIGRATIONS = (
+    (1, '热点查询索引', _m001_hot_path_indexes),
+    (2, '补齐旧库缺失的列', _m002_legacy_columns),
+    (3, '警报按时间分页索引', _m003_alerts_time_index),
+    (4, '企业汇总统计表', _m004_company_stats),
+    (5, '回测任务候选企业列表', _m005_backtest_job_candidates),
+    (6, '企业资料检索变更水位', _m006_retrieval_versions),
+)
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """把数据库迁移到最新版本，返回本次执行的版本号列表。conn 不能处于未提交的事务中。"""
+    if conn.in_transaction:
+        conn.commit()
+    applied = []
+    version = current_version(conn)
+    for target, desc, fn in MIGRATIONS:
+        if target <= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn(conn)
+            conn.execute("PRAGMA user_version = %d" % target)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception('schema migration %d (%s) failed', target, desc)
+            raise
+        version = target
+        applied.append(target)
+    return applied
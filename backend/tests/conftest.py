@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Pytest 公共配置：把项目根加入 sys.path，使 `from backend.services import ...` 可用；
+提供与 init_db 相同表结构的临时库 fixture。
+"""
+
+import os
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+project_root = Path(__file__).resolve().parent.parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+# 测试中不把 LLM 遥测写入项目数据目录下的主库；需要时由具体测试开启
+os.environ.setdefault("RISKGUARD_LLM_TELEMETRY", "0")
+
+
+@pytest.fixture()
+def schema_db(tmp_path):
+    """与 init_db 相同表结构（db_schema 建表 + 版本化迁移）的临时库，返回路径。"""
+    from backend.services import db_schema, schema_migrations
+
+    path = str(tmp_path / "riskguard.db")
+    conn = sqlite3.connect(path)
+    db_schema.create_tables(conn)
+    schema_migrations.migrate(conn)
+    conn.close()
+    return path
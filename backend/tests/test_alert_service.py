@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+警报列表测试：筛选在 LIMIT 之前生效；键集分页遍历完整且无重复（含同一时间戳）；
+企业、已处理、日期范围筛选；只返回用户关联企业；分页查询走索引且无需排序。
+"""
+
+import sqlite3
+
+import pytest
+
+from backend.services import alert_service
+
+
+@pytest.fixture()
+def conn(schema_db):
+    c = sqlite3.connect(schema_db)
+    c.executemany("INSERT INTO companies (id, name) VALUES (?, ?)", [(i, "企业%d" % i) for i in range(1, 5)])
+    # 用户 1 关联企业 1-3，用户 2 关联企业 4
+    c.executemany("INSERT INTO user_companies (user_id, company_id) VALUES (?, ?)", [(1, 1), (1, 2), (1, 3), (2, 4)])
+    rows = []
+    for i in range(300):
+        cid = 1 + i % 4
+        # 只有最早的 5 条是高风险；每 3 条共用一个时间戳，检验同一时间戳下的分页
+        severity = "高" if i < 5 else ("中" if i % 2 else "low")
+        ts = "2026-01-%02d %02d:%02d:00" % (1 + i // 60, (i // 3) % 24, i % 60 // 3)
+        processed = ts if i % 7 == 0 else None
+        rows.append((cid, "news", severity, "d%d" % i, ts, processed))
+    c.executemany("INSERT INTO risk_alerts (company_id, alert_type, severity, description, timestamp, processed_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    c.commit()
+    yield c
+    c.close()
+
+
+def _all_pages(conn, **kw):
+    out, cursor, pages = [], {}, 0
+    while True:
+        page = alert_service.list_alerts(conn, 1, **kw, **cursor)
+        out.extend(page["items"])
+        pages += 1
+        if not page["next_cursor"]:
+            return out, pages
+        cursor = page["next_cursor"]
+
+
+def _expected(conn, where="1=1", params=()):
+    return [r[0] for r in conn.execute(
+        "SELECT id FROM risk_alerts WHERE company_id IN (1,2,3) AND " + where + " ORDER BY timestamp DESC, id DESC",
+        params)]
+
+
+def test_severity_filter_applies_before_limit(conn):
+    page = alert_service.list_alerts(conn, 1, severity="high")
+    # 高风险警报都在最旧的一批里，旧实现先取最新 50 条再过滤会得到空列表
+    assert [a["id"] for a in page["items"]] == _expected(conn, "severity = '高'")
+    assert page["items"] and page["next_cursor"] is None
+    assert {a["severity"] for a in alert_service.list_alerts(conn, 1, severity="low", limit=200)["items"]} == {"low"}
+
+
+def test_keyset_pagination_is_complete(conn):
+    items, pages = _all_pages(conn, limit=20)
+    ids = [a["id"] for a in items]
+    assert ids == _expected(conn)
+    assert len(ids) == len(set(ids)) == 225 and pages == 12
+    assert {a["company_id"] for a in items} == {1, 2, 3}
+    assert items[0]["company_name"]
+
+
+def test_filters_pushed_into_sql(conn):
+    items, _ = _all_pages(conn, processed=False, company_id=2, limit=7)
+    assert [a["id"] for a in items] == _expected(conn, "processed_at IS NULL AND company_id = 2")
+    items, _ = _all_pages(conn, processed=True, limit=50)
+    assert [a["id"] for a in items] == _expected(conn, "processed_at IS NOT NULL")
+    items, _ = _all_pages(conn, since="2026-01-02", until="2026-01-03", limit=30)
+    assert [a["id"] for a in items] == _expected(conn, "timestamp >= '2026-01-02' AND timestamp < '2026-01-04'")
+    # 其他用户的企业不可见
+    assert alert_service.list_alerts(conn, 1, company_id=4)["items"] == []
+    assert {a["company_id"] for a in alert_service.list_alerts(conn, 2)["items"]} == {4}
+
+
+def test_first_page_walks_time_index_without_sort(conn):
+    plan = [r[-1] for r in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT ra.id FROM risk_alerts ra JOIN companies c ON c.id = ra.company_id "
+        "WHERE +ra.company_id IN (SELECT company_id FROM user_companies WHERE user_id = ?) "
+        "ORDER BY ra.timestamp DESC, ra.id DESC LIMIT ?", (1, 51))]
+    assert any("idx_risk_alerts_ts" in d for d in plan), plan
+    assert not any("TEMP B-TREE" in d for d in plan), plan
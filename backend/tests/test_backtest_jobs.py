@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+回测任务测试：候选企业在创建任务时固定；分片中途崩溃后续跑只补算缺失企业，且不因新数据改变企业集合；
+汇总指标等于逐企业充分统计量之和，并与同步回测一致；resume_interrupted_jobs 续跑未完成的任务。
+"""
+
+import json
+import sqlite3
+import time
+
+import pytest
+
+from backend.services import backtest_job_service as bjs
+from backend.services import backtest_service as bts
+
+LOOKBACK = 7
+HORIZONS = [3, 5]
+
+
+def _add_series(path, enterprise_id, n, seed):
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO enterprise_risk_timeseries (enterprise_id, ts_date, risk_score, score_legal, score_business, "
+        "score_media, score_policy, score_industry) VALUES (?, ?, ?, 0, 0, 0, 0, 0)",
+        [(enterprise_id, "2026-%02d-%02d" % (1 + d // 28, 1 + d % 28), 40 + (seed * 7 + d * d * seed) % 31)
+         for d in range(n)])
+    conn.commit()
+    conn.close()
+
+
+def _results(path, job_id):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT enterprise_id, horizon_days, n_samples, sum_abs_err, sum_sq_err FROM backtest_enterprise_results "
+        "WHERE job_id=? ORDER BY enterprise_id, horizon_days", (job_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture()
+def db(schema_db, monkeypatch):
+    monkeypatch.setattr(bjs, "SHARD_SIZE", 2)
+    # 企业 1~6 序列足够长（6 只够最短 horizon），7 太短不参与回测
+    for eid, n in ((1, 20), (2, 25), (3, 18), (4, 30), (5, 16), (6, 10), (7, 5)):
+        _add_series(schema_db, eid, n, eid)
+    return schema_db
+
+
+def test_candidates_fixed_at_creation(db):
+    job = bjs.create_job(LOOKBACK, HORIZONS, max_enterprises=4, db_path=db)
+    assert job["total_enterprises"] == 4
+    assert bjs.get_job(job["job_id"], db_path=db)["enterprise_ids"] == [1, 2, 3, 4]
+    job = bjs.create_job(LOOKBACK, HORIZONS, db_path=db)
+    assert bjs.get_job(job["job_id"], db_path=db)["enterprise_ids"] == [1, 2, 3, 4, 5, 6]
+
+
+def test_resume_after_crash_only_computes_missing(db, monkeypatch):
+    job_id = bjs.create_job(LOOKBACK, HORIZONS, db_path=db)["job_id"]
+    real_run_shard = bjs._run_shard
+    computed = []
+
+    def crashing_run_shard(path, shard, *args):
+        if len(computed) == 1:
+            raise RuntimeError("worker crashed")
+        computed.append(list(shard))
+        return real_run_shard(path, shard, *args)
+
+    monkeypatch.setattr(bjs, "_run_shard", crashing_run_shard)
+    with pytest.raises(RuntimeError):
+        bjs.run_job(job_id, db_path=db, workers=1, engine=bts.ENGINE_PYTHON)
+    job = bjs.get_job(job_id, db_path=db)
+    assert (job["status"], job["done_enterprises"], job["total_enterprises"]) == ("error", 2, 6)
+    assert {r[0] for r in _results(db, job_id)} == {1, 2}
+
+    # 崩溃后才有足够数据的企业不进入本任务
+    _add_series(db, 8, 40, 8)
+    computed.clear()
+    monkeypatch.setattr(bjs, "_run_shard", lambda path, shard, *args: computed.append(list(shard)) or
+                        real_run_shard(path, shard, *args))
+    job = bjs.run_job(job_id, db_path=db, workers=1, engine=bts.ENGINE_PYTHON)
+    assert computed == [[3, 4], [5, 6]]
+    assert (job["status"], job["done_enterprises"], job["total_enterprises"]) == ("success", 6, 6)
+    assert job["enterprise_ids"] == [1, 2, 3, 4, 5, 6]
+    assert {r[0] for r in _results(db, job_id)} == {1, 2, 3, 4, 5, 6}
+
+
+def test_legacy_job_without_candidates_persists_them(db):
+    job_id = bjs.create_job(LOOKBACK, HORIZONS, max_enterprises=3, db_path=db)["job_id"]
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE backtest_jobs SET enterprise_ids=NULL WHERE id=?", (job_id,))
+    conn.commit()
+    job = bjs._load_job(conn, job_id)
+    candidates, pending = bjs._pending_enterprises(conn, job)
+    assert candidates == pending == [1, 2, 3]
+    assert json.loads(conn.execute("SELECT enterprise_ids FROM backtest_jobs WHERE id=?", (job_id,)).fetchone()[0]) \
+        == [1, 2, 3]
+    conn.close()
+
+
+def test_aggregate_totals_match_per_enterprise_and_sync(db):
+    job = bjs.run_job(bjs.create_job(LOOKBACK, HORIZONS, db_path=db)["job_id"], db_path=db, workers=1,
+                      engine=bts.ENGINE_PYTHON)
+    rows = _results(db, job["id"])
+    sync = bts.run_backtest_sweep(LOOKBACK, HORIZONS, db_path=db, engine=bts.ENGINE_PYTHON)["results"]
+    for h in HORIZONS:
+        per = [r for r in rows if r[1] == h and r[2] > 0]
+        n = sum(r[2] for r in per)
+        res = job["results"][str(h)]
+        assert (res["n_samples"], res["n_enterprises"]) == (n, len(per))
+        assert res["mae"] == round(sum(r[3] for r in per) / n, 4)
+        assert res["rmse"] == round((sum(r[4] for r in per) / n) ** 0.5, 4)
+        for key in ("n_samples", "mae", "rmse", "direction_accuracy", "residual_std", "mae_naive"):
+            assert res[key] == pytest.approx(sync[h][key], abs=1e-4), key
+    # 企业 6 只够最短 horizon：较长 horizon 样本为 0，不计入汇总
+    assert job["results"]["5"]["n_enterprises"] == 5
+
+
+def test_resume_interrupted_jobs(db):
+    running = bjs.create_job(LOOKBACK, HORIZONS, db_path=db)["job_id"]
+    pending = bjs.create_job(LOOKBACK, [3], db_path=db)["job_id"]
+    finished = bjs.create_job(LOOKBACK, [3], db_path=db)["job_id"]
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE backtest_jobs SET status='running' WHERE id=?", (running,))
+    conn.execute("UPDATE backtest_jobs SET status='success' WHERE id=?", (finished,))
+    conn.commit()
+    conn.close()
+    assert bjs.resume_interrupted_jobs(db_path=db, workers=1) == [running, pending]
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if all(bjs.get_job(j, db_path=db)["status"] == "success" for j in (running, pending)):
+            break
+        time.sleep(0.05)
+    assert bjs.get_job(running, db_path=db)["done_enterprises"] == 6
+    assert bjs.get_job(pending, db_path=db)["status"] == "success"
+    assert _results(db, finished) == []
+    assert bjs.resume_interrupted_jobs(db_path=db) == []
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""
+企业资料检索测试：按问题返回相关片段且不串企业；增量同步只索引新行；删除、原地修改、迟到行触发该来源重建；
+文档按段切分入索引；问答时不在请求内同步，索引落后时登记后台同步。
+"""
+
+import json
+import sqlite3
+import threading
+
+import pytest
+
+from backend.services import company_retrieval as cr
+
+pytestmark = pytest.mark.skipif(not cr.fts5_available(), reason="SQLite 未编译 FTS5")
+
+
+@pytest.fixture()
+def db_path(schema_db):
+    conn = sqlite3.connect(schema_db)
+    for i in range(50):
+        conn.execute("INSERT INTO company_news (company_id, title, content, source, risk_level) VALUES (1,?,?,?,?)",
+                     ("经营动态%d" % i, "公司发布季度报告，营收稳定增长，市场份额扩大。", "财经网", "低"))
+    conn.execute("INSERT INTO company_news (company_id, title, content, source, risk_level) VALUES (1,?,?,?,?)",
+                 ("涉诉公告", "公司因合同纠纷被供应商起诉，法院已立案，涉案金额 3000 万元。", "法院公告", "高"))
+    conn.execute("INSERT INTO company_news (company_id, title, content, source, risk_level) VALUES (2,?,?,?,?)",
+                 ("乙公司诉讼", "乙公司卷入专利诉讼。", "新闻网", "中"))
+    conn.execute("INSERT INTO company_supplements (company_id, user_id, role, content) VALUES (1,1,'user',?)",
+                 ("客户经理走访：实际控制人近期频繁质押股权。",))
+    conn.commit()
+    conn.close()
+    return schema_db
+
+
+def _execute(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def test_search_ranks_relevant_passages_per_company(db_path):
+    cr.sync_company(db_path, 1)
+    hits = cr.search(db_path, 1, "这家企业有哪些诉讼纠纷？", k=3)
+    assert hits and hits[0]["source"] == "news"
+    assert "合同纠纷" in hits[0]["text"] and hits[0]["text"].startswith("新闻：涉诉公告 | 法院公告 | 风险:高")
+    assert all("乙公司" not in h["text"] for h in hits)
+
+    hits = cr.search(db_path, 1, "股权质押情况", k=3)
+    assert hits[0]["source"] == "supplement" and "质押" in hits[0]["text"]
+
+    assert cr.search(db_path, 1, "？？", k=3) == []
+    passages = cr.top_passages(db_path, 1, "营收增长", k=20, max_chars=200)
+    assert 1 <= len(passages) < 20
+
+
+def test_incremental_sync_and_rebuild(db_path, tmp_path):
+    assert cr.sync_company(db_path, 1) == 52
+    assert cr.sync_company(db_path, 1) == 0
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO company_media_reviews (company_id, platform, title, content) VALUES (1,'微博','环保处罚','工厂因排污超标被罚款')")
+    conn.commit()
+    assert cr.sync_company(db_path, 1) == 1
+    assert cr.search(db_path, 1, "环保罚款")[0]["source"] == "media"
+
+    # 删除后重建：被删的新闻不再命中
+    conn.execute("DELETE FROM company_news WHERE title='涉诉公告'")
+    conn.commit()
+    assert cr.sync_company(db_path, 1) == 50
+    assert all("合同纠纷" not in h["text"] for h in cr.search(db_path, 1, "合同纠纷起诉"))
+
+    # 文档分析完成后才进入索引，长文按段切分
+    doc = tmp_path / "report.txt"
+    doc.write_text("尽调报告。" + "经营正常。" * 200 + "发现关联交易未披露。", encoding="utf-8")
+    conn.execute("INSERT INTO documents (user_id, company_id, filename, filepath, status) VALUES (1,1,'report.txt',?,'pending')",
+                 (str(doc),))
+    conn.commit()
+    assert cr.sync_company(db_path, 1) == 0
+    conn.execute("UPDATE documents SET status='analyzed', analysis_result=? WHERE filename='report.txt'",
+                 (json.dumps({"summary": "x"}),))
+    conn.commit()
+    assert cr.sync_company(db_path, 1) > 1
+    top = cr.search(db_path, 1, "关联交易披露")[0]
+    assert top["source"] == "document" and "关联交易" in top["text"]
+    conn.close()
+
+
+def test_in_place_edit_triggers_rebuild(db_path):
+    cr.sync_company(db_path, 1)
+    # 条数与最大 id 都不变的原地修改也要重建该来源
+    _execute(db_path, "UPDATE company_news SET content='公司因环保问题被责令停产整顿。' WHERE title='涉诉公告'")
+    assert cr.sync_company(db_path, 1) == 51
+    assert all("合同纠纷" not in h["text"] for h in cr.search(db_path, 1, "合同纠纷起诉"))
+    assert "停产" in cr.search(db_path, 1, "停产整顿")[0]["text"]
+    # 与检索无关的列变化不触发同步
+    _execute(db_path, "UPDATE company_news SET sentiment_score=-0.5 WHERE company_id=1")
+    assert cr.sync_company(db_path, 1) == 0
+
+
+def test_search_syncs_in_background(db_path, monkeypatch):
+    # 从未建立索引：本次返回 None（调用方回退），登记后台同步
+    assert cr.search(db_path, 2, "专利诉讼") is None
+    cr._sync_queue.join()
+    assert "专利" in cr.search(db_path, 2, "专利诉讼")[0]["text"]
+
+    release = threading.Event()
+    calls = []
+    real_sync = cr.sync_company
+
+    def gated_sync(path, company_id):
+        calls.append(company_id)
+        release.wait(5)
+        return real_sync(path, company_id)
+
+    monkeypatch.setattr(cr, "sync_company", gated_sync)
+    _execute(db_path, "INSERT INTO company_supplements (company_id, user_id, role, content) VALUES (2,1,'user',?)",
+             ("乙公司主要客户集中度过高。",))
+    # 索引落后：使用当前索引立即返回，同步在后台进行；排队中的企业不重复登记
+    assert all("客户集中" not in h["text"] for h in cr.search(db_path, 2, "客户集中度"))
+    cr.schedule_sync(db_path, 1)
+    cr.schedule_sync(db_path, 1)
+    release.set()
+    cr._sync_queue.join()
+    assert calls == [2, 1]
+    assert "客户集中" in cr.search(db_path, 2, "客户集中度")[0]["text"]
+
+
+def test_tokenize():
+    assert cr.tokenize("诉讼风险 ABC-12") == ["诉讼", "讼风", "风险", "abc", "12"]
+    assert cr.tokenize("税") == ["税"]
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+企业汇总统计测试：触发器在警报插入/处理/删除、新闻写入/删除、风险分更新时增量维护 company_stats，
+结果与全量重算一致；企业列表一次查询读出计数与收藏，不再对警报表分组。
+"""
+
+import random
+import sqlite3
+
+import pytest
+
+from backend.services import company_stats, db_schema, schema_migrations
+
+
+@pytest.fixture()
+def conn(tmp_path):
+    c = sqlite3.connect(str(tmp_path / "stats.db"))
+    db_schema.create_tables(c)
+    c.executemany("INSERT INTO companies (id, name, last_updated) VALUES (?, ?, ?)",
+                  [(i, "企业%d" % i, "2026-01-0%d" % i) for i in range(1, 5)])
+    # 迁移前已有的数据由回填计入
+    c.execute("INSERT INTO risk_alerts (company_id, alert_type, severity) VALUES (1, 'news', '高')")
+    c.execute("INSERT INTO company_news (company_id, title, risk_level, created_at) VALUES (1, 'old', '低', '2025-12-31')")
+    c.commit()
+    schema_migrations.migrate(c)
+    yield c
+    c.close()
+
+
+# 风险时序只关心 risk_score，各维度分填 0
+_INSERT_TS = ("INSERT OR REPLACE INTO enterprise_risk_timeseries (enterprise_id, ts_date, risk_score, score_legal, "
+              "score_business, score_media, score_policy, score_industry) VALUES (?, ?, ?, 0, 0, 0, 0, 0)")
+
+
+def _snapshot(conn):
+    return {r[0]: r[1:] for r in conn.execute(
+        "SELECT company_id, %s FROM company_stats ORDER BY company_id" % ", ".join(company_stats.COLUMNS))}
+
+
+def test_backfill_on_migration(conn):
+    s = company_stats.get(conn, 1)
+    assert (s["alert_count"], s["unprocessed_alert_count"], s["news_count"], s["news_low_count"]) == (1, 1, 1, 1)
+    assert s["latest_news_at"] == "2025-12-31"
+    assert company_stats.get(conn, 4)["alert_count"] == 0
+
+
+def test_triggers_match_full_rebuild(conn):
+    rng = random.Random(7)
+    for i in range(400):
+        op = rng.random()
+        cid = rng.randint(1, 4)
+        if op < 0.35:
+            conn.execute("INSERT INTO risk_alerts (company_id, alert_type, severity) VALUES (?, 'news', '中')", (cid,))
+        elif op < 0.7:
+            conn.execute("INSERT INTO company_news (company_id, title, risk_level, created_at) VALUES (?, ?, ?, ?)",
+                         (cid, "n%d" % i, rng.choice(["高", "中", "低", None, "high"]),
+                          "2026-01-%02d 10:00:%02d" % (rng.randint(1, 28), i % 60)))
+        elif op < 0.8:
+            conn.execute("UPDATE risk_alerts SET processed_at = datetime('now') WHERE id = "
+                         "(SELECT id FROM risk_alerts WHERE company_id = ? ORDER BY random() LIMIT 1)", (cid,))
+        elif op < 0.88:
+            conn.execute("DELETE FROM company_news WHERE id = "
+                         "(SELECT id FROM company_news WHERE company_id = ? ORDER BY random() LIMIT 1)", (cid,))
+        elif op < 0.94:
+            conn.execute("UPDATE company_news SET risk_level = '高' WHERE id = "
+                         "(SELECT id FROM company_news WHERE company_id = ? ORDER BY random() LIMIT 1)", (cid,))
+        else:
+            conn.execute(_INSERT_TS, (cid, "2026-01-%02d" % rng.randint(1, 28), rng.uniform(0, 100)))
+    # 批量删除（刷新资讯、删除企业）同样逐行维护
+    conn.execute("DELETE FROM company_news WHERE company_id = 2")
+    conn.execute("DELETE FROM risk_alerts WHERE company_id = 3")
+    conn.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id = 3")
+    conn.commit()
+    incremental = _snapshot(conn)
+    company_stats.rebuild(conn)
+    assert incremental == _snapshot(conn)
+    assert incremental[2][2] == 0 and incremental[2][6] is None
+    assert incremental[3][0] == 0 and incremental[3][7] is None
+
+
+def test_processing_and_risk_score(conn):
+    conn.execute("INSERT INTO risk_alerts (company_id, alert_type, severity) VALUES (2, 'news', '高')")
+    aid = conn.execute("SELECT max(id) FROM risk_alerts").fetchone()[0]
+    assert company_stats.get(conn, 2)["unprocessed_alert_count"] == 1
+    for _ in range(2):  # 重复标记已处理不会重复扣减
+        conn.execute("UPDATE risk_alerts SET processed_at = datetime('now') WHERE id = ?", (aid,))
+    assert (company_stats.get(conn, 2)["alert_count"], company_stats.get(conn, 2)["unprocessed_alert_count"]) == (1, 0)
+    conn.executemany(_INSERT_TS, [(2, "2026-01-02", 40.0), (2, "2026-01-03", 72.5), (2, "2026-01-01", 10.0)])
+    assert company_stats.get(conn, 2)["risk_score"] == 72.5
+    conn.execute("DELETE FROM companies WHERE id = 2")
+    assert conn.execute("SELECT 1 FROM company_stats WHERE company_id = 2").fetchone() is None
+
+
+def test_list_companies_single_flat_query(conn):
+    conn.executemany("INSERT INTO user_companies (user_id, company_id) VALUES (?, ?)", [(1, 1), (1, 2), (1, 3), (2, 4)])
+    conn.execute("INSERT INTO user_company_favorites (user_id, company_id) VALUES (1, 2)")
+    conn.execute("INSERT INTO user_company_favorites (user_id, company_id) VALUES (2, 1)")
+    rows = company_stats.list_companies(conn, 1)
+    assert [r["id"] for r in rows] == [3, 2, 1]
+    assert {r["id"]: r["is_favorite"] for r in rows} == {1: False, 2: True, 3: False}
+    first = rows[-1]
+    assert (first["alert_count"], first["unprocessed_alert_count"], first["news_count"]) == (1, 1, 1)
+    assert first["news_by_risk_level"] == {"high": 0, "medium": 0, "low": 1}
+    assert [r["id"] for r in company_stats.list_companies(conn, 1, favorite_only=True)] == [2]
+    assert [r["id"] for r in company_stats.list_companies(conn, 1, search="企业3")] == [3]
+    plan = [r[-1] for r in conn.execute("""EXPLAIN QUERY PLAN
+        SELECT c.id FROM user_companies uc JOIN companies c ON c.id = uc.company_id
+        LEFT JOIN company_stats s ON s.company_id = c.id
+        LEFT JOIN user_company_favorites f ON f.user_id = uc.user_id AND f.company_id = c.id
+        WHERE uc.user_id = ?""", (1,))]
+    assert not any("risk_alerts" in d or "GROUP BY" in d for d in plan), plan
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+SQLite 连接池测试：连接复用且设置了 PRAGMA；close() 归还时回滚未提交事务并重置 row_factory / isolation_level；
+请求结束只归还本线程仍持有的连接（跨线程关闭、再次借出的不受影响）；空闲上限；统计。
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from backend.services import db_pool
+
+
+@pytest.fixture()
+def pool(tmp_path):
+    path = str(tmp_path / "pool.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)")
+    conn.commit()
+    conn.close()
+    p = db_pool.ConnectionPool(path, size=2)
+    yield p
+    p.close_idle()
+
+
+def test_reuses_connection_with_pragmas(pool):
+    c1 = pool.acquire()
+    assert c1.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert c1.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    assert c1.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+    assert c1.execute("PRAGMA cache_size").fetchone()[0] == -16000
+    c1.close()
+    c2 = pool.acquire()
+    assert c2 is c1
+    c2.close()
+    s = pool.stats()
+    assert s["created"] == 1 and s["reused"] == 1 and s["in_use"] == 0 and s["idle"] == 1
+
+
+def test_release_resets_connection_state(pool):
+    conn = pool.acquire()
+    conn.row_factory = sqlite3.Row
+    conn.isolation_level = None
+    conn.execute("BEGIN IMMEDIATE")
+    conn.execute("INSERT INTO t (v) VALUES ('uncommitted')")
+    conn.close()
+    conn.close()  # 重复 close 不会重复入池
+    assert pool.stats()["idle"] == 1
+    again = pool.acquire()
+    assert again.row_factory is None and again.isolation_level == ""
+    assert again.execute("SELECT COUNT(*) FROM t").fetchone() == (0,)
+    again.execute("INSERT INTO t (v) VALUES ('ok')")
+    again.commit()
+    again.close()
+    other = sqlite3.connect(pool.path)
+    assert other.execute("SELECT v FROM t").fetchall() == [("ok",)]
+    other.close()
+
+
+def test_release_thread_reclaims_leaked_connections(pool):
+    leaked = pool.acquire()
+    leaked.execute("INSERT INTO t (v) VALUES ('x')")
+    closed = pool.acquire()
+    closed.close()
+
+    seen = []
+
+    def other_thread():
+        # 其他线程借出的连接不受本线程 teardown 影响
+        c = pool.acquire()
+        seen.append(pool.release_thread())
+        seen.append(c._in_use)
+
+    t = threading.Thread(target=other_thread)
+    t.start()
+    t.join()
+    assert seen == [1, False]
+    assert pool.release_thread() == 1
+    s = pool.stats()
+    assert s["in_use"] == 0 and s["reclaimed"] == 2
+    assert not leaked.in_transaction
+
+
+def test_connection_closed_on_another_thread_is_not_reclaimed_twice(pool):
+    conn = pool.acquire()
+    result = {}
+
+    def closer():
+        conn.close()
+
+    def borrower(ready, done):
+        result["conn"] = pool.acquire()
+        ready.set()
+        done.wait(5)
+        result["conn"].close()
+
+    t = threading.Thread(target=closer)
+    t.start()
+    t.join()
+    # 在其他线程关闭后被另一线程再次借出：本线程 teardown 不能把它归还
+    ready, done = threading.Event(), threading.Event()
+    t = threading.Thread(target=borrower, args=(ready, done))
+    t.start()
+    ready.wait(5)
+    assert result["conn"] is conn
+    assert pool.release_thread() == 0
+    assert conn._in_use
+    done.set()
+    t.join()
+    s = pool.stats()
+    assert (s["in_use"], s["released"], s["reclaimed"], s["idle"]) == (0, 2, 0, 1)
+
+
+def test_idle_cap_and_shared_across_threads(pool):
+    conns = [pool.acquire() for _ in range(4)]
+    for c in conns:
+        c.close()
+    s = pool.stats()
+    assert s["idle"] == 2 and s["discarded"] == 2
+    with pytest.raises(sqlite3.ProgrammingError):
+        conns[-1].execute("SELECT 1")  # 超出上限的已真正关闭
+
+    errors = []
+
+    def worker(i):
+        try:
+            for j in range(20):
+                c = pool.acquire()
+                c.execute("INSERT INTO t (v) VALUES (?)", ("%d-%d" % (i, j),))
+                c.commit()
+                c.close()
+        except Exception as e:  # pragma: no cover - 失败时收集
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    c = pool.acquire()
+    assert c.execute("SELECT COUNT(*) FROM t").fetchone() == (80,)
+    c.close()
+    assert pool.stats()["reuse_rate"] > 0.5
+
+
+def test_pooled_acquire_cheaper_than_new_connection(pool):
+    pool.acquire().close()
+    n = 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        c = pool.acquire()
+        c.execute("SELECT 1").fetchone()
+        c.close()
+    pooled = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        c = sqlite3.connect(pool.path, timeout=30)
+        c.execute("SELECT 1").fetchone()
+        c.close()
+    fresh = time.perf_counter() - t0
+    assert pooled < fresh
+
+
+def test_module_level_pool_by_path(tmp_path):
+    path = str(tmp_path / "m.db")
+    c = db_pool.connect(path)
+    assert db_pool.get_pool(path) is c._pool
+    assert db_pool.release_thread() >= 1
+    assert db_pool.stats()[path]["in_use"] == 0
+    db_pool.get_pool(path).close_idle()
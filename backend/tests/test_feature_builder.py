@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+单遍特征构建测试：前缀和 + 二分的窗口特征必须与逐窗口直接计算一致，进程池结果与单进程一致。
+"""
+
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.ml import feature_builder as fb  # noqa: E402
+
+START = date(2025, 1, 1)
+
+
+@pytest.fixture()
+def db_path(schema_db):
+    conn = sqlite3.connect(schema_db)
+    rnd = random.Random(5)
+    for eid in range(1, 31):
+        day = START
+        for _ in range(rnd.randint(1, 150)):
+            # 日期不连续，检验按日期（而非条数）截取窗口
+            day += timedelta(days=rnd.choice((1, 1, 2, 5)))
+            conn.execute(
+                "INSERT INTO enterprise_risk_timeseries (enterprise_id, ts_date, score_legal, score_business, "
+                "score_media, score_policy, score_industry, risk_score) VALUES (?,?,?,?,?,?,?,?)",
+                (eid, day.isoformat(), rnd.random(), rnd.random(), rnd.random(), rnd.random(), rnd.random(),
+                 rnd.uniform(0, 100)),
+            )
+        for _ in range(rnd.randint(0, 8)):
+            as_of = START + timedelta(days=rnd.randint(-10, 400))
+            conn.execute(
+                "INSERT OR IGNORE INTO enterprise_risk_label (enterprise_id, as_of_date, label_type, label_value) "
+                "VALUES (?,?,?,?)",
+                (eid, as_of.isoformat(), "explosion", rnd.randint(0, 1)),
+            )
+    # 无时间序列的企业与其他类型标签应被忽略
+    conn.execute("INSERT INTO enterprise_risk_label (enterprise_id, as_of_date, label_type, label_value) VALUES (99, '2025-03-01', 'explosion', 1)")
+    conn.execute("INSERT INTO enterprise_risk_label (enterprise_id, as_of_date, label_type, label_value) VALUES (1, '2025-03-01', 'other', 1)")
+    conn.commit()
+    conn.close()
+    return schema_db
+
+
+def _reference(db_path, eid, as_of, lookback_days=90):
+    """逐窗口直接计算的参考实现。"""
+    conn = sqlite3.connect(db_path)
+    start = (date.fromisoformat(as_of) - timedelta(days=lookback_days)).isoformat()
+    rows = conn.execute(
+        "SELECT %s FROM enterprise_risk_timeseries WHERE enterprise_id=? AND ts_date BETWEEN ? AND ? ORDER BY ts_date"
+        % ", ".join(fb.SCORE_COLUMNS),
+        (eid, start, as_of),
+    ).fetchall()
+    conn.close()
+    if not rows:
+        return None
+    out = []
+    for col in zip(*rows):
+        arr = np.array(col, dtype=float)
+        slope = np.polyfit(np.arange(len(arr)), arr, 1)[0] if len(arr) > 1 else 0.0
+        out.extend([arr.mean(), arr.std(), arr[-1], slope])
+    return np.array(out)
+
+
+def test_dataset_matches_reference(db_path):
+    X, y, meta = fb.build_ml_dataset("explosion", db_path=db_path)
+    assert X.shape == (len(meta), len(fb.FEATURE_NAMES))
+    assert len(y) == len(meta) > 0
+    assert all(m["enterprise_id"] != 99 for m in meta)
+
+    conn = sqlite3.connect(db_path)
+    labels = conn.execute(
+        "SELECT enterprise_id, as_of_date FROM enterprise_risk_label WHERE label_type='explosion' ORDER BY as_of_date"
+    ).fetchall()
+    conn.close()
+    expected = [(eid, d, _reference(db_path, eid, d)) for eid, d in labels]
+    expected = [e for e in expected if e[2] is not None]
+    assert [(m["enterprise_id"], m["as_of_date"]) for m in meta] == [(e[0], e[1]) for e in expected]
+    for row, (_, _, ref) in zip(X, expected):
+        assert row == pytest.approx(ref, rel=1e-6, abs=1e-6)
+
+
+def test_single_and_process_pool_match(db_path):
+    X1, y1, meta1 = fb.build_ml_dataset("explosion", db_path=db_path)
+    X2, y2, meta2 = fb.build_ml_dataset("explosion", db_path=db_path, workers=2)
+    assert meta1 == meta2
+    assert np.array_equal(y1, y2)
+    assert np.allclose(X1, X2)
+
+    m = meta1[0]
+    single = fb.build_features_for_single(m["enterprise_id"], m["as_of_date"], db_path=db_path)
+    assert single == pytest.approx(X1[0], rel=1e-6, abs=1e-6)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+NEWS 特征增量抽取测试：按企业高水位只处理新行；重复抽取按 (source_type, source_id) upsert 不产生重复；
+原始新闻删除后特征随之删除；dirty_dates 覆盖新增、删除与日期变更涉及的日桶；结果与全量重建一致。
+"""
+
+import sqlite3
+
+import pytest
+
+from backend.services import feature_extraction_service as fes
+
+
+def _add_news(path, company_id, title, publish_date, risk_level="中", sentiment=0.0, category="经营"):
+    conn = sqlite3.connect(path)
+    cur = conn.execute(
+        "INSERT INTO company_news (company_id, title, content, risk_level, sentiment_score, category, publish_date) "
+        "VALUES (?, ?, '', ?, ?, ?, ?)", (company_id, title, risk_level, sentiment, category, publish_date))
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
+
+def _features(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT enterprise_id, source_id, event_date, event_type, sentiment_label, severity_score "
+        "FROM enterprise_event_feature WHERE source_type='NEWS' ORDER BY source_id").fetchall()
+    conn.close()
+    return rows
+
+
+def _marks(path):
+    conn = sqlite3.connect(path)
+    rows = dict(conn.execute(
+        "SELECT enterprise_id, last_source_id FROM feature_extraction_state WHERE source_type='NEWS'").fetchall())
+    conn.close()
+    return rows
+
+
+@pytest.fixture()
+def db(schema_db):
+    conn = sqlite3.connect(schema_db)
+    conn.executemany("INSERT INTO companies (id, name) VALUES (?, ?)", [(1, "甲"), (2, "乙")])
+    conn.commit()
+    conn.close()
+    return schema_db
+
+
+def test_high_water_mark_advances_per_enterprise(db):
+    a1 = _add_news(db, 1, "a1", "2026-01-01")
+    a2 = _add_news(db, 1, "a2", "2026-01-02", risk_level="高", sentiment=-0.5, category="法律")
+    b1 = _add_news(db, 2, "b1", "2026-01-01")
+    res = fes.update_news_features(db)
+    assert (res["written"], res["deleted"]) == (3, 0)
+    assert res["dirty_dates"] == {1: ["2026-01-01", "2026-01-02"], 2: ["2026-01-01"]}
+    assert _marks(db) == {1: a2, 2: b1}
+    assert [r[1] for r in _features(db)] == [a1, a2, b1]
+    assert _features(db)[1][3:] == ("LEGAL_PENALTY", "NEG", 1.0)
+
+    # 没有新行时不做任何写入
+    assert fes.update_news_features(db) == {"written": 0, "deleted": 0, "dirty_dates": {}}
+
+    # 只处理高于高水位的新行；指定企业时不动其他企业
+    b2 = _add_news(db, 2, "b2", "2026-01-05")
+    a3 = _add_news(db, 1, "a3", "2026-01-06")
+    res = fes.update_news_features(db, enterprise_id=2)
+    assert (res["written"], res["dirty_dates"]) == (1, {2: ["2026-01-05"]})
+    assert _marks(db) == {1: a2, 2: b2}
+    res = fes.update_news_features(db)
+    assert (res["written"], res["dirty_dates"]) == (1, {1: ["2026-01-06"]})
+    assert _marks(db) == {1: a3, 2: b2}
+
+
+def test_reextraction_is_idempotent(db):
+    _add_news(db, 1, "a1", "2026-01-01")
+    _add_news(db, 1, "a2", "2026-01-02")
+    fes.update_news_features(db)
+    before = _features(db)
+    # 高水位丢失（如状态表被清）后重抽：按 (source_type, source_id) upsert，不产生重复行
+    conn = sqlite3.connect(db)
+    conn.execute("DELETE FROM feature_extraction_state")
+    conn.commit()
+    conn.close()
+    res = fes.update_news_features(db)
+    assert res["written"] == 2
+    assert _features(db) == before
+
+
+def test_upsert_reports_old_and_new_dates(db):
+    nid = _add_news(db, 1, "a1", "2026-01-01")
+    fes.update_news_features(db)
+    # 同一来源行改了日期后重抽：旧日期与新日期都要重算
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE company_news SET publish_date='2026-02-01' WHERE id=?", (nid,))
+    conn.execute("DELETE FROM feature_extraction_state")
+    conn.commit()
+    conn.close()
+    res = fes.update_news_features(db)
+    assert res["dirty_dates"] == {1: ["2026-01-01", "2026-02-01"]}
+    assert [r[2] for r in _features(db)] == ["2026-02-01"]
+
+
+def test_deleted_news_removes_features(db):
+    keep = _add_news(db, 1, "a1", "2026-01-01")
+    gone = _add_news(db, 1, "a2", "2026-01-03")
+    _add_news(db, 2, "b1", "2026-01-03")
+    fes.update_news_features(db)
+    conn = sqlite3.connect(db)
+    conn.execute("DELETE FROM company_news WHERE id=?", (gone,))
+    conn.commit()
+    conn.close()
+    # 指定其他企业时不删本企业的特征
+    assert fes.update_news_features(db, enterprise_id=2)["deleted"] == 0
+    res = fes.update_news_features(db, enterprise_id=1)
+    assert (res["written"], res["deleted"], res["dirty_dates"]) == (0, 1, {1: ["2026-01-03"]})
+    assert [r[1] for r in _features(db) if r[0] == 1] == [keep]
+
+
+def test_incremental_matches_full_rebuild(db):
+    for i in range(20):
+        _add_news(db, 1 + i % 2, "n%d" % i, "2026-01-%02d" % (1 + i % 5), risk_level="高低中"[i % 3],
+                  sentiment=(i % 5 - 2) / 4.0, category=["法律", "经营", "财务", "其他"][i % 4])
+        if i % 6 == 5:
+            fes.update_news_features(db)
+    fes.update_news_features(db)
+    incremental, marks = _features(db), _marks(db)
+    assert fes.rebuild_news_features(db) == 20
+    assert _features(db) == incremental
+    assert _marks(db) == marks
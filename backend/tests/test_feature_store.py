@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+列式特征缓存测试：随时间序列写入同步更新、与 SQLite 保持一致；补齐后读取不再查询数据行；
+绕过写入路径的外部改动使缓存文件失效后自动从 SQLite 重建。
+"""
+
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from backend.ml import feature_store as fs  # noqa: E402
+from backend.services import risk_timeseries_service as rts  # noqa: E402
+from backend.tests.test_risk_timeseries_engines import db_path  # noqa: E402,F401
+
+
+def _db_series(path, eid):
+    conn = sqlite3.connect(path)
+    rows = conn.execute(
+        "SELECT ts_date, %s FROM enterprise_risk_timeseries WHERE enterprise_id=? ORDER BY ts_date"
+        % ", ".join(fs.STORE_COLUMNS),
+        (eid,),
+    ).fetchall()
+    conn.close()
+    return [r[0] for r in rows], np.array([r[1:] for r in rows], dtype=float).reshape(-1, len(fs.STORE_COLUMNS))
+
+
+def _assert_store_matches_db(path, eid):
+    dates, values = _db_series(path, eid)
+    arr = fs.load(path, eid)
+    if not dates:
+        assert arr is None
+        return
+    assert arr is not None
+    assert fs.to_date_strings(arr["date"]) == dates
+    assert np.allclose(arr["values"], values)
+
+
+def test_store_follows_timeseries_writes(db_path):  # noqa: F811
+    rts.rebuild_timeseries_for_all(db_path=db_path)
+    for eid in range(1, 6):
+        _assert_store_matches_db(db_path, eid)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM enterprise_event_feature WHERE enterprise_id=2 AND event_date='2025-02-10'")
+    conn.execute("UPDATE enterprise_event_feature SET severity_score=0.95 WHERE enterprise_id=2 AND event_date='2025-01-05'")
+    conn.commit()
+    conn.close()
+    rts.recompute_timeseries_days(2, ["2025-02-10", "2025-01-05"], db_path=db_path)
+    _assert_store_matches_db(db_path, 2)
+
+    # 晚于已有最后一天的新日期走追加路径
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO enterprise_event_feature (enterprise_id, source_type, source_id, event_date, event_type, "
+        "sentiment_label, severity_score) VALUES (3, 'NEWS', 99999, '2025-05-01', 'LEGAL_PENALTY', 'NEGATIVE', 0.8)"
+    )
+    conn.commit()
+    conn.close()
+    rts.recompute_timeseries_days(3, ["2025-05-01"], db_path=db_path)
+    _assert_store_matches_db(db_path, 3)
+    assert fs.to_date_strings(fs.load(db_path, 3)["date"])[-1] == "2025-05-01"
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM enterprise_event_feature WHERE enterprise_id=4")
+    conn.commit()
+    conn.close()
+    rts.rebuild_timeseries_for_enterprise(4, db_path=db_path)
+    _assert_store_matches_db(db_path, 4)
+
+
+def test_load_many_fills_from_sqlite_once(db_path, monkeypatch):  # noqa: F811
+    rts.rebuild_timeseries_for_all(db_path=db_path)
+    fs.invalidate(db_path)
+    assert fs.load(db_path, 1) is None
+
+    first = fs.load_many(db_path, [1, 2, 42])
+    assert sorted(first) == [1, 2]
+    _assert_store_matches_db(db_path, 1)
+
+    # 补齐后的读取走内存映射，SQLite 只做索引上的 (行数, 最后日期) 校验，不再读取数据行
+    expected = _db_series(db_path, 2)
+    statements = []
+    real_connect = sqlite3.connect
+
+    def tracing_connect(*args, **kwargs):
+        c = real_connect(*args, **kwargs)
+        c.set_trace_callback(statements.append)
+        return c
+
+    monkeypatch.setattr(sqlite3, "connect", tracing_connect)
+    again = fs.load_many(db_path, [2])
+    monkeypatch.setattr(sqlite3, "connect", real_connect)
+    assert isinstance(again[2], np.memmap)
+    assert fs.to_date_strings(again[2]["date"]) == expected[0]
+    assert np.allclose(again[2]["values"], expected[1])
+    assert len(statements) == 1 and "COUNT(*), MAX(ts_date)" in statements[0]
+
+
+def test_stale_files_rebuilt_after_external_writes(db_path):  # noqa: F811
+    rts.rebuild_timeseries_for_all(db_path=db_path)
+    fs.load_many(db_path, [1, 2, 3])
+    # 绕过 risk_timeseries_service 的改动（如开发环境重置后企业 id 被复用、从备份恢复）
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id=1")
+    conn.execute("UPDATE enterprise_risk_timeseries SET enterprise_id=1 WHERE enterprise_id=2")
+    conn.execute("DELETE FROM enterprise_risk_timeseries WHERE enterprise_id=3 AND ts_date="
+                 "(SELECT MAX(ts_date) FROM enterprise_risk_timeseries WHERE enterprise_id=3)")
+    conn.commit()
+    conn.close()
+    out = fs.load_many(db_path, [1, 2, 3])
+    assert sorted(out) == [1, 3]
+    assert fs.load(db_path, 2) is None
+    for eid in (1, 3):
+        _assert_store_matches_db(db_path, eid)
+        assert fs.to_date_strings(out[eid]["date"]) == _db_series(db_path, eid)[0]
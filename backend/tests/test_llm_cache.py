@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 响应缓存测试：相同输入只调用一次模型；模型/模板/接口地址不同不串用；TTL 过期与容量淘汰；命中率统计。
+"""
+
+import time
+
+import pytest
+
+from backend.services import llm_cache, llm_service
+
+
+@pytest.fixture()
+def calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    llm_cache.reset_stats()
+    seen = []
+
+    def fake_call_llm(prompt, api_key=None, base_url=None, model=None, enable_search=False, task=None):
+        seen.append((prompt, model))
+        if "关键词" in prompt and "keywords" in prompt and "舆情分析师" not in prompt:
+            return {"keywords": ["a", "b"]}
+        return {"sentiment_score": -0.2, "risk_level": "高", "risk_dimensions": {"legal_risk": "高"}, "keywords": []}
+
+    monkeypatch.setattr(llm_service, "call_llm", fake_call_llm)
+    return seen
+
+
+def test_identical_inputs_hit_cache(calls):
+    a = llm_service.analyze_news_for_company("甲公司", "标题", "内容  一", api_key="k", model="m1")
+    b = llm_service.analyze_news_for_company("甲公司", " 标题", "内容 一\n", api_key="k", model="m1")
+    assert len(calls) == 1
+    assert a == b
+    assert b["risk_dimensions"]["financial_risk"] == "中"
+
+    llm_service.analyze_news_for_company("甲公司", "标题", "内容 一", api_key="k", model="m2")
+    llm_service.analyze_sentiment_and_keywords("甲公司", "内容 一", api_key="k", model="m1")
+    assert llm_service.extract_keywords("甲公司", "文本", api_key="k") == ["a", "b"]
+    assert llm_service.extract_keywords("甲公司", "文本", api_key="k") == ["a", "b"]
+    assert len(calls) == 4
+
+    s = llm_cache.stats()
+    assert s["hits"] == 2 and s["misses"] == 4
+    assert s["tasks"]["news_analyze"]["hit_rate"] == pytest.approx(1 / 3, abs=1e-3)
+    assert s["entries"] == 4
+
+
+def test_base_url_is_part_of_key(calls):
+    # 同名模型在不同服务商下结果不同，不能串用；默认地址与显式写出的默认地址（含末尾斜杠）等价
+    llm_service.analyze_news_for_company("甲公司", "标题", "内容", api_key="k", model="m1")
+    llm_service.analyze_news_for_company("甲公司", "标题", "内容", api_key="k", model="m1",
+                                         base_url=llm_service.DEFAULT_BASE_URL + "/")
+    assert len(calls) == 1
+    llm_service.analyze_news_for_company("甲公司", "标题", "内容", api_key="k", model="m1",
+                                         base_url="https://proxy.example.invalid/v1")
+    llm_service.analyze_news_batch_for_company("甲公司", [{"title": "标题", "content": "内容"}], api_key="k", model="m1",
+                                               base_url="https://proxy.example.invalid/v1")
+    assert len(calls) == 2
+
+
+def test_no_api_key_bypasses_cache(calls):
+    llm_service.analyze_news_for_company("甲公司", "t", "c", api_key=None)
+    assert llm_cache.stats()["hits"] == 0 and llm_cache.stats()["misses"] == 0
+
+
+def test_ttl_and_size_eviction(calls, monkeypatch):
+    monkeypatch.setitem(llm_cache.TASK_TTL_SECONDS, "news_analyze", 0.05)
+    llm_service.analyze_news_for_company("甲公司", "t", "c", api_key="k")
+    time.sleep(0.1)
+    llm_service.analyze_news_for_company("甲公司", "t", "c", api_key="k")
+    assert len(calls) == 2
+    assert llm_cache.stats()["tasks"]["news_analyze"]["expired"] == 1
+
+    monkeypatch.setitem(llm_cache.TASK_TTL_SECONDS, "news_analyze", 3600)
+    monkeypatch.setattr(llm_cache, "MAX_ENTRIES", 5)
+    for i in range(12):
+        llm_service.analyze_news_for_company("甲公司", "t%d" % i, "c", api_key="k")
+        time.sleep(0.001)
+    llm_cache.evict()
+    assert llm_cache.stats()["entries"] <= 5
+    # 最近写入的条目保留
+    before = len(calls)
+    llm_service.analyze_news_for_company("甲公司", "t11", "c", api_key="k")
+    assert len(calls) == before
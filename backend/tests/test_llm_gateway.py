@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 网关测试：相同在途请求合并、并发上限、令牌桶限流、429/5xx 重试与不可重试错误直接抛出。
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from backend.services import llm_gateway
+from backend.services.llm_gateway import LLMGateway
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__("status %d" % status_code)
+        self.status_code = status_code
+        self.response = type("R", (), {"headers": {"retry-after": retry_after} if retry_after is not None else {}})()
+
+
+@pytest.fixture(autouse=True)
+def _fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "BACKOFF_BASE_SECONDS", 0.01)
+
+
+def _msgs(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_identical_inflight_requests_are_coalesced():
+    sent = []
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        sent.append(messages[0]["content"])
+        await asyncio.sleep(0.2)
+        return "answer:" + messages[0]["content"]
+
+    gw = LLMGateway(rate=1000, burst=1000, sender=sender)
+    try:
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            outs = list(pool.map(lambda i: gw.complete("k", None, "m", _msgs("same" if i < 8 else "other%d" % i)), range(10)))
+        assert outs[:8] == ["answer:same"] * 8
+        assert sorted(sent) == ["other8", "other9", "same"]
+        assert gw.stats()["coalesced"] == 7
+    finally:
+        gw.shutdown()
+
+
+def test_in_flight_limit_and_token_bucket():
+    active = {"now": 0, "peak": 0}
+    lock = threading.Lock()
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        with lock:
+            active["now"] += 1
+            active["peak"] = max(active["peak"], active["now"])
+        await asyncio.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        return "ok"
+
+    gw = LLMGateway(rate=1000, burst=1000, max_in_flight=3, sender=sender)
+    try:
+        with ThreadPoolExecutor(max_workers=12) as pool:
+            list(pool.map(lambda i: gw.complete("k", None, "m", _msgs(str(i))), range(12)))
+        assert active["peak"] == 3
+    finally:
+        gw.shutdown()
+
+    # 突发 2、每秒 20 个：6 个请求至少需要 (6-2)/20 = 0.2 秒
+    gw = LLMGateway(rate=20, burst=2, sender=sender)
+    try:
+        t0 = time.monotonic()
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            list(pool.map(lambda i: gw.complete("k", None, "m", _msgs(str(i))), range(6)))
+        assert time.monotonic() - t0 >= 0.18
+        # 不同 (base_url, model) 使用独立的桶
+        assert ("", "m") in gw._buckets
+    finally:
+        gw.shutdown()
+
+
+def test_retries_on_429_and_5xx_then_succeeds():
+    attempts = []
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise _HTTPError(429, retry_after="0.05")
+        if len(attempts) == 2:
+            raise _HTTPError(503)
+        return "ok"
+
+    gw = LLMGateway(rate=1000, burst=1000, sender=sender)
+    try:
+        assert gw.complete("k", None, "m", _msgs("x")) == "ok"
+        assert attempts[1] - attempts[0] >= 0.05
+        s = gw.stats()
+        assert s["retries"] == 2 and s["rate_limited"] == 1 and s["errors"] == 0
+    finally:
+        gw.shutdown()
+
+
+def test_non_retryable_and_exhausted_errors_raise():
+    calls = []
+
+    async def bad_request(gw, *args):
+        calls.append(1)
+        raise _HTTPError(400)
+
+    gw = LLMGateway(rate=1000, burst=1000, sender=bad_request, max_retries=3)
+    try:
+        with pytest.raises(_HTTPError):
+            gw.complete("k", None, "m", _msgs("x"))
+        assert len(calls) == 1
+    finally:
+        gw.shutdown()
+
+    async def always_500(gw, *args):
+        calls.append(1)
+        raise _HTTPError(500)
+
+    calls.clear()
+    gw = LLMGateway(rate=1000, burst=1000, sender=always_500, max_retries=2)
+    try:
+        with pytest.raises(_HTTPError):
+            gw.complete("k", None, "m", _msgs("x"))
+        assert len(calls) == 3
+        assert gw.stats()["errors"] == 1
+    finally:
+        gw.shutdown()
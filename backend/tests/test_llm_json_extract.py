@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 回复 JSON 提取：常见回复形态的正确性测试 + 微基准。
+
+正确性：代码块、前后说明文字、尾随逗号、字符串内含括号、多个对象、截断回复、数组、
+正文前有大量花括号（超出候选上限）等形态。
+微基准：与旧实现（多个回溯正则 + 多次 json.loads）对比各形态的单次解析耗时。断言的是耗时比例，
+受机器负载影响，默认跳过；设置 RISKGUARD_BENCHMARK=1 时运行，
+或直接运行本文件打印对比表：python -m backend.tests.test_llm_json_extract
+"""
+
+import json
+import os
+import re
+import time
+
+import pytest
+
+from backend.services.llm_service import _extract_json_from_text
+
+_NEWS = {
+    "related": True, "sentiment_score": -0.6, "risk_level": "高", "category": "法律",
+    "risk_dimensions": {"legal_risk": "高", "financial_risk": "中", "operation_risk": "低"},
+    "keywords": ["诉讼", "冻结", "{括号}"], "summary": "公司因合同纠纷被起诉，部分账户被冻结。",
+}
+
+
+# 说明文字中的占位花括号，数量超过 _JSON_MAX_CANDIDATES
+_PLACEHOLDERS = "回复模板字段：" + "、".join("{字段%d}" % i for i in range(12)) + "。\n"
+
+
+def _web_search_reply(n_items):
+    items = [{"title": "政策动态 %d" % i, "content": "监管部门发布通知，要求加强合规管理。" * 8,
+              "source": "新华网", "dimension": "监管"} for i in range(n_items)]
+    body = json.dumps({"items": items}, ensure_ascii=False, indent=2)
+    return "根据联网搜索结果，整理如下：\n\n```json\n" + body + "\n```\n\n以上信息来源于公开报道，仅供参考。" + "注：数据截至今日。" * 50
+
+
+# (名称, 回复文本, 期望结果)
+SHAPES = [
+    ("bare", json.dumps(_NEWS, ensure_ascii=False), _NEWS),
+    ("fenced", "```json\n" + json.dumps(_NEWS, ensure_ascii=False, indent=2) + "\n```", _NEWS),
+    ("prose_wrapped", "好的，分析结果如下：\n" + json.dumps(_NEWS, ensure_ascii=False) + "\n如需进一步说明请告诉我。", _NEWS),
+    ("trailing_commas", '{"keywords": ["a", "b",], "risk_level": "中",}', {"keywords": ["a", "b"], "risk_level": "中"}),
+    ("comma_inside_string", '{"summary": "保留 ,} 原文", "x": [1,],}', {"summary": "保留 ,} 原文", "x": [1]}),
+    ("braces_before_json", "说明：{此处为占位} 结果：" + json.dumps({"a": 1}), {"a": 1}),
+    ("two_objects", '{"a": 1}\n另一个：{"b": 2}', {"a": 1}),
+    ("fenced_array", '```json\n[{"title": "x"}]\n```', [{"title": "x"}]),
+    ("many_braces_before_fenced", _PLACEHOLDERS + "```json\n" + json.dumps(_NEWS, ensure_ascii=False) + "\n```", _NEWS),
+    ("many_braces_before_object", _PLACEHOLDERS + "结果：" + json.dumps(_NEWS, ensure_ascii=False) + "\n以上。", _NEWS),
+    ("truncated", '```json\n{"items": [{"title": "x", "content": "被截断', None),
+    ("no_json", "抱歉，我无法回答这个问题。", None),
+    ("web_search_long", _web_search_reply(40), None),
+    # 病态输入：大量未闭合的 {，旧实现的 \{[\s\S]*\} 对每个起点都扫描到末尾
+    ("many_open_braces", "{ 说明" * 4000, None),
+]
+
+
+def _expected(name, reply, expected):
+    if name == "web_search_long":
+        return json.loads(reply.split("```json\n", 1)[1].split("\n```", 1)[0])
+    return expected
+
+
+def _legacy_extract(text):
+    """旧实现，仅作基准对比。"""
+    if not text or not isinstance(text, str):
+        return None
+    text = text.strip()
+    m = re.search(r'```(?:json)?\s*(\{[\s\S]*?\})\s*```', text)
+    if m:
+        try:
+            return json.loads(m.group(1))
+        except json.JSONDecodeError:
+            pass
+    m = re.search(r'\{[\s\S]*\}', text)
+    if m:
+        raw = m.group(0)
+        raw = re.sub(r',\s*}', '}', raw)
+        raw = re.sub(r',\s*]', ']', raw)
+        try:
+            return json.loads(raw)
+        except json.JSONDecodeError:
+            pass
+    try:
+        parsed = json.loads(text)
+    except json.JSONDecodeError:
+        parsed = None
+    if parsed is not None:
+        return parsed
+    if text.startswith('```'):
+        text = text.split('```')[1]
+        if text.startswith('json'):
+            text = text[4:].strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+@pytest.mark.parametrize("name,reply,expected", SHAPES, ids=[s[0] for s in SHAPES])
+def test_extract_shapes(name, reply, expected):
+    assert _extract_json_from_text(reply) == _expected(name, reply, expected)
+
+
+def test_non_string_inputs():
+    assert _extract_json_from_text(None) is None
+    assert _extract_json_from_text("") is None
+    assert _extract_json_from_text({"a": 1}) is None
+
+
+def _time_per_call(fn, text, min_seconds=0.02, max_loops=2000):
+    loops, t0 = 0, time.perf_counter()
+    while True:
+        fn(text)
+        loops += 1
+        elapsed = time.perf_counter() - t0
+        if elapsed >= min_seconds or loops >= max_loops:
+            return elapsed / loops
+
+
+def run_benchmarks(min_seconds=0.02):
+    """返回 {形态: (新实现 µs/次, 旧实现 µs/次)}。"""
+    out = {}
+    for name, reply, _ in SHAPES:
+        new = _time_per_call(_extract_json_from_text, reply, min_seconds)
+        old = _time_per_call(_legacy_extract, reply, min_seconds)
+        out[name] = (new * 1e6, old * 1e6)
+    return out
+
+
+@pytest.mark.skipif(os.environ.get("RISKGUARD_BENCHMARK") != "1", reason="耗时比例断言，设置 RISKGUARD_BENCHMARK=1 时运行")
+def test_benchmark_against_legacy():
+    results = run_benchmarks(min_seconds=0.01)
+    new, old = results["many_open_braces"]
+    # 旧实现在该形态上是平方复杂度，新实现有候选数上限，应快一个数量级以上
+    assert new * 10 < old
+    # 常见形态不应明显退化（留足余量，避免机器抖动导致误报）
+    for name in ("bare", "fenced", "prose_wrapped", "web_search_long"):
+        new, old = results[name]
+        assert new < old * 3 + 50, name
+
+
+if __name__ == "__main__":
+    print("%-26s %12s %12s %8s" % ("shape", "new(us)", "legacy(us)", "speedup"))
+    for name, (new, old) in run_benchmarks(min_seconds=0.2).items():
+        print("%-26s %12.1f %12.1f %7.1fx" % (name, new, old, old / new if new else float("inf")))
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+批量新闻分析测试：多条新闻合并为一次请求；缺失/无法解析的条目才回退单条调用；结果与单条缓存互通。
+"""
+
+import re
+
+import pytest
+
+from backend.services import llm_cache, llm_service
+
+
+@pytest.fixture()
+def fake_llm(tmp_path, monkeypatch):
+    monkeypatch.setattr(llm_cache, "CACHE_PATH", str(tmp_path / "llm_cache.db"))
+    llm_cache.reset_stats()
+    calls = {"batch": 0, "single": 0}
+
+    def fake_call_llm(prompt, api_key=None, base_url=None, model=None, enable_search=False, task=None):
+        if not api_key:
+            return None
+        if "逐条分析" in prompt:
+            calls["batch"] += 1
+            ids = [int(x) for x in re.findall(r"^\[(\d+)\]$", prompt, re.M)]
+            items = []
+            for j in ids:
+                title = re.search(r"^\[%d\]\n标题：(.*)$" % j, prompt, re.M).group(1)
+                if title == "坏":
+                    items.append({"id": j, "sentiment_score": "n/a", "risk_level": "极高"})
+                elif title == "漏":
+                    continue
+                else:
+                    items.append({"id": j, "sentiment_score": -0.5, "risk_level": "高", "category": "法律",
+                                  "risk_dimensions": {"legal_risk": "高"}, "keywords": [title]})
+            return {"items": items}
+        calls["single"] += 1
+        return {"sentiment_score": 0.1, "risk_level": "低", "category": "其他", "keywords": ["single"]}
+
+    monkeypatch.setattr(llm_service, "call_llm", fake_call_llm)
+    return calls
+
+
+def test_batch_reduces_round_trips_and_falls_back(fake_llm):
+    items = [{"title": "新闻%d" % i, "content": "内容%d" % i} for i in range(20)]
+    items[3] = {"title": "坏", "content": "x"}
+    items[15] = {"title": "漏", "content": "y"}
+    out = llm_service.analyze_news_batch_for_company("甲公司", items, api_key="k", batch_size=10)
+
+    assert len(out) == 20
+    assert fake_llm == {"batch": 2, "single": 2}
+    assert out[0]["keywords"] == ["新闻0"] and "id" not in out[0]
+    assert out[0]["risk_dimensions"]["financial_risk"] == "中"
+    assert out[3]["keywords"] == ["single"] and out[15]["keywords"] == ["single"]
+
+    # 批量结果写入单条缓存：再次分析（批量或单条）都不再请求模型
+    again = llm_service.analyze_news_batch_for_company("甲公司", items, api_key="k")
+    assert again == out
+    assert llm_service.analyze_news_for_company("甲公司", "新闻7", "内容7", api_key="k")["keywords"] == ["新闻7"]
+    assert fake_llm == {"batch": 2, "single": 2}
+
+
+def test_without_api_key_uses_single_path(fake_llm):
+    out = llm_service.analyze_news_batch_for_company("甲公司", [{"title": "a"}, {"title": "b"}])
+    assert len(out) == 2 and all(o["related"] is False for o in out)
+    assert llm_service.analyze_news_batch_for_company("甲公司", []) == []
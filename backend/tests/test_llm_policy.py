@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 调用策略测试：时延预算内必返回；预算从请求发出时开始计，在网关排队的时间不计入（排队有上限）；
+超过 p95 后对冲到备用模型并取消落后请求；主请求失败后降级（换模型 / 去掉联网），未配置备用模型时使用默认备用；
+按任务与路由统计指标。
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from backend.services import llm_gateway, llm_policy
+from backend.services.llm_gateway import LLMGateway
+
+
+@pytest.fixture(autouse=True)
+def _isolated(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm_policy, "TASK_POLICIES", {"default": {}})
+    llm_policy.metrics.reset()
+    yield
+    llm_policy.metrics.reset()
+
+
+def _gateway(sender, max_in_flight=None):
+    return LLMGateway(rate=1000, burst=1000, max_in_flight=max_in_flight, max_retries=0, sender=sender)
+
+
+def _msgs(text="q"):
+    return [{"role": "user", "content": text}]
+
+
+def test_budget_bounds_a_hung_provider():
+    async def hung(gw, api_key, base_url, model, messages, temperature, extra_body):
+        await asyncio.sleep(30)
+        return "late"
+
+    llm_policy.configure("t", budget_seconds=0.2)
+    gw = _gateway(hung)
+    try:
+        t0 = time.monotonic()
+        with pytest.raises(TimeoutError):
+            llm_policy.run("t", _msgs(), "k", None, "m", gateway=gw)
+        assert time.monotonic() - t0 < 1.0
+        s = llm_policy.stats()["tasks"]["t"]
+        assert s["timeouts"] == 1 and s["failed"] == 1
+        # 超时后上游请求被取消，不再占用并发名额
+        deadline = time.monotonic() + 1
+        while gw.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert gw.stats()["in_flight"] == 0
+    finally:
+        gw.shutdown()
+
+
+async def _sleepy(gw, api_key, base_url, model, messages, temperature, extra_body):
+    await asyncio.sleep(float(messages[0]["content"]))
+    return messages[0]["content"]
+
+
+def _occupy(gw, seconds):
+    """在另一个线程中占住网关唯一的并发名额 seconds 秒。"""
+    llm_policy.configure("occupy", budget_seconds=10)
+    t = threading.Thread(target=llm_policy.run, args=("occupy", _msgs(str(seconds)), "k", None, "m"),
+                         kwargs={"gateway": gw})
+    t.start()
+    deadline = time.monotonic() + 1
+    while not gw.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return t
+
+
+def test_budget_starts_when_request_is_sent():
+    llm_policy.configure("t", budget_seconds=0.3)
+    gw = _gateway(_sleepy, max_in_flight=1)
+    try:
+        occupier = _occupy(gw, 0.5)
+        t0 = time.monotonic()
+        # 排队约 0.5 秒、发出后 0.1 秒返回：不超出 0.3 秒预算
+        assert llm_policy.run("t", _msgs("0.1"), "k", None, "m", gateway=gw) == "0.1"
+        assert time.monotonic() - t0 >= 0.4
+        occupier.join()
+        # 发出后超出预算仍按预算放弃
+        with pytest.raises(TimeoutError, match="budget"):
+            llm_policy.run("t", _msgs("2"), "k", None, "m", gateway=gw)
+    finally:
+        gw.shutdown()
+
+
+def test_queue_wait_is_capped(monkeypatch):
+    monkeypatch.setattr(llm_policy, "MAX_QUEUE_SECONDS", 0.2)
+    llm_policy.configure("t", budget_seconds=5)
+    gw = _gateway(_sleepy, max_in_flight=1)
+    try:
+        occupier = _occupy(gw, 1)
+        t0 = time.monotonic()
+        with pytest.raises(TimeoutError, match="queued"):
+            llm_policy.run("t", _msgs("0.01"), "k", None, "m", gateway=gw)
+        assert time.monotonic() - t0 < 0.8
+        occupier.join()
+    finally:
+        gw.shutdown()
+
+
+def test_hedges_to_secondary_after_p95(monkeypatch):
+    monkeypatch.setattr(llm_policy, "HEDGE_MIN_SAMPLES", 5)
+    monkeypatch.setattr(llm_policy, "HEDGE_MIN_SECONDS", 0.0)
+    slow = {"on": False}
+    seen = []
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        seen.append(model)
+        if model == "primary" and slow["on"]:
+            await asyncio.sleep(5)
+        else:
+            await asyncio.sleep(0.02)
+        return model
+
+    llm_policy.configure("news_analyze", model="primary", fallback_model="backup", budget_seconds=3)
+    gw = _gateway(sender)
+    try:
+        for i in range(5):
+            assert llm_policy.run("news_analyze", _msgs(str(i)), "k", None, "user-model", gateway=gw) == "primary"
+        slow["on"] = True
+        t0 = time.monotonic()
+        assert llm_policy.run("news_analyze", _msgs("x"), "k", None, "user-model", gateway=gw) == "backup"
+        assert time.monotonic() - t0 < 1.0
+        s = llm_policy.stats()
+        assert s["tasks"]["news_analyze"]["hedges"] == 1 and s["tasks"]["news_analyze"]["hedge_wins"] == 1
+        assert s["routes"]["news_analyze/primary"]["cancelled"] == 1
+        assert s["routes"]["news_analyze/backup"]["ok"] == 1
+        assert s["tasks"]["news_analyze"]["p95_ms"] is not None
+    finally:
+        gw.shutdown()
+
+
+def test_fallback_after_failure():
+    calls = []
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        calls.append((model, extra_body))
+        if extra_body:
+            raise ValueError("model does not support search")
+        return "ok"
+
+    gw = _gateway(sender)
+    try:
+        # 联网任务：去掉联网再试（与原 call_llm 行为一致）
+        assert llm_policy.run("company_info", _msgs(), "k", None, "qwen", enable_search=True, gateway=gw) == "ok"
+        assert calls == [("qwen", {"enable_search": True}), ("qwen", None)]
+        assert llm_policy.stats()["tasks"]["company_info"]["fallback_wins"] == 1
+
+        # 未配置备用模型：按 FALLBACK_MODELS 降级到同一提供方的备用模型
+        calls.clear()
+        assert llm_policy.run("company_info", _msgs(), "k", None, "qwen3-max", enable_search=True, gateway=gw) == "ok"
+        assert calls == [("qwen3-max", {"enable_search": True}), ("qwen-plus", None)]
+
+        # 非联网任务且主模型没有默认备用：不重复发送同一请求，直接抛出
+        async def bad(gw, *args):
+            calls.append("bad")
+            raise ValueError("bad request")
+
+        gw2 = _gateway(bad)
+        try:
+            calls.clear()
+            with pytest.raises(ValueError):
+                llm_policy.run("sentiment", _msgs(), "k", None, "m", gateway=gw2)
+            assert calls == ["bad"]
+        finally:
+            gw2.shutdown()
+    finally:
+        gw.shutdown()
+
+
+def test_call_llm_routes_through_policy(monkeypatch):
+    from backend.services import llm_service
+
+    captured = {}
+
+    def fake_run(task, messages, api_key, base_url, model, enable_search=False, temperature=0.3):
+        captured.update(task=task, model=model, enable_search=enable_search)
+        return '前言 ```json\n{"a": 1}\n```'
+
+    monkeypatch.setattr(llm_policy, "run", fake_run)
+    assert llm_service.call_llm("p", "k", None, "m", enable_search=True, task="company_info") == {"a": 1}
+    assert captured == {"task": "company_info", "model": "m", "enable_search": True}
+
+    def failing_run(*args, **kwargs):
+        raise TimeoutError("budget")
+
+    monkeypatch.setattr(llm_policy, "run", failing_run)
+    assert llm_service.call_llm("p", "k") is None
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+流式输出测试：网关逐段转发并在首个 token 前可重试；空闲时产出心跳；调用方提前关闭时取消上游；
+问答/尽调补充的流式生成器最后产出结构化结果；同时进行的流数有上限，按服务器线程数计算。
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from backend.services import llm_gateway, llm_service
+from backend.services.llm_gateway import LLMGateway
+
+
+class _HTTPError(Exception):
+    def __init__(self, status_code):
+        super().__init__("status %d" % status_code)
+        self.status_code = status_code
+
+
+@pytest.fixture(autouse=True)
+def _fast_backoff(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "BACKOFF_BASE_SECONDS", 0.01)
+
+
+def _msgs(text):
+    return [{"role": "user", "content": text}]
+
+
+def test_stream_yields_tokens_and_retries_before_first_token():
+    attempts = []
+
+    async def streamer(gw, api_key, base_url, model, messages, temperature, extra_body):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise _HTTPError(503)
+        for piece in ("你", "好", "！"):
+            await asyncio.sleep(0.01)
+            yield piece
+
+    gw = LLMGateway(rate=1000, burst=1000, streamer=streamer)
+    try:
+        assert [p for p in gw.stream("k", None, "m", _msgs("q")) if p is not None] == ["你", "好", "！"]
+        s = gw.stats()
+        assert len(attempts) == 2 and s["retries"] == 1
+        assert s["streams"] == 1 and s["stream_first_tokens"] == 1 and s["in_flight"] == 0
+        assert s["avg_first_token_ms"] is not None
+    finally:
+        gw.shutdown()
+
+
+def test_error_after_first_token_is_not_retried():
+    attempts = []
+
+    async def streamer(gw, *args):
+        attempts.append(1)
+        yield "半"
+        raise _HTTPError(502)
+
+    gw = LLMGateway(rate=1000, burst=1000, streamer=streamer)
+    try:
+        got = []
+        with pytest.raises(_HTTPError):
+            for p in gw.stream("k", None, "m", _msgs("q")):
+                got.append(p)
+        assert got == ["半"] and len(attempts) == 1
+        assert gw.stats()["errors"] == 1
+    finally:
+        gw.shutdown()
+
+
+def test_idle_ping_and_cancel_on_close():
+    async def slow(gw, *args):
+        yield "a"
+        await asyncio.sleep(5)
+        yield "b"
+
+    gw = LLMGateway(rate=1000, burst=1000, streamer=slow)
+    try:
+        it = gw.stream("k", None, "m", _msgs("q"), idle_timeout=0.05)
+        assert next(it) == "a"
+        assert next(it) is None  # 空闲心跳
+        it.close()  # 模拟客户端断开
+        deadline = time.monotonic() + 2
+        while gw.stats()["in_flight"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        s = gw.stats()
+        assert s["in_flight"] == 0 and s["streams_cancelled"] == 1
+    finally:
+        gw.shutdown()
+
+
+@pytest.fixture()
+def fake_stream(monkeypatch):
+    def install(pieces, error=None):
+        def stream(api_key, base_url, model, messages, temperature=0.3, extra_body=None, **kw):
+            for p in pieces:
+                yield p
+            if error is not None:
+                raise error
+        monkeypatch.setattr(llm_gateway, "stream", stream)
+    return install
+
+
+def test_stream_company_answer_events(fake_stream):
+    fake_stream(["该企业", None, "风险较低。"])
+    events = list(llm_service.stream_company_answer("甲公司", "上下文", "风险如何？", api_key="k"))
+    assert events == [
+        ("token", {"text": "该企业"}),
+        ("ping", None),
+        ("token", {"text": "风险较低。"}),
+        ("done", {"answer": "该企业风险较低。"}),
+    ]
+
+    fake_stream(["半句"], error=RuntimeError("boom"))
+    events = list(llm_service.stream_company_answer("甲公司", "上下文", "问题", api_key="k"))
+    assert events[0] == ("token", {"text": "半句"})
+    assert events[-1][0] == "error" and "boom" in events[-1][1]["message"]
+
+    assert list(llm_service.stream_company_answer("甲公司", "", "问题")) == [("done", {"answer": "请配置 LLM 并输入问题。"})]
+
+
+def test_stream_supplement_chat_parses_final_json(fake_stream):
+    fake_stream(['```json\n{"updates": {"legal_representative": "张三"}', ', "summary": "已归集：法人"}\n```'])
+    events = list(llm_service.stream_supplement_chat("甲公司", "摘要", "法人是张三", api_key="k"))
+    assert [e for e, _ in events] == ["token", "token", "done"]
+    assert events[-1][1] == {"updates": {"legal_representative": "张三"}, "summary": "已归集：法人"}
+
+    fake_stream(["不是 JSON"])
+    done = list(llm_service.stream_supplement_chat("甲公司", "摘要", "x", api_key="k"))[-1]
+    assert done == ("done", llm_service.SUPPLEMENT_FALLBACK)
+
+
+def test_stream_limit_follows_server_threads():
+    assert llm_service.stream_limit("32") == 16
+    assert llm_service.stream_limit("8") == 4
+    assert llm_service.stream_limit("1") == 1
+    assert llm_service.stream_limit(None) == llm_service.DEFAULT_MAX_STREAMS
+    assert llm_service.stream_limit("32", explicit="5") == 5
+
+
+def test_stream_slots_are_bounded(monkeypatch):
+    import threading
+    monkeypatch.setattr(llm_service, "_stream_slots", threading.BoundedSemaphore(2))
+    assert llm_service.acquire_stream_slot() and llm_service.acquire_stream_slot()
+    assert not llm_service.acquire_stream_slot()
+    llm_service.release_stream_slot()
+    assert llm_service.acquire_stream_slot()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+LLM 遥测测试：每次真正发出的上游请求按任务/模型/结果记录 token 与耗时；合并的请求不重复计；
+流式请求记录最后一个分片返回的用量；聚合写入 llm_call_stats 并可按任务汇总与估算费用；过期小时桶被清理。
+"""
+
+import asyncio
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from backend.services import llm_gateway, llm_policy, llm_telemetry
+from backend.services.llm_gateway import LLMGateway, LLMText
+
+
+@pytest.fixture()
+def telemetry(tmp_path, monkeypatch):
+    monkeypatch.setenv("RISKGUARD_LLM_TELEMETRY", "1")
+    monkeypatch.setattr(llm_telemetry, "DB_PATH", str(tmp_path / "main.db"))
+    monkeypatch.setattr(llm_telemetry, "MODEL_PRICES_PER_1K", {"cheap": (0.001, 0.002)})
+    monkeypatch.setattr(llm_telemetry, "_last_prune", 0.0)
+    monkeypatch.setattr(llm_gateway, "BACKOFF_BASE_SECONDS", 0.01)
+    monkeypatch.setattr(llm_policy, "TASK_POLICIES", {"default": {}})
+    llm_telemetry._pending.clear()
+    yield str(tmp_path / "main.db")
+    llm_telemetry._pending.clear()
+
+
+class _HTTPError(Exception):
+    status_code = 503
+
+
+def test_records_usage_latency_and_outcome(telemetry):
+    calls = {"n": 0}
+
+    async def sender(gw, api_key, base_url, model, messages, temperature, extra_body):
+        calls["n"] += 1
+        if messages[0]["content"] == "flaky" and calls["n"] == 1:
+            raise _HTTPError()
+        await asyncio.sleep(0.05)
+        text = LLMText("ok")
+        text.usage = (100, 20) if model == "cheap" else None
+        return text
+
+    gw = LLMGateway(rate=1000, burst=1000, sender=sender)
+    try:
+        assert llm_policy.run("news_analyze", [{"role": "user", "content": "flaky"}], "k", None, "cheap", gateway=gw) == "ok"
+        # 8 个相同请求合并为 1 次上游调用，只记一次
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(lambda _: gw.complete("k", None, "cheap", [{"role": "user", "content": "same"}],
+                                                task="news_analyze"), range(8)))
+        llm_policy.run("company_info", [{"role": "user", "content": "x"}], "k", None, "search-model", gateway=gw)
+    finally:
+        gw.shutdown()
+
+    out = llm_telemetry.summary(24)
+    by_route = {(r["task"], r["model"]): r for r in out["items"]}
+    news = by_route[("news_analyze", "cheap")]
+    assert news["calls"] == 3 and news["ok"] == 2 and news["error"] == 1
+    assert news["prompt_tokens"] == 200 and news["completion_tokens"] == 40
+    assert news["avg_latency_ms"] > 0 and news["max_latency_ms"] >= 50
+    assert news["est_cost"] == pytest.approx(200 / 1000 * 0.001 + 40 / 1000 * 0.002)
+    info = by_route[("company_info", "search-model")]
+    assert info["calls_without_usage"] == 1 and info["est_cost"] is None
+    assert out["totals"]["calls"] == 4
+
+    conn = sqlite3.connect(telemetry)
+    rows = conn.execute("SELECT task, model, outcome, calls FROM llm_call_stats ORDER BY task, outcome").fetchall()
+    conn.close()
+    assert rows == [("company_info", "search-model", "ok", 1), ("news_analyze", "cheap", "error", 1),
+                    ("news_analyze", "cheap", "ok", 2)]
+
+
+def _chunk(content=None, usage=None):
+    choices = [SimpleNamespace(delta=SimpleNamespace(content=content))] if content is not None else []
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def test_stream_records_final_chunk_usage(telemetry, monkeypatch):
+    requests = []
+
+    class _Completions:
+        async def create(self, **kwargs):
+            requests.append(kwargs)
+
+            async def chunks():
+                for piece in ("风", "险"):
+                    yield _chunk(piece)
+                # include_usage：最后一个分片没有 choices，只带用量
+                yield _chunk(usage=SimpleNamespace(prompt_tokens=30, completion_tokens=7))
+
+            return chunks()
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=_Completions()))
+    monkeypatch.setattr(llm_gateway, "_async_client", lambda gw, api_key, base_url: client)
+    gw = LLMGateway(rate=1000, burst=1000)
+    try:
+        assert [p for p in gw.stream("k", None, "cheap", [{"role": "user", "content": "q"}], task="ask")
+                if p is not None] == ["风", "险"]
+    finally:
+        gw.shutdown()
+    assert requests[0]["stream"] is True and requests[0]["stream_options"] == {"include_usage": True}
+    ask = {(r["task"], r["model"]): r for r in llm_telemetry.summary(24)["items"]}[("ask", "cheap")]
+    assert (ask["calls"], ask["prompt_tokens"], ask["completion_tokens"], ask["calls_without_usage"]) == (1, 30, 7, 0)
+
+
+def test_flush_merges_and_prunes(telemetry):
+    llm_telemetry.record("sentiment", "m", "ok", 0.1, (10, 5))
+    assert llm_telemetry.flush() == 1
+    llm_telemetry.record("sentiment", "m", "ok", 0.3, (10, 5))
+    llm_telemetry.flush()
+    conn = sqlite3.connect(telemetry)
+    conn.execute("INSERT INTO llm_call_stats (bucket, task, model, outcome, calls) VALUES ('2000-01-01 00:00','old','m','ok',1)")
+    conn.commit()
+    conn.close()
+    llm_telemetry._last_prune = 0.0
+    llm_telemetry.record("sentiment", "m", "ok", 0.2)
+    llm_telemetry.flush()
+    conn = sqlite3.connect(telemetry)
+    rows = conn.execute("SELECT task, calls, prompt_tokens, calls_without_usage, latency_ms_max FROM llm_call_stats").fetchall()
+    conn.close()
+    assert rows == [("sentiment", 3, 20, 1, pytest.approx(300.0))]
+
+
+def test_disabled_records_nothing(telemetry, monkeypatch):
+    monkeypatch.setenv("RISKGUARD_LLM_TELEMETRY", "0")
+    llm_telemetry.record("sentiment", "m", "ok", 0.1)
+    assert llm_telemetry.flush() == 0
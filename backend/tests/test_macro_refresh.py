@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+宏观政策新闻刷新测试：各维度并发请求并合并去重；一个事务内按标题增删 macro_policy_news；
+宏观指数每天一行，只累加新条目，刷新时移除的已计入条目同一事务内扣除，历史日期的行不被覆盖。
+"""
+
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from backend.services import llm_service, macro_index_service as mis, scheduler_service
+
+
+@pytest.fixture()
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "risk.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE llm_config (api_key TEXT, base_url TEXT, model TEXT, enable_web_search INTEGER);
+        INSERT INTO llm_config VALUES ('k', NULL, 'm', 1);
+        CREATE TABLE macro_policy_news (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, content TEXT NOT NULL, source TEXT,
+            dimension TEXT, published_at TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, risk_score REAL);
+        CREATE TABLE macro_daily_index (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, ts_date TEXT NOT NULL UNIQUE,
+            policy_score REAL NOT NULL DEFAULT 0, macro_risk_score REAL NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, item_count INTEGER NOT NULL DEFAULT 0,
+            score_sum REAL NOT NULL DEFAULT 0, last_item_id INTEGER NOT NULL DEFAULT 0);
+        """
+    )
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(scheduler_service, "DB_PATH", path)
+    monkeypatch.setattr(mis, "DB_PATH", path)
+    return path
+
+
+def _rows(path, sql):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute(sql).fetchall()
+    finally:
+        conn.close()
+
+
+def test_dimensions_requested_concurrently(monkeypatch):
+    active = {"now": 0, "max": 0}
+    lock = threading.Lock()
+
+    def fake_call_llm(prompt, api_key, base_url=None, model=None, enable_search=False, task="default"):
+        assert task == "macro_policy"
+        with lock:
+            active["now"] += 1
+            active["max"] = max(active["max"], active["now"])
+        time.sleep(0.05)
+        with lock:
+            active["now"] -= 1
+        dim = prompt.split("「", 1)[1].split("」", 1)[0]
+        if dim == "国际":
+            return None
+        # 所有维度都返回同一条共享新闻，合并后只保留一条，且维度取请求时的维度
+        return {"items": [{"title": "%s动态" % dim, "content": "内容", "source": "来源", "dimension": "其他"},
+                          {"title": "共享新闻", "content": "x"}]}
+
+    monkeypatch.setattr(llm_service, "call_llm", fake_call_llm)
+    t0 = time.monotonic()
+    items = llm_service.generate_macro_policy_news_by_dimension("k")
+    assert time.monotonic() - t0 < 0.05 * len(llm_service.MACRO_DIMENSIONS) / 2
+    assert active["max"] > 1
+    titles = [it["title"] for it in items]
+    assert titles[0] == "政策动态" and "国际动态" not in titles
+    assert titles.count("共享新闻") == 1
+    assert {it["title"]: it["dimension"] for it in items}["监管动态"] == "监管"
+
+
+def test_swap_keeps_existing_rows_and_scores_new(db, monkeypatch):
+    batches = [
+        [{"title": "A", "content": "监管趋严", "dimension": "监管"}, {"title": "B", "content": "平稳", "dimension": "产业"}],
+        [{"title": "B", "content": "平稳", "dimension": "产业"}, {"title": "C", "content": "平稳", "dimension": "市场环境"}],
+    ]
+    monkeypatch.setattr(llm_service, "generate_macro_policy_news_by_dimension", lambda **kw: batches.pop(0))
+
+    assert scheduler_service.refresh_macro_policy_news() == {"items": 2, "inserted": 2, "deleted": 0}
+    first = dict(_rows(db, "SELECT title, id FROM macro_policy_news"))
+    assert scheduler_service.refresh_macro_policy_news() == {"items": 2, "inserted": 1, "deleted": 1}
+    rows = {t: (i, s) for t, i, s in _rows(db, "SELECT title, id, risk_score FROM macro_policy_news")}
+    assert set(rows) == {"B", "C"}
+    assert rows["B"][0] == first["B"]  # 未变化的条目保留原行
+    assert rows["C"][1] == pytest.approx(mis.DIMENSION_RISK_WEIGHT["市场环境"])
+
+    # 当日指数：A、B 为基线，第二轮扣除被移除的 A、只累加新条目 C
+    (count, total, policy), = _rows(db, "SELECT item_count, score_sum, policy_score FROM macro_daily_index")
+    expected = [mis.item_score("产业", "B", "平稳"), mis.item_score("市场环境", "C", "平稳")]
+    assert count == 2 and total == pytest.approx(sum(expected))
+    assert policy == pytest.approx(sum(expected) / 2)
+
+
+def test_swap_removing_everything_rebaselines_index(db, monkeypatch):
+    batches = [[{"title": "A", "content": "监管趋严", "dimension": "监管"}],
+               [{"title": "B", "content": "平稳", "dimension": "产业"}]]
+    monkeypatch.setattr(llm_service, "generate_macro_policy_news_by_dimension", lambda **kw: batches.pop(0))
+    scheduler_service.refresh_macro_policy_news()
+    # 第二轮 A 被移除、当日计数扣到 0：以当前全部条目（只有 B）为新基线
+    scheduler_service.refresh_macro_policy_news()
+    assert _rows(db, "SELECT item_count, score_sum FROM macro_daily_index") == [
+        (1, pytest.approx(mis.item_score("产业", "B", "平稳")))]
+    # 其他日期的行不受当日扣除影响
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO macro_daily_index (ts_date, item_count, score_sum, last_item_id) "
+                 "VALUES ('2000-01-01', 5, 4.0, 100)")
+    conn.commit()
+    conn.close()
+    batches.append([{"title": "C", "content": "", "dimension": "国际"}])
+    scheduler_service.refresh_macro_policy_news()
+    assert _rows(db, "SELECT item_count, score_sum FROM macro_daily_index WHERE ts_date = '2000-01-01'") == [(5, 4.0)]
+
+
+def test_index_keeps_daily_history_and_backfills(db):
+    conn = sqlite3.connect(db)
+    conn.executemany(
+        "INSERT INTO macro_policy_news (title, content, dimension) VALUES (?, ?, ?)",
+        [("旧条目1", "处罚", "合规"), ("旧条目2", "", "产业")],
+    )
+    conn.commit()
+    conn.close()
+
+    assert mis.compute_and_save_macro_index(ts_date="2026-01-01")
+    # 旧数据计算时补打分
+    assert all(s is not None for (s,) in _rows(db, "SELECT risk_score FROM macro_policy_news"))
+    # 同一天再算一次：没有新条目，结果不变
+    assert mis.compute_and_save_macro_index(ts_date="2026-01-01")
+    day1 = _rows(db, "SELECT item_count, policy_score FROM macro_daily_index WHERE ts_date = '2026-01-01'")
+    assert day1[0][0] == 2
+
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO macro_policy_news (title, content, dimension, risk_score) VALUES ('新条目', '', '国际', 0.8)")
+    conn.commit()
+    conn.close()
+    assert mis.compute_and_save_macro_index(ts_date="2026-01-02")
+    history = mis.get_macro_index_history(10)
+    assert [h["date"] for h in history] == ["2026-01-02", "2026-01-01"]
+    assert _rows(db, "SELECT item_count, policy_score FROM macro_daily_index WHERE ts_date = '2026-01-01'") == day1
+    # 新的一天以当前全部条目为基线
+    assert _rows(db, "SELECT item_count FROM macro_daily_index WHERE ts_date = '2026-01-02'") == [(3,)]
+
+
+def test_index_empty_returns_false(db):
+    assert mis.compute_and_save_macro_index() is False
+    assert _rows(db, "SELECT COUNT(*) FROM macro_daily_index") == [(0,)]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+模型注册表测试：只加载一次、按版本区分、mtime 变化时热更新、计数正确；
+加载在注册表锁之外进行，同一模型并发请求只加载一次，加载失败后按检查间隔再试。
+"""
+
+import os
+import pickle
+import threading
+
+from backend.ml.model_registry import ModelRegistry
+
+
+class _ConstModel:
+    def __init__(self, p):
+        self.p = p
+
+    def predict_proba(self, X):
+        return [[1 - self.p, self.p] for _ in X]
+
+
+def _pickle_load(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _dump(path, model, mtime):
+    with open(path, "wb") as f:
+        pickle.dump(model, f)
+    os.utime(path, (mtime, mtime))
+
+
+def test_load_once_and_hot_reload(tmp_path):
+    loads = []
+
+    def loader(path):
+        loads.append(path)
+        return _pickle_load(path)
+
+    reg = ModelRegistry(models_dir=str(tmp_path), loader=loader, check_interval=0)
+    assert reg.get("explosion") is None
+
+    path = reg.model_path("explosion")
+    _dump(path, _ConstModel(0.2), 1_000_000)
+    m1 = reg.get("explosion")
+    assert m1.p == 0.2
+    assert reg.get("explosion") is m1
+    assert len(loads) == 1
+
+    # 重新训练覆盖文件（mtime 变化）后自动换新模型
+    _dump(path, _ConstModel(0.7), 1_000_100)
+    m2 = reg.get("explosion")
+    assert m2.p == 0.7
+    assert len(loads) == 2
+
+    s = reg.stats()
+    assert s["loads"] == 2 and s["reloads"] == 1 and s["cache_hits"] == 1
+    assert [m["version"] for m in s["models"]] == ["latest"]
+
+
+def test_versions_and_inference_counters(tmp_path):
+    reg = ModelRegistry(models_dir=str(tmp_path), loader=_pickle_load, check_interval=0)
+    _dump(reg.model_path("explosion"), _ConstModel(0.1), 1_000_000)
+    _dump(reg.model_path("explosion", "v2"), _ConstModel(0.9), 1_000_000)
+    assert reg.get("explosion").p == 0.1
+    assert reg.get("explosion", "v2").p == 0.9
+
+    out = reg.predict_proba(reg.get("explosion", "v2"), [[0.0], [1.0]])
+    assert out[0][1] == 0.9
+    s = reg.stats()
+    assert s["inferences"] == 1
+    assert s["avg_inference_ms"] is not None
+
+
+def test_broken_file_keeps_previous_model(tmp_path):
+    reg = ModelRegistry(models_dir=str(tmp_path), loader=_pickle_load, check_interval=0)
+    path = reg.model_path("explosion")
+    _dump(path, _ConstModel(0.3), 1_000_000)
+    assert reg.get("explosion").p == 0.3
+    with open(path, "wb") as f:
+        f.write(b"not a pickle")
+    os.utime(path, (1_000_200, 1_000_200))
+    assert reg.get("explosion").p == 0.3
+    assert reg.stats()["load_failures"] == 1
+
+
+def test_load_outside_registry_lock(tmp_path):
+    started, release = threading.Event(), threading.Event()
+    loads = []
+
+    def slow_loader(path):
+        loads.append(os.path.basename(path))
+        if path.endswith("_v2.pkl"):
+            started.set()
+            release.wait(5)
+        return _pickle_load(path)
+
+    reg = ModelRegistry(models_dir=str(tmp_path), loader=slow_loader, check_interval=0)
+    _dump(reg.model_path("explosion"), _ConstModel(0.1), 1_000_000)
+    _dump(reg.model_path("explosion", "v2"), _ConstModel(0.9), 1_000_000)
+    got = []
+    threads = [threading.Thread(target=lambda: got.append(reg.get("explosion", "v2"))) for _ in range(3)]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    # v2 加载中：其他模型照常加载、读取，stats 不被阻塞
+    assert reg.get("explosion").p == 0.1
+    assert reg.stats()["loads"] == 1
+    release.set()
+    for t in threads:
+        t.join(5)
+    assert [m.p for m in got] == [0.9, 0.9, 0.9]
+    assert loads.count("risk_classifier_explosion_v2.pkl") == 1
+
+
+def test_failed_reload_waits_for_check_interval(tmp_path):
+    calls = []
+
+    def loader(path):
+        calls.append(path)
+        return _pickle_load(path)
+
+    reg = ModelRegistry(models_dir=str(tmp_path), loader=loader, check_interval=60)
+    path = reg.model_path("explosion")
+    _dump(path, _ConstModel(0.3), 1_000_000)
+    reg.get("explosion")
+    with open(path, "wb") as f:
+        f.write(b"not a pickle")
+    os.utime(path, (1_000_200, 1_000_200))
+    reg._entries[("explosion", "latest")].checked_at -= 120
+    for _ in range(5):
+        assert reg.get("explosion").p == 0.3
+    assert len(calls) == 2 and reg.stats()["load_failures"] == 1
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+批量预测一致性测试：predict_risk_batch 的结果必须与逐个 predict_risk_for_enterprise 一致。
+"""
+
+import random
+import sqlite3
+from datetime import date, timedelta
+
+import pytest
+
+from backend.services import prediction_service as ps
+
+@pytest.fixture()
+def db_path(schema_db):
+    conn = sqlite3.connect(schema_db)
+    rnd = random.Random(11)
+    start = date(2025, 1, 1)
+    # 企业 1~5 序列长度各异（含只有 1 天的），企业 6 无数据
+    for eid, n in ((1, 60), (2, 12), (3, 1), (4, 45), (5, 2)):
+        score = rnd.uniform(20, 80)
+        for i in range(n):
+            score = max(0.0, min(100.0, score + rnd.uniform(-6, 6)))
+            conn.execute(
+                "INSERT INTO enterprise_risk_timeseries (enterprise_id, ts_date, risk_score, score_legal, "
+                "score_business, score_media, score_policy, score_industry) VALUES (?,?,?,?,0,0,0,0)",
+                (eid, (start + timedelta(days=i)).isoformat(), score, rnd.random()),
+            )
+    conn.execute("INSERT INTO backtest_metrics (metric_name, value_real) VALUES ('residual_std_7d', 4.5)")
+    conn.commit()
+    conn.close()
+    return schema_db
+
+
+def _strip(result):
+    out = dict(result)
+    out.pop("generated_at", None)
+    return out
+
+
+def test_batch_matches_single(db_path):
+    ids = [1, 2, 3, 4, 5, 6]
+    batch = ps.predict_risk_batch(ids, horizon_days=14, db_path=db_path, include_history=True)
+    assert batch["count"] == len(ids)
+    assert [r["enterprise_id"] for r in batch["results"]] == ids
+    for eid, got in zip(ids, batch["results"]):
+        want = ps.predict_risk_for_enterprise(eid, horizon_days=14, db_path=db_path)
+        got, want = _strip(got), _strip(want)
+        if not want["predictions"]:
+            assert got == want
+            continue
+        assert got["trend_description"] == want["trend_description"]
+        assert got["history"] == want["history"]
+        for g, w in zip(got["predictions"], want["predictions"]):
+            assert g["date"] == w["date"]
+            assert g["risk_score"] == pytest.approx(w["risk_score"], abs=1e-9)
+            assert g["risk_level"] == w["risk_level"]
+            assert g["confidence_interval"] == pytest.approx(w["confidence_interval"], abs=1e-9)
+
+
+def test_batch_residual_std_fallback_and_dedupe(db_path):
+    batch = ps.predict_risk_batch([2, 2, 1], horizon_days=30, db_path=db_path)
+    # 无 30d 残差时回退到 7d；重复 id 只预测一次；默认不回传历史
+    assert batch["confidence_interval_based_on_backtest"] is True
+    assert [r["enterprise_id"] for r in batch["results"]] == [2, 1]
+    assert all(r["history"] == [] for r in batch["results"])
+    assert len(batch["results"][0]["predictions"]) == 30
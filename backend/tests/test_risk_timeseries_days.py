@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+按日桶增量重算测试：recompute_timeseries_days 只改传入的日期，未传入的日桶保持原样；
+当日已无事件的日桶被删除；与特征增量抽取的 dirty_dates 串联后结果与全量重建一致。
+"""
+
+import sqlite3
+
+import pytest
+
+from backend.services import feature_extraction_service as fes
+from backend.services import risk_timeseries_service as rts
+
+
+def _add_news(path, company_id, publish_date, risk_level="中", sentiment=0.0, category="经营"):
+    conn = sqlite3.connect(path)
+    cur = conn.execute(
+        "INSERT INTO company_news (company_id, title, content, risk_level, sentiment_score, category, publish_date) "
+        "VALUES (?, 't', '', ?, ?, ?, ?)", (company_id, risk_level, sentiment, category, publish_date))
+    conn.commit()
+    conn.close()
+    return cur.lastrowid
+
+
+def _execute(path, sql, params=()):
+    conn = sqlite3.connect(path)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def _series(path, enterprise_id=None):
+    conn = sqlite3.connect(path)
+    where, params = ("WHERE enterprise_id=?", (enterprise_id,)) if enterprise_id else ("", ())
+    rows = conn.execute(
+        "SELECT enterprise_id, ts_date, risk_score, news_count, neg_news_ratio, score_legal, score_business "
+        "FROM enterprise_risk_timeseries %s ORDER BY enterprise_id, ts_date" % where, params).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture()
+def db(schema_db, monkeypatch):
+    monkeypatch.setattr(rts, "_feature_store", None)
+    conn = sqlite3.connect(schema_db)
+    conn.executemany("INSERT INTO companies (id, name) VALUES (?, ?)", [(1, "甲"), (2, "乙")])
+    conn.commit()
+    conn.close()
+    for day in ("2026-01-01", "2026-01-02", "2026-01-03"):
+        _add_news(schema_db, 1, day)
+    _add_news(schema_db, 2, "2026-01-02")
+    fes.update_news_features(schema_db)
+    rts.rebuild_timeseries_for_all(schema_db)
+    return schema_db
+
+
+def test_only_requested_days_are_touched(db):
+    # 两天的特征都变重，只重算其中一天：另一天保持旧值
+    _execute(db, "UPDATE enterprise_event_feature SET severity_score=0.9, event_type='LEGAL_PENALTY' "
+                 "WHERE enterprise_id=1 AND event_date IN ('2026-01-01', '2026-01-03')")
+    before = {r[1]: r for r in _series(db, 1)}
+    other = _series(db, 2)
+    assert rts.recompute_timeseries_days(1, ["2026-01-03"], db_path=db) == 1
+    after = {r[1]: r for r in _series(db, 1)}
+    assert after["2026-01-01"] == before["2026-01-01"]
+    assert after["2026-01-02"] == before["2026-01-02"]
+    assert after["2026-01-03"][5] == 0.9 and after["2026-01-03"][2] >= 58.0
+    # 其他企业不受影响
+    assert _series(db, 2) == other
+
+
+def test_empty_day_is_deleted_and_new_day_inserted(db):
+    _execute(db, "DELETE FROM enterprise_event_feature WHERE enterprise_id=1 AND event_date='2026-01-02'")
+    _execute(db, "INSERT INTO enterprise_event_feature (enterprise_id, source_type, source_id, event_date, event_type, "
+                 "severity_score, sentiment_score) VALUES (1, 'POLICY', 900, '2026-01-09', 'OTHER', 0.4, 0)")
+    # 重复日期、空值被忽略；已无事件的日桶删除，新日桶写入
+    assert rts.recompute_timeseries_days(1, ["2026-01-02", "2026-01-09", "2026-01-09", None, ""], db_path=db) == 1
+    assert [r[1] for r in _series(db, 1)] == ["2026-01-01", "2026-01-03", "2026-01-09"]
+    assert rts.recompute_timeseries_days(1, [], db_path=db) == 0
+
+
+def test_dates_chunked_below_param_limit(db, monkeypatch):
+    monkeypatch.setattr(rts, "_MAX_IN_PARAMS", 2)
+    _execute(db, "UPDATE enterprise_event_feature SET severity_score=0.7 WHERE enterprise_id=1")
+    days = ["2026-01-01", "2026-01-02", "2026-01-03", "2026-01-04", "2026-01-05"]
+    assert rts.recompute_timeseries_days(1, days, db_path=db) == 3
+    assert {r[1] for r in _series(db, 1)} == {"2026-01-01", "2026-01-02", "2026-01-03"}
+
+
+def test_dirty_dates_pipeline_matches_full_rebuild(db):
+    # 新增、删除新闻后，用特征抽取返回的 dirty_dates 做日桶重算，结果与全量重建一致
+    _add_news(db, 1, "2026-01-02", risk_level="高", sentiment=-0.6, category="法律")
+    _add_news(db, 2, "2026-01-07")
+    _execute(db, "DELETE FROM company_news WHERE company_id=1 AND publish_date='2026-01-01'")
+    res = fes.update_news_features(db)
+    assert res["dirty_dates"] == {1: ["2026-01-01", "2026-01-02"], 2: ["2026-01-07"]}
+    for eid, dates in res["dirty_dates"].items():
+        rts.recompute_timeseries_days(eid, dates, db_path=db)
+    incremental = _series(db)
+    rts.rebuild_timeseries_for_all(db)
+    assert _series(db) == incremental
+    assert "2026-01-01" not in {r[1] for r in incremental if r[0] == 1}
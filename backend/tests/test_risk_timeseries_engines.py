@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+风险时间序列聚合引擎一致性测试：sql 引擎（GROUP BY 下推）与 python 引擎（逐行计算）结果必须一致。
+"""
+
+import random
+import sqlite3
+
+import pytest
+
+from backend.services import risk_timeseries_service as rts
+
+EVENT_TYPES = ["LEGAL_PENALTY", "litigation", "BUSINESS", "FINANCIAL_STRESS", "PUBLIC_OPINION", "OTHER", ""]
+SOURCE_TYPES = ["NEWS", "NEWS", "NEWS", "POLICY", "SOCIAL"]
+DIRECTIONS = [None, "", "NEGATIVE", "negative", "POSITIVE", "NEUTRAL"]
+
+TS_COLUMNS = (
+    "enterprise_id, ts_date, score_legal, score_business, score_media, score_policy, score_industry, "
+    "risk_score, news_count, neg_news_ratio, sentiment_index, sentiment_vol, policy_impact"
+)
+
+
+def _maybe_none(rng, value, p=0.1):
+    return None if rng.random() < p else value
+
+
+@pytest.fixture
+def db_path(schema_db):
+    rng = random.Random(20250205)
+    conn = sqlite3.connect(schema_db)
+    for i in range(1, 6):
+        conn.execute("INSERT INTO companies (name) VALUES (?)", ("企业%d" % i,))
+    rows = []
+    for n in range(3000):
+        rows.append((
+            rng.randint(1, 5),
+            rng.choice(SOURCE_TYPES),
+            n,
+            "2025-%02d-%02d" % (rng.randint(1, 3), rng.randint(1, 28)),
+            rng.choice(EVENT_TYPES),
+            _maybe_none(rng, round(rng.uniform(-1, 1), 3)),
+            _maybe_none(rng, round(rng.uniform(0, 1), 3)),
+            rng.choice(DIRECTIONS),
+            _maybe_none(rng, round(rng.uniform(-0.2, 1), 3), p=0.4),
+        ))
+    conn.executemany(
+        """
+        INSERT INTO enterprise_event_feature (
+            enterprise_id, source_type, source_id, event_date, event_type,
+            sentiment_score, severity_score, policy_direction, policy_strength
+        ) VALUES (?,?,?,?,?,?,?,?,?)
+        """,
+        rows,
+    )
+    conn.commit()
+    conn.close()
+    return schema_db
+
+
+def _snapshot(path):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT %s FROM enterprise_risk_timeseries ORDER BY enterprise_id, ts_date" % TS_COLUMNS).fetchall()
+    conn.close()
+    return rows
+
+
+def _assert_same(left, right):
+    assert len(left) == len(right)
+    for a, b in zip(left, right):
+        assert a[:2] == b[:2]
+        for x, y in zip(a[2:], b[2:]):
+            if x is None or y is None:
+                assert x is y
+            else:
+                assert x == pytest.approx(y, abs=1e-9)
+
+
+def test_rebuild_for_enterprise_engines_match(db_path):
+    for eid in range(1, 6):
+        rts.rebuild_timeseries_for_enterprise(eid, db_path=db_path, engine=rts.ENGINE_PYTHON)
+    expected = _snapshot(db_path)
+    assert expected
+    for eid in range(1, 6):
+        rts.rebuild_timeseries_for_enterprise(eid, db_path=db_path, engine=rts.ENGINE_SQL)
+    _assert_same(_snapshot(db_path), expected)
+
+
+def test_rebuild_for_all_matches_per_enterprise(db_path):
+    for eid in range(1, 6):
+        rts.rebuild_timeseries_for_enterprise(eid, db_path=db_path, engine=rts.ENGINE_PYTHON)
+    expected = _snapshot(db_path)
+    written = rts.rebuild_timeseries_for_all(db_path=db_path, engine=rts.ENGINE_SQL)
+    assert written == len(expected)
+    _assert_same(_snapshot(db_path), expected)
+
+
+def test_recompute_days_matches_full_rebuild(db_path):
+    rts.rebuild_timeseries_for_all(db_path=db_path, engine=rts.ENGINE_PYTHON)
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM enterprise_event_feature WHERE enterprise_id=2 AND event_date='2025-02-10'")
+    conn.execute("UPDATE enterprise_event_feature SET severity_score=0.95 WHERE enterprise_id=2 AND event_date='2025-01-05'")
+    conn.commit()
+    conn.close()
+
+    rts.recompute_timeseries_days(2, ["2025-02-10", "2025-01-05"], db_path=db_path, engine=rts.ENGINE_SQL)
+    incremental = _snapshot(db_path)
+    rts.rebuild_timeseries_for_enterprise(2, db_path=db_path, engine=rts.ENGINE_PYTHON)
+    _assert_same(incremental, _snapshot(db_path))
+
+
+def test_unknown_engine_rejected(db_path):
+    with pytest.raises(ValueError):
+        rts.rebuild_timeseries_for_enterprise(1, db_path=db_path, engine="numpy")
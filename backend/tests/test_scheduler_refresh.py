@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+企业刷新流水线测试：并发采集 + 单写线程分批提交；单个企业失败不影响其他企业；
+整批提交失败时整批计入失败；提交后的同步任务不在写线程上执行；不允许两轮叠加。
+"""
+
+import sqlite3
+import threading
+
+import pytest
+
+from backend.services import enterprise_crawler, llm_service
+from backend.services import scheduler_service as sched
+
+@pytest.fixture()
+def db_path(schema_db, monkeypatch):
+    path = schema_db
+    conn = sqlite3.connect(path)
+    for i in range(1, 13):
+        conn.execute("INSERT INTO companies (name, risk_level) VALUES (?, '低')", ("企业%d" % i,))
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(sched, "DB_PATH", path)
+
+    monkeypatch.setattr(enterprise_crawler, "fetch_company_info", lambda name: {"industry": "制造", "business_status": "存续"})
+    monkeypatch.setattr(enterprise_crawler, "fetch_news_for_company",
+                        lambda name: [{"title": "%s 新闻%d" % (name, k), "content": "c"} for k in range(3)])
+
+    def sentiment(name, text, *a, **kw):
+        if name == "企业5":
+            raise RuntimeError("llm down")
+        level = "高" if name in ("企业2", "企业3") else "中"
+        return {"summary": "ok", "risk_level": level, "keywords": ["k1", "k2", "k1"]}
+
+    monkeypatch.setattr(llm_service, "analyze_sentiment_and_keywords", sentiment)
+    monkeypatch.setattr(llm_service, "analyze_news_for_company",
+                        lambda *a, **kw: {"sentiment_score": -0.5, "risk_level": "medium", "category": "x", "keywords": []})
+    written = []
+    monkeypatch.setattr(sched, "_after_company_written", lambda res, llm: written.append(res["cid"]))
+    monkeypatch.setattr(sched, "WRITE_BATCH_SIZE", 4)
+    return path, written
+
+
+def test_pipeline_writes_all_companies(db_path):
+    path, written = db_path
+    summary = sched.refresh_all_companies(workers=4)
+    assert summary == {"companies": 12, "written": 11, "failed": 1}
+    assert sorted(written) == [i for i in range(1, 13) if i != 5]
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM company_news").fetchone()[0] == 33
+    # company_keywords 没有 (company_id, keyword) 唯一约束，只校验每个企业的关键词都已写入
+    assert conn.execute("SELECT COUNT(DISTINCT company_id || '/' || keyword) FROM company_keywords").fetchone()[0] == 22
+    assert sorted(r[0] for r in conn.execute("SELECT company_id FROM risk_alerts")) == [2, 3]
+    # 失败的企业保持建表默认状态，不被标记为已采集
+    assert conn.execute("SELECT crawl_status FROM companies WHERE id=5").fetchone()[0] == "pending"
+    conn.close()
+
+    # 再次刷新：风险等级已为高，不重复生成预警
+    sched.refresh_all_companies(workers=2)
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM risk_alerts").fetchone()[0] == 2
+    conn.close()
+
+
+def test_write_failure_rolls_back_only_that_company(db_path, monkeypatch):
+    path, written = db_path
+    original = sched._apply_company
+
+    def flaky(cursor, res):
+        original(cursor, res)
+        if res["cid"] == 7:
+            raise sqlite3.IntegrityError("boom")
+
+    monkeypatch.setattr(sched, "_apply_company", flaky)
+    summary = sched.refresh_all_companies(workers=3)
+    assert summary["failed"] == 2
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM company_news WHERE company_id=7").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM company_news WHERE company_id=8").fetchone()[0] == 3
+    conn.close()
+    assert 7 not in written
+
+
+def test_overlapping_runs_are_skipped(db_path):
+    assert sched._refresh_lock.acquire(blocking=False)
+    try:
+        result = []
+        t = threading.Thread(target=lambda: result.append(sched.refresh_all_companies()))
+        t.start()
+        t.join(5)
+        assert result == [None]
+    finally:
+        sched._refresh_lock.release()
+
+
+class _FailingCursor:
+    def __init__(self, cursor, fail_on):
+        self._cursor, self._fail_on = cursor, fail_on
+
+    def execute(self, sql, *args):
+        if sql == self._fail_on:
+            raise sqlite3.OperationalError("database is locked")
+        return self._cursor.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _FailingConn:
+    def __init__(self, conn, fail_on):
+        self._conn, self._fail_on = conn, fail_on
+
+    def cursor(self):
+        return _FailingCursor(self._conn.cursor(), self._fail_on)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+@pytest.mark.parametrize("fail_on", ["BEGIN IMMEDIATE", "COMMIT"])
+def test_failed_batch_counts_every_company(db_path, monkeypatch, fail_on):
+    path, written = db_path
+    original = sched._apply_company
+
+    def flaky(cursor, res):
+        original(cursor, res)
+        if res["cid"] == 2:
+            raise sqlite3.IntegrityError("boom")
+
+    monkeypatch.setattr(sched, "_apply_company", flaky)
+    llm = (None, None, None, False)
+    batch = [sched._collect_company(cid, "企业%d" % cid, llm) for cid in (1, 2, 3)]
+    writer = sched._BatchWriter(llm)
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        writer._flush(_FailingConn(conn, fail_on), batch)
+        assert not conn.in_transaction
+        assert conn.execute("SELECT COUNT(*) FROM company_news").fetchone()[0] == 0
+    finally:
+        conn.close()
+    writer.post_pool.shutdown(wait=True)
+    assert (writer.written, writer.failed) == (0, 3)
+    assert written == []
+
+
+def test_post_write_runs_off_writer_thread(db_path, monkeypatch):
+    path, _ = db_path
+    threads = []
+    monkeypatch.setattr(sched, "_after_company_written", lambda res, llm: threads.append(threading.current_thread().name))
+    summary = sched.refresh_all_companies(workers=2)
+    assert summary["written"] == 11
+    assert len(threads) == 11
+    assert all(name.startswith("refresh-post") for name in threads)
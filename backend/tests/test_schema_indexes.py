@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+热点查询索引回归测试：表结构由 db_schema 建表 + 版本化迁移得到（与 init_db 相同），
+查询取自实际代码——services 中的查询通过 trace 回调捕获实际执行的 SQL，app.py 路由中的查询逐字引用并校验仍与源码一致。
+用 EXPLAIN QUERY PLAN 检查，热点表出现全表扫描（SCAN 表，包括按索引全扫）即失败。
+"""
+
+import re
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from backend.services import (
+    alert_service,
+    company_retrieval,
+    company_stats,
+    db_schema,
+    feature_extraction_service,
+    media_review_store,
+    prediction_service,
+    risk_timeseries_service,
+    schema_migrations,
+)
+
+HOT_TABLES = {
+    "company_news", "risk_alerts", "enterprise_event_feature", "enterprise_risk_timeseries",
+    "user_companies", "company_media_reviews", "notifications", "audit_log", "company_stats",
+}
+
+# 允许的按索引全扫：警报列表首页按 (timestamp, rowid) 索引倒序走，取满 LIMIT 行即停（见 alert_service）
+ALLOWED_SCANS = {"SCAN ra USING INDEX idx_risk_alerts_ts"}
+
+_APP_PY = Path(__file__).resolve().parent.parent / "app.py"
+
+# app.py 路由中的查询 (路由, SQL, 参数)：app.py 依赖 Flask，测试中无法导入执行，这里逐字引用；
+# "{in}" 处为运行时拼接的 IN 占位符，test_app_queries_match_source 校验各段文本仍出现在 app.py 中
+APP_QUERIES = [
+    ("_user_company_ids", """SELECT u.company_id FROM user_companies u
+                      INNER JOIN companies c ON c.id = u.company_id
+                      WHERE u.user_id = ?""", (1,)),
+    ("company access check", "SELECT 1 FROM user_companies WHERE user_id=? AND company_id=?", (1, 2)),
+    ("delete_company", "DELETE FROM user_companies WHERE company_id=?", (2,)),
+    ("get_company alerts", """
+        SELECT id, alert_type, severity, description, source, timestamp
+        FROM risk_alerts
+        WHERE company_id = ?
+        ORDER BY timestamp DESC
+    """, (2,)),
+    ("company media", "SELECT id, platform, title, content, sentiment, source_url, llm_summary, created_at "
+                      "FROM company_media_reviews WHERE company_id=? ORDER BY created_at DESC", (2,)),
+    ("company news", "SELECT title, content, source, risk_level, category FROM company_news "
+                     "WHERE company_id=? ORDER BY created_at DESC LIMIT 50", (2,)),
+    ("get_rolling_news all", """SELECT id, company_id, title, content, source, source_url, sentiment_score, risk_level, category, publish_date, created_at, risk_dimensions
+            FROM company_news WHERE company_id IN ({in}) ORDER BY created_at DESC LIMIT ?""", (1, 2, 3, 20)),
+    ("dashboard news 24h", "SELECT COUNT(*) FROM company_news WHERE company_id IN ({in}) "
+                           "AND created_at > datetime('now','-1 day')", (1, 2, 3)),
+    ("mark_alert_processed", "SELECT id FROM risk_alerts WHERE id=? AND company_id IN ({in})", (5, 1, 2, 3)),
+    ("notifications unread", """SELECT id, type, title, body, related_type, related_id, read_at, created_at
+            FROM notifications WHERE user_id=? AND read_at IS NULL ORDER BY id DESC LIMIT ? OFFSET ?""", (1, 50, 0)),
+    ("notifications all", """SELECT id, type, title, body, related_type, related_id, read_at, created_at
+            FROM notifications WHERE user_id=? ORDER BY id DESC LIMIT ? OFFSET ?""", (1, 50, 0)),
+    ("notifications unread count", "SELECT COUNT(*) FROM notifications WHERE user_id=? AND read_at IS NULL", (1,)),
+    ("audit log by user", """SELECT a.id, a.user_id, u.username, a.action, a.resource_type, a.resource_id, a.detail, a.ip, a.created_at
+            FROM audit_log a LEFT JOIN users u ON u.id = a.user_id WHERE a.user_id=? ORDER BY a.id DESC LIMIT ? OFFSET ?""",
+     (1, 50, 0)),
+]
+
+
+def _normalize(sql):
+    return re.sub(r"\s+", " ", sql).strip()
+
+
+def _app_sql(template, params):
+    n_in = len(params) - template.replace("{in}", "").count("?")
+    return template.replace("{in}", ",".join("?" * n_in))
+
+
+@pytest.fixture()
+def db_path(tmp_path):
+    path = str(tmp_path / "idx.db")
+    conn = sqlite3.connect(path)
+    db_schema.create_tables(conn)
+    conn.commit()
+    conn.close()
+    return path
+
+
+@pytest.fixture()
+def conn(db_path):
+    c = sqlite3.connect(db_path)
+    yield c
+    c.close()
+
+
+def _capture_service_queries(db_path, monkeypatch):
+    """调用拥有热点查询的 service 函数，用 trace 回调记录实际执行的 SQL（参数已内联）。"""
+    statements = []
+    real_connect = sqlite3.connect
+
+    def tracing_connect(*args, **kwargs):
+        c = real_connect(*args, **kwargs)
+        c.set_trace_callback(statements.append)
+        return c
+
+    monkeypatch.setattr(sqlite3, "connect", tracing_connect)
+    monkeypatch.setattr(prediction_service, "_feature_store", None)
+    monkeypatch.setattr(risk_timeseries_service, "_feature_store", None)
+    # 检索索引在独立库中由后台线程同步，不在本测试的查询范围内
+    monkeypatch.setattr(company_retrieval, "schedule_sync", lambda *args: None)
+    c = sqlite3.connect(db_path)
+    try:
+        alert_service.list_alerts(c, 1)
+        alert_service.list_alerts(c, 1, processed=False, before_ts="2026-01-01", before_id=10)
+        alert_service.list_alerts(c, 1, company_id=2, before_ts="2026-01-01", before_id=10)
+        company_stats.list_companies(c, 1)
+        company_stats.list_companies(c, 1, favorite_only=True)
+    finally:
+        c.close()
+    media_review_store.save_media_reviews_dedup(db_path, 2, "企业", [{"platform": "weibo", "title": "t"}])
+    feature_extraction_service.update_news_features(db_path, enterprise_id=2)
+    risk_timeseries_service.recompute_timeseries_days(2, ["2026-01-01"], db_path=db_path)
+    prediction_service._load_histories([1, 2], db_path=db_path)
+    monkeypatch.setattr(sqlite3, "connect", real_connect)
+    return [s for s in statements if s.lstrip().upper().startswith(("SELECT", "DELETE", "UPDATE", "WITH"))]
+
+
+def _full_scans(conn, sql, params=()):
+    """返回查询计划中的全扫步骤：'SCAN t' 与 'SCAN t USING INDEX ...'（按索引全扫）都算；旧版 SQLite 为 'SCAN TABLE t'。"""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    return [row[-1] for row in plan if row[-1].startswith("SCAN ")], plan
+
+
+def _alias_tables(sql):
+    """把 SQL 中 'table alias' 的别名映射回表名，用于判断全扫的是否为热点表。"""
+    tokens = sql.replace(",", " ").replace("(", " ").replace(")", " ").split()
+    out = {}
+    for i, tok in enumerate(tokens[:-1]):
+        if tok in HOT_TABLES or tok in ("companies", "users", "user_company_favorites", "feature_extraction_state"):
+            out[tok] = tok
+            nxt = tokens[i + 1]
+            if nxt.isidentifier() and nxt.upper() not in ("WHERE", "JOIN", "LEFT", "INNER", "ON", "ORDER", "GROUP",
+                                                         "SET", "LIMIT", "AS"):
+                out[nxt] = tok
+    return out
+
+
+def _hot_scans(conn, sql, params=()):
+    scans, plan = _full_scans(conn, sql, params)
+    aliases = _alias_tables(sql)
+    hot = []
+    for detail in scans:
+        if detail in ALLOWED_SCANS:
+            continue
+        words = detail.split()
+        target = words[2] if len(words) > 2 and words[1] == "TABLE" else words[1]
+        if aliases.get(target, target) in HOT_TABLES:
+            hot.append(detail)
+    return hot, [r[-1] for r in plan]
+
+
+def test_app_queries_match_source():
+    source = _normalize(_APP_PY.read_text(encoding="utf-8"))
+    for name, template, _ in APP_QUERIES:
+        for part in template.split("{in}"):
+            assert _normalize(part) in source, "%s: SQL no longer matches app.py: %s" % (name, _normalize(part))
+
+
+@pytest.mark.parametrize("name,template,params", APP_QUERIES, ids=[q[0] for q in APP_QUERIES])
+def test_app_queries_use_indexes(conn, name, template, params):
+    schema_migrations.migrate(conn)
+    hot, plan = _hot_scans(conn, _app_sql(template, params), params)
+    assert not hot, "%s falls back to a full scan: %s" % (name, plan)
+
+
+def test_service_queries_use_indexes(db_path, conn, monkeypatch):
+    schema_migrations.migrate(conn)
+    statements = _capture_service_queries(db_path, monkeypatch)
+    assert len(statements) >= 10
+    failures = []
+    for sql in statements:
+        hot, plan = _hot_scans(conn, sql)
+        if hot:
+            failures.append((_normalize(sql)[:160], plan))
+    assert not failures, failures
+
+
+def test_queries_scan_without_migration(conn):
+    # 对照：未迁移时确有热点查询全表扫描，说明回归测试能发现问题
+    name, template, params = APP_QUERIES[3]
+    hot, _ = _hot_scans(conn, _app_sql(template, params), params)
+    assert hot
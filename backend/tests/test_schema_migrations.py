@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+版本化迁移测试：按 PRAGMA user_version 只执行一次；旧表结构被补齐为最新列；缺表与失败的迁移整体回滚。
+"""
+
+import sqlite3
+
+import pytest
+
+from backend.services import db_schema, schema_migrations
+
+# 早期版本的表结构：没有后来 ALTER 补的列
+_LEGACY_SCHEMA = """
+CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, email TEXT, password_hash TEXT,
+    role TEXT NOT NULL DEFAULT 'user', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE companies (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, industry TEXT, risk_level TEXT,
+    last_updated TIMESTAMP, crawl_status TEXT DEFAULT 'pending');
+CREATE TABLE company_news (id INTEGER PRIMARY KEY AUTOINCREMENT, company_id INTEGER, title TEXT NOT NULL, content TEXT,
+    risk_level TEXT, created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE risk_alerts (id INTEGER PRIMARY KEY AUTOINCREMENT, company_id INTEGER, alert_type TEXT NOT NULL,
+    severity TEXT NOT NULL, description TEXT, source TEXT, timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE llm_config (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, api_key TEXT, base_url TEXT, model TEXT);
+INSERT INTO companies (name) VALUES ('甲公司');
+INSERT INTO risk_alerts (company_id, alert_type, severity) VALUES (1, 'news', '高');
+"""
+
+
+@pytest.fixture()
+def conn(tmp_path):
+    c = sqlite3.connect(str(tmp_path / "legacy.db"))
+    c.executescript(_LEGACY_SCHEMA)
+    # 与 init_db 相同：先补建缺失的表（已有的旧表不变），再迁移
+    db_schema.create_tables(c)
+    c.commit()
+    yield c
+    c.close()
+
+
+def _cols(conn, table):
+    return {r[1] for r in conn.execute("PRAGMA table_info(%s)" % table)}
+
+
+def test_migrate_once_by_user_version(conn):
+    assert schema_migrations.current_version(conn) == 0
+    assert schema_migrations.migrate(conn) == [v for v, _, _ in schema_migrations.MIGRATIONS]
+    assert schema_migrations.current_version(conn) == schema_migrations.LATEST_VERSION
+    assert schema_migrations.migrate(conn) == []
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert "idx_risk_alerts_company_ts" in names and "idx_company_news_company_created" in names
+
+
+def test_legacy_schema_brought_to_current(conn):
+    schema_migrations.migrate(conn)
+    assert {"llm_status", "media_status", "news_status", "supplement_notes", "tags"} <= _cols(conn, "companies")
+    assert {"risk_dimensions", "company_tag"} <= _cols(conn, "company_news")
+    assert "processed_at" in _cols(conn, "risk_alerts")
+    assert {"reset_token", "reset_token_expires", "alert_threshold", "two_factor_enabled"} <= _cols(conn, "users")
+    assert "enable_web_search" in _cols(conn, "llm_config")
+    # 默认值对已有行生效，路由可直接按最新表结构查询
+    assert conn.execute("SELECT llm_status, media_status, news_status, tags FROM companies").fetchone() == \
+        ("pending", "pending", "pending", None)
+    assert conn.execute("SELECT processed_at FROM risk_alerts").fetchone() == (None,)
+    # 汇总表回填已有警报
+    assert conn.execute("SELECT alert_count, unprocessed_alert_count FROM company_stats WHERE company_id=1").fetchone() \
+        == (1, 1)
+
+
+def test_resumes_from_recorded_version(conn):
+    conn.execute("PRAGMA user_version = 1")
+    assert schema_migrations.migrate(conn) == [v for v, _, _ in schema_migrations.MIGRATIONS if v > 1]
+    assert "company_tag" in _cols(conn, "company_news")
+    # 版本 1 记录为已执行，不会再建索引
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert "idx_risk_alerts_company_ts" not in names
+
+
+def test_missing_table_fails_migration(tmp_path):
+    # 缺表时迁移报错回滚，不会跳过后记为已执行（否则之后建表也不会再补索引）
+    c = sqlite3.connect(str(tmp_path / "partial.db"))
+    c.executescript(_LEGACY_SCHEMA)
+    with pytest.raises(sqlite3.OperationalError):
+        schema_migrations.migrate(c)
+    assert schema_migrations.current_version(c) == 0
+    db_schema.create_tables(c)
+    c.commit()
+    assert schema_migrations.migrate(c) == [v for v, _, _ in schema_migrations.MIGRATIONS]
+    c.close()
+
+
+def test_company_stats_migration_requires_source_tables(conn):
+    # 汇总表的触发器不能因缺表被静默跳过：迁移 4 报错回滚，版本停在 3
+    schema_migrations.migrate(conn)
+    conn.execute("PRAGMA user_version = 3")
+    conn.executescript("DROP TABLE company_stats; DROP TABLE enterprise_risk_timeseries;")
+    with pytest.raises(sqlite3.OperationalError):
+        schema_migrations.migrate(conn)
+    assert schema_migrations.current_version(conn) == 3
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name='company_stats'").fetchone() is None
+
+
+def test_failed_migration_rolls_back(conn, monkeypatch, caplog):
+    def boom(c):
+        c.execute("CREATE INDEX idx_tmp ON company_news (title)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(schema_migrations, "MIGRATIONS", ((1, "bad", boom),))
+    with pytest.raises(RuntimeError):
+        schema_migrations.migrate(conn)
+    assert "schema migration 1 (bad) failed" in caplog.text
+    assert schema_migrations.current_version(conn) == 0
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name='idx_tmp'").fetchone() is None
@@ -5,6 +5,7 @@ import {
 } from 'recharts';
 import { useToast } from './ToastContext';
 import { useDateTimeFormat } from './utils/useDateTimeFormat';
+import { readSSE } from './utils/sse';
 
 const CompanyDetail = () => {
   const { id } = useParams();
@@ -30,6 +31,7 @@ const CompanyDetail = () => {
   const [supplements, setSupplements] = useState([]);
   const [supplementText, setSupplementText] = useState('');
   const [supplementSending, setSupplementSending] = useState(false);
+  const [supplementDraft, setSupplementDraft] = useState('');
   const [supplementPanelOpen, setSupplementPanelOpen] = useState(true);
   const [listening, setListening] = useState(false);
   const [askQuestion, setAskQuestion] = useState('');
@@ -224,26 +226,44 @@ const CompanyDetail = () => {
     const text = supplementText.trim();
     if (!text || supplementSending) return;
     setSupplementSending(true);
+    setSupplementDraft('');
+    const finish = async (data) => {
+      setSupplementText('');
+      await fetchSupplements();
+      await fetchCompanyDetails(false);
+      toast.success(data.summary || '已归集');
+    };
     try {
       const token = localStorage.getItem('token');
       const res = await fetch(`/api/companies/${id}/supplement-chat`, {
         method: 'POST',
-        headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
+        headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream', Authorization: `Bearer ${token}` },
         body: JSON.stringify({ text })
       });
-      const data = await res.json();
-      if (res.ok) {
-        setSupplementText('');
-        await fetchSupplements();
-        await fetchCompanyDetails(false);
-        toast.success(data.summary || '已归集');
+      if (res.ok && (res.headers.get('Content-Type') || '').includes('text/event-stream')) {
+        let streamed = '';
+        let result = null;
+        await readSSE(res, (event, data) => {
+          if (event === 'token') {
+            streamed += data.text || '';
+            setSupplementDraft(streamed);
+          } else if (event === 'done') {
+            result = data;
+          } else if (event === 'error') {
+            toast.error(data.message || '提交失败');
+          }
+        });
+        if (result) await finish(result);
       } else {
-        toast.error(data.message || '提交失败');
+        const data = await res.json();
+        if (res.ok) await finish(data);
+        else toast.error(data.message || '提交失败');
       }
     } catch (e) {
       toast.error('请求失败: ' + e.message);
     } finally {
       setSupplementSending(false);
+      setSupplementDraft('');
     }
   };
 
@@ -1016,6 +1036,13 @@ const CompanyDetail = () => {
                   </div>
                 ))
               )}
+              {supplementSending && supplementDraft && (
+                <div className="flex justify-start">
+                  <div className="max-w-[85%] rounded-lg px-3 py-2 text-sm bg-white border border-gray-200 text-gray-500">
+                    <div className="whitespace-pre-wrap">{supplementDraft}</div>
+                  </div>
+                </div>
+              )}
             </div>
             <form onSubmit={handleSupplementSubmit} className="flex gap-2">
               <input
@@ -1058,12 +1085,26 @@ const CompanyDetail = () => {
               const token = localStorage.getItem('token');
               const res = await fetch(`/api/companies/${id}/ask`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
+                headers: { 'Content-Type': 'application/json', Accept: 'text/event-stream', Authorization: `Bearer ${token}` },
                 body: JSON.stringify({ question: q })
               });
-              const data = await res.json();
-              if (res.ok) setAskAnswer(data.answer || '');
-              else toast.error(data.message || '回答失败');
+              if (res.ok && (res.headers.get('Content-Type') || '').includes('text/event-stream')) {
+                let streamed = '';
+                await readSSE(res, (event, data) => {
+                  if (event === 'token') {
+                    streamed += data.text || '';
+                    setAskAnswer(streamed);
+                  } else if (event === 'done') {
+                    setAskAnswer(data.answer || streamed);
+                  } else if (event === 'error') {
+                    toast.error(data.message || '回答失败');
+                  }
+                });
+              } else {
+                const data = await res.json();
+                if (res.ok) setAskAnswer(data.answer || '');
+                else toast.error(data.message || '回答失败');
+              }
             } catch (err) { toast.error('请求失败: ' + err.message); }
             setAskLoading(false);
           }}
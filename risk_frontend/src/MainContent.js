@@ -95,9 +95,32 @@ const MainContent = ({ user }) => {
   const [dashboardLoading, setDashboardLoading] = useState(true);
   const [alertSeverityFilter, setAlertSeverityFilter] = useState('');
   const [markingAlertId, setMarkingAlertId] = useState(null);
+  const [alertsCursor, setAlertsCursor] = useState(null);
+  const [alertsLoadingMore, setAlertsLoadingMore] = useState(false);
   const [multiRisk, setMultiRisk] = useState({});
   const [multiRiskLoading, setMultiRiskLoading] = useState(false);
 
+  // 警报列表按 next_cursor 继续加载更早的一页
+  const loadMoreAlerts = async () => {
+    if (!alertsCursor || alertsLoadingMore) return;
+    const token = localStorage.getItem('token');
+    const params = new URLSearchParams({ before_ts: alertsCursor.before_ts, before_id: String(alertsCursor.before_id) });
+    if (alertSeverityFilter) params.set('severity', alertSeverityFilter);
+    setAlertsLoadingMore(true);
+    try {
+      const r = await fetch('/api/alerts?' + params.toString(), { headers: { Authorization: `Bearer ${token}` } });
+      if (r.ok) {
+        const a = await r.json();
+        setAlerts((prev) => prev.concat(a.items || []));
+        setAlertsCursor(a.next_cursor || null);
+      }
+    } catch (e) {
+      console.error(e);
+    } finally {
+      setAlertsLoadingMore(false);
+    }
+  };
+
   // 根据当前路径设置选中的标签
   useEffect(() => {
     const path = location.pathname;
@@ -143,7 +166,11 @@ const MainContent = ({ user }) => {
       if (rRes.ok) setRiskIndicators(await rRes.json());
       if (riskDistRes.ok) setRiskDistribution(await riskDistRes.json());
       if (catDistRes.ok) { const c = await catDistRes.json(); setCategoryDistribution(Array.isArray(c) ? c : []); }
-      if (alertsRes.ok) { const a = await alertsRes.json(); setAlerts(Array.isArray(a) ? a : []); }
+      if (alertsRes.ok) {
+        const a = await alertsRes.json();
+        setAlerts(Array.isArray(a) ? a : (a?.items ?? []));
+        setAlertsCursor(a?.next_cursor ?? null);
+      }
     } catch (e) {
       if (e?.name !== 'AbortError') console.error(e);
     } finally {
@@ -1028,6 +1055,18 @@ const MainContent = ({ user }) => {
               })
             )}
           </div>
+          {alertsCursor && (
+            <div className="flex justify-center mt-6">
+              <button
+                type="button"
+                disabled={alertsLoadingMore}
+                onClick={loadMoreAlerts}
+                className="px-4 py-2 rounded-lg text-sm font-medium bg-gray-100 dark:bg-gray-700 text-gray-700 dark:text-gray-300 disabled:opacity-50"
+              >
+                {alertsLoadingMore ? '加载中…' : '加载更多'}
+              </button>
+            </div>
+          )}
         </div>
       )}
 
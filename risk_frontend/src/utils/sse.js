@@ -0,0 +1,34 @@
+/**
+ * 读取 fetch 返回的 text/event-stream 响应，逐个回调 onEvent(event, data)。
+ * 以冒号开头的注释行（心跳）被忽略；data 按 JSON 解析，解析失败时传原始字符串。
+ */
+export async function readSSE(res, onEvent) {
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder('utf-8');
+  let buffer = '';
+  const dispatch = (frame) => {
+    let event = 'message';
+    const dataLines = [];
+    frame.split('\n').forEach((line) => {
+      if (!line || line.startsWith(':')) return;
+      if (line.startsWith('event:')) event = line.slice(6).trim();
+      else if (line.startsWith('data:')) dataLines.push(line.slice(5).replace(/^ /, ''));
+    });
+    if (!dataLines.length) return;
+    const raw = dataLines.join('\n');
+    let data = raw;
+    try { data = JSON.parse(raw); } catch (e) { /* 非 JSON 数据原样传递 */ }
+    onEvent(event, data);
+  };
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let idx;
+    while ((idx = buffer.indexOf('\n\n')) >= 0) {
+      dispatch(buffer.slice(0, idx));
+      buffer = buffer.slice(idx + 2);
+    }
+  }
+  if (buffer.trim()) dispatch(buffer);
+}